@@ -0,0 +1,132 @@
+import json
+import logging
+import threading
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, or_, select
+
+from app.database.models import HistoryItem
+from comfy_execution.jobs import JobStatus, normalize_history_item
+
+
+def _encode_item(history_item: dict) -> str:
+    try:
+        return json.dumps(history_item)
+    except (TypeError, ValueError):
+        # Custom nodes can put arbitrary objects in their ui output
+        logging.warning("History item is not JSON serializable, storing the repr of the offending values.")
+        return json.dumps(history_item, default=repr)
+
+
+class HistoryStore:
+    """
+    Prompt history kept in the database instead of the in memory dict of the PromptQueue.
+
+    Every finished prompt is a row holding the JSON history item, plus the columns /api/jobs
+    filters and sorts on, so paging is done by the database and memory use doesn't grow with
+    the number of jobs that have run. History survives restarts. Rows are numbered in the
+    order the prompts finished, which is the order /history returns them in.
+
+    The PromptQueue calls the store without holding its mutex, the writes are serialized by a
+    lock of their own.
+    """
+    def __init__(self, session_factory, max_items: int = 0):
+        self.session_factory = session_factory
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        with self.session_factory() as session:
+            self.count = session.scalar(select(func.count()).select_from(HistoryItem))
+
+    def __len__(self):
+        return self.count
+
+    def put(self, prompt_id: str, history_item: dict):
+        job = normalize_history_item(prompt_id, history_item)
+        start = job.get('execution_start_time')
+        end = job.get('execution_end_time')
+        row = HistoryItem(
+            prompt_id=prompt_id,
+            status=job['status'],
+            create_time=job.get('create_time') or 0,
+            workflow_id=job.get('workflow_id'),
+            execution_duration=end - start if end and start else 0,
+            data=_encode_item(history_item),
+        )
+        with self.lock, self.session_factory() as session:
+            replaced = session.execute(delete(HistoryItem).where(HistoryItem.prompt_id == prompt_id)).rowcount
+            session.add(row)
+            self.count += 1 - replaced
+            if self.max_items > 0 and self.count > self.max_items:
+                oldest = select(HistoryItem.id).order_by(HistoryItem.id).limit(self.count - self.max_items)
+                self.count -= session.execute(delete(HistoryItem).where(HistoryItem.id.in_(oldest))).rowcount
+            session.commit()
+
+    def get(self, prompt_id: str) -> Optional[dict]:
+        with self.session_factory() as session:
+            data = session.scalar(select(HistoryItem.data).where(HistoryItem.prompt_id == prompt_id))
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def get_history(self, max_items: Optional[int] = None, offset: int = -1) -> dict:
+        """Same paging as PromptQueue.get_history: a negative offset returns the newest max_items."""
+        if offset < 0:
+            offset = 0 if max_items is None else max(self.count - max_items, 0)
+        query = select(HistoryItem.prompt_id, HistoryItem.data).order_by(HistoryItem.id).offset(offset)
+        if max_items is not None:
+            query = query.limit(max_items)
+        with self.session_factory() as session:
+            return {prompt_id: json.loads(data) for prompt_id, data in session.execute(query)}
+
+    def delete(self, prompt_id: str):
+        with self.lock, self.session_factory() as session:
+            self.count -= session.execute(delete(HistoryItem).where(HistoryItem.prompt_id == prompt_id)).rowcount
+            session.commit()
+
+    def wipe(self):
+        with self.lock, self.session_factory() as session:
+            session.execute(delete(HistoryItem))
+            session.commit()
+            self.count = 0
+
+    def query_jobs(
+        self,
+        statuses: list[str],
+        workflow_id: Optional[str] = None,
+        sort_by: str = "created_at",
+        sort_order: str = "desc",
+        limit: Optional[int] = None,
+        cursor: Optional[tuple[int, str]] = None
+    ) -> tuple[list[dict], int]:
+        """
+        Finished jobs as normalized job dicts, filtered and sorted like get_all_jobs.
+
+        Returns:
+            tuple: (first limit jobs, number of jobs matching the filters)
+        """
+        conditions = []
+        if set(statuses) != {JobStatus.COMPLETED, JobStatus.FAILED}:
+            conditions.append(HistoryItem.status.in_(statuses))
+        if workflow_id:
+            conditions.append(HistoryItem.workflow_id == workflow_id)
+        if cursor is not None:
+            create_time, prompt_id = cursor
+            if sort_order == 'desc':
+                conditions.append(or_(HistoryItem.create_time < create_time, and_(HistoryItem.create_time == create_time, HistoryItem.prompt_id < prompt_id)))
+            else:
+                conditions.append(or_(HistoryItem.create_time > create_time, and_(HistoryItem.create_time == create_time, HistoryItem.prompt_id > prompt_id)))
+
+        if sort_by == 'execution_duration':
+            order = [HistoryItem.execution_duration]
+        else:
+            order = [HistoryItem.create_time, HistoryItem.prompt_id]
+        if sort_order == 'desc':
+            order = [column.desc() for column in order]
+
+        query = select(HistoryItem.prompt_id, HistoryItem.data).where(*conditions).order_by(*order)
+        if limit is not None:
+            query = query.limit(limit)
+        with self.session_factory() as session:
+            total = session.scalar(select(func.count()).select_from(HistoryItem).where(*conditions))
+            jobs = [normalize_history_item(prompt_id, json.loads(data)) for prompt_id, data in session.execute(query)]
+        return jobs, total
@@ -1,12 +1,12 @@
 try:
-    from sqlalchemy import Column, Integer, String, DateTime
+    from sqlalchemy import Column, Integer, String, DateTime, Text
     from sqlalchemy.sql import func
     from sqlalchemy.orm import declarative_base
     Base = declarative_base()
 except ImportError:
     Base = object
     Column = lambda *args, **kwargs: None
-    Integer = String = DateTime = None
+    Integer = String = DateTime = Text = None
     func = None
 
 class User(Base):
@@ -27,3 +27,25 @@ class User(Base):
             "username": self.username,
             "created_at": self.created_at.isoformat() if self.created_at else None
         }
+
+
+class HistoryItem(Base):
+    """Finished prompt, stored as the same JSON document the /history endpoint returns."""
+    __tablename__ = "history"
+
+    if Base is not object:
+        id = Column(Integer, primary_key=True, autoincrement=True)
+        prompt_id = Column(String, unique=True, index=True, nullable=False)
+        status = Column(String, index=True)
+        create_time = Column(Integer, index=True, nullable=False, default=0)
+        workflow_id = Column(String, index=True)
+        execution_duration = Column(Integer, nullable=False, default=0)
+        data = Column(Text, nullable=False)
+    else:
+        id = None
+        prompt_id = None
+        status = None
+        create_time = None
+        workflow_id = None
+        execution_duration = None
+        data = None
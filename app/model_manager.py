@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import asyncio
 import base64
 import json
 import time
@@ -49,6 +50,22 @@ class ModelFileManager:
             files = self.get_model_file_list(folder)
             return web.json_response(files)
 
+        @routes.get("/experiment/models/detect/{folder}")
+        async def detect_models(request):
+            folder = request.match_info.get("folder", None)
+            if not folder in folder_paths.folder_names_and_paths:
+                return web.Response(status=404)
+            files = [dict(f) for f in self.get_model_file_list(folder)]
+            folders = folder_paths.folder_names_and_paths[map_legacy(folder)][0]
+            paths = [os.path.join(folders[f["pathIndex"]], f["name"]) for f in files]
+            # Imported here, it needs the torch device setup that comes with comfy.model_management
+            import comfy.header_detection
+            detected = await asyncio.get_running_loop().run_in_executor(None, comfy.header_detection.detect_files, paths)
+            for f, path in zip(files, paths):
+                model = detected[path]
+                f["model"] = model.to_json() if model is not None else None
+            return web.json_response(files)
+
         @routes.get("/experiment/models/preview/{folder}/{path_index}/{filename:.*}")
         async def get_model_preview(request):
             folder_name = request.match_info.get("folder", None)
@@ -113,6 +113,13 @@ cache_group.add_argument("--cache-classic", action="store_true", help="Use the o
 cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU caching with a maximum of N node results cached. May use more RAM/VRAM.")
 cache_group.add_argument("--cache-none", action="store_true", help="Reduced RAM/VRAM usage at the expense of executing every node for each run.")
 cache_group.add_argument("--cache-ram", nargs='?', const=4.0, type=float, default=0, help="Use RAM pressure caching with the specified headroom threshold. If available RAM drops below the threhold the cache remove large items to free RAM. Default 4GB")
+cache_group.add_argument("--cache-bytes", type=float, default=0, metavar="MAX_GB", help="Cache node outputs up to MAX_GB of tensor and model memory. When it is full the outputs that free the most memory for the least recompute time are evicted first.")
+parser.add_argument("--cache-disk", nargs='?', const=16.0, type=float, default=0, metavar="MAX_GB", help="Spill cached node outputs evicted from RAM to disk so they can be reloaded, also after a restart. Only used together with --cache-lru, --cache-ram or --cache-bytes. Optional argument is the maximum size of the disk cache in GB. Default 16GB")
+parser.add_argument("--cache-directory", type=str, default=None, help="Set the ComfyUI cache directory used by the on-disk caches. Overrides --base-directory.")
+parser.add_argument("--patched-weight-cache", nargs='?', const=8.0, type=float, default=0, metavar="MAX_GB", help="Keep weights with LoRAs and other patches merged in in RAM so switching back to a recently used set of LoRAs copies the weights instead of merging them again. Optional argument is the maximum size in GB. Default 8GB.")
+parser.add_argument("--prefetch-models", nargs='?', const=16.0, type=float, default=0, metavar="MAX_GB", help="While a prompt runs, read the model files of the next queued prompts into the OS file cache in the background so loading them doesn't wait on the disk. Optional argument is the maximum size in GB of the files remembered as prefetched. Default 16GB.")
+parser.add_argument("--compiled-model-cache", nargs='?', const=32.0, type=float, default=0, metavar="MAX_GB", help="Save diffusion models after their type got detected and their weights converted and cast to the dtype they run in, so the next loads of the same file skip all of that. The files go in the compiled_models folder of the cache directory. Optional argument is the maximum size of that folder in GB. Default 32GB.")
+parser.add_argument("--eviction-policy", type=str, default="default", choices=["default", "cost"], help="How to pick the models to unload when memory is needed. cost unloads the models that are the cheapest to load again first, based on their measured load times and on whether the queued prompts use them.")
 
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
@@ -146,6 +153,16 @@ parser.add_argument("--reserve-vram", type=float, default=None, help="Set the am
 
 parser.add_argument("--async-offload", nargs='?', const=2, type=int, default=None, metavar="NUM_STREAMS", help="Use async weight offloading. An optional argument controls the amount of offload streams. Default is 2. Enabled by default on Nvidia.")
 parser.add_argument("--disable-async-offload", action="store_true", help="Disable async weight offloading.")
+parser.add_argument("--weight-streaming", nargs='?', const=2, type=int, default=0, metavar="RING_BLOCKS", help="For models that don't fit in VRAM, copy the offloaded weights of the next blocks of the model to the GPU while the current block computes, in a ring of RING_BLOCKS block sized buffers. Default is 2 (double buffering).")
+
+parser.add_argument("--parallel-execution", nargs='?', const=4, type=int, default=0, metavar="NUM_THREADS", help="Run nodes that declare themselves CPU or IO bound (EXECUTION_RESOURCE) on a thread pool, concurrently with the rest of the workflow. GPU nodes stay serialized. The optional argument is the number of threads. Default 4.")
+parser.add_argument("--prompt-workers", type=int, default=1, metavar="NUM_WORKERS", help="Number of prompts executed at the same time. Each worker has its own executor and cache and, with several CUDA devices, is pinned to one of them round robin. Queued prompts are routed to the worker that already has their models loaded.")
+parser.add_argument("--enable-prompt-coalescing", action="store_true", help="A submitted prompt identical to one that is queued or running shares that execution and its outputs instead of running again. Clients can also ask for it per prompt with \"coalesce\": true. Prompts with nodes that are not idempotent or have IS_CHANGED always run.")
+parser.add_argument("--replay-prompt-results", nargs='?', const=300, type=int, default=0, metavar="SECONDS", help="Answer a submitted prompt with the result of an identical prompt that finished successfully within the last SECONDS instead of executing it again. Prompts with nodes that are not idempotent or have IS_CHANGED always run. Default 300 seconds.")
+parser.add_argument("--noise-rng", type=str, default="torch", choices=["torch", "philox"], help="How the sampling noise is generated from the seed. torch is the compatibility mode that gives the same noise, and images, as always. philox computes the noise of the whole batch at once with a counter based generator keyed by the seed and the batch index of every item, so an item gets the same noise alone as in a batch. The philox noise is different from the torch noise.")
+parser.add_argument("--schedule-cache-size", type=int, default=256, metavar="ENTRIES", help="How many computed sigma schedules are kept to be reused by later prompts. 0 disables the cache, the schedule tables registered by nodes are still used.")
+parser.add_argument("--static-sampling-loop", nargs='?', const="eager", type=str, default=None, choices=["eager", "compile", "reduce-overhead"], help="Run the euler, dpmpp_2m and uni_pc samplers as a loop with all the sigmas and step coefficients computed up front. When there are no hooks, model patches, wrappers, area/mask/timestep conds, controlnets, denoise mask or lowvram the model call and its conds are frozen so every step runs the same update on tensors of fixed shapes: compile compiles it with torch.compile and reduce-overhead also captures it in a CUDA graph. Other runs use the regular model call. Default eager.")
+parser.add_argument("--sampler-batching", nargs='?', const=0.05, type=float, default=0, metavar="SECONDS", help="Sample compatible KSampler and SamplerCustom calls of prompts running on different prompt workers as one batch. The first call waits up to SECONDS for the others. Only has an effect with --prompt-workers. Default 0.05 seconds.")
 
 parser.add_argument("--force-non-blocking", action="store_true", help="Force ComfyUI to use non-blocking operations for all applicable tensors. This may improve performance on some non-Nvidia systems but can cause issues with some workflows.")
 
@@ -163,6 +180,8 @@ class PerformanceFeature(enum.Enum):
 parser.add_argument("--fast", nargs="*", type=PerformanceFeature, help="Enable some untested and potentially quality deteriorating optimizations. This is used to test new features so using it might crash your comfyui. --fast with no arguments enables everything. You can pass a list specific optimizations if you only want to enable specific ones. Current valid optimizations: {}".format(" ".join(map(lambda c: c.value, PerformanceFeature))))
 
 parser.add_argument("--disable-pinned-memory", action="store_true", help="Disable pinned memory use.")
+parser.add_argument("--shared-model-weights", action="store_true", help="Map the weights of safetensors models copy on write from the OS file cache instead of reading them into private memory, so several ComfyUI processes on the same machine loading the same models share the memory of their weights.")
+parser.add_argument("--pinned-model-pool", type=float, default=0, metavar="MAX_GB", help="Keep the weights of up to MAX_GB of models unloaded from the GPU in pinned memory so loading them again is faster. The models unloaded the longest time ago are unpinned first.")
 
 parser.add_argument("--mmap-torch-files", action="store_true", help="Use mmap when loading ckpt/pt files.")
 parser.add_argument("--disable-mmap", action="store_true", help="Don't use mmap when loading safetensors.")
@@ -231,6 +250,7 @@ database_default_path = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "..", "user", "comfyui.db")
 )
 parser.add_argument("--database-url", type=str, default=f"sqlite:///{database_default_path}", help="Specify the database URL, e.g. for an in-memory database you can use 'sqlite:///:memory:'.")
+parser.add_argument("--persistent-history", nargs='?', const=100000, type=int, default=0, metavar="MAX_ITEMS", help="Store the prompt history in the database so it survives restarts and doesn't use RAM. The optional argument is the number of prompts kept. Default 100000.")
 
 if comfy.options.args_parsing:
     args = parser.parse_args()
@@ -0,0 +1,221 @@
+"""
+Compiled diffusion model cache (--compiled-model-cache).
+
+Loading a diffusion model detects its config from the keys and shapes of its state dict, converts
+diffusers and other formats to the key names of the comfy model and casts the weights to the
+dtype of the model. The first time a file is loaded with a set of options, the detected config and
+the converted state dict, with the weights already cast to the dtypes of the model, are saved to a
+safetensors file in the cache directory. The following loads rebuild the config from that file
+and load the weights as is, so they are bound by the disk (or, with --shared-model-weights, just
+map the file).
+
+Compiled files are named after a hash of the source file (its path, size, modification time and
+safetensors header) and of the load options, and are compiled again when the dtypes picked for the
+model on this machine aren't the ones they were compiled for. The least recently used files are
+deleted when the cache gets larger than its maximum size.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import struct
+from typing import Optional
+
+import torch
+
+from comfy.cli_args import args
+import comfy.safetensors_stream
+import comfy.supported_models
+
+FORMAT_VERSION = 1
+METADATA_KEY = "comfy_compiled_model"
+# Options of load_diffusion_model the compiled files depend on, other options disable the cache
+CACHEABLE_OPTIONS = ("dtype", "fp8_optimizations")
+
+MAX_BYTES = int(args.compiled_model_cache * (1024 ** 3))
+cache_directory: Optional[str] = None
+
+
+def set_cache_directory(path: Optional[str]):
+    global cache_directory
+    cache_directory = path
+
+
+def enabled() -> bool:
+    return cache_directory is not None and MAX_BYTES > 0
+
+
+def _source_header(path: str) -> bytes:
+    with open(path, "rb") as f:
+        header_size = f.read(8)
+        if len(header_size) < 8:
+            return header_size
+        return header_size + f.read(min(struct.unpack("<Q", header_size)[0], 100 * 1024 * 1024))
+
+
+def get_path(path: str, model_options: dict) -> Optional[str]:
+    """Path of the compiled file of the model file path loaded with model_options, None if it can't be compiled."""
+    if not enabled() or not path.lower().endswith((".safetensors", ".sft")):
+        return None
+    if any(k not in CACHEABLE_OPTIONS for k in model_options):
+        return None
+    try:
+        stat = os.stat(path)
+        h = hashlib.sha256()
+        h.update("{}\n{}\n{}\n{}\n".format(FORMAT_VERSION, os.path.realpath(path), stat.st_size, stat.st_mtime_ns).encode())
+        h.update(repr(tuple(str(model_options.get(k)) for k in CACHEABLE_OPTIONS)).encode())
+        h.update(_source_header(path))
+    except OSError as e:
+        logging.debug("Can't compile model {}: {}".format(path, e))
+        return None
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_directory, "{}-{}.safetensors".format(name, h.hexdigest()[:32]))
+
+
+def _encode(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, tuple):
+        return {"tuple": [_encode(v) for v in value]}
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {"dict": {k: _encode(v) for k, v in value.items()}}
+    if isinstance(value, torch.dtype):
+        return {"dtype": str(value).split(".")[-1]}
+    raise TypeError("Can't save values of type {}".format(type(value).__name__))
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict):
+        if "tuple" in value:
+            return tuple(_decode(v) for v in value["tuple"])
+        if "dtype" in value:
+            return getattr(torch, value["dtype"])
+        return {k: _decode(v) for k, v in value["dict"].items()}
+    return value
+
+
+def describe(model_config, parameters: int, weight_dtype) -> Optional[dict]:
+    """What a compiled file needs to rebuild model_config, call before model_config gets its dtypes set."""
+    if model_config.__class__ not in comfy.supported_models.models:
+        return None
+    try:
+        return {
+            "format": FORMAT_VERSION,
+            "model_config": model_config.__class__.__name__,
+            "unet_config": _encode(model_config.unet_config),
+            "quant_config": _encode(model_config.quant_config),
+            "parameters": parameters,
+            "weight_dtype": _encode(weight_dtype),
+        }
+    except TypeError as e:
+        logging.debug("Can't compile model config {}: {}".format(model_config.__class__.__name__, e))
+        return None
+
+
+def dtypes_match(info: dict, model_config) -> bool:
+    """If the dtypes picked for the model_config rebuilt from info are the ones info got compiled for."""
+    return info.get("dtype") == _encode(model_config.unet_config.get("dtype")) and info.get("manual_cast_dtype") == _encode(model_config.manual_cast_dtype)
+
+
+def _compiled_dtypes(sd: dict, module: torch.nn.Module, cast: bool) -> Optional[dict]:
+    # The dtypes the weights of sd get saved in, they are cast while the file is written so the
+    # cast weights are never all in memory at once
+    module_sd = module.state_dict(keep_vars=True)
+    dtypes = {}
+    for k, v in sd.items():
+        if type(v) not in (torch.Tensor, torch.nn.Parameter):
+            return None
+        target = module_sd.get(k)
+        if cast and target is not None and type(target) in (torch.Tensor, torch.nn.Parameter) and target.shape == v.shape and target.dtype != v.dtype and target.dtype.is_floating_point and v.dtype.is_floating_point:
+            # The same cast load_state_dict does when copying the weight in the module
+            dtypes[k] = target.dtype
+        else:
+            dtypes[k] = v.dtype
+    return dtypes
+
+
+def save(path: str, sd: dict, info: Optional[dict], model_config, module: torch.nn.Module):
+    """
+    Saves the state dict sd a model got loaded from with the info of describe. module is the loaded
+    model, the weights of sd are saved in the dtypes of its weights with the same keys.
+    """
+    if info is None:
+        return
+    info = dict(info)
+    info["dtype"] = _encode(model_config.unet_config.get("dtype"))
+    info["manual_cast_dtype"] = _encode(model_config.manual_cast_dtype)
+    # Quantized layers load their weights in their own formats, keep them as they are
+    dtypes = _compiled_dtypes(sd, module, cast=model_config.quant_config is None)
+    if dtypes is None:
+        logging.debug("Can't compile model {}, its state dict has tensor subclasses.".format(path))
+        return
+    size = sum(v.nelement() * dtypes[k].itemsize for k, v in sd.items())
+    if size > MAX_BYTES:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        trim(MAX_BYTES - size)
+        comfy.safetensors_stream.save_file(sd, path, metadata={METADATA_KEY: json.dumps(info)}, dtypes=dtypes)
+        logging.info("Saved compiled model {}".format(path))
+    except OSError as e:
+        logging.warning("Failed to save compiled model {}: {}".format(path, e))
+
+
+def load_config(path: str):
+    """Returns (model config without its dtypes set, info) of the compiled file path, None if there is none."""
+    try:
+        f = comfy.safetensors_stream.SafetensorsFile(path)
+        info = json.loads((f.metadata or {})[METADATA_KEY])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning("Ignoring invalid compiled model {}: {}".format(path, e))
+        return None
+    if info.get("format") != FORMAT_VERSION:
+        return None
+
+    model_config_class = next((m for m in comfy.supported_models.models if m.__name__ == info["model_config"]), None)
+    if model_config_class is None:
+        return None
+    model_config = model_config_class(_decode(info["unet_config"]))
+    quant_config = _decode(info["quant_config"])
+    if quant_config is not None:
+        model_config.quant_config = quant_config
+    info = dict(info)
+    info["weight_dtype"] = _decode(info["weight_dtype"])
+    try:
+        os.utime(path)  # Mark as recently used
+    except OSError:
+        pass
+    return model_config, info
+
+
+def trim(max_bytes: int):
+    """Deletes the least recently used compiled files until the cache is at most max_bytes."""
+    if cache_directory is None or not os.path.isdir(cache_directory):
+        return
+    files = []
+    for name in os.listdir(cache_directory):
+        if name.endswith(".safetensors"):
+            path = os.path.join(cache_directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+    total = sum(f[1] for f in files)
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            logging.info("Deleted compiled model {}".format(path))
+        except OSError as e:
+            logging.warning("Failed to delete compiled model {}: {}".format(path, e))
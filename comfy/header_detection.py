@@ -0,0 +1,125 @@
+"""
+Model detection from safetensors headers only.
+
+comfy.model_detection only looks at the keys, shapes and dtypes of a state dict to detect the
+model config of a file, so it can run on a state dict of meta tensors built from the header of a
+safetensors file without reading any of the weights. This is what listings of model files use to
+tell what every file is. Results are cached by path, size and modification time and whole folders
+can be detected in parallel.
+"""
+
+import concurrent.futures
+import logging
+import os
+import threading
+from typing import NamedTuple, Optional
+
+import torch
+
+import comfy.model_detection
+import comfy.safetensors_stream
+import comfy.utils
+
+DETECT_THREADS = max(1, min(8, os.cpu_count() or 1))
+
+
+class DetectedModel(NamedTuple):
+    model_config: object
+    # Prefix of the diffusion model keys, "" for diffusion model files
+    unet_prefix: str
+    # Diffusers format diffusion model that gets converted on load
+    diffusers: bool
+    parameters: int
+    weight_dtype: Optional[torch.dtype]
+
+    def to_json(self) -> dict:
+        return {
+            "model_type": self.model_config.__class__.__name__,
+            "image_model": self.model_config.unet_config.get("image_model", None),
+            "unet_prefix": self.unet_prefix,
+            "diffusers": self.diffusers,
+            "parameters": self.parameters,
+            "weight_dtype": str(self.weight_dtype).split(".")[-1] if self.weight_dtype is not None else None,
+            "quantized": self.model_config.quant_config is not None,
+        }
+
+
+def meta_state_dict(path: str):
+    """(state dict of meta tensors with the shapes and dtypes of the tensors of the file, metadata)"""
+    f = comfy.safetensors_stream.SafetensorsFile(path)
+    sd = {k: torch.empty(info.shape, dtype=info.dtype, device="meta") for k, info in f.tensors.items()}
+    return sd, f.metadata
+
+
+def detect_state_dict(sd: dict, metadata: Optional[dict] = None) -> Optional[DetectedModel]:
+    """
+    Detects the diffusion model of sd the way comfy.sd.load_checkpoint_guess_config does, falling
+    back to load_diffusion_model_state_dict like it, without reading any tensor values.
+    """
+    unet_prefix = comfy.model_detection.unet_prefix_from_state_dict(sd)
+    parameters = comfy.utils.calculate_parameters(sd, unet_prefix)
+    weight_dtype = comfy.utils.weight_dtype(sd, unet_prefix)
+    checkpoint_sd, checkpoint_metadata = comfy.utils.convert_old_quants(dict(sd), unet_prefix, metadata=metadata)
+    model_config = comfy.model_detection.model_config_from_unet(checkpoint_sd, unet_prefix, metadata=checkpoint_metadata)
+    if model_config is not None:
+        return DetectedModel(model_config, unet_prefix, False, parameters, weight_dtype)
+
+    temp_sd = comfy.utils.state_dict_prefix_replace(sd, {unet_prefix: ""}, filter_keys=True)
+    if len(temp_sd) > 0:
+        sd = temp_sd
+    sd, metadata = comfy.utils.convert_old_quants(dict(sd), "", metadata=metadata)
+    parameters = comfy.utils.calculate_parameters(sd)
+    weight_dtype = comfy.utils.weight_dtype(sd)
+    model_config = comfy.model_detection.model_config_from_unet(sd, "", metadata=metadata)
+    diffusers = False
+    if model_config is None:
+        diffusers = True
+        new_sd = comfy.model_detection.convert_diffusers_mmdit(sd, "")
+        if new_sd is not None:
+            model_config = comfy.model_detection.model_config_from_unet(new_sd, "")
+        else:
+            model_config = comfy.model_detection.model_config_from_diffusers_unet(sd)
+    if model_config is None:
+        return None
+    return DetectedModel(model_config, "", diffusers, parameters, weight_dtype)
+
+
+_cache: dict[str, tuple[tuple, Optional[DetectedModel]]] = {}
+_cache_lock = threading.Lock()
+
+
+def detect_file(path: str) -> Optional[DetectedModel]:
+    """Detects the model of a safetensors file from its header, None if it isn't a known diffusion model."""
+    if not path.lower().endswith((".safetensors", ".sft")):
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = os.path.realpath(path)
+    version = (stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    try:
+        sd, metadata = meta_state_dict(path)
+        detected = detect_state_dict(sd, metadata)
+    except Exception as e:
+        logging.debug("Failed to detect the model of {}: {}".format(path, e))
+        detected = None
+    with _cache_lock:
+        _cache[key] = (version, detected)
+    return detected
+
+
+def detect_files(paths: list[str], threads=DETECT_THREADS) -> dict[str, Optional[DetectedModel]]:
+    """detect_file for every path, on a thread pool."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        return dict(zip(paths, executor.map(detect_file, paths)))
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
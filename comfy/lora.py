@@ -366,8 +366,99 @@ def pad_tensor_to_shape(tensor: torch.Tensor, new_shape: list[int]) -> torch.Ten
 
     return padded_tensor
 
-def calculate_weight(patches, weight, key, intermediate_dtype=torch.float32, original_weights=None):
-    for p in patches:
+# Upper bound for the bytes of the factors and products of one batched matmul
+LORA_BATCH_MAX_BYTES = 256 * 1024 * 1024
+# Smaller matmuls aren't worth batching and torch.mm takes another code path for tiny ones.
+LORA_BATCH_MIN_MULTIPLY_ADDS = 64 * 64 * 16
+
+def calculate_matmul_products(patches: dict, device, intermediate_dtype=torch.float32, max_bytes=LORA_BATCH_MAX_BYTES):
+    """
+    Computes the matrix products that the weight adapters in patches (key -> list of patches like
+    ModelPatcher.patches) need to calculate their weights. Factors with the same shapes, dtypes and
+    devices are stacked and multiplied with one torch.bmm for all the keys of a group instead of one
+    torch.mm per key, which gives the same results. Groups of one and small matmuls still use torch.mm.
+
+    Returns key -> patch index -> list of products for the matmul_products of calculate_weight.
+    """
+    groups = {}
+    out = {}
+    for key, key_patches in patches.items():
+        for i, p in enumerate(key_patches):
+            v = p[1]
+            if not isinstance(v, weight_adapter.WeightAdapterBase):
+                continue
+            factors = v.get_matmul_factors()
+            if factors is None:
+                continue
+            out.setdefault(key, {})[i] = [None] * len(factors)
+            for j, (a, b) in enumerate(factors):
+                group = (tuple(a.shape), tuple(b.shape), a.dtype, b.dtype, a.device, b.device)
+                groups.setdefault(group, []).append((key, i, j, a, b))
+
+    item_size = comfy.model_management.dtype_size(intermediate_dtype)
+    for (a_shape, b_shape, _, _, _, _), items in groups.items():
+        if len(items) == 1 or a_shape[0] * a_shape[1] * b_shape[1] < LORA_BATCH_MIN_MULTIPLY_ADDS:
+            for key, i, j, a, b in items:
+                out[key][i][j] = torch.mm(comfy.model_management.cast_to_device(a, device, intermediate_dtype),
+                                          comfy.model_management.cast_to_device(b, device, intermediate_dtype))
+            continue
+
+        item_bytes = (a_shape[0] * a_shape[1] + b_shape[0] * b_shape[1] + a_shape[0] * b_shape[1]) * item_size
+        chunk_size = max(1, max_bytes // max(1, item_bytes))
+        for c in range(0, len(items), chunk_size):
+            chunk = items[c:c + chunk_size]
+            mat_a = comfy.model_management.cast_to_device(torch.stack([x[3] for x in chunk]), device, intermediate_dtype)
+            mat_b = comfy.model_management.cast_to_device(torch.stack([x[4] for x in chunk]), device, intermediate_dtype)
+            products = torch.bmm(mat_a, mat_b)
+            del mat_a, mat_b
+            for (key, i, j, _, _), product in zip(chunk, products):
+                out[key][i][j] = product
+    return out
+
+
+class BatchedMatmulProducts:
+    """
+    Computes the matmul products (see calculate_matmul_products) of keys in the order they get
+    patched, for a window of keys at a time so the products don't all have to fit in memory at once.
+    """
+    def __init__(self, patches: dict, keys: list[str], device, intermediate_dtype=torch.float32, max_bytes=LORA_BATCH_MAX_BYTES):
+        self.patches = patches
+        self.keys = [k for k in keys if k in patches]
+        self.positions = {k: i for i, k in enumerate(self.keys)}
+        self.device = device
+        self.intermediate_dtype = intermediate_dtype
+        self.max_bytes = max_bytes
+        self.products = {}
+
+    def _window(self, start):
+        window = {}
+        window_bytes = 0
+        item_size = comfy.model_management.dtype_size(self.intermediate_dtype)
+        for key in self.keys[start:]:
+            key_bytes = 0
+            for p in self.patches[key]:
+                v = p[1]
+                if isinstance(v, weight_adapter.WeightAdapterBase):
+                    for a, b in v.get_matmul_factors() or []:
+                        key_bytes += a.shape[0] * b.shape[1] * item_size
+            if len(window) > 0 and window_bytes + key_bytes > self.max_bytes:
+                break
+            window[key] = self.patches[key]
+            window_bytes += key_bytes
+        return window
+
+    def pop(self, key):
+        """Returns patch index -> products for calculate_weight or None if there are none for key."""
+        if key not in self.products and key in self.positions:
+            window = self._window(self.positions[key])
+            self.products.update(calculate_matmul_products(window, self.device, self.intermediate_dtype, self.max_bytes))
+            for k in window:
+                self.positions.pop(k, None)
+        return self.products.pop(key, None)
+
+
+def calculate_weight(patches, weight, key, intermediate_dtype=torch.float32, original_weights=None, matmul_products=None):
+    for i, p in enumerate(patches):
         strength = p[0]
         v = p[1]
         strength_model = p[2]
@@ -388,7 +479,10 @@ def calculate_weight(patches, weight, key, intermediate_dtype=torch.float32, ori
             v = (calculate_weight(v[1:], v[0][1](comfy.model_management.cast_to_device(v[0][0], weight.device, intermediate_dtype, copy=True), inplace=True), key, intermediate_dtype=intermediate_dtype), )
 
         if isinstance(v, weight_adapter.WeightAdapterBase):
-            output = v.calculate_weight(weight, key, strength, strength_model, offset, function, intermediate_dtype, original_weights)
+            if matmul_products is not None and i in matmul_products:
+                output = v.calculate_weight(weight, key, strength, strength_model, offset, function, intermediate_dtype, original_weights, matmul_products=matmul_products[i])
+            else:
+                output = v.calculate_weight(weight, key, strength, strength_model, offset, function, intermediate_dtype, original_weights)
             if output is None:
                 logging.warning("Calculate Weight Failed: {} {}".format(v.name, key))
             else:
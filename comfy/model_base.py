@@ -50,6 +50,7 @@ import comfy.ldm.qwen_image.model
 import comfy.ldm.kandinsky5.model
 
 import comfy.model_management
+import comfy.shared_weights
 import comfy.patcher_extension
 import comfy.conds
 import comfy.ops
@@ -305,7 +306,7 @@ class BaseModel(torch.nn.Module):
                 to_load[k[len(unet_prefix):]] = sd.pop(k)
 
         to_load = self.model_config.process_unet_state_dict(to_load)
-        m, u = self.diffusion_model.load_state_dict(to_load, strict=False)
+        m, u = comfy.shared_weights.load_state_dict(self.diffusion_model, to_load)
         if len(m) > 0:
             logging.warning("unet missing: {}".format(m))
 
@@ -0,0 +1,191 @@
+"""
+Choice of the models comfy.model_management.free_memory unloads first.
+
+The default policy unloads the models with the most weights already offloaded first, then the ones
+with the fewest references. The cost policy (--eviction-policy cost) estimates what unloading each
+model would cost per byte it frees: the time it took to load the model the last times, weighted by
+how likely it is that one of the next queued prompts needs it again.
+
+Models are matched to prompts by the model file names in the prompts (see
+comfy_execution.workers.prompt_model_names), the names of a model are the ones common to all the
+prompts that loaded it. Evictions of models that get loaded again within EVICTION_REGRET_PROMPTS
+prompts are counted as regretted, for both policies, so they can be compared.
+"""
+
+import contextvars
+import logging
+import threading
+import weakref
+from typing import Callable, Optional
+
+from comfy.cli_args import args
+
+EVICTION_REGRET_PROMPTS = 3
+# Number of queued prompts looked at to predict if a model gets used again
+REUSE_LOOKAHEAD_PROMPTS = 8
+# Loading speed assumed for models that haven't been timed yet
+DEFAULT_LOAD_BYTES_PER_SECOND = 2 * 1024 * 1024 * 1024
+# Reuse probability for models that can't be matched to the queue
+UNKNOWN_REUSE_PROBABILITY = 0.5
+
+
+class ModelStats:
+    def __init__(self):
+        self.names: Optional[frozenset] = None
+        self.seconds_per_byte: Optional[float] = None
+        self.evicted_at: Optional[int] = None
+
+
+class EvictionTelemetry:
+    def __init__(self):
+        self.evictions = 0
+        self.regretted = 0
+        self.reloads = 0
+
+    def get_stats(self) -> dict:
+        return {
+            "evictions": self.evictions,
+            "regretted": self.regretted,
+            "regret_window_prompts": EVICTION_REGRET_PROMPTS,
+            "reloads": self.reloads,
+        }
+
+
+_lock = threading.Lock()
+# ModelPatcher.model -> ModelStats, clones of a patcher share their model
+_stats: "weakref.WeakKeyDictionary[object, ModelStats]" = weakref.WeakKeyDictionary()
+_prompt_counter = 0
+_current_prompt_models: contextvars.ContextVar[Optional[frozenset]] = contextvars.ContextVar("current_prompt_models", default=None)
+_pending_prompt_models: Optional[Callable[[], list[frozenset]]] = None
+telemetry = EvictionTelemetry()
+
+
+def _get_stats(patcher) -> ModelStats:
+    stats = _stats.get(patcher.model)
+    if stats is None:
+        stats = ModelStats()
+        _stats[patcher.model] = stats
+    return stats
+
+
+def prompt_started(model_names: frozenset):
+    """Called by the executor when it starts a prompt, with the model file names of the prompt."""
+    global _prompt_counter
+    with _lock:
+        _prompt_counter += 1
+    _current_prompt_models.set(model_names)
+
+
+def set_pending_prompt_models(function: Optional[Callable[[], list[frozenset]]]):
+    """function returns the model file names of the next queued prompts, in queue order."""
+    global _pending_prompt_models
+    _pending_prompt_models = function
+
+
+def record_load(patcher, seconds: float, loaded_bytes: int):
+    """Called after a model was loaded to its device, loaded_bytes is how much of it got loaded."""
+    with _lock:
+        stats = _get_stats(patcher)
+        names = _current_prompt_models.get()
+        if names is not None:
+            stats.names = names if stats.names is None else stats.names & names
+        if loaded_bytes > 0:
+            seconds_per_byte = seconds / loaded_bytes
+            if stats.seconds_per_byte is None:
+                stats.seconds_per_byte = seconds_per_byte
+            else:
+                stats.seconds_per_byte = 0.5 * (stats.seconds_per_byte + seconds_per_byte)
+            if stats.evicted_at is not None:
+                telemetry.reloads += 1
+            if stats.evicted_at is not None and _prompt_counter - stats.evicted_at <= EVICTION_REGRET_PROMPTS:
+                telemetry.regretted += 1
+                logging.debug("Model {} was loaded again {} prompts after being unloaded.".format(patcher.model.__class__.__name__, _prompt_counter - stats.evicted_at))
+        stats.evicted_at = None
+
+
+def record_eviction(patcher):
+    with _lock:
+        telemetry.evictions += 1
+        _get_stats(patcher).evicted_at = _prompt_counter
+
+
+def reuse_distance(patcher, pending: Optional[list[frozenset]]) -> Optional[int]:
+    """Position in pending of the first prompt that uses the model, len(pending) if none does, None if unknown."""
+    with _lock:
+        stats = _stats.get(patcher.model)
+        names = stats.names if stats is not None else None
+    if pending is None or not names:
+        return None
+    for i, prompt_names in enumerate(pending):
+        if names <= prompt_names:
+            return i
+    return len(pending)
+
+
+class EvictionPolicy:
+    def begin(self):
+        """Called once before sort_key is called for the candidates of a free_memory call."""
+        pass
+
+    def sort_key(self, loaded_model, refcount: int) -> tuple:
+        """Models with the lowest key get unloaded first."""
+        raise NotImplementedError
+
+
+class DefaultEvictionPolicy(EvictionPolicy):
+    def sort_key(self, loaded_model, refcount):
+        return (-loaded_model.model_offloaded_memory(), refcount, loaded_model.model_memory())
+
+
+class CostEvictionPolicy(EvictionPolicy):
+    def begin(self):
+        self.pending = None
+        if _pending_prompt_models is not None:
+            try:
+                self.pending = _pending_prompt_models()
+            except Exception as e:
+                logging.debug("Couldn't get the models of the queued prompts: {}".format(e))
+
+    def reuse_probability(self, patcher) -> float:
+        distance = reuse_distance(patcher, self.pending)
+        if distance is None:
+            return UNKNOWN_REUSE_PROBABILITY
+        if distance >= len(self.pending):
+            return 0.0
+        return 1.0 / (1 + distance)
+
+    def sort_key(self, loaded_model, refcount):
+        patcher = loaded_model.model
+        with _lock:
+            stats = _stats.get(patcher.model)
+            seconds_per_byte = stats.seconds_per_byte if stats is not None and stats.seconds_per_byte is not None else 1.0 / DEFAULT_LOAD_BYTES_PER_SECOND
+        # Expected reload seconds per byte freed, the bytes reloaded are the bytes freed
+        cost = self.reuse_probability(patcher) * seconds_per_byte
+        return (cost,) + DefaultEvictionPolicy.sort_key(self, loaded_model, refcount)
+
+
+POLICIES: dict[str, EvictionPolicy] = {
+    "default": DefaultEvictionPolicy(),
+    "cost": CostEvictionPolicy(),
+}
+
+_policy: EvictionPolicy = POLICIES[args.eviction_policy]
+
+
+def set_policy(policy):
+    """Sets the eviction policy, an EvictionPolicy or the name of one in POLICIES."""
+    global _policy
+    _policy = POLICIES[policy] if isinstance(policy, str) else policy
+
+
+def order_for_eviction(candidates: list[tuple]) -> list:
+    """Sorts (loaded model, refcount, *extra) tuples in the order the models should be unloaded."""
+    policy = _policy
+    policy.begin()
+    return [x for _, x in sorted(((policy.sort_key(x[0], x[1]), i), x) for i, x in enumerate(candidates))]
+
+
+def get_stats() -> dict:
+    stats = telemetry.get_stats()
+    stats["policy"] = next((name for name, p in POLICIES.items() if p is _policy), _policy.__class__.__name__)
+    return stats
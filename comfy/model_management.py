@@ -17,9 +17,11 @@
 """
 
 import psutil
+import collections
 import logging
 from enum import Enum
 from comfy.cli_args import args, PerformanceFeature
+import comfy.model_eviction
 import torch
 import sys
 import importlib
@@ -27,6 +29,9 @@ import platform
 import weakref
 import gc
 import os
+import threading
+import time
+import contextvars
 
 class VRAMState(Enum):
     DISABLED = 0    #No vram present: no need to move models to vram
@@ -450,6 +455,30 @@ except:
 
 
 current_loaded_models = []
+# Prompt workers on other threads can load and unload models at the same time.
+current_loaded_models_lock = threading.RLock()
+
+# The models every prompt worker (current_model_user) is using: the models of its last load_models_gpu call, until it
+# loads others or release_models() at the end of its prompt. Other workers don't unload them and
+# wait for them to be released before loading one of their clones, which share the weights.
+current_model_user: contextvars.ContextVar = contextvars.ContextVar("current_model_user", default=None)
+models_in_use = {}
+models_in_use_changed = threading.Condition(current_loaded_models_lock)
+
+def used_by_other_workers(model, clones=False):
+    user = current_model_user.get()
+    for other_user, models in models_in_use.items():
+        if other_user == user:
+            continue
+        for m in models:
+            if m is model or (clones and hasattr(model, "is_clone") and model.is_clone(m)):
+                return True
+    return False
+
+def release_models():
+    with models_in_use_changed:
+        if models_in_use.pop(current_model_user.get(), None) is not None:
+            models_in_use_changed.notify_all()
 
 def module_size(module):
     module_mem = 0
@@ -533,6 +562,8 @@ class LoadedModel:
         self.model_finalizer.detach()
         self.model_finalizer = None
         self.real_model = None
+        if unpatch_weights and pinned_model_pool is not None:
+            pinned_model_pool.add(self.model)
         return True
 
     def model_use_more_vram(self, extra_memory, force_patch_weights=False):
@@ -582,138 +613,158 @@ def minimum_inference_memory():
     return (1024 * 1024 * 1024) * 0.8 + extra_reserved_memory()
 
 def free_memory(memory_required, device, keep_loaded=[]):
-    cleanup_models_gc()
-    unloaded_model = []
-    can_unload = []
-    unloaded_models = []
-
-    for i in range(len(current_loaded_models) -1, -1, -1):
-        shift_model = current_loaded_models[i]
-        if shift_model.device == device:
-            if shift_model not in keep_loaded and not shift_model.is_dead():
-                can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
-                shift_model.currently_used = False
-
-    for x in sorted(can_unload):
-        i = x[-1]
-        memory_to_free = None
-        if not DISABLE_SMART_MEMORY:
-            free_mem = get_free_memory(device)
-            if free_mem > memory_required:
-                break
-            memory_to_free = memory_required - free_mem
-        logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
-        if current_loaded_models[i].model_unload(memory_to_free):
-            unloaded_model.append(i)
-
-    for i in sorted(unloaded_model, reverse=True):
-        unloaded_models.append(current_loaded_models.pop(i))
-
-    if len(unloaded_model) > 0:
-        soft_empty_cache()
-    else:
-        if vram_state != VRAMState.HIGH_VRAM:
-            mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
-            if mem_free_torch > mem_free_total * 0.25:
-                soft_empty_cache()
-    return unloaded_models
+    with current_loaded_models_lock:
+        cleanup_models_gc()
+        unloaded_model = []
+        can_unload = []
+        unloaded_models = []
+
+        for i in range(len(current_loaded_models) -1, -1, -1):
+            shift_model = current_loaded_models[i]
+            if shift_model.device == device:
+                if shift_model not in keep_loaded and not shift_model.is_dead() and not used_by_other_workers(shift_model.model):
+                    can_unload.append((shift_model, sys.getrefcount(shift_model.model), i))
+                    shift_model.currently_used = False
+
+        for x in comfy.model_eviction.order_for_eviction(can_unload):
+            i = x[-1]
+            memory_to_free = None
+            if not DISABLE_SMART_MEMORY:
+                free_mem = get_free_memory(device)
+                if free_mem > memory_required:
+                    break
+                memory_to_free = memory_required - free_mem
+            logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
+            if current_loaded_models[i].model_unload(memory_to_free):
+                comfy.model_eviction.record_eviction(current_loaded_models[i].model)
+                unloaded_model.append(i)
+
+        for i in sorted(unloaded_model, reverse=True):
+            unloaded_models.append(current_loaded_models.pop(i))
+
+        if len(unloaded_model) > 0:
+            soft_empty_cache()
+        else:
+            if vram_state != VRAMState.HIGH_VRAM:
+                mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
+                if mem_free_torch > mem_free_total * 0.25:
+                    soft_empty_cache()
+        return unloaded_models
 
 def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
-    cleanup_models_gc()
-    global vram_state
+    with current_loaded_models_lock:
+        cleanup_models_gc()
+        global vram_state
+
+        inference_memory = minimum_inference_memory()
+        extra_mem = max(inference_memory, memory_required + extra_reserved_memory())
+        if minimum_memory_required is None:
+            minimum_memory_required = extra_mem
+        else:
+            minimum_memory_required = max(inference_memory, minimum_memory_required + extra_reserved_memory())
 
-    inference_memory = minimum_inference_memory()
-    extra_mem = max(inference_memory, memory_required + extra_reserved_memory())
-    if minimum_memory_required is None:
-        minimum_memory_required = extra_mem
-    else:
-        minimum_memory_required = max(inference_memory, minimum_memory_required + extra_reserved_memory())
+        models_temp = set()
+        for m in models:
+            models_temp.add(m)
+            for mm in m.model_patches_models():
+                models_temp.add(mm)
 
-    models_temp = set()
-    for m in models:
-        models_temp.add(m)
-        for mm in m.model_patches_models():
-            models_temp.add(mm)
+        models = models_temp
 
-    models = models_temp
+        if current_model_user.get() is not None:
+            # The previous models of this worker aren't in use anymore, release them before
+            # waiting so two workers never wait for each other.
+            release_models()
+            while any(used_by_other_workers(x, clones=True) for x in models):
+                logging.debug("Waiting for another prompt worker to finish with a clone of the models")
+                models_in_use_changed.wait()
+            models_in_use[current_model_user.get()] = list(models)
 
-    models_to_load = []
+        models_to_load = []
 
-    for x in models:
-        loaded_model = LoadedModel(x)
-        try:
-            loaded_model_index = current_loaded_models.index(loaded_model)
-        except:
-            loaded_model_index = None
+        for x in models:
+            loaded_model = LoadedModel(x)
+            try:
+                loaded_model_index = current_loaded_models.index(loaded_model)
+            except:
+                loaded_model_index = None
 
-        if loaded_model_index is not None:
-            loaded = current_loaded_models[loaded_model_index]
-            loaded.currently_used = True
-            models_to_load.append(loaded)
-        else:
-            if hasattr(x, "model"):
-                logging.info(f"Requested to load {x.model.__class__.__name__}")
-            models_to_load.append(loaded_model)
+            if loaded_model_index is not None:
+                loaded = current_loaded_models[loaded_model_index]
+                loaded.currently_used = True
+                models_to_load.append(loaded)
+            else:
+                if hasattr(x, "model"):
+                    logging.info(f"Requested to load {x.model.__class__.__name__}")
+                models_to_load.append(loaded_model)
+
+        for loaded_model in models_to_load:
+            to_unload = []
+            for i in range(len(current_loaded_models)):
+                if loaded_model.model.is_clone(current_loaded_models[i].model):
+                    to_unload = [i] + to_unload
+            for i in to_unload:
+                model_to_unload = current_loaded_models.pop(i)
+                model_to_unload.model.detach(unpatch_all=False)
+                model_to_unload.model_finalizer.detach()
+
+        total_memory_required = {}
+        for loaded_model in models_to_load:
+            total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
+
+        for device in total_memory_required:
+            if device != torch.device("cpu"):
+                free_memory(total_memory_required[device] * 1.1 + extra_mem, device)
+
+        for device in total_memory_required:
+            if device != torch.device("cpu"):
+                free_mem = get_free_memory(device)
+                if free_mem < minimum_memory_required:
+                    models_l = free_memory(minimum_memory_required, device)
+                    logging.info("{} models unloaded.".format(len(models_l)))
+
+        for loaded_model in models_to_load:
+            model = loaded_model.model
+            torch_dev = model.load_device
+            if is_device_cpu(torch_dev):
+                vram_set_state = VRAMState.DISABLED
+            else:
+                vram_set_state = vram_state
+            lowvram_model_memory = 0
+            if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
+                loaded_memory = loaded_model.model_loaded_memory()
+                current_free_mem = get_free_memory(torch_dev) + loaded_memory
 
-    for loaded_model in models_to_load:
-        to_unload = []
-        for i in range(len(current_loaded_models)):
-            if loaded_model.model.is_clone(current_loaded_models[i].model):
-                to_unload = [i] + to_unload
-        for i in to_unload:
-            model_to_unload = current_loaded_models.pop(i)
-            model_to_unload.model.detach(unpatch_all=False)
-            model_to_unload.model_finalizer.detach()
-
-    total_memory_required = {}
-    for loaded_model in models_to_load:
-        total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
-
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_memory(total_memory_required[device] * 1.1 + extra_mem, device)
-
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_mem = get_free_memory(device)
-            if free_mem < minimum_memory_required:
-                models_l = free_memory(minimum_memory_required, device)
-                logging.info("{} models unloaded.".format(len(models_l)))
-
-    for loaded_model in models_to_load:
-        model = loaded_model.model
-        torch_dev = model.load_device
-        if is_device_cpu(torch_dev):
-            vram_set_state = VRAMState.DISABLED
-        else:
-            vram_set_state = vram_state
-        lowvram_model_memory = 0
-        if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
-            loaded_memory = loaded_model.model_loaded_memory()
-            current_free_mem = get_free_memory(torch_dev) + loaded_memory
+                lowvram_model_memory = max(0, (current_free_mem - minimum_memory_required), min(current_free_mem * MIN_WEIGHT_MEMORY_RATIO, current_free_mem - minimum_inference_memory()))
+                lowvram_model_memory = lowvram_model_memory - loaded_memory
 
-            lowvram_model_memory = max(0, (current_free_mem - minimum_memory_required), min(current_free_mem * MIN_WEIGHT_MEMORY_RATIO, current_free_mem - minimum_inference_memory()))
-            lowvram_model_memory = lowvram_model_memory - loaded_memory
+                if lowvram_model_memory == 0:
+                    lowvram_model_memory = 0.1
 
-            if lowvram_model_memory == 0:
+            if vram_set_state == VRAMState.NO_VRAM:
                 lowvram_model_memory = 0.1
 
-        if vram_set_state == VRAMState.NO_VRAM:
-            lowvram_model_memory = 0.1
-
-        loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
-        current_loaded_models.insert(0, loaded_model)
-    return
+            if pinned_model_pool is not None:
+                pinned_model_pool.remove(model)
+            memory_before_load = loaded_model.model_loaded_memory()
+            load_start = time.perf_counter()
+            loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
+            comfy.model_eviction.record_load(model, time.perf_counter() - load_start, loaded_model.model_loaded_memory() - memory_before_load)
+            current_loaded_models.insert(0, loaded_model)
+        return
 
 def load_model_gpu(model):
     return load_models_gpu([model])
 
 def loaded_models(only_currently_used=False):
     output = []
+    in_use = models_in_use.get(current_model_user.get())
     for m in current_loaded_models:
         if only_currently_used:
             if not m.currently_used:
                 continue
+            if in_use is not None and not any(m.model is x for x in in_use):
+                continue
 
         output.append(m.model)
     return output
@@ -740,14 +791,15 @@ def cleanup_models_gc():
 
 
 def cleanup_models():
-    to_delete = []
-    for i in range(len(current_loaded_models)):
-        if current_loaded_models[i].real_model() is None:
-            to_delete = [i] + to_delete
+    with current_loaded_models_lock:
+        to_delete = []
+        for i in range(len(current_loaded_models)):
+            if current_loaded_models[i].real_model() is None:
+                to_delete = [i] + to_delete
 
-    for i in to_delete:
-        x = current_loaded_models.pop(i)
-        del x
+        for i in to_delete:
+            x = current_loaded_models.pop(i)
+            del x
 
 def dtype_size(dtype):
     dtype_size = 4
@@ -1205,6 +1257,77 @@ def unpin_memory(tensor):
 
     return False
 
+class PinnedModelPool:
+    """
+    Keeps the weights of models that got fully unloaded from their device in pinned memory so
+    loading them back is a straight DMA copy instead of a copy through pageable memory. Up to
+    max_bytes of weights are kept pinned, the models unloaded the longest time ago get unpinned
+    first when a newly unloaded model needs the room.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        # id(ModelPatcher.model) -> (weakref to the ModelPatcher, bytes pinned), least recently unloaded first
+        self.models = collections.OrderedDict()
+        self.evictions = 0
+
+    def _prune(self):
+        for key in [k for k, (patcher, _) in self.models.items() if patcher() is None]:
+            self.models.pop(key)
+
+    def total_bytes(self):
+        with self.lock:
+            self._prune()
+            return sum(size for _, size in self.models.values())
+
+    def add(self, patcher):
+        """Pins the offloaded weights of patcher, which just got unloaded from its device."""
+        with self.lock:
+            self.remove(patcher)
+            self._prune()
+            size = patcher.model_size()
+            if size > self.max_bytes:
+                return
+            while len(self.models) > 0 and (self.total_bytes() + size > self.max_bytes or TOTAL_PINNED_MEMORY + size > MAX_PINNED_MEMORY):
+                _, (evicted, _) = self.models.popitem(last=False)
+                evicted = evicted()
+                if evicted is not None:
+                    evicted.unpin_all_weights()
+                    self.evictions += 1
+            pinned = patcher.pin_offloaded_weights()
+            if pinned > 0:
+                self.models[id(patcher.model)] = (weakref.ref(patcher), pinned)
+
+    def remove(self, patcher):
+        """Forgets patcher when it gets loaded again, loading it unpins the weights it moves."""
+        with self.lock:
+            self.models.pop(id(patcher.model), None)
+
+    def get_stats(self):
+        with self.lock:
+            self._prune()
+            return {
+                "max_bytes": self.max_bytes,
+                "bytes": sum(size for _, size in self.models.values()),
+                "evictions": self.evictions,
+                "models": [{"model": patcher().model.__class__.__name__, "bytes": size} for patcher, size in self.models.values()],
+            }
+
+
+pinned_model_pool = None
+if args.pinned_model_pool > 0:
+    if MAX_PINNED_MEMORY > 0:
+        pinned_model_pool = PinnedModelPool(int(args.pinned_model_pool * (1024 ** 3)))
+    else:
+        logging.warning("--pinned-model-pool has no effect, pinned memory isn't available.")
+
+def pinned_memory_stats():
+    return {
+        "total": TOTAL_PINNED_MEMORY,
+        "max": max(0, MAX_PINNED_MEMORY),
+        "pool": pinned_model_pool.get_stats() if pinned_model_pool is not None else None,
+    }
+
 def sage_attention_enabled():
     return args.use_sage_attention
 
@@ -33,7 +33,10 @@ import comfy.hooks
 import comfy.lora
 import comfy.model_management
 import comfy.patcher_extension
+import comfy.shared_weights
 import comfy.utils
+import comfy.weight_cache
+import comfy.weight_streaming
 from comfy.comfy_types import UnetWrapperFunction
 from comfy.quant_ops import QuantizedTensor
 from comfy.patcher_extension import CallbacksMP, PatcherInjection, WrappersMP
@@ -611,7 +614,7 @@ class ModelPatcher:
                         sd.pop(k)
             return sd
 
-    def patch_weight_to_device(self, key, device_to=None, inplace_update=False):
+    def patch_weight_to_device(self, key, device_to=None, inplace_update=False, batched_products=None):
         if key not in self.patches:
             return
 
@@ -621,17 +624,26 @@ class ModelPatcher:
         if key not in self.backup:
             self.backup[key] = collections.namedtuple('Dimension', ['weight', 'inplace_update'])(weight.to(device=self.offload_device, copy=inplace_update), inplace_update)
 
-        temp_dtype = comfy.model_management.lora_compute_dtype(device_to)
-        if device_to is not None:
-            temp_weight = comfy.model_management.cast_to_device(weight, device_to, temp_dtype, copy=True)
-        else:
-            temp_weight = weight.to(temp_dtype, copy=True)
-        if convert_func is not None:
-            temp_weight = convert_func(temp_weight, inplace=True)
+        cache_entry, out_weight = None, None
+        if set_func is None and convert_func is None:
+            cache_entry, out_weight = comfy.weight_cache.lookup(self.model, key, weight, self.patches[key], device_to if device_to is not None else weight.device)
+
+        if out_weight is None:
+            temp_dtype = comfy.model_management.lora_compute_dtype(device_to)
+            if device_to is not None:
+                temp_weight = comfy.model_management.cast_to_device(weight, device_to, temp_dtype, copy=True)
+            else:
+                temp_weight = weight.to(temp_dtype, copy=True)
+            if convert_func is not None:
+                temp_weight = convert_func(temp_weight, inplace=True)
+
+            matmul_products = batched_products.pop(key) if batched_products is not None else None
+            out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key, matmul_products=matmul_products)
+            if set_func is None:
+                out_weight = comfy.float.stochastic_rounding(out_weight, weight.dtype, seed=string_to_seed(key))
+                comfy.weight_cache.store(cache_entry, out_weight)
 
-        out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key)
         if set_func is None:
-            out_weight = comfy.float.stochastic_rounding(out_weight, weight.dtype, seed=string_to_seed(key))
             if inplace_update:
                 comfy.utils.copy_to_param(self.model, key, out_weight)
             else:
@@ -639,8 +651,27 @@ class ModelPatcher:
         else:
             set_func(out_weight, inplace_update=inplace_update, seed=string_to_seed(key))
 
+    def batched_matmul_products(self, keys, device_to):
+        """
+        Precomputes the matmuls of the weight adapters of keys batched across keys, for
+        patch_weight_to_device to patch the keys in that order. Keys with a cached patched weight
+        are left out.
+        """
+        to_compute = []
+        for key in keys:
+            if key not in self.patches:
+                continue
+            weight, set_func, convert_func = get_key_weight(self.model, key)
+            if set_func is None and convert_func is None and comfy.weight_cache.contains(self.model, key, weight, self.patches[key]):
+                continue
+            to_compute.append(key)
+        return comfy.lora.BatchedMatmulProducts(self.patches, to_compute, device_to)
+
     def pin_weight_to_device(self, key):
         weight, set_func, convert_func = get_key_weight(self.model, key)
+        if comfy.shared_weights.is_shared(weight):
+            # Pinning would make the pages of the shared mapping private copies
+            return
         if comfy.model_management.pin_memory(weight):
             self.pinned.add(key)
 
@@ -650,6 +681,16 @@ class ModelPatcher:
             comfy.model_management.unpin_memory(weight)
             self.pinned.remove(key)
 
+    def pin_offloaded_weights(self):
+        """Pins the weights that are in CPU memory, returns the number of bytes that got pinned."""
+        pinned = 0
+        for key, param in self.model.named_parameters():
+            if key not in self.pinned and comfy.model_management.is_device_cpu(param.device):
+                self.pin_weight_to_device(key)
+                if key in self.pinned:
+                    pinned += param.numel() * param.element_size()
+        return pinned
+
     def unpin_all_weights(self):
         for key in list(self.pinned):
             self.unpin_weight(key)
@@ -763,6 +804,10 @@ class ModelPatcher:
                 mem_counter += move_weight_functions(m, device_to)
 
             load_completely.sort(reverse=True)
+            batched_products = None
+            if device_to is not None:
+                batched_products = self.batched_matmul_products(["{}.{}".format(x[1], param) for x in load_completely if getattr(x[2], "comfy_patched_weights", False) != True for param in x[3]], device_to)
+
             for x in load_completely:
                 n = x[1]
                 m = x[2]
@@ -774,7 +819,7 @@ class ModelPatcher:
                 for param in params:
                     key = "{}.{}".format(n, param)
                     self.unpin_weight(key)
-                    self.patch_weight_to_device(key, device_to=device_to)
+                    self.patch_weight_to_device(key, device_to=device_to, batched_products=batched_products)
                 if comfy.model_management.is_device_cuda(device_to):
                     torch.cuda.synchronize()
 
@@ -791,6 +836,9 @@ class ModelPatcher:
                     self.pin_weight_to_device("{}.{}".format(n, param))
 
             if lowvram_counter > 0:
+                streamer = comfy.weight_streaming.attach(self.model, device_to)
+                if streamer is not None:
+                    offload_buffer = max(offload_buffer, streamer.ring_bytes())
                 logging.info("loaded partially; {:.2f} MB usable, {:.2f} MB loaded, {:.2f} MB offloaded, {:.2f} MB buffer reserved, lowvram patches: {}".format(lowvram_model_memory / (1024 * 1024), mem_counter / (1024 * 1024), lowvram_mem_counter / (1024 * 1024), offload_buffer / (1024 * 1024), patch_counter))
                 self.model.model_lowvram = True
             else:
@@ -834,6 +882,7 @@ class ModelPatcher:
             self.unpatch_hooks()
             self.unpin_all_weights()
             if self.model.model_lowvram:
+                comfy.weight_streaming.detach(self.model)
                 for m in self.model.modules():
                     move_weight_functions(m, device_to)
                     wipe_lowvram_weight(m)
@@ -854,6 +903,11 @@ class ModelPatcher:
             self.backup.clear()
 
             if device_to is not None:
+                if comfy.model_management.is_device_cpu(device_to):
+                    # The weights shared with other processes are still in memory, no need to copy them back
+                    # They are recorded on the module they got loaded in, the diffusion model of a BaseModel for example
+                    for m in self.model.modules():
+                        comfy.shared_weights.restore_weights(m)
                 self.model.to(device_to)
                 self.model.device = device_to
             self.model.model_loaded_weight_memory = 0
@@ -948,6 +1002,9 @@ class ModelPatcher:
 
 
             self.model.model_lowvram = True
+            streamer = comfy.weight_streaming.attach(self.model, self.load_device)
+            if streamer is not None:
+                offload_buffer = max(offload_buffer, streamer.ring_bytes())
             self.model.lowvram_patch_counter += patch_counter
             self.model.model_loaded_weight_memory -= memory_freed
             self.model.model_offload_buffer_memory = offload_buffer
@@ -0,0 +1,103 @@
+"""
+Counter based noise generation (--noise-rng philox).
+
+The default torch mode is the compatibility mode: the noise comes from a torch generator seeded
+with the seed, exactly like it always did, so a seed gives the same images as before. The items of
+a batch get consecutive noise from that generator, so the noise of an item depends on the items
+before it.
+
+The philox mode computes every noise value from the seed, the batch index of its item and its
+position with the Philox4x32-10 counter based generator, as tensor ops for the whole batch at once.
+The noise of an item only depends on the seed and its batch index, an item sampled alone with its
+batch_index gets the same noise as in the full batch. The philox noise is different from the torch
+noise, switching modes changes the images. The integer part is exact on every device, the normal
+values can differ in the last bits between devices.
+"""
+
+import math
+
+import torch
+
+from comfy.cli_args import args
+import comfy.nested_tensor
+
+MODE = args.noise_rng
+
+PHILOX_M0 = 0xD2511F53
+PHILOX_M1 = 0xCD9E8D57
+PHILOX_W0 = 0x9E3779B9
+PHILOX_W1 = 0xBB67AE85
+MASK = 0xFFFFFFFF
+
+# Streams of noise for the same seed
+STREAM_INITIAL_NOISE = 0
+STREAM_NOISE_SAMPLER = 1
+
+
+def _mulhilo(a: int, b: torch.Tensor):
+    """(high, low) 32 bits of a * b for 32 bit a and b, without overflowing int64."""
+    p_lo = b * (a & 0xFFFF)
+    p_hi = b * (a >> 16)
+    lo = p_lo + ((p_hi & 0xFFFF) << 16)
+    hi = (p_hi >> 16) + (lo >> 32)
+    return hi & MASK, lo & MASK
+
+
+def philox4x32(c0, c1, c2, c3, k0: int, k1: int, rounds=10):
+    """Philox4x32 of the counter (c0, c1, c2, c3) and the key (k0, k1), int64 tensors or ints holding 32 bit values."""
+    for _ in range(rounds):
+        hi0, lo0 = _mulhilo(PHILOX_M0, c0)
+        hi1, lo1 = _mulhilo(PHILOX_M1, c2)
+        c0, c1, c2, c3 = hi1 ^ c1 ^ k0, lo1, hi0 ^ c3 ^ k1, lo0
+        k0 = (k0 + PHILOX_W0) & MASK
+        k1 = (k1 + PHILOX_W1) & MASK
+    return c0, c1, c2, c3
+
+
+def randn(shape, seed: int, indices=None, offset=0, stream=STREAM_INITIAL_NOISE, dtype=torch.float32, device="cpu") -> torch.Tensor:
+    """
+    Normal noise of shape. The noise of item i (first dimension) is keyed by the seed and indices[i],
+    i by default, offset and stream select other noise for the same keys.
+    """
+    batch = shape[0]
+    numel = math.prod(shape[1:])
+    if indices is None:
+        indices = torch.arange(batch, device=device)
+    items = torch.as_tensor(indices, dtype=torch.int64, device=device).reshape(-1, 1) & MASK
+    # Every counter gives 4 values
+    counters = torch.arange((numel + 3) // 4, dtype=torch.int64, device=device).reshape(1, -1)
+    r = philox4x32(counters, offset & MASK, items, stream & MASK, seed & MASK, (seed >> 32) & MASK)
+
+    # 24 bit uniforms in (0, 1) to normals with Box-Muller
+    u = [((x >> 8).to(torch.float32) + 0.5) * (1.0 / (1 << 24)) for x in r]
+    radius0 = torch.sqrt(-2.0 * torch.log(u[0]))
+    radius1 = torch.sqrt(-2.0 * torch.log(u[2]))
+    theta0 = (2.0 * math.pi) * u[1]
+    theta1 = (2.0 * math.pi) * u[3]
+    noise = torch.stack([radius0 * torch.cos(theta0), radius0 * torch.sin(theta0), radius1 * torch.cos(theta1), radius1 * torch.sin(theta1)], dim=-1)
+    return noise.reshape(batch, -1)[:, :numel].reshape(shape).to(dtype)
+
+
+def prepare_noise(latent_image, seed: int, noise_inds=None):
+    """comfy.sample.prepare_noise in philox mode."""
+    def noise(latent, stream):
+        return randn(latent.shape, seed, indices=noise_inds, stream=stream, dtype=latent.dtype)
+
+    if latent_image.is_nested:
+        # Even streams, the odd ones are for the noise samplers
+        return comfy.nested_tensor.NestedTensor([noise(t, STREAM_INITIAL_NOISE + 2 * i) for i, t in enumerate(latent_image.unbind())])
+    return noise(latent_image, STREAM_INITIAL_NOISE)
+
+
+def noise_sampler(x, seed: int, indices=None):
+    """
+    comfy.k_diffusion.sampling.default_noise_sampler in philox mode, every call gets the next noise.
+    Like prepare_noise the noise of the items is keyed by their batch indices, indices.
+    """
+    calls = 0
+
+    def sample(sigma, sigma_next):
+        nonlocal calls
+        calls += 1
+        return randn(x.shape, seed, indices=indices, offset=calls, stream=STREAM_NOISE_SAMPLER, dtype=x.dtype, device=x.device)
+    return sample
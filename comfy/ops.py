@@ -19,6 +19,7 @@
 import torch
 import logging
 import comfy.model_management
+import comfy.weight_streaming
 from comfy.cli_args import args, PerformanceFeature
 import comfy.float
 import comfy.rmsnorm
@@ -87,8 +88,15 @@ def cast_bias_weight(s, input=None, dtype=None, device=None, bias_dtype=None, of
         if device is None:
             device = input.device
 
-    if offloadable and (device != s.weight.device or
-                        (s.bias is not None and device != s.bias.device)):
+    # Weights comfy.weight_streaming already copied to the device, they are copies the functions can modify
+    prefetched = {}
+    if hasattr(s, "comfy_prefetched"):
+        prefetched = comfy.weight_streaming.take_prefetched(s, device) or {}
+    weight_source = prefetched.get("weight", s.weight)
+    bias_source = prefetched.get("bias", s.bias)
+
+    if offloadable and (device != weight_source.device or
+                        (bias_source is not None and device != bias_source.device)):
         offload_stream = comfy.model_management.get_offload_stream(device)
     else:
         offload_stream = None
@@ -98,11 +106,11 @@ def cast_bias_weight(s, input=None, dtype=None, device=None, bias_dtype=None, of
     weight_has_function = len(s.weight_function) > 0
     bias_has_function = len(s.bias_function) > 0
 
-    weight = comfy.model_management.cast_to(s.weight, None, device, non_blocking=non_blocking, copy=weight_has_function, stream=offload_stream)
+    weight = comfy.model_management.cast_to(weight_source, None, device, non_blocking=non_blocking, copy=weight_has_function and "weight" not in prefetched, stream=offload_stream)
 
     bias = None
     if s.bias is not None:
-        bias = comfy.model_management.cast_to(s.bias, bias_dtype, device, non_blocking=non_blocking, copy=bias_has_function, stream=offload_stream)
+        bias = comfy.model_management.cast_to(bias_source, bias_dtype, device, non_blocking=non_blocking, copy=bias_has_function and "bias" not in prefetched, stream=offload_stream)
 
     comfy.model_management.sync_stream(device, offload_stream)
 
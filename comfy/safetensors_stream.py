@@ -0,0 +1,227 @@
+"""
+Streaming safetensors reader.
+
+The header is parsed once and the tensors are read in large byte ranges that cover many tensors
+each, with a few reads in flight on a thread pool. Tensors are yielded as soon as the range they
+are in has been read, converted to the requested dtype and device, so callers can put them where
+they belong without keeping every tensor of the file around at once.
+"""
+
+import concurrent.futures
+import itertools
+import json
+import os
+import struct
+import tempfile
+from typing import Iterable, NamedTuple, Optional
+
+import torch
+
+
+READ_CHUNK_BYTES = 64 * 1024 * 1024
+READ_THREADS = max(1, min(8, os.cpu_count() or 1))
+
+_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+for _name, _attr in (("F8_E4M3", "float8_e4m3fn"), ("F8_E5M2", "float8_e5m2"), ("U16", "uint16"), ("U32", "uint32"), ("U64", "uint64")):
+    if hasattr(torch, _attr):
+        _DTYPES[_name] = getattr(torch, _attr)
+
+
+class TensorInfo(NamedTuple):
+    dtype: torch.dtype
+    shape: tuple
+    start: int
+    end: int
+
+
+class SafetensorsFile:
+    def __init__(self, path: str, max_header_size=100 * 1024 * 1024):
+        self.path = path
+        file_size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            header_size = f.read(8)
+            if len(header_size) < 8:
+                raise ValueError("MetadataIncompleteBuffer")
+            header_size = struct.unpack("<Q", header_size)[0]
+            if header_size > max_header_size:
+                raise ValueError("HeaderTooLarge")
+            if header_size + 8 > file_size:
+                raise ValueError("MetadataIncompleteBuffer")
+            header = json.loads(f.read(header_size))
+
+        self.data_start = 8 + header_size
+        self.metadata = header.pop("__metadata__", None)
+        self.tensors: dict[str, TensorInfo] = {}
+        for key, info in header.items():
+            dtype = _DTYPES.get(info["dtype"])
+            if dtype is None:
+                raise ValueError("Unsupported safetensors dtype {} for {}".format(info["dtype"], key))
+            start, end = info["data_offsets"]
+            if self.data_start + end > file_size:
+                raise ValueError("MetadataIncompleteBuffer")
+            self.tensors[key] = TensorInfo(dtype, tuple(info["shape"]), start, end)
+
+    def keys(self):
+        return self.tensors.keys()
+
+    def _read_ranges(self, keys):
+        """Groups keys in file order into byte ranges of up to READ_CHUNK_BYTES (or a single larger tensor)."""
+        ranges = []
+        for key in sorted(keys, key=lambda k: self.tensors[k].start):
+            info = self.tensors[key]
+            if len(ranges) > 0:
+                start, end, range_keys = ranges[-1]
+                if info.start >= end and info.end - start <= READ_CHUNK_BYTES:
+                    ranges[-1] = (start, max(end, info.end), range_keys + [key])
+                    continue
+            ranges.append((info.start, info.end, [key]))
+        return ranges
+
+    def _read(self, start, end):
+        buffer = torch.empty((end - start,), dtype=torch.uint8)
+        if end > start:
+            with open(self.path, "rb", buffering=0) as f:
+                f.seek(self.data_start + start)
+                view = memoryview(buffer.numpy())
+                read = 0
+                while read < len(view):
+                    n = f.readinto(view[read:])
+                    if not n:
+                        raise ValueError("MetadataIncompleteBuffer")
+                    read += n
+        return buffer
+
+    def stream(self, keys: Optional[Iterable[str]] = None, device=None, dtype: Optional[torch.dtype] = None, threads=READ_THREADS):
+        """
+        Yields (key, tensor) in file order. Floating point tensors get converted to dtype when it is
+        set and everything gets moved to device when it is set. Tensors that don't get converted or
+        moved are views of the range they were read with, unless they aren't aligned to their element
+        size in the file.
+        """
+        if keys is None:
+            keys = self.tensors.keys()
+        ranges = self._read_ranges(keys)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            pending = {}
+            for i in range(len(ranges)):
+                # Keep a bounded number of ranges in flight so this doesn't read the whole file into RAM
+                for j in range(i, min(len(ranges), i + threads + 1)):
+                    if j not in pending:
+                        pending[j] = executor.submit(self._read, ranges[j][0], ranges[j][1])
+                start, _, range_keys = ranges[i]
+                buffer = pending.pop(i).result()
+                for key in range_keys:
+                    info = self.tensors[key]
+                    tensor = buffer[info.start - start:info.end - start]
+                    if (info.start - start) % info.dtype.itemsize != 0:
+                        # The format doesn't require alignment, views need it
+                        tensor = tensor.clone()
+                    tensor = tensor.view(info.dtype).reshape(info.shape)
+                    if dtype is not None and tensor.is_floating_point():
+                        tensor = tensor.to(dtype)
+                    if device is not None:
+                        tensor = tensor.to(device)
+                    yield key, tensor
+                del buffer
+
+    def load(self, device=None, dtype: Optional[torch.dtype] = None) -> dict[str, torch.Tensor]:
+        sd = {}
+        # Keep the key order of the header like safe_open does
+        order = {k: i for i, k in enumerate(self.tensors)}
+        for key, tensor in sorted(self.stream(device=device, dtype=dtype), key=lambda x: order[x[0]]):
+            sd[key] = tensor
+        return sd
+
+
+def save_file(sd: dict[str, torch.Tensor], path: str, metadata: Optional[dict[str, str]] = None, dtypes: Optional[dict[str, torch.dtype]] = None):
+    """
+    Writes sd to a safetensors file one tensor at a time instead of serializing it in memory first.
+    The tensors with a key in dtypes are saved in that dtype, cast one at a time while writing.
+    Tensors are written largest element size first so every tensor is aligned to its element size
+    in the file and can be mapped as is. The file gets written next to path and renamed over it.
+    """
+    if dtypes is None:
+        dtypes = {}
+    dtype_names = {v: k for k, v in _DTYPES.items()}
+    dtypes = {k: dtypes.get(k, sd[k].dtype) for k in sd}
+    keys = sorted(sd.keys(), key=lambda k: -dtypes[k].itemsize)
+    header = {}
+    if metadata is not None:
+        header["__metadata__"] = metadata
+    offset = 0
+    for k in keys:
+        size = sd[k].nelement() * dtypes[k].itemsize
+        header[k] = {"dtype": dtype_names[dtypes[k]], "shape": list(sd[k].shape), "data_offsets": [offset, offset + size]}
+        offset += size
+    header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header += b" " * (-len(header) % 8)
+
+    # A unique name, other threads can be saving the same file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for k in keys:
+                t = sd[k].detach().to(device="cpu", dtype=dtypes[k]).contiguous().reshape(-1)
+                if t.nelement() > 0:
+                    f.write(memoryview(t.view(torch.uint8).numpy()))
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def stream_into_module(module: torch.nn.Module, file: SafetensorsFile, prefix="", keys: Optional[Iterable[str]] = None) -> dict[str, torch.Tensor]:
+    """
+    Copies the tensors of file straight into the parameters and buffers of module, without a state
+    dict of the whole file in between. Keys starting with prefix map to the module attribute of the
+    rest of the key. Each tensor gets converted to the dtype and device of the attribute on the fly.
+
+    Returns the tensors that didn't match an attribute of the same shape or belong to a module with
+    its own state dict loading (like the quantized layers of comfy.ops), for the caller to load the
+    regular way (module.load_state_dict with strict=False for example).
+    """
+    targets = {}
+    for module_name, m in module.named_modules():
+        if type(m)._load_from_state_dict is not torch.nn.Module._load_from_state_dict or len(m._load_state_dict_pre_hooks) > 0:
+            continue
+        for name, t in itertools.chain(m.named_parameters(recurse=False), m.named_buffers(recurse=False)):
+            targets["{}.{}".format(module_name, name) if module_name else name] = t
+    if keys is None:
+        keys = file.keys()
+    keys = [k for k in keys if k.startswith(prefix)]
+    leftover = {}
+    for key, tensor in file.stream(keys):
+        name = key[len(prefix):]
+        target = targets.get(name)
+        if target is None or tuple(target.shape) != tuple(tensor.shape) or target.device.type == "meta":
+            leftover[name] = tensor.clone() if tensor._base is not None else tensor
+            continue
+        with torch.no_grad():
+            target.copy_(tensor)
+    return leftover
+
+
+def load_into_module(module: torch.nn.Module, path: str, prefix="", strict=False):
+    """Like module.load_state_dict with the tensors of a file under prefix, returns (missing keys, unexpected keys)."""
+    f = SafetensorsFile(path)
+    leftover = stream_into_module(module, f, prefix)
+    copied = set(k[len(prefix):] for k in f.keys() if k.startswith(prefix)) - set(leftover.keys())
+    missing, unexpected = module.load_state_dict(leftover, strict=False)
+    missing = [k for k in missing if k not in copied]
+    if strict and (len(missing) > 0 or len(unexpected) > 0):
+        raise RuntimeError("Error(s) in loading {} into {}: missing keys {}, unexpected keys {}".format(path, module.__class__.__name__, missing, unexpected))
+    return missing, unexpected
+
@@ -5,17 +5,24 @@ import comfy.utils
 import numpy as np
 import logging
 import comfy.nested_tensor
+import comfy.noise_rng
+import math
 
 def prepare_noise_inner(latent_image, generator, noise_inds=None):
     if noise_inds is None:
         return torch.randn(latent_image.size(), dtype=latent_image.dtype, layout=latent_image.layout, generator=generator, device="cpu")
 
     unique_inds, inverse = np.unique(noise_inds, return_inverse=True)
+    item_size = list(latent_image.size())[1:]
+    chunk = 1
+    if math.prod(item_size) % 16 == 0:
+        # For items of a multiple of 16 values the generator gives the same noise to one call for several items as to one call per item
+        chunk = len(unique_inds)
     noises = []
-    for i in range(unique_inds[-1]+1):
-        noise = torch.randn([1] + list(latent_image.size())[1:], dtype=latent_image.dtype, layout=latent_image.layout, generator=generator, device="cpu")
-        if i in unique_inds:
-            noises.append(noise)
+    for i in range(0, unique_inds[-1] + 1, chunk):
+        noise = torch.randn([min(chunk, unique_inds[-1] + 1 - i)] + item_size, dtype=latent_image.dtype, layout=latent_image.layout, generator=generator, device="cpu")
+        for j in unique_inds[(unique_inds >= i) & (unique_inds < i + noise.shape[0])]:
+            noises.append(noise[j - i:j - i + 1])
     noises = [noises[i] for i in inverse]
     return torch.cat(noises, axis=0)
 
@@ -24,6 +31,9 @@ def prepare_noise(latent_image, seed, noise_inds=None):
     creates random noise given a latent image and a seed.
     optional arg skip can be used to skip and discard x number of noise generations for a given seed
     """
+    if comfy.noise_rng.MODE == "philox":
+        return comfy.noise_rng.prepare_noise(latent_image, seed, noise_inds)
+
     generator = torch.manual_seed(seed)
 
     if latent_image.is_nested:
@@ -54,14 +64,14 @@ def prepare_sampling(model, noise_shape, positive, negative, noise_mask):
 def cleanup_additional_models(models):
     logging.warning("Warning: comfy.sample.cleanup_additional_models isn't used anymore and can be removed")
 
-def sample(model, noise, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=1.0, disable_noise=False, start_step=None, last_step=None, force_full_denoise=False, noise_mask=None, sigmas=None, callback=None, disable_pbar=False, seed=None):
+def sample(model, noise, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=1.0, disable_noise=False, start_step=None, last_step=None, force_full_denoise=False, noise_mask=None, sigmas=None, callback=None, disable_pbar=False, seed=None, noise_inds=None):
     sampler = comfy.samplers.KSampler(model, steps=steps, device=model.load_device, sampler=sampler_name, scheduler=scheduler, denoise=denoise, model_options=model.model_options)
 
-    samples = sampler.sample(noise, positive, negative, cfg=cfg, latent_image=latent_image, start_step=start_step, last_step=last_step, force_full_denoise=force_full_denoise, denoise_mask=noise_mask, sigmas=sigmas, callback=callback, disable_pbar=disable_pbar, seed=seed)
+    samples = sampler.sample(noise, positive, negative, cfg=cfg, latent_image=latent_image, start_step=start_step, last_step=last_step, force_full_denoise=force_full_denoise, denoise_mask=noise_mask, sigmas=sigmas, callback=callback, disable_pbar=disable_pbar, seed=seed, noise_inds=noise_inds)
     samples = samples.to(comfy.model_management.intermediate_device())
     return samples
 
-def sample_custom(model, noise, cfg, sampler, sigmas, positive, negative, latent_image, noise_mask=None, callback=None, disable_pbar=False, seed=None):
-    samples = comfy.samplers.sample(model, noise, positive, negative, cfg, model.load_device, sampler, sigmas, model_options=model.model_options, latent_image=latent_image, denoise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=seed)
+def sample_custom(model, noise, cfg, sampler, sigmas, positive, negative, latent_image, noise_mask=None, callback=None, disable_pbar=False, seed=None, noise_inds=None):
+    samples = comfy.samplers.sample(model, noise, positive, negative, cfg, model.load_device, sampler, sigmas, model_options=model.model_options, latent_image=latent_image, denoise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=seed, noise_inds=noise_inds)
     samples = samples.to(comfy.model_management.intermediate_device())
     return samples
@@ -17,6 +17,8 @@ import comfy.model_patcher
 import comfy.patcher_extension
 import comfy.hooks
 import comfy.context_windows
+import comfy.static_sampling
+import comfy.schedule_cache
 import comfy.utils
 import scipy.stats
 import numpy
@@ -27,19 +29,32 @@ def add_area_dims(area, num_dims):
         area = [2147483648] + area[:len(area) // 2] + [0] + area[len(area) // 2:]
     return area
 
-def get_area_and_mult(conds, x_in, timestep_in):
-    dims = tuple(x_in.shape[2:])
-    area = None
-    strength = 1.0
-
+def timestep_in_range(conds, timestep_in):
     if 'timestep_start' in conds:
         timestep_start = conds['timestep_start']
         if timestep_in[0] > timestep_start:
-            return None
+            return False
     if 'timestep_end' in conds:
         timestep_end = conds['timestep_end']
         if timestep_in[0] < timestep_end:
-            return None
+            return False
+    return True
+
+def area_input(x_in, area):
+    input_x = x_in
+    if area is not None:
+        dims = len(area) // 2
+        for i in range(dims):
+            input_x = input_x.narrow(i + 2, area[dims + i], area[i])
+    return input_x
+
+def get_area_and_mult(conds, x_in, timestep_in):
+    dims = tuple(x_in.shape[2:])
+    area = None
+    strength = 1.0
+
+    if not timestep_in_range(conds, timestep_in):
+        return None
     if 'area' in conds:
         area = list(conds['area'])
         area = add_area_dims(area, len(dims))
@@ -213,18 +228,76 @@ def _calc_cond_batch_outer(model: BaseModel, conds: list[list[dict]], x_in: torc
     )
     return executor.execute(model, conds, x_in, timestep, model_options)
 
-def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tensor, timestep, model_options):
-    out_conds = []
-    out_counts = []
+class CondBatch(NamedTuple):
+    hooks: comfy.hooks.HookGroup
+    # cond_obj of get_area_and_mult for every cond of the batch, without input_x which changes every step
+    cond_objs: list
+    cond_or_uncond: list[int]
+    conditioning: dict
+    # memory_required of the batch when more than one cond got batched
+    memory_required: float | None
+
+class CondBatchPlan:
+    """
+    Batches of the conds of a sampling run, for _calc_cond_batch.
+
+    Grouping the conds by hooks, checking which ones can be concatenated, probing how many fit in
+    memory and concatenating their conditioning only depends on the conds that are active at the
+    timestep and on the shape of the input, so it is done once and reused by the next steps. Plans
+    get rebuilt when the active conds change (timestep ranges), when a hook keyframe changes or when
+    a batch doesn't fit in the free memory anymore.
+    """
+    MAX_PLANS = 8
+
+    def __init__(self):
+        self.plans = {}
+
+    def get_batches(self, model: BaseModel, conds: list[list[dict]], x_in: torch.Tensor, timestep, model_options) -> list[CondBatch]:
+        active = []
+        for cond in conds:
+            if cond is None:
+                active.append(None)
+            else:
+                active.append(tuple(x for x in cond if timestep_in_range(x, timestep)))
+        key = (tuple(x_in.shape), x_in.dtype, x_in.device, tuple(tuple(map(id, c)) if c is not None else None for c in active))
+
+        plan = self.plans.get(key, None)
+        if plan is not None:
+            _, batches, keyframes = plan
+            for hooks in self._hook_groups(batches):
+                model.current_patcher.prepare_hook_patches_current_keyframe(timestep, hooks, model_options)
+            if self._keyframes(batches) == keyframes and self._batches_fit(batches, x_in):
+                return batches
+            self.plans.pop(key)
+
+        batches = plan_cond_batches(model, conds, x_in, timestep, model_options)
+        # The active conds are kept so their ids in the key stay unique
+        self.plans[key] = (active, batches, self._keyframes(batches))
+        while len(self.plans) > self.MAX_PLANS:
+            self.plans.pop(next(iter(self.plans)))
+        return batches
+
+    @staticmethod
+    def _hook_groups(batches: list[CondBatch]):
+        return [b.hooks for b in batches if b.hooks is not None]
+
+    def _keyframes(self, batches: list[CondBatch]):
+        return tuple(hook.hook_keyframe.strength for hooks in self._hook_groups(batches) for hook in hooks.hooks)
+
+    @staticmethod
+    def _batches_fit(batches: list[CondBatch], x_in):
+        memory_required = max((b.memory_required for b in batches if b.memory_required is not None), default=None)
+        if memory_required is None:
+            return True
+        return memory_required * 1.5 < model_management.get_free_memory(x_in.device)
+
+def plan_cond_batches(model: BaseModel, conds: list[list[dict]], x_in: torch.Tensor, timestep, model_options) -> list[CondBatch]:
     # separate conds by matching hooks
     hooked_to_run: dict[comfy.hooks.HookGroup,list[tuple[tuple,int]]] = {}
     default_conds = []
     has_default_conds = False
 
     for i in range(len(conds)):
-        out_conds.append(torch.zeros_like(x_in))
-        out_counts.append(torch.ones_like(x_in) * 1e-37)
-
         cond = conds[i]
         default_c = []
         if cond is not None:
@@ -245,9 +318,7 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
     if has_default_conds:
         finalize_default_conds(model, hooked_to_run, default_conds, x_in, timestep, model_options)
 
-    model.current_patcher.prepare_state(timestep)
-
-    # run every hooked_to_run separately
+    batches = []
     for hooks, to_run in hooked_to_run.items():
         while len(to_run) > 0:
             first = to_run[0]
@@ -259,6 +330,7 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
 
             to_batch_temp.reverse()
             to_batch = to_batch_temp[:1]
+            memory_required = None
 
             free_memory = model_management.get_free_memory(x_in.device)
             for i in range(1, len(to_batch_temp) + 1):
@@ -270,76 +342,100 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
                     for k, v in to_run[tt][0].conditioning.items():
                         cond_shapes[k].append(v.size())
 
-                if model.memory_required(input_shape, cond_shapes=cond_shapes) * 1.5 < free_memory:
+                batch_memory = model.memory_required(input_shape, cond_shapes=cond_shapes)
+                if batch_memory * 1.5 < free_memory:
                     to_batch = batch_amount
+                    if len(batch_amount) > 1:
+                        memory_required = batch_memory
                     break
 
-            input_x = []
-            mult = []
-            c = []
+            cond_objs = []
             cond_or_uncond = []
-            uuids = []
-            area = []
-            control = None
-            patches = None
             for x in to_batch:
                 o = to_run.pop(x)
-                p = o[0]
-                input_x.append(p.input_x)
-                mult.append(p.mult)
-                c.append(p.conditioning)
-                area.append(p.area)
+                cond_objs.append(o[0]._replace(input_x=None))
                 cond_or_uncond.append(o[1])
-                uuids.append(p.uuid)
-                control = p.control
-                patches = p.patches
-
-            batch_chunks = len(cond_or_uncond)
-            input_x = torch.cat(input_x)
-            c = cond_cat(c)
-            timestep_ = torch.cat([timestep] * batch_chunks)
-
-            transformer_options = model.current_patcher.apply_hooks(hooks=hooks)
-            if 'transformer_options' in model_options:
-                transformer_options = comfy.patcher_extension.merge_nested_dicts(transformer_options,
-                                                                                 model_options['transformer_options'],
-                                                                                 copy_dict1=False)
-
-            if patches is not None:
-                transformer_options["patches"] = comfy.patcher_extension.merge_nested_dicts(
-                    transformer_options.get("patches", {}),
-                    patches
-                )
-
-            transformer_options["cond_or_uncond"] = cond_or_uncond[:]
-            transformer_options["uuids"] = uuids[:]
-            transformer_options["sigmas"] = timestep
-
-            c['transformer_options'] = transformer_options
-
-            if control is not None:
-                c['control'] = control.get_control(input_x, timestep_, c, len(cond_or_uncond), transformer_options)
-
-            if 'model_function_wrapper' in model_options:
-                output = model_options['model_function_wrapper'](model.apply_model, {"input": input_x, "timestep": timestep_, "c": c, "cond_or_uncond": cond_or_uncond}).chunk(batch_chunks)
+            batches.append(CondBatch(hooks, cond_objs, cond_or_uncond, cond_cat([p.conditioning for p in cond_objs]), memory_required))
+    return batches
+
+def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tensor, timestep, model_options):
+    out_conds = []
+    out_counts = []
+    for i in range(len(conds)):
+        out_conds.append(torch.zeros_like(x_in))
+        out_counts.append(torch.ones_like(x_in) * 1e-37)
+
+    cond_batch_plan = model_options.get("cond_batch_plan", None)
+    if cond_batch_plan is None:
+        cond_batch_plan = CondBatchPlan()
+    batches = cond_batch_plan.get_batches(model, conds, x_in, timestep, model_options)
+
+    model.current_patcher.prepare_state(timestep)
+
+    # run every batch separately
+    for batch in batches:
+        hooks = batch.hooks
+        cond_or_uncond = batch.cond_or_uncond
+        input_x = []
+        mult = []
+        uuids = []
+        area = []
+        control = None
+        patches = None
+        for p in batch.cond_objs:
+            input_x.append(area_input(x_in, p.area))
+            mult.append(p.mult)
+            area.append(p.area)
+            uuids.append(p.uuid)
+            control = p.control
+            patches = p.patches
+
+        batch_chunks = len(cond_or_uncond)
+        input_x = torch.cat(input_x)
+        c = batch.conditioning.copy()
+        timestep_ = torch.cat([timestep] * batch_chunks)
+
+        transformer_options = model.current_patcher.apply_hooks(hooks=hooks)
+        if 'transformer_options' in model_options:
+            transformer_options = comfy.patcher_extension.merge_nested_dicts(transformer_options,
+                                                                             model_options['transformer_options'],
+                                                                             copy_dict1=False)
+
+        if patches is not None:
+            transformer_options["patches"] = comfy.patcher_extension.merge_nested_dicts(
+                transformer_options.get("patches", {}),
+                patches
+            )
+
+        transformer_options["cond_or_uncond"] = cond_or_uncond[:]
+        transformer_options["uuids"] = uuids[:]
+        transformer_options["sigmas"] = timestep
+
+        c['transformer_options'] = transformer_options
+
+        if control is not None:
+            c['control'] = control.get_control(input_x, timestep_, c, len(cond_or_uncond), transformer_options)
+
+        if 'model_function_wrapper' in model_options:
+            output = model_options['model_function_wrapper'](model.apply_model, {"input": input_x, "timestep": timestep_, "c": c, "cond_or_uncond": cond_or_uncond}).chunk(batch_chunks)
+        else:
+            output = model.apply_model(input_x, timestep_, **c).chunk(batch_chunks)
+
+        for o in range(batch_chunks):
+            cond_index = cond_or_uncond[o]
+            a = area[o]
+            if a is None:
+                out_conds[cond_index] += output[o] * mult[o]
+                out_counts[cond_index] += mult[o]
             else:
-                output = model.apply_model(input_x, timestep_, **c).chunk(batch_chunks)
-
-            for o in range(batch_chunks):
-                cond_index = cond_or_uncond[o]
-                a = area[o]
-                if a is None:
-                    out_conds[cond_index] += output[o] * mult[o]
-                    out_counts[cond_index] += mult[o]
-                else:
-                    out_c = out_conds[cond_index]
-                    out_cts = out_counts[cond_index]
-                    dims = len(a) // 2
-                    for i in range(dims):
-                        out_c = out_c.narrow(i + 2, a[i + dims], a[i])
-                        out_cts = out_cts.narrow(i + 2, a[i + dims], a[i])
-                    out_c += output[o] * mult[o]
-                    out_cts += mult[o]
+                out_c = out_conds[cond_index]
+                out_cts = out_counts[cond_index]
+                dims = len(a) // 2
+                for i in range(dims):
+                    out_c = out_c.narrow(i + 2, a[i + dims], a[i])
+                    out_cts = out_cts.narrow(i + 2, a[i + dims], a[i])
+                out_c += output[o] * mult[o]
+                out_cts += mult[o]
 
     for i in range(len(out_conds)):
         out_conds[i] /= out_counts[i]
@@ -392,7 +488,7 @@ class KSamplerX0Inpaint:
     def __init__(self, model, sigmas):
         self.inner_model = model
         self.sigmas = sigmas
-    def __call__(self, x, sigma, denoise_mask, model_options={}, seed=None):
+    def __call__(self, x, sigma, denoise_mask, model_options={}, seed=None, noise_inds=None):
         if denoise_mask is not None:
             if "denoise_mask_function" in model_options:
                 denoise_mask = model_options["denoise_mask_function"](sigma, denoise_mask, extra_options={"model": self.inner_model, "sigmas": self.sigmas})
@@ -755,7 +851,9 @@ class KSAMPLER(Sampler):
 
 
 def ksampler(sampler_name, extra_options={}, inpaint_options={}):
-    if sampler_name == "dpm_fast":
+    if comfy.static_sampling.supports(sampler_name, extra_options):
+        sampler_function = comfy.static_sampling.sampler_function(sampler_name)
+    elif sampler_name == "dpm_fast":
         def dpm_fast_function(model, noise, sigmas, extra_args, callback, disable):
             if len(sigmas) <= 1:
                 return noise
@@ -970,7 +1068,12 @@ class CFGGuider:
 
         extra_model_options = comfy.model_patcher.create_model_options_clone(self.model_options)
         extra_model_options.setdefault("transformer_options", {})["sample_sigmas"] = sigmas
+        extra_model_options["cond_batch_plan"] = CondBatchPlan()
         extra_args = {"model_options": extra_model_options, "seed": seed}
+        noise_inds = getattr(self, "noise_inds", None)
+        if noise_inds is not None:
+            # Batch indices of the items, for the noise samplers
+            extra_args["noise_inds"] = noise_inds
 
         executor = comfy.patcher_extension.WrapperExecutor.new_class_executor(
             sampler.sample,
@@ -1000,10 +1103,12 @@ class CFGGuider:
         del self.loaded_models
         return output
 
-    def sample(self, noise, latent_image, sampler, sigmas, denoise_mask=None, callback=None, disable_pbar=False, seed=None):
+    def sample(self, noise, latent_image, sampler, sigmas, denoise_mask=None, callback=None, disable_pbar=False, seed=None, noise_inds=None):
         if sigmas.shape[-1] == 0:
             return latent_image
 
+        self.noise_inds = None if latent_image.is_nested else noise_inds
+
         if latent_image.is_nested:
             latent_image, latent_shapes = comfy.utils.pack_latents(latent_image.unbind())
             noise, _ = comfy.utils.pack_latents(noise.unbind())
@@ -1055,17 +1160,18 @@ class CFGGuider:
             self.model_patcher.restore_hook_patches()
 
         del self.conds
+        self.noise_inds = None
 
         if len(latent_shapes) > 1:
             output = comfy.nested_tensor.NestedTensor(comfy.utils.unpack_latents(output, latent_shapes))
         return output
 
 
-def sample(model, noise, positive, negative, cfg, device, sampler, sigmas, model_options={}, latent_image=None, denoise_mask=None, callback=None, disable_pbar=False, seed=None):
+def sample(model, noise, positive, negative, cfg, device, sampler, sigmas, model_options={}, latent_image=None, denoise_mask=None, callback=None, disable_pbar=False, seed=None, noise_inds=None):
     cfg_guider = CFGGuider(model)
     cfg_guider.set_conds(positive, negative)
     cfg_guider.set_cfg(cfg)
-    return cfg_guider.sample(noise, latent_image, sampler, sigmas, denoise_mask, callback, disable_pbar, seed)
+    return cfg_guider.sample(noise, latent_image, sampler, sigmas, denoise_mask, callback, disable_pbar, seed, noise_inds=noise_inds)
 
 
 SAMPLER_NAMES = KSAMPLER_NAMES + ["ddim", "uni_pc", "uni_pc_bh2"]
@@ -1097,11 +1203,15 @@ def calculate_sigmas(model_sampling: object, scheduler_name: str, steps: int) ->
         logging.error(err)
         raise ValueError(err)
     if handler.use_ms:
-        return handler.handler(model_sampling, steps)
-    return handler.handler(n=steps, sigma_min=float(model_sampling.sigma_min), sigma_max=float(model_sampling.sigma_max))
+        compute = lambda: handler.handler(model_sampling, steps)
+    else:
+        compute = lambda: handler.handler(n=steps, sigma_min=float(model_sampling.sigma_min), sigma_max=float(model_sampling.sigma_max))
+    return comfy.schedule_cache.get(scheduler_name, comfy.schedule_cache.model_sampling_key(model_sampling), steps, compute, source=handler)
 
 def sampler_object(name):
-    if name == "uni_pc":
+    if name in ("uni_pc", "uni_pc_bh2") and comfy.static_sampling.supports(name, {}):
+        sampler = ksampler(name)
+    elif name == "uni_pc":
         sampler = KSAMPLER(uni_pc.sample_unipc)
     elif name == "uni_pc_bh2":
         sampler = KSAMPLER(uni_pc.sample_unipc_bh2)
@@ -1155,7 +1265,7 @@ class KSampler:
                 sigmas = self.calculate_sigmas(new_steps).to(self.device)
                 self.sigmas = sigmas[-(steps + 1):]
 
-    def sample(self, noise, positive, negative, cfg, latent_image=None, start_step=None, last_step=None, force_full_denoise=False, denoise_mask=None, sigmas=None, callback=None, disable_pbar=False, seed=None):
+    def sample(self, noise, positive, negative, cfg, latent_image=None, start_step=None, last_step=None, force_full_denoise=False, denoise_mask=None, sigmas=None, callback=None, disable_pbar=False, seed=None, noise_inds=None):
         if sigmas is None:
             sigmas = self.sigmas
 
@@ -1175,4 +1285,4 @@ class KSampler:
 
         sampler = sampler_object(self.sampler)
 
-        return sample(self.model, noise, positive, negative, cfg, self.device, sampler, sigmas, self.model_options, latent_image=latent_image, denoise_mask=denoise_mask, callback=callback, disable_pbar=disable_pbar, seed=seed)
+        return sample(self.model, noise, positive, negative, cfg, self.device, sampler, sigmas, self.model_options, latent_image=latent_image, denoise_mask=denoise_mask, callback=callback, disable_pbar=disable_pbar, seed=seed, noise_inds=noise_inds)
@@ -0,0 +1,114 @@
+"""
+Memoized sigma schedules (--schedule-cache-size).
+
+Computing a schedule can take more time than a short sampling run on a fast GPU: the beta scheduler
+calls scipy's beta ppf, the AlignYourSteps, GITS and OptimalSteps schedules interpolate their tables
+with numpy. The same schedules get computed again for every prompt, so they are kept in an LRU keyed
+by the scheduler, the parameters of the model sampling object and the number of steps.
+
+Nodes can also register tables of precomputed schedules, they are never evicted and take precedence
+over computing the schedule:
+
+    model_key = comfy.schedule_cache.model_sampling_key(model_sampling)
+    comfy.schedule_cache.register_table("beta", model_key, {steps: sigmas, ...})
+
+Every lookup returns a copy of the schedule, callers are free to modify it.
+"""
+
+import collections
+import hashlib
+import threading
+from typing import Callable, Hashable
+
+import torch
+
+from comfy.cli_args import args
+
+
+def model_sampling_key(model_sampling) -> tuple:
+    """A key of everything about model_sampling that schedules depend on."""
+    # The model sampling classes get created for every model, use the names of their bases
+    classes = tuple("{}.{}".format(c.__module__, c.__qualname__) for c in type(model_sampling).__mro__)
+    params = []
+    for name, value in sorted(vars(model_sampling).items()):
+        if isinstance(value, (bool, int, float, str)):
+            params.append((name, value))
+        elif isinstance(value, torch.Tensor) and value.numel() == 1:
+            params.append((name, value.item()))
+    buffers = hashlib.sha1()
+    for name, buffer in model_sampling.named_buffers():
+        buffers.update(name.encode())
+        buffers.update(buffer.detach().float().cpu().numpy().tobytes())
+    return (classes, tuple(params), buffers.hexdigest())
+
+
+class ScheduleCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.tables = {}
+        self.hits = 0
+        self.misses = 0
+
+    def register_table(self, scheduler: Hashable, model_key: Hashable, table: dict):
+        """Precomputed schedules of scheduler for model_key, table maps numbers of steps to sigmas."""
+        with self.lock:
+            for steps, sigmas in table.items():
+                self.tables[(scheduler, model_key, int(steps))] = torch.as_tensor(sigmas, dtype=torch.float32).cpu().clone()
+
+    def get(self, scheduler: Hashable, model_key: Hashable, steps: int, compute: Callable[[], torch.Tensor], source: Hashable = None) -> torch.Tensor:
+        key = (scheduler, model_key, steps, source)
+        with self.lock:
+            sigmas = self.tables.get(key[:3])
+            if sigmas is None:
+                sigmas = self.entries.get(key)
+                if sigmas is not None:
+                    self.entries.move_to_end(key)
+            if sigmas is not None:
+                self.hits += 1
+                return sigmas.clone()
+            self.misses += 1
+
+        sigmas = compute()
+        if self.max_entries <= 0:
+            return sigmas
+        with self.lock:
+            self.entries[key] = sigmas.detach().cpu().clone()
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return sigmas
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "table_entries": len(self.tables),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+cache = ScheduleCache(args.schedule_cache_size)
+
+
+def register_table(scheduler: Hashable, model_key: Hashable, table: dict):
+    cache.register_table(scheduler, model_key, table)
+
+
+def get(scheduler: Hashable, model_key: Hashable, steps: int, compute: Callable[[], torch.Tensor], source: Hashable = None) -> torch.Tensor:
+    """
+    The schedule of scheduler for model_key and steps, from the registered tables or computed with
+    compute() if it isn't cached. The cached schedules are also keyed by source, the function that
+    computes them, so replacing it doesn't return stale schedules.
+    """
+    return cache.get(scheduler, model_key, steps, compute, source)
+
+
+def get_stats() -> dict:
+    return cache.get_stats()
@@ -25,6 +25,11 @@ import math
 import os
 
 import comfy.utils
+import comfy.shared_weights
+import comfy.compiled_models
+import comfy.header_detection
+import comfy.safetensors_stream
+import comfy.supported_models_base
 
 from . import clip_vision
 from . import gligen
@@ -662,7 +667,7 @@ class VAE:
             self.first_stage_model = AutoencoderKL(**(config['params']))
         self.first_stage_model = self.first_stage_model.eval()
 
-        m, u = self.first_stage_model.load_state_dict(sd, strict=False)
+        m, u = comfy.shared_weights.load_state_dict(self.first_stage_model, sd)
         if len(m) > 0:
             logging.warning("Missing VAE keys {}".format(m))
 
@@ -1444,7 +1449,7 @@ def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_c
     return (model_patcher, clip, vae, clipvision)
 
 
-def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
+def load_diffusion_model_state_dict(sd, model_options={}, metadata=None, compile_to=None):
     """
     Loads a UNet diffusion model from a state dictionary, supporting both diffusers and regular formats.
 
@@ -1454,6 +1459,8 @@ def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
             - dtype: Override model data type
             - custom_operations: Custom model operations
             - fp8_optimizations: Enable FP8 optimizations
+        compile_to (str, optional): Path of a compiled model file (see comfy.compiled_models) to
+            save the detected config and converted weights to, so the next load can skip them.
 
     Returns:
         ModelPatcher: A wrapped model instance that handles device management and weight loading.
@@ -1466,8 +1473,6 @@ def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
     4. Manages model optimization settings
     5. Loads weights and returns a device-managed model instance
     """
-    dtype = model_options.get("dtype", None)
-
     #Allow loading unets from checkpoint files
     diffusion_model_prefix = model_detection.unet_prefix_from_state_dict(sd)
     temp_sd = comfy.utils.state_dict_prefix_replace(sd, {diffusion_model_prefix: ""}, filter_keys=True)
@@ -1505,7 +1510,27 @@ def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
                 else:
                     logging.warning("{} {}".format(diffusers_keys[k], k))
 
-    offload_device = model_management.unet_offload_device()
+    compiled_info = None
+    if compile_to is not None:
+        compiled_info = comfy.compiled_models.describe(model_config, parameters, weight_dtype)
+        compiled_sd = dict(new_sd)
+
+    set_diffusion_model_options(model_config, parameters, weight_dtype, model_options, load_device)
+    model_patcher = diffusion_model_from_config(model_config, new_sd, load_device)
+    left_over = sd.keys()
+    if len(left_over) > 0:
+        logging.info("left over keys in diffusion model: {}".format(left_over))
+
+    if compiled_info is not None:
+        comfy.compiled_models.save(compile_to, compiled_sd, compiled_info, model_config, model_patcher.model.diffusion_model)
+    return model_patcher
+
+
+def set_diffusion_model_options(model_config, parameters, weight_dtype, model_options, load_device):
+    """Sets the inference dtypes and the model_options of a detected diffusion model config."""
+    dtype = model_options.get("dtype", None)
+    custom_operations = model_options.get("custom_operations", None)
+
     unet_weight_dtype = list(model_config.supported_inference_dtypes)
     if model_config.quant_config is not None:
         weight_dtype = None
@@ -1527,18 +1552,76 @@ def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
     if model_options.get("fp8_optimizations", False):
         model_config.optimizations["fp8"] = True
 
-    model = model_config.get_model(new_sd, "")
+
+def diffusion_model_from_config(model_config, sd, load_device):
+    offload_device = model_management.unet_offload_device()
+    model = model_config.get_model(sd, "")
     model = model.to(offload_device)
-    model.load_model_weights(new_sd, "")
-    left_over = sd.keys()
-    if len(left_over) > 0:
-        logging.info("left over keys in diffusion model: {}".format(left_over))
+    model.load_model_weights(sd, "")
+    return comfy.model_patcher.ModelPatcher(model, load_device=load_device, offload_device=offload_device)
+
+
+def load_compiled_diffusion_model(compiled_path, model_options={}):
+    """
+    Loads a diffusion model from a file saved by load_diffusion_model_state_dict(compile_to=...),
+    returns None if there is none or it was compiled for other dtypes.
+    """
+    compiled = comfy.compiled_models.load_config(compiled_path)
+    if compiled is None:
+        return None
+    model_config, info = compiled
+    load_device = model_management.get_torch_device()
+    set_diffusion_model_options(model_config, info["parameters"], info["weight_dtype"], model_options, load_device)
+    if not comfy.compiled_models.dtypes_match(info, model_config):
+        logging.info("Compiled model {} is for other dtypes, compiling it again.".format(compiled_path))
+        return None
+    sd = comfy.utils.load_torch_file(compiled_path)
+    return diffusion_model_from_config(model_config, sd, load_device)
+
+
+def load_streamed_diffusion_model(unet_path, model_options={}):
+    """
+    Loads a diffusion model safetensors file by detecting the model from its header and streaming
+    the weights straight into the model, without a state dict of the whole file in between.
+    Returns None for files that need the state dict path: diffusers format, old scaled fp8 quants
+    or models with their own unet state dict processing.
+    """
+    sd, metadata = comfy.header_detection.meta_state_dict(unet_path)
+    detected = comfy.header_detection.detect_state_dict(sd, metadata)
+    if detected is None or detected.diffusers or "{}scaled_fp8".format(detected.unet_prefix) in sd:
+        return None
+    model_config = detected.model_config
+    if type(model_config).process_unet_state_dict is not comfy.supported_models_base.BASE.process_unet_state_dict:
+        return None
+
+    load_device = model_management.get_torch_device()
+    set_diffusion_model_options(model_config, detected.parameters, detected.weight_dtype, model_options, load_device)
+    offload_device = model_management.unet_offload_device()
+    model = model_config.get_model(comfy.utils.state_dict_prefix_replace(sd, {detected.unet_prefix: ""}, filter_keys=True), "")
+    model = model.to(offload_device)
+    m, u = comfy.safetensors_stream.load_into_module(model.diffusion_model, unet_path, prefix=detected.unet_prefix)
+    if len(m) > 0:
+        logging.warning("unet missing: {}".format(m))
+    if len(u) > 0:
+        logging.warning("unet unexpected: {}".format(u))
     return comfy.model_patcher.ModelPatcher(model, load_device=load_device, offload_device=offload_device)
 
 
 def load_diffusion_model(unet_path, model_options={}):
+    compiled_path = comfy.compiled_models.get_path(unet_path, model_options)
+    if compiled_path is not None:
+        model = load_compiled_diffusion_model(compiled_path, model_options)
+        if model is not None:
+            return model
+
+    # Without mmap the state dict path would hold every weight in RAM twice
+    if comfy.utils.DISABLE_MMAP and compiled_path is None and not comfy.shared_weights.ENABLED and model_options.get("custom_operations", None) is None and unet_path.lower().endswith((".safetensors", ".sft")):
+        model = load_streamed_diffusion_model(unet_path, model_options)
+        if model is not None:
+            return model
+
     sd, metadata = comfy.utils.load_torch_file(unet_path, return_metadata=True)
-    model = load_diffusion_model_state_dict(sd, model_options=model_options, metadata=metadata)
+    model = load_diffusion_model_state_dict(sd, model_options=model_options, metadata=metadata, compile_to=compiled_path)
     if model is None:
         logging.error("ERROR UNSUPPORTED DIFFUSION MODEL {}".format(unet_path))
         raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(unet_path, model_detection_error_hint(unet_path, sd)))
@@ -0,0 +1,129 @@
+"""
+Model weights shared between processes (--shared-model-weights).
+
+Safetensors files are mapped copy on write (MAP_PRIVATE) instead of being read, and the tensors of the
+state dict are views of that mapping. Weights that are used as is end up as the parameters of the
+models instead of being copied into them, so they stay pages of the OS file cache that every
+process on the host loading the same file shares. Writing to a weight (patching it in place for
+example) copies the pages it touches into private memory of that process, the file never changes.
+Weights that get cast to another dtype, patched or moved to another device are private copies as
+usual.
+
+ModelPatcher puts the shared weights back when it offloads a model to the CPU, instead of copying
+the weights back from the device.
+"""
+
+import logging
+import os
+import threading
+from typing import Optional
+
+import torch
+
+from comfy.cli_args import args
+import comfy.safetensors_stream
+
+ENABLED = args.shared_model_weights
+
+_lock = threading.Lock()
+# Start address of the storage of every mapping -> path of the file. Mappings get unmapped when the
+# last tensor viewing them is freed, an entry can outlive its mapping but shared tensors are only
+# looked up while loading, and the weights remembered for restore_weights are the tensors themselves.
+_mapped: dict[int, str] = {}
+
+
+def map_file(path: str) -> torch.Tensor:
+    """A uint8 CPU tensor mapping the whole file, copy on write."""
+    mapping = torch.from_file(path, shared=False, size=os.path.getsize(path), dtype=torch.uint8)
+    with _lock:
+        _mapped[mapping.untyped_storage().data_ptr()] = path
+    return mapping
+
+
+def is_shared(tensor: torch.Tensor) -> bool:
+    if not isinstance(tensor, torch.Tensor) or tensor.device.type != "cpu":
+        return False
+    with _lock:
+        return tensor.untyped_storage().data_ptr() in _mapped
+
+
+def load_safetensors(path: str):
+    """Returns (state dict, metadata) with the tensors of the file as views of its mapping."""
+    f = comfy.safetensors_stream.SafetensorsFile(path)
+    mapping = map_file(path)
+    sd = {}
+    for key, info in f.tensors.items():
+        start = f.data_start + info.start
+        data = mapping[start:f.data_start + info.end]
+        if start % torch.empty((), dtype=info.dtype).element_size() != 0:
+            # Views need offsets aligned to the element size, misaligned tensors get copied
+            data = data.clone()
+        sd[key] = data.view(info.dtype).reshape(info.shape)
+    return sd, f.metadata
+
+
+def load_state_dict(module: torch.nn.Module, sd: dict, strict=False):
+    """
+    module.load_state_dict that makes the shared tensors of sd the parameters and buffers of module
+    instead of copying them, when the module has them on the CPU. Shared tensors of another dtype
+    than the module's get cast.
+    """
+    if not ENABLED:
+        return module.load_state_dict(sd, strict=strict)
+
+    own = module.state_dict(keep_vars=True)
+    assign = {}
+    copy = {}
+    for k, v in sd.items():
+        target = own.get(k)
+        if is_shared(v) and target is not None and target.device.type == "cpu" and target.shape == v.shape and type(target) in (torch.Tensor, torch.nn.Parameter):
+            assign[k] = v if v.dtype == target.dtype else v.to(target.dtype)
+        else:
+            copy[k] = v
+
+    missing, unexpected = module.load_state_dict(copy, strict=False)
+    if len(assign) > 0:
+        missing_assign, unexpected_assign = module.load_state_dict(assign, strict=False, assign=True)
+        missing = [k for k in missing if k in missing_assign]
+        unexpected = unexpected + unexpected_assign
+    if strict and (len(missing) > 0 or len(unexpected) > 0):
+        raise RuntimeError("Error(s) in loading state_dict for {}: missing keys {}, unexpected keys {}".format(module.__class__.__name__, missing, unexpected))
+    remember_weights(module)
+    return missing, unexpected
+
+
+def remember_weights(module: torch.nn.Module):
+    """Records which weights of module are shared, for restore_weights."""
+    shared = {}
+    for k, v in module.state_dict(keep_vars=True).items():
+        if is_shared(v):
+            shared[k] = v.data
+    if len(shared) > 0:
+        module.comfy_shared_weights = shared
+        logging.debug("{} shares {} weights with other processes.".format(module.__class__.__name__, len(shared)))
+
+
+def restore_weights(module: torch.nn.Module, exclude: Optional[set] = None) -> int:
+    """
+    Puts the shared weights recorded by remember_weights back in module, except the keys in
+    exclude. Returns how many weights got restored.
+    """
+    shared = getattr(module, "comfy_shared_weights", None)
+    if shared is None:
+        return 0
+    import comfy.utils
+    restored = 0
+    for key, tensor in shared.items():
+        if exclude is not None and key in exclude:
+            continue
+        current = comfy.utils.get_attr(module, key)
+        if current.data_ptr() == tensor.data_ptr():
+            continue
+        if current.shape != tensor.shape or current.dtype != tensor.dtype:
+            continue
+        if isinstance(current, torch.nn.Parameter):
+            comfy.utils.set_attr_param(module, key, tensor)
+        else:
+            comfy.utils.set_attr(module, key, tensor)
+        restored += 1
+    return restored
@@ -0,0 +1,263 @@
+"""
+Static sampling loop (--static-sampling-loop).
+
+The k-diffusion samplers call the model through KSamplerX0Inpaint, CFGGuider, sampling_function,
+the cond batching and the patcher wrappers, with the conds batched and the transformer_options
+built again on every call. In the static loop the model call of the plain case (a CFGGuider
+without hooks, wrappers, patches, controlnets, area, masks or timestep ranges on its conds, no
+denoise mask and the model fully loaded) is frozen once per run by frozen_model: the conds are
+batched once with the CondBatchPlan of comfy.samplers and the transformer_options are built once,
+so the model call is a function of x and sigma only. Everything else keeps the dynamic model call.
+
+For the samplers in SAMPLERS the sigmas passed to the model and the coefficients of all the steps
+are also computed up front, so every step including the model call is the same function of
+tensors of fixed shapes:
+
+    x, denoised = static_step(frozen, step, x, sigma, denoised, coefficients[i])
+
+which gets compiled once with torch.compile, or also captured in CUDA graphs with the
+"reduce-overhead" mode. The samplers in MODEL_SAMPLERS keep their own update, with its order
+changing over the steps, and only their frozen model call gets compiled.
+
+The coefficients are computed with the same tensor ops as the samplers of comfy.k_diffusion.sampling,
+the steps apply them in the same order and the frozen model call does the same ops as the dynamic
+one, so without compiling the results are identical.
+"""
+
+import logging
+import math
+from typing import Callable, NamedTuple, Optional
+
+import torch
+from tqdm.auto import trange
+
+from comfy.cli_args import args
+from comfy.extra_samplers import uni_pc
+from comfy.k_diffusion import utils
+import comfy.patcher_extension
+
+MODE = args.static_sampling_loop
+
+# Model options that change the model call, runs with them keep the dynamic one
+DYNAMIC_MODEL_OPTIONS = ("sampler_cfg_function", "sampler_post_cfg_function", "sampler_pre_cfg_function",
+                         "sampler_calc_cond_batch_function", "model_function_wrapper", "context_handler", "denoise_mask_function")
+DYNAMIC_TRANSFORMER_OPTIONS = ("patches", "patches_replace")
+# Wrappers around the model call
+MODEL_WRAPPERS = (comfy.patcher_extension.WrappersMP.PREDICT_NOISE, comfy.patcher_extension.WrappersMP.CALC_COND_BATCH,
+                  comfy.patcher_extension.WrappersMP.APPLY_MODEL, comfy.patcher_extension.WrappersMP.DIFFUSION_MODEL)
+# Keys of the conds that need the dynamic model call
+DYNAMIC_COND_KEYS = ("area", "mask", "timestep_start", "timestep_end", "hooks", "control", "gligen", "default")
+
+
+def euler_coefficients(sigmas: torch.Tensor) -> torch.Tensor:
+    rows = []
+    for i in range(len(sigmas) - 1):
+        sigma_hat = sigmas[i]
+        dt = sigmas[i + 1] - sigma_hat
+        rows.append(torch.stack([sigma_hat, dt]))
+    return torch.stack(rows)
+
+
+def euler_step(x, denoised, old_denoised, c):
+    sigma_hat, dt = c[0], c[1]
+    d = (x - denoised) / utils.append_dims(sigma_hat, x.ndim)
+    return x + d * dt, denoised
+
+
+def dpmpp_2m_coefficients(sigmas: torch.Tensor) -> torch.Tensor:
+    sigma_fn = lambda t: t.neg().exp()
+    t_fn = lambda sigma: sigma.log().neg()
+    one = sigmas.new_ones(())
+    zero = sigmas.new_zeros(())
+    rows = []
+    for i in range(len(sigmas) - 1):
+        t, t_next = t_fn(sigmas[i]), t_fn(sigmas[i + 1])
+        h = t_next - t
+        if i == 0 or sigmas[i + 1] == 0:
+            # First order step: denoised_d = 1 * denoised - 0 * old_denoised is denoised
+            c_denoised, c_old = one, zero
+        else:
+            h_last = t - t_fn(sigmas[i - 1])
+            r = h_last / h
+            c_denoised, c_old = 1 + 1 / (2 * r), 1 / (2 * r)
+        rows.append(torch.stack([sigma_fn(t_next) / sigma_fn(t), (-h).expm1(), c_denoised, c_old]))
+    return torch.stack(rows)
+
+
+def dpmpp_2m_step(x, denoised, old_denoised, c):
+    denoised_d = c[2] * denoised - c[3] * old_denoised
+    return c[0] * x - c[1] * denoised_d, denoised
+
+
+class StaticSampler(NamedTuple):
+    coefficients: Callable[[torch.Tensor], torch.Tensor]
+    step: Callable
+
+
+SAMPLERS = {
+    "euler": StaticSampler(euler_coefficients, euler_step),
+    "dpmpp_2m": StaticSampler(dpmpp_2m_coefficients, dpmpp_2m_step),
+}
+
+
+class FrozenModel:
+    """The model call of a sampling run with its conds batched and its transformer_options built once."""
+    def __init__(self, model, conditioning: dict, transformer_options: dict, cond_or_uncond: list[int], cond_scale: float):
+        self.model = model
+        self.conditioning = conditioning
+        self.transformer_options = transformer_options
+        self.cond_or_uncond = cond_or_uncond
+        self.cond_scale = cond_scale
+
+    def __call__(self, x, sigma):
+        # What sampling_function and _calc_cond_batch do for a single batch without area or mask
+        n = len(self.cond_or_uncond)
+        input_x = torch.cat([x] * n)
+        timestep = torch.cat([sigma] * n)
+        transformer_options = dict(self.transformer_options, sigmas=sigma)
+        output = self.model.apply_model(input_x, timestep, transformer_options=transformer_options, **self.conditioning).chunk(n)
+        cond_pred = output[self.cond_or_uncond.index(0)]
+        uncond_pred = output[self.cond_or_uncond.index(1)] if 1 in self.cond_or_uncond else torch.zeros_like(x)
+        return uncond_pred + (cond_pred - uncond_pred) * self.cond_scale
+
+
+def _has_wrappers(transformer_options: dict) -> bool:
+    return any(len(comfy.patcher_extension.get_all_wrappers(w, transformer_options)) > 0 for w in MODEL_WRAPPERS)
+
+
+def frozen_model(model, x, sigmas, extra_args: dict) -> Optional[FrozenModel]:
+    """The model call of the samplers (a KSamplerX0Inpaint) frozen for the run, None if it has to stay dynamic."""
+    import comfy.samplers
+    if type(model) is not comfy.samplers.KSamplerX0Inpaint or extra_args.get("denoise_mask", None) is not None:
+        return None
+    if len(set(extra_args) - {"model_options", "seed", "denoise_mask", "noise_inds"}) > 0:
+        return None
+    guider = model.inner_model
+    guider_class = type(guider)
+    if not isinstance(guider, comfy.samplers.CFGGuider) or any(getattr(guider_class, f) is not getattr(comfy.samplers.CFGGuider, f) for f in ("__call__", "outer_predict_noise", "predict_noise")):
+        return None
+    model_options = extra_args.get("model_options", {})
+    transformer_options = model_options.get("transformer_options", {})
+    if any(model_options.get(k) for k in DYNAMIC_MODEL_OPTIONS) or any(transformer_options.get(k) for k in DYNAMIC_TRANSFORMER_OPTIONS) or _has_wrappers(transformer_options):
+        return None
+    patcher = guider.model_patcher
+    base_model = guider.inner_model
+    if getattr(base_model, "model_lowvram", False) or len(patcher.get_all_callbacks(comfy.patcher_extension.CallbacksMP.ON_PREPARE_STATE)) > 0:
+        return None
+
+    cond = guider.conds.get("positive", None)
+    uncond = guider.conds.get("negative", None)
+    if math.isclose(guider.cfg, 1.0) and model_options.get("disable_cfg1_optimization", False) == False:
+        uncond = None
+    conds = [cond, uncond]
+    if cond is None:
+        return None
+    for c in conds:
+        for x_cond in (c or []):
+            if any(x_cond.get(k, None) is not None for k in DYNAMIC_COND_KEYS) or x_cond.get("strength", 1.0) != 1.0:
+                return None
+
+    cond_batch_plan = model_options.get("cond_batch_plan", None)
+    if cond_batch_plan is None:
+        cond_batch_plan = comfy.samplers.CondBatchPlan()
+    sigma = sigmas[0] * x.new_ones([x.shape[0]])
+    batches = cond_batch_plan.get_batches(base_model, conds, x, sigma, model_options)
+    # One batch with at most one cond of each type, the outputs are the predictions as they are
+    if len(batches) != 1 or batches[0].hooks is not None or len(set(batches[0].cond_or_uncond)) != len(batches[0].cond_or_uncond):
+        return None
+    batch = batches[0]
+    if any(p.patches is not None for p in batch.cond_objs):
+        return None
+
+    frozen_options = patcher.apply_hooks(hooks=None)
+    frozen_options = comfy.patcher_extension.merge_nested_dicts(frozen_options, transformer_options, copy_dict1=False)
+    # The uuids of the conds are only used by patches and wrappers, they would make compiled
+    # graphs specific to a run
+    frozen_options["cond_or_uncond"] = batch.cond_or_uncond[:]
+    return FrozenModel(base_model, batch.conditioning.copy(), frozen_options, batch.cond_or_uncond[:], guider.cfg)
+
+
+def static_step(frozen: FrozenModel, step, x, sigma, old_denoised, c):
+    denoised = frozen(x, sigma)
+    return step(x, denoised, old_denoised, c)
+
+
+def frozen_call(frozen: FrozenModel, x, sigma):
+    return frozen(x, sigma)
+
+
+_compiled = {}
+
+
+def compiled(function, mode):
+    if mode == "eager":
+        return function
+    key = (function, mode)
+    if key not in _compiled:
+        logging.info("Compiling {} of the static sampling loop with torch.compile ({})".format(function.__name__, mode))
+        _compiled[key] = torch.compile(function, dynamic=False, mode=None if mode == "compile" else mode)
+    return _compiled[key]
+
+
+def call_compiled(function, mode, *args):
+    if mode == "reduce-overhead":
+        torch.compiler.cudagraph_mark_step_begin()
+    out = compiled(function, mode)(*args)
+    if mode != "eager":
+        # The outputs of compiled graphs can be reused by their next run
+        out = tuple(o.clone() for o in out) if isinstance(out, tuple) else out.clone()
+    return out
+
+
+MODEL_SAMPLERS = {
+    "uni_pc": uni_pc.sample_unipc,
+    "uni_pc_bh2": uni_pc.sample_unipc_bh2,
+}
+
+
+def supports(sampler_name: str, extra_options: dict) -> bool:
+    """If ksampler should use the static loop for sampler_name, the samplers with options stay dynamic."""
+    return MODE is not None and (sampler_name in SAMPLERS or sampler_name in MODEL_SAMPLERS) and len(extra_options) == 0
+
+
+@torch.no_grad()
+def sample_static(model, x, sigmas, extra_args=None, callback=None, disable=None, sampler_name="euler", mode="eager"):
+    """The k-diffusion sampler sampler_name as a static loop."""
+    if len(sigmas) <= 1:
+        return x
+    extra_args = {} if extra_args is None else extra_args
+    frozen = frozen_model(model, x, sigmas, extra_args)
+    if frozen is None and mode != "eager":
+        logging.debug("The static sampling loop keeps the dynamic model call for this run, it doesn't get compiled.")
+        mode = "eager"
+
+    if sampler_name in MODEL_SAMPLERS:
+        if frozen is None:
+            return MODEL_SAMPLERS[sampler_name](model, x, sigmas, extra_args=extra_args, callback=callback, disable=disable)
+        frozen_model_call = lambda x, sigma, **kwargs: call_compiled(frozen_call, mode, frozen, x, sigma)
+        return MODEL_SAMPLERS[sampler_name](frozen_model_call, x, sigmas, extra_args={}, callback=callback, disable=disable)
+
+    sampler = SAMPLERS[sampler_name]
+    s_in = x.new_ones([x.shape[0]])
+    model_sigmas = [sigmas[i] * s_in for i in range(len(sigmas) - 1)]
+    coefficients = sampler.coefficients(sigmas)
+    old_denoised = torch.zeros_like(x)
+
+    for i in trange(len(sigmas) - 1, disable=disable):
+        x_in = x
+        if frozen is None:
+            denoised = model(x, model_sigmas[i], **extra_args)
+            x, old_denoised = sampler.step(x, denoised, old_denoised, coefficients[i])
+        else:
+            x, old_denoised = call_compiled(static_step, mode, frozen, sampler.step, x, model_sigmas[i], old_denoised, coefficients[i])
+        if callback is not None:
+            callback({'x': x_in, 'i': i, 'sigma': sigmas[i], 'sigma_hat': sigmas[i], 'denoised': old_denoised})
+    return x
+
+
+def sampler_function(sampler_name: str, mode: str = None):
+    mode = MODE if mode is None else mode
+
+    def static_function(model, noise, sigmas, extra_args=None, callback=None, disable=None):
+        return sample_static(model, noise, sigmas, extra_args=extra_args, callback=callback, disable=disable, sampler_name=sampler_name, mode=mode)
+    return static_function
@@ -0,0 +1,349 @@
+"""
+Reuse of the model outputs of previous sampling steps (step caching).
+
+Consecutive sampling steps often get nearly the same output from the model. A StepCache in the
+transformer_options of a model skips the model on the steps its policy judges close enough to the
+last computed one. It works for any BaseModel through the APPLY_MODEL wrapper: the raw output of
+the diffusion model of every computed call is kept per cond batch (the uuids of the batch) and a
+skipped call turns it into the denoised output at the current sigma with the model_sampling of the
+model.
+
+The first model call of each step decides for the whole step, with one of the POLICIES:
+    relative_l1: relative L1 change of the model input, accumulated since the last computed step.
+    first_block: relative L1 change of the output of the first block of the diffusion model since
+        the last computed step. Only the first block runs on the skipped steps.
+    teacache: like relative_l1 with every change rescaled by a polynomial that estimates the
+        change of the output, fitted to the history of a reference run by fit_polynomial.
+
+benchmark() compares caches to reference outputs sampled without them.
+"""
+
+from __future__ import annotations
+
+import collections
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+import numpy
+import torch
+
+import comfy.model_patcher
+import comfy.patcher_extension
+import comfy.weight_streaming
+if TYPE_CHECKING:
+    from comfy.model_patcher import ModelPatcher
+
+# Every PROBE_STRIDE-th value of the tensors the policies compare is kept
+PROBE_STRIDE = 7
+RECENT_RUNS = 16
+
+
+class StepCacheTelemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.steps = 0
+        self.skipped = 0
+        self.recent = collections.deque(maxlen=RECENT_RUNS)
+
+    def record_run(self, run: dict):
+        with self.lock:
+            self.runs += 1
+            self.steps += run["steps"]
+            self.skipped += run["skipped"]
+            self.recent.append(run)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "runs": self.runs,
+                "steps": self.steps,
+                "skipped": self.skipped,
+                "skip_ratio": self.skipped / self.steps if self.steps > 0 else None,
+                "recent_runs": list(self.recent),
+            }
+
+
+telemetry = StepCacheTelemetry()
+
+
+def probe(x: torch.Tensor) -> torch.Tensor:
+    return x.detach().flatten()[::PROBE_STRIDE].float()
+
+
+def relative_l1(a: torch.Tensor, b: torch.Tensor) -> float:
+    return ((a - b).abs().mean() / b.abs().mean().clamp_min(1e-8)).item()
+
+
+class StepCachePolicy:
+    """Decides from the probe of the first model call of a step if the step reuses the cached outputs."""
+    name: str = None
+    default_threshold: float = 0.1
+    # Probe the output of the first block of the diffusion model instead of its input
+    first_block = False
+
+    def __init__(self, threshold: Optional[float] = None):
+        self.threshold = self.default_threshold if threshold is None else threshold
+        self.reset()
+
+    def reset(self):
+        self.previous: Optional[torch.Tensor] = None
+
+    def should_skip(self, probe: torch.Tensor) -> bool:
+        raise NotImplementedError
+
+    def clone(self):
+        return self.__class__(self.threshold)
+
+
+class RelativeL1Policy(StepCachePolicy):
+    name = "relative_l1"
+    default_threshold = 0.15
+
+    def reset(self):
+        super().reset()
+        self.accumulated = 0.0
+
+    def rescale(self, change: float) -> float:
+        return change
+
+    def should_skip(self, probe):
+        previous = self.previous
+        self.previous = probe
+        if previous is None or previous.shape != probe.shape:
+            return False
+        self.accumulated += self.rescale(relative_l1(probe, previous))
+        if self.accumulated < self.threshold:
+            return True
+        self.accumulated = 0.0
+        return False
+
+
+class TeaCachePolicy(RelativeL1Policy):
+    name = "teacache"
+    default_threshold = 0.3
+
+    def __init__(self, threshold: Optional[float] = None, coefficients=(1.0, 0.0)):
+        self.coefficients = list(coefficients)
+        super().__init__(threshold)
+
+    def rescale(self, change):
+        return max(0.0, float(numpy.polyval(self.coefficients, change)))
+
+    def clone(self):
+        return self.__class__(self.threshold, self.coefficients)
+
+
+class FirstBlockPolicy(StepCachePolicy):
+    name = "first_block"
+    default_threshold = 0.08
+    first_block = True
+
+    def should_skip(self, probe):
+        # Compared to the last computed step, so the error can't pile up over several skipped steps
+        if self.previous is not None and self.previous.shape == probe.shape and relative_l1(probe, self.previous) < self.threshold:
+            return True
+        self.previous = probe
+        return False
+
+
+POLICIES: dict[str, type[StepCachePolicy]] = {
+    RelativeL1Policy.name: RelativeL1Policy,
+    FirstBlockPolicy.name: FirstBlockPolicy,
+    TeaCachePolicy.name: TeaCachePolicy,
+}
+
+
+def fit_polynomial(history: list[tuple[float, float]], degree=4) -> list[float]:
+    """TeaCachePolicy coefficients from the (input change, output change) history of a run."""
+    history = [h for h in history if h[0] is not None and h[1] is not None]
+    if len(history) <= degree:
+        raise ValueError("Not enough steps in the history to fit a polynomial of degree {}".format(degree))
+    x, y = zip(*history)
+    return [float(c) for c in numpy.polyfit(x, y, degree)]
+
+
+class _SkipStep(Exception):
+    pass
+
+
+class StepCache:
+    def __init__(self, policy: StepCachePolicy, start_percent=0.0, end_percent=1.0, record_history=False, runs: list = None):
+        self.policy = policy
+        self.start_percent = start_percent
+        self.end_percent = end_percent
+        # Record the (input change, output change) of the computed steps, for fit_polynomial
+        self.record_history = record_history
+        # Stats of the runs of this cache and of its clones
+        self.runs = collections.deque(maxlen=RECENT_RUNS) if runs is None else runs
+        self.start_t = 999999999.9
+        self.end_t = 0.0
+        self.reset()
+
+    def reset(self):
+        self.outputs: dict[tuple, torch.Tensor] = {}
+        self.step_sigmas: Optional[torch.Tensor] = None
+        self.in_range = False
+        self.skip = False
+        self.steps = 0
+        self.skipped = 0
+        self.history: list[tuple[Optional[float], Optional[float]]] = []
+        self.history_input: Optional[torch.Tensor] = None
+        self.history_output: Optional[torch.Tensor] = None
+        self.policy.reset()
+        return self
+
+    def clone(self):
+        return StepCache(self.policy.clone(), self.start_percent, self.end_percent, self.record_history, runs=self.runs)
+
+    def prepare(self, model_sampling):
+        self.start_t = model_sampling.percent_to_sigma(self.start_percent)
+        self.end_t = model_sampling.percent_to_sigma(self.end_percent)
+        return self.reset()
+
+    def finish(self):
+        run = {"policy": self.policy.name, "steps": self.steps, "skipped": self.skipped, "skip_ratio": self.skipped / self.steps if self.steps > 0 else 0.0}
+        if self.record_history:
+            run["history"] = self.history
+        self.runs.append(run)
+        telemetry.record_run({k: v for k, v in run.items() if k != "history"})
+        logging.info("Step cache ({}): skipped {}/{} steps.".format(self.policy.name, self.skipped, self.steps))
+        self.outputs = {}
+        self.policy.reset()
+
+    def _begin_call(self, sigmas: torch.Tensor) -> bool:
+        if sigmas is self.step_sigmas:
+            return False
+        # The step keeps a reference to its sigmas so no other tensor gets the same identity
+        self.step_sigmas = sigmas
+        self.skip = False
+        self.steps += 1
+        self.in_range = bool((sigmas[0] <= self.start_t).item() and (sigmas[0] > self.end_t).item())
+        return True
+
+    def _reuse(self, model, raw_output, x, t):
+        return model.model_sampling.calculate_denoised(t, raw_output.float(), x)
+
+    def _record_history(self, x, raw_output):
+        input_probe = probe(x)
+        output_probe = probe(raw_output) if raw_output is not None else None
+        input_change = output_change = None
+        if self.history_input is not None and self.history_input.shape == input_probe.shape:
+            input_change = relative_l1(input_probe, self.history_input)
+        if output_probe is not None and self.history_output is not None and self.history_output.shape == output_probe.shape:
+            output_change = relative_l1(output_probe, self.history_output)
+        self.history.append((input_change, output_change))
+        self.history_input = input_probe
+        self.history_output = output_probe
+
+    def __call__(self, executor, x, t, *args, transformer_options={}, **kwargs):
+        model = executor.class_obj
+        key = (tuple(transformer_options["uuids"]), tuple(x.shape))
+        first = self._begin_call(transformer_options["sigmas"])
+        cached = self.outputs.get(key, None)
+        if self.in_range and not first and self.skip and cached is not None:
+            return self._reuse(model, cached, x, t)
+
+        decide = self.in_range and first
+        if decide and not self.policy.first_block:
+            self.skip = self.policy.should_skip(probe(x)) and cached is not None
+            if self.skip:
+                self.skipped += 1
+                return self._reuse(model, cached, x, t)
+
+        captured = []
+        handles = [model.diffusion_model.register_forward_hook(lambda module, args, output: captured.append(output))]
+        if decide and self.policy.first_block:
+            blocks = comfy.weight_streaming.find_blocks(model.diffusion_model)
+            if len(blocks) > 0:
+                def first_block_hook(module, args, output):
+                    if not torch.is_tensor(output):
+                        output = next((o for o in output if torch.is_tensor(o)), None)
+                    if output is None:
+                        return
+                    self.skip = self.policy.should_skip(probe(output)) and cached is not None
+                    if self.skip:
+                        raise _SkipStep()
+                handles.append(blocks[0].register_forward_hook(first_block_hook))
+        try:
+            output = executor(x, t, *args, transformer_options=transformer_options, **kwargs)
+        except _SkipStep:
+            self.skipped += 1
+            return self._reuse(model, cached, x, t)
+        finally:
+            for h in handles:
+                h.remove()
+
+        raw_output = captured[0] if len(captured) == 1 and torch.is_tensor(captured[0]) else None
+        if first and self.record_history:
+            self._record_history(x, raw_output)
+        if raw_output is not None:
+            self.outputs[key] = raw_output.detach()
+        else:
+            self.outputs.pop(key, None)
+        return output
+
+
+def apply_model_wrapper(executor, x, t, c_concat=None, c_crossattn=None, control=None, transformer_options={}, **kwargs):
+    cache: StepCache = transformer_options.get("step_cache", None)
+    if cache is None or transformer_options.get("uuids", None) is None or transformer_options.get("sigmas", None) is None:
+        return executor(x, t, c_concat, c_crossattn, control, transformer_options, **kwargs)
+    return cache(executor, x, t, c_concat, c_crossattn, control, transformer_options=transformer_options, **kwargs)
+
+
+def outer_sample_wrapper(executor, *args, **kwargs):
+    """Every sampling run gets its own clone of the cache, prepared for the sigmas of the model."""
+    guider = executor.class_obj
+    orig_model_options = guider.model_options
+    guider.model_options = comfy.model_patcher.create_model_options_clone(orig_model_options)
+    transformer_options = guider.model_options["transformer_options"]
+    cache: StepCache = transformer_options["step_cache"].clone()
+    transformer_options["step_cache"] = cache
+    cache.prepare(guider.model_patcher.model.model_sampling)
+    try:
+        return executor(*args, **kwargs)
+    finally:
+        cache.finish()
+        guider.model_options = orig_model_options
+
+
+def apply(model: ModelPatcher, cache: StepCache) -> ModelPatcher:
+    """A clone of model that samples with cache."""
+    model = model.clone()
+    model.model_options["transformer_options"]["step_cache"] = cache
+    model.add_wrapper_with_key(comfy.patcher_extension.WrappersMP.OUTER_SAMPLE, "step_cache", outer_sample_wrapper)
+    model.add_wrapper_with_key(comfy.patcher_extension.WrappersMP.APPLY_MODEL, "step_cache", apply_model_wrapper)
+    return model
+
+
+def benchmark(model: ModelPatcher, sample: Callable[[ModelPatcher], torch.Tensor], caches: dict[str, StepCache]) -> dict[str, dict]:
+    """
+    Quality against speed of caches: sample(model) is the reference output, then every cache samples
+    with sample(apply(model, cache)). Returns the seconds, speedup, skip ratio and the relative L1
+    error and PSNR against the reference of every cache, "reference" for the reference itself.
+    """
+    def run(m):
+        start = time.perf_counter()
+        output = sample(m).float().cpu()
+        return output, time.perf_counter() - start
+
+    reference, reference_seconds = run(model)
+    results = {"reference": {"seconds": reference_seconds, "speedup": 1.0, "skip_ratio": 0.0, "relative_l1": 0.0, "psnr": float("inf")}}
+    peak = reference.abs().max().clamp_min(1e-8)
+    for name, cache in caches.items():
+        output, seconds = run(apply(model, cache))
+        mse = ((output - reference) ** 2).mean()
+        results[name] = {
+            "seconds": seconds,
+            "speedup": reference_seconds / seconds if seconds > 0 else float("inf"),
+            "skip_ratio": cache.runs[-1]["skip_ratio"] if len(cache.runs) > 0 else 0.0,
+            "relative_l1": relative_l1(output, reference),
+            "psnr": (10 * torch.log10(peak ** 2 / mse)).item() if mse > 0 else float("inf"),
+        }
+    return results
+
+
+def get_stats() -> dict:
+    return telemetry.get_stats()
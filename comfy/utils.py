@@ -21,6 +21,8 @@ import torch
 import math
 import struct
 import comfy.checkpoint_pickle
+import comfy.safetensors_stream
+import comfy.shared_weights
 import safetensors.torch
 import numpy as np
 from PIL import Image
@@ -61,15 +63,20 @@ def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
     metadata = None
     if ckpt.lower().endswith(".safetensors") or ckpt.lower().endswith(".sft"):
         try:
-            with safetensors.safe_open(ckpt, framework="pt", device=device.type) as f:
-                sd = {}
-                for k in f.keys():
-                    tensor = f.get_tensor(k)
-                    if DISABLE_MMAP:  # TODO: Not sure if this is the best way to bypass the mmap issues
-                        tensor = tensor.to(device=device, copy=True)
-                    sd[k] = tensor
-                if return_metadata:
-                    metadata = f.metadata()
+            if DISABLE_MMAP or device.type != "cpu":
+                # Read the tensors in large chunks straight to the device instead of copying them one by one
+                f = comfy.safetensors_stream.SafetensorsFile(ckpt)
+                sd = f.load(device=device)
+                metadata = f.metadata
+            elif comfy.shared_weights.ENABLED:
+                sd, metadata = comfy.shared_weights.load_safetensors(ckpt)
+            else:
+                with safetensors.safe_open(ckpt, framework="pt", device=device.type) as f:
+                    sd = {}
+                    for k in f.keys():
+                        sd[k] = f.get_tensor(k)
+                    if return_metadata:
+                        metadata = f.metadata()
         except Exception as e:
             if len(e.args) > 0:
                 message = e.args[0]
@@ -100,6 +107,11 @@ def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
                 sd = pl_sd
     return (sd, metadata) if return_metadata else sd
 
+def load_torch_file_into_module(module, ckpt, safe_load=False, strict=True):
+    if ckpt.lower().endswith(".safetensors") or ckpt.lower().endswith(".sft"):
+        return comfy.safetensors_stream.load_into_module(module, ckpt, strict=strict)
+    return module.load_state_dict(load_torch_file(ckpt, safe_load=safe_load), strict=strict)
+
 def save_torch_file(sd, ckpt, metadata=None):
     if metadata is not None:
         safetensors.torch.save_file(sd, ckpt, metadata=metadata)
@@ -1249,7 +1261,7 @@ def convert_old_quants(state_dict, model_prefix="", metadata={}):
                 if k_out.endswith(".scale_input"):
                     layer = k_out[:-len(".scale_input")]
                     k_out = "{}.input_scale".format(layer)
-                    if w.item() == 1.0:
+                    if w.device.type != "meta" and w.item() == 1.0:
                         continue
 
                 out_sd[k_out] = w
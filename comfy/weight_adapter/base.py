@@ -39,6 +39,14 @@ class WeightAdapterBase:
     ):
         raise NotImplementedError
 
+    def get_matmul_factors(self) -> Optional[list[tuple[torch.Tensor, torch.Tensor]]]:
+        """
+        The pairs of 2D matrices whose products calculate_weight needs, so comfy.lora can compute
+        them batched across keys and pass them back as calculate_weight(..., matmul_products=...).
+        None when the adapter doesn't support that.
+        """
+        return None
+
 
 class WeightAdapterTrainBase(nn.Module):
     # We follow the scheme of PR #7032
@@ -181,6 +181,12 @@ class LoHaAdapter(WeightAdapterBase):
         else:
             return None
 
+    def get_matmul_factors(self):
+        v = self.weights
+        if v[5] is not None:
+            return None
+        return [(v[0], v[1]), (v[3], v[4])]
+
     def calculate_weight(
         self,
         weight,
@@ -191,6 +197,7 @@ class LoHaAdapter(WeightAdapterBase):
         function,
         intermediate_dtype=torch.float32,
         original_weight=None,
+        matmul_products=None,
     ):
         v = self.weights
         w1a = v[0]
@@ -215,6 +222,8 @@ class LoHaAdapter(WeightAdapterBase):
                                 comfy.model_management.cast_to_device(t2, weight.device, intermediate_dtype),
                                 comfy.model_management.cast_to_device(w2b, weight.device, intermediate_dtype),
                                 comfy.model_management.cast_to_device(w2a, weight.device, intermediate_dtype))
+        elif matmul_products is not None:
+            m1, m2 = matmul_products
         else:
             m1 = torch.mm(comfy.model_management.cast_to_device(w1a, weight.device, intermediate_dtype),
                             comfy.model_management.cast_to_device(w1b, weight.device, intermediate_dtype))
@@ -160,6 +160,17 @@ class LoKrAdapter(WeightAdapterBase):
         else:
             return None
 
+    def get_matmul_factors(self):
+        v = self.weights
+        factors = []
+        if v[0] is None:
+            factors.append((v[3], v[4]))
+        if v[1] is None and v[7] is None:
+            factors.append((v[5], v[6]))
+        if len(factors) == 0:
+            return None
+        return factors
+
     def calculate_weight(
         self,
         weight,
@@ -170,6 +181,7 @@ class LoKrAdapter(WeightAdapterBase):
         function,
         intermediate_dtype=torch.float32,
         original_weight=None,
+        matmul_products=None,
     ):
         v = self.weights
         w1 = v[0]
@@ -182,7 +194,10 @@ class LoKrAdapter(WeightAdapterBase):
         dora_scale = v[8]
         dim = None
 
-        if w1 is None:
+        if w1 is None and matmul_products is not None:
+            dim = w1_b.shape[0]
+            w1 = matmul_products[0]
+        elif w1 is None:
             dim = w1_b.shape[0]
             w1 = torch.mm(comfy.model_management.cast_to_device(w1_a, weight.device, intermediate_dtype),
                             comfy.model_management.cast_to_device(w1_b, weight.device, intermediate_dtype))
@@ -191,7 +206,10 @@ class LoKrAdapter(WeightAdapterBase):
 
         if w2 is None:
             dim = w2_b.shape[0]
-            if t2 is None:
+            if t2 is None and matmul_products is not None:
+                # The w2 product comes after the w1 one when both are there
+                w2 = matmul_products[-1]
+            elif t2 is None:
                 w2 = torch.mm(comfy.model_management.cast_to_device(w2_a, weight.device, intermediate_dtype),
                                 comfy.model_management.cast_to_device(w2_b, weight.device, intermediate_dtype))
             else:
@@ -147,6 +147,12 @@ class LoRAAdapter(WeightAdapterBase):
         else:
             return None
 
+    def get_matmul_factors(self):
+        v = self.weights
+        if v[3] is not None:
+            return None
+        return [(v[0].flatten(start_dim=1), v[1].flatten(start_dim=1))]
+
     def calculate_weight(
         self,
         weight,
@@ -157,14 +163,9 @@ class LoRAAdapter(WeightAdapterBase):
         function,
         intermediate_dtype=torch.float32,
         original_weight=None,
+        matmul_products=None,
     ):
         v = self.weights
-        mat1 = comfy.model_management.cast_to_device(
-            v[0], weight.device, intermediate_dtype
-        )
-        mat2 = comfy.model_management.cast_to_device(
-            v[1], weight.device, intermediate_dtype
-        )
         dora_scale = v[4]
         reshape = v[5]
 
@@ -172,10 +173,18 @@ class LoRAAdapter(WeightAdapterBase):
             weight = pad_tensor_to_shape(weight, reshape)
 
         if v[2] is not None:
-            alpha = v[2] / mat2.shape[0]
+            alpha = v[2] / v[1].shape[0]
         else:
             alpha = 1.0
 
+        if matmul_products is None:
+            mat1 = comfy.model_management.cast_to_device(
+                v[0], weight.device, intermediate_dtype
+            )
+            mat2 = comfy.model_management.cast_to_device(
+                v[1], weight.device, intermediate_dtype
+            )
+
         if v[3] is not None:
             # locon mid weights, hopefully the math is fine because I didn't properly test it
             mat3 = comfy.model_management.cast_to_device(
@@ -191,10 +200,13 @@ class LoRAAdapter(WeightAdapterBase):
                 .transpose(0, 1)
             )
         try:
-            lora_diff = torch.mm(
-                mat1.flatten(start_dim=1), mat2.flatten(start_dim=1)
-            ).reshape(weight.shape)
-            del mat1, mat2
+            if matmul_products is not None:
+                lora_diff = matmul_products[0].reshape(weight.shape)
+            else:
+                lora_diff = torch.mm(
+                    mat1.flatten(start_dim=1), mat2.flatten(start_dim=1)
+                ).reshape(weight.shape)
+                del mat1, mat2
             if dora_scale is not None:
                 weight = weight_decompose(
                     dora_scale,
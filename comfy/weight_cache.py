@@ -0,0 +1,132 @@
+"""
+Cache of weights with their patches (LoRAs and other weight adapters) merged in.
+
+Every time a model gets patched with a different patch set, comfy.lora.calculate_weight runs
+again for every patched key. This keeps recently merged weights in CPU RAM so patching a model
+with a patch set it had recently is a copy instead of a recompute.
+
+Entries are keyed by the model, the weight key and a fingerprint of the patches of that key.
+Patch tensors, adapters and functions are fingerprinted by identity and every entry keeps the
+objects of its fingerprint alive, so the identities can't be reused by other patches. Like the
+rest of the patches, this assumes patch tensors aren't modified in place. The cache is bounded
+in bytes and evicts the least recently used weights.
+"""
+
+import collections
+import logging
+import threading
+import weakref
+from typing import Optional
+
+import torch
+
+from comfy.cli_args import args
+import comfy.weight_adapter
+
+
+def _fingerprint(obj, refs):
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, list):
+        # calculate_weight treats lists (nested patches) differently from tuples
+        return ("LIST",) + tuple(_fingerprint(o, refs) for o in obj)
+    if isinstance(obj, tuple):
+        return tuple(_fingerprint(o, refs) for o in obj)
+    if isinstance(obj, dict):
+        return ("DICT",) + tuple((str(k), _fingerprint(v, refs)) for k, v in sorted(obj.items(), key=lambda i: str(i[0])))
+    if isinstance(obj, comfy.weight_adapter.WeightAdapterBase):
+        # Adapters get created again every time a LoRA loader runs, the tensors they wrap don't.
+        return ("ADAPTER", type(obj).__name__, _fingerprint(obj.weights, refs))
+    refs.append(obj)
+    return ("ID", id(obj))
+
+
+class PatchedWeightCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = collections.OrderedDict()
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def _remove_model(self, model_id):
+        with self.lock:
+            for cache_key in [k for k in self.entries if k[0] == model_id]:
+                self.total_bytes -= self._size(self.entries.pop(cache_key)[0])
+            self.models.pop(model_id, None)
+
+    def _size(self, weight):
+        return weight.numel() * weight.element_size()
+
+    def get(self, cache_key, device) -> Optional[torch.Tensor]:
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(cache_key)
+        return entry[0].to(device, copy=True)
+
+    def put(self, model, cache_key, weight, refs):
+        size = self._size(weight)
+        if size > self.max_bytes:
+            return
+        weight = weight.to("cpu", copy=True)
+        with self.lock:
+            if id(model) not in self.models:
+                # Entries hold the model id, drop them when the model goes away so the id can't
+                # be confused with a new model's.
+                self.models[id(model)] = weakref.finalize(model, self._remove_model, id(model))
+            old = self.entries.pop(cache_key, None)
+            if old is not None:
+                self.total_bytes -= self._size(old[0])
+            self.entries[cache_key] = (weight, refs)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.total_bytes -= self._size(evicted)
+
+
+_cache: Optional[PatchedWeightCache] = None
+
+
+def set_cache_size(max_gb: float):
+    global _cache
+    if max_gb > 0:
+        _cache = PatchedWeightCache(int(max_gb * (1024 ** 3)))
+        logging.info("Caching up to {:.2f} GB of patched weights in RAM.".format(max_gb))
+    else:
+        _cache = None
+
+
+def _cache_key(model, key, weight, patches, refs):
+    return (id(model), key, weight.dtype, tuple(weight.shape), _fingerprint(patches, refs))
+
+
+def contains(model, key: str, weight: torch.Tensor, patches: list) -> bool:
+    if _cache is None:
+        return False
+    cache_key = _cache_key(model, key, weight, patches, [])
+    with _cache.lock:
+        return cache_key in _cache.entries
+
+
+def lookup(model, key: str, weight: torch.Tensor, patches: list, device):
+    """
+    Returns (entry, cached weight) for a weight key of model patched with patches. The cached
+    weight is a copy on device or None on a miss. entry is what store() takes after computing the
+    weight on a miss, it is None when the cache is disabled.
+    """
+    if _cache is None:
+        return None, None
+    refs = []
+    cache_key = _cache_key(model, key, weight, patches, refs)
+    return (model, cache_key, refs), _cache.get(cache_key, device)
+
+
+def store(entry, weight: torch.Tensor):
+    if _cache is not None and entry is not None:
+        model, cache_key, refs = entry
+        _cache.put(model, cache_key, weight, refs)
+
+
+set_cache_size(args.patched_weight_cache)
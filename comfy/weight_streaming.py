@@ -0,0 +1,324 @@
+"""
+Block streaming of the offloaded weights of lowvram models (--weight-streaming).
+
+When a model doesn't fit in VRAM, the weights of its offloaded layers get copied to the device by
+comfy.ops right before each layer runs, a layer or two ahead at most. Most diffusion models are a
+few lists of identical blocks (comfy/ldm/*: double_blocks, single_blocks, transformer_blocks,
+input_blocks...) that run one after the other, so the streamer learns the order the blocks run in
+on the first call of the model and from then on copies all the offloaded weights of the next
+block to the device on its own stream while the current block computes. The copies go to a fixed
+ring of RING_BLOCKS block sized buffers, a buffer gets filled again once the block that used it
+finished computing.
+
+Overlap efficiency is the fraction of the copy time the compute didn't have to wait for, measured
+with device events.
+"""
+
+import contextlib
+import logging
+import threading
+from typing import Optional
+
+import torch
+
+from comfy.cli_args import args
+import comfy.model_management
+
+ENABLED = args.weight_streaming > 0
+RING_BLOCKS = max(2, args.weight_streaming)
+# Alignment of the weights in the ring buffers
+ALIGNMENT = 256
+
+
+class StreamingTelemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = 0
+        self.streamed_bytes = 0
+        self.copy_ms = 0.0
+        self.stall_ms = 0.0
+
+    def record_block(self, streamed_bytes: int):
+        with self.lock:
+            self.blocks += 1
+            self.streamed_bytes += streamed_bytes
+
+    def record_timing(self, copy_ms: float, stall_ms: float):
+        with self.lock:
+            self.copy_ms += copy_ms
+            self.stall_ms += stall_ms
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": ENABLED,
+                "ring_blocks": RING_BLOCKS,
+                "blocks": self.blocks,
+                "streamed_bytes": self.streamed_bytes,
+                "copy_ms": self.copy_ms,
+                "stall_ms": self.stall_ms,
+                "overlap_efficiency": max(0.0, 1.0 - self.stall_ms / self.copy_ms) if self.copy_ms > 0 else None,
+            }
+
+
+telemetry = StreamingTelemetry()
+
+
+def find_blocks(model: torch.nn.Module) -> list[torch.nn.Module]:
+    """The items of the outermost ModuleLists of model."""
+    blocks = []
+    for child in model.children():
+        if isinstance(child, torch.nn.ModuleList):
+            blocks.extend(child)
+        else:
+            blocks.extend(find_blocks(child))
+    return blocks
+
+
+def offloaded_weights(block: torch.nn.Module, device) -> list[tuple[torch.nn.Module, str, torch.Tensor]]:
+    """(module, "weight" or "bias", tensor) of the weights of block that comfy.ops casts from another device."""
+    out = []
+    for m in block.modules():
+        if not getattr(m, "comfy_cast_weights", False):
+            continue
+        for name in ("weight", "bias"):
+            t = getattr(m, name, None)
+            if t is None or type(t) not in (torch.Tensor, torch.nn.Parameter) or t.device == device:
+                continue
+            out.append((m, name, t))
+    return out
+
+
+def _aligned_size(t: torch.Tensor) -> int:
+    size = t.nelement() * t.element_size()
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _new_stream(device):
+    if comfy.model_management.is_device_cuda(device):
+        stream = torch.cuda.Stream(device=device)
+        stream.as_context = torch.cuda.stream
+    elif comfy.model_management.is_device_xpu(device):
+        stream = torch.xpu.Stream(device=device)
+        stream.as_context = torch.xpu.stream
+    else:
+        return None
+    return stream
+
+
+def _new_event(device):
+    return getattr(torch, device.type).Event(enable_timing=True)
+
+
+class Prefetch:
+    def __init__(self, slot: int, weights: list, streamed_bytes: int):
+        self.slot = slot
+        self.weights = weights
+        self.streamed_bytes = streamed_bytes
+        self.copy_start = None
+        self.copy_end = None
+
+
+class BlockStreamer:
+    """Streams the offloaded weights of the blocks of model to device, RING_BLOCKS - 1 blocks ahead."""
+    def __init__(self, model: torch.nn.Module, device, ring_blocks=RING_BLOCKS):
+        self.model = model
+        self.device = device
+        self.ring_blocks = ring_blocks
+        self.blocks = find_blocks(model)
+        self.stream = _new_stream(device)
+        self.ring: list[Optional[torch.Tensor]] = [None] * ring_blocks
+        # Event recorded on the compute stream after the last block that used each buffer
+        self.ring_free = [None] * ring_blocks
+        self.next_slot = 0
+        self.order: Optional[list[torch.nn.Module]] = None
+        self.recording: Optional[list[torch.nn.Module]] = None
+        self.position = 0
+        self.prefetched: dict[int, Prefetch] = {}
+        self.timings = []
+        self.handles = [model.register_forward_pre_hook(self._model_pre_hook)]
+        for block in self.blocks:
+            self.handles.append(block.register_forward_pre_hook(self._block_pre_hook))
+            self.handles.append(block.register_forward_hook(self._block_hook))
+
+    def ring_bytes(self) -> int:
+        """Memory the ring buffers take once they're all allocated."""
+        largest = max((sum(_aligned_size(t) for _, _, t in offloaded_weights(b, self.device)) for b in self.blocks), default=0)
+        return largest * self.ring_blocks
+
+    def reset(self):
+        """Drops the weights copied ahead, for when the weights of the model change."""
+        for prefetch in self.prefetched.values():
+            self._clear(prefetch)
+        self.prefetched.clear()
+
+    def remove(self):
+        for h in self.handles:
+            h.remove()
+        self.handles = []
+        self.reset()
+        if self.stream is not None:
+            comfy.model_management.current_stream(self.device).wait_stream(self.stream)
+        self.ring = [None] * self.ring_blocks
+        self.ring_free = [None] * self.ring_blocks
+
+    def _model_pre_hook(self, module, args):
+        self._collect_timings()
+        if self.recording is not None and len(self.recording) > 0:
+            self.order = self.recording
+        self.recording = [] if self.order is None else None
+        self.position = 0
+
+    def _prefetch(self, position: int):
+        if position in self.prefetched:
+            return
+        weights = offloaded_weights(self.order[position], self.device)
+        if len(weights) == 0:
+            return
+        size = sum(_aligned_size(t) for _, _, t in weights)
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.ring_blocks
+        for p, prefetch in list(self.prefetched.items()):
+            if prefetch.slot == slot:
+                # Never used, the block order changed
+                self._clear(self.prefetched.pop(p))
+        if self.ring[slot] is None or self.ring[slot].nelement() < size:
+            if self.ring[slot] is not None and self.stream is not None:
+                # Copies into the old buffer have to be done before the allocator reuses its memory
+                comfy.model_management.current_stream(self.device).wait_stream(self.stream)
+            self.ring[slot] = None
+            self.ring[slot] = torch.empty((size,), dtype=torch.uint8, device=self.device)
+            self.ring_free[slot] = None
+
+        prefetch = Prefetch(slot, [], size)
+        buffer = self.ring[slot]
+        non_blocking = comfy.model_management.device_supports_non_blocking(self.device)
+        context = self.stream.as_context(self.stream) if self.stream is not None else contextlib.nullcontext()
+        with context, torch.no_grad():
+            if self.stream is not None:
+                if self.ring_free[slot] is not None:
+                    self.stream.wait_event(self.ring_free[slot])
+                else:
+                    self.stream.wait_stream(comfy.model_management.current_stream(self.device))
+                prefetch.copy_start = _new_event(self.device)
+                self.stream.record_event(prefetch.copy_start)
+            offset = 0
+            for m, name, t in weights:
+                n = t.nelement() * t.element_size()
+                dst = buffer[offset:offset + n].view(t.dtype).view(t.shape)
+                dst.copy_(t, non_blocking=non_blocking)
+                prefetch.weights.append((m, name, t, dst))
+                offset += _aligned_size(t)
+            if self.stream is not None:
+                prefetch.copy_end = _new_event(self.device)
+                self.stream.record_event(prefetch.copy_end)
+        self.prefetched[position] = prefetch
+
+    def _block_pre_hook(self, block, args):
+        if self.recording is not None:
+            self.recording.append(block)
+            return
+        if self.order is None:
+            return
+        position = self.position
+        if position >= len(self.order) or self.order[position] is not block:
+            # Not the order of the first call, stop until the next call records it again
+            logging.debug("Weight streaming: block order changed, recording it again.")
+            self.order = None
+            self.reset()
+            return
+        self.position += 1
+
+        self._prefetch(position)
+        for i in range(1, self.ring_blocks):
+            self._prefetch((position + i) % len(self.order))
+
+        prefetch = self.prefetched.get(position)
+        if prefetch is None:
+            return
+        for m, name, source, dst in prefetch.weights:
+            prefetched = getattr(m, "comfy_prefetched", None)
+            if prefetched is None:
+                prefetched = {}
+                m.comfy_prefetched = prefetched
+            prefetched[name] = (source, dst)
+        if self.stream is not None:
+            compute = comfy.model_management.current_stream(self.device)
+            needed = _new_event(self.device)
+            compute.record_event(needed)
+            compute.wait_event(prefetch.copy_end)
+            self.timings.append((prefetch.copy_start, prefetch.copy_end, needed))
+        telemetry.record_block(prefetch.streamed_bytes)
+
+    def _block_hook(self, block, args, output):
+        if self.order is None or self.recording is not None:
+            return
+        prefetch = self.prefetched.pop(self.position - 1, None)
+        if prefetch is None:
+            return
+        self._clear(prefetch)
+        if self.stream is not None:
+            self.ring_free[prefetch.slot] = comfy.model_management.current_stream(self.device).record_event()
+
+    def _clear(self, prefetch: Prefetch):
+        for m, name, _, _ in prefetch.weights:
+            prefetched = getattr(m, "comfy_prefetched", None)
+            if prefetched is not None:
+                prefetched.pop(name, None)
+                if len(prefetched) == 0:
+                    del m.comfy_prefetched
+
+    def _collect_timings(self):
+        pending = []
+        for copy_start, copy_end, needed in self.timings:
+            if not (copy_end.query() and needed.query()):
+                pending.append((copy_start, copy_end, needed))
+                continue
+            copy_ms = copy_start.elapsed_time(copy_end)
+            # Time the compute waited for the copy after it got to the block
+            stall_ms = max(0.0, needed.elapsed_time(copy_end))
+            telemetry.record_timing(copy_ms, min(stall_ms, copy_ms))
+        self.timings = pending
+
+
+def take_prefetched(module: torch.nn.Module, device) -> Optional[dict[str, torch.Tensor]]:
+    """The weights of module the streamer already copied to device, by name, for comfy.ops."""
+    prefetched = getattr(module, "comfy_prefetched", None)
+    if prefetched is None:
+        return None
+    out = {}
+    for name, (source, dst) in prefetched.items():
+        # Weights that got replaced since they were copied are cast the regular way
+        if getattr(module, name, None) is source and dst.device == device:
+            out[name] = dst
+    return out if len(out) > 0 else None
+
+
+def attach(model: torch.nn.Module, device) -> Optional[BlockStreamer]:
+    """Starts streaming the offloaded weights of model to device, if enabled and the device has streams."""
+    if not ENABLED or comfy.model_management.current_stream(device) is None:
+        return None
+    streamer = getattr(model, "weight_streamer", None)
+    if streamer is not None:
+        if streamer.device == device:
+            streamer.reset()
+            return streamer
+        streamer.remove()
+    target = getattr(model, "diffusion_model", model)
+    streamer = BlockStreamer(target, device)
+    if len(streamer.blocks) == 0:
+        streamer.remove()
+        return None
+    model.weight_streamer = streamer
+    return streamer
+
+
+def detach(model: torch.nn.Module):
+    streamer = getattr(model, "weight_streamer", None)
+    if streamer is not None:
+        streamer.remove()
+        del model.weight_streamer
+
+
+def get_stats() -> dict:
+    return telemetry.get_stats()
@@ -0,0 +1,266 @@
+"""
+Micro-batching of sampler calls across prompt workers.
+
+With several prompt workers, queued prompts that only differ in seed or prompt text reach their
+sampler at about the same time and each of them samples at batch size 1. When sampler batching
+is enabled the first sampler call waits a short window for compatible calls from the other
+workers and runs all of them as one batch: noise and latents are concatenated, the conds of
+every call are concatenated item by item and the result is split back to each caller.
+
+Calls are compatible when their model, sampler settings and latent shape match. Every worker
+loads its own copy of a model, so models are compared by the signature of the subgraph that
+produced them, like the output cache does. Only samplers that don't draw random numbers while
+sampling are batched so every item comes out the same as if it had been sampled on its own.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+import torch
+
+from comfy_execution.graph_utils import is_link
+
+# Samplers whose result for one batch item doesn't depend on the seed or on the other items.
+DETERMINISTIC_SAMPLERS = frozenset([
+    "euler", "euler_cfg_pp", "heun", "heunpp2", "dpm_2", "lms", "dpmpp_2m", "dpmpp_2m_cfg_pp",
+    "ipndm", "ipndm_v", "deis", "gradient_estimation", "gradient_estimation_cfg_pp",
+    "ddim", "uni_pc", "uni_pc_bh2",
+])
+
+# Cond options holding one entry per batch item, concatenated like the cond tensor itself. Every
+# other option has to be the same for all calls in a batch.
+BATCHED_COND_OPTIONS = frozenset(["pooled_output"])
+
+# Maximum number of latents sampled in one batched call.
+SAMPLER_BATCH_MAX_SIZE = 8
+
+# Signature tokens of the inputs of the executing node, set by the executor for nodes that
+# declare SAMPLER_BATCHING = True.
+current_link_tokens: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("current_link_tokens", default=None)
+
+
+def _repeat_to_batch_size(tensor, batch_size):
+    import comfy.utils
+    return comfy.utils.repeat_to_batch_size(tensor, batch_size)
+
+
+def _batchable_tensors(a, b) -> bool:
+    return (isinstance(a, torch.Tensor) and isinstance(b, torch.Tensor) and not a.is_nested and not b.is_nested
+            and a.shape[1:] == b.shape[1:] and a.dtype == b.dtype and a.device == b.device)
+
+
+def _same_option(a, b) -> bool:
+    if a is b:
+        return True
+    if isinstance(a, torch.Tensor) or isinstance(b, torch.Tensor):
+        return (isinstance(a, torch.Tensor) and isinstance(b, torch.Tensor) and a.shape == b.shape
+                and a.dtype == b.dtype and a.device == b.device and torch.equal(a, b))
+    if isinstance(a, (int, float, str, bool, type(None))):
+        return type(a) is type(b) and a == b
+    if isinstance(a, (list, tuple)) and type(a) is type(b):
+        return len(a) == len(b) and all(_same_option(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same_option(a[k], b[k]) for k in a)
+    # Model patches, control nets, hooks... are only the same if they are the same object.
+    return False
+
+
+def conds_compatible(a: list, b: list) -> bool:
+    """Whether two conditionings can be concatenated into the conditioning of a single batch."""
+    if len(a) != len(b):
+        return False
+    for (cond_a, options_a), (cond_b, options_b) in zip(a, b):
+        if not _batchable_tensors(cond_a, cond_b) or options_a.keys() != options_b.keys():
+            return False
+        for k in options_a:
+            if k in BATCHED_COND_OPTIONS and isinstance(options_a[k], torch.Tensor):
+                if not _batchable_tensors(options_a[k], options_b[k]):
+                    return False
+            elif not _same_option(options_a[k], options_b[k]):
+                return False
+    return True
+
+
+def fuse_conds(conds: list[list], batch_sizes: list[int]) -> list:
+    """
+    Concatenates compatible conditionings so item i of the batch is conditioned like it would be
+    by its own conditioning, each conditioning being repeated to the batch size of its latent.
+    """
+    fused = []
+    for entries in zip(*conds):
+        cond = torch.cat([_repeat_to_batch_size(c, batch_size) for (c, _), batch_size in zip(entries, batch_sizes)])
+        options = entries[0][1].copy()
+        for k in BATCHED_COND_OPTIONS:
+            if isinstance(options.get(k), torch.Tensor):
+                options[k] = torch.cat([_repeat_to_batch_size(o[k], batch_size) for (_, o), batch_size in zip(entries, batch_sizes)])
+        fused.append([cond, options])
+    return fused
+
+
+def is_deterministic_sampler(sampler) -> bool:
+    """Takes a sampler name or a SAMPLER object like the ones KSamplerSelect outputs."""
+    if isinstance(sampler, str):
+        return sampler in DETERMINISTIC_SAMPLERS
+    import comfy.samplers
+    if not isinstance(sampler, comfy.samplers.KSAMPLER):
+        return False
+    return any(sampler.sampler_function is comfy.samplers.sampler_object(name).sampler_function for name in DETERMINISTIC_SAMPLERS)
+
+
+class _Request:
+    def __init__(self, run, noise, latent_image, positive, negative):
+        self.run = run
+        self.noise = noise
+        self.latent_image = latent_image
+        self.positive = positive
+        self.negative = negative
+        self.batch_size = latent_image.shape[0]
+        self.result = None
+        self.done = threading.Event()
+
+    def sample(self):
+        return self.run(self.noise, self.latent_image, self.positive, self.negative)
+
+
+class SamplerBatcher:
+    def __init__(self, window: float, expected_callers: Optional[Callable[[], int]] = None, max_batch_size: int = SAMPLER_BATCH_MAX_SIZE):
+        """
+        Args:
+            window: Seconds the first call of a batch waits for compatible calls.
+            expected_callers: Number of threads that may sample right now (the busy prompt
+                workers). The first call stops waiting once that many calls joined it.
+            max_batch_size: Maximum number of latents in a batch.
+        """
+        self.window = window
+        self.expected_callers = expected_callers
+        self.max_batch_size = max_batch_size
+        self.condition = threading.Condition()
+        self.groups = {}
+
+    def _batch_size(self, group):
+        return sum(r.batch_size for r in group)
+
+    def _accepts(self, group, request):
+        return (self._batch_size(group) + request.batch_size <= self.max_batch_size
+                and conds_compatible(group[0].positive, request.positive)
+                and conds_compatible(group[0].negative, request.negative))
+
+    def _wait_for_callers(self, group):
+        deadline = time.monotonic() + self.window
+        while self._batch_size(group) < self.max_batch_size:
+            expected = self.expected_callers() if self.expected_callers is not None else self.max_batch_size
+            remaining = deadline - time.monotonic()
+            if len(group) >= expected or remaining <= 0:
+                break
+            self.condition.wait(remaining)
+
+    def sample(self, key, run, noise, latent_image, positive, negative):
+        request = _Request(run, noise, latent_image, positive, negative)
+        with self.condition:
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = [request]
+                self._wait_for_callers(group)
+                del self.groups[key]
+            elif self._accepts(group, request):
+                group.append(request)
+                self.condition.notify_all()
+                group = None
+            else:
+                group = [request]
+
+        if group is None:
+            request.done.wait()
+            if request.result is None:
+                # The batched call failed, sample on our own so the error (if any) is reported
+                # against this prompt too.
+                return request.sample()
+            return request.result
+        if len(group) == 1:
+            return request.sample()
+        return self._sample_group(group)
+
+    def _sample_group(self, group):
+        try:
+            try:
+                batch_sizes = [r.batch_size for r in group]
+                noise = torch.cat([r.noise for r in group])
+                latent_image = torch.cat([r.latent_image for r in group])
+                positive = fuse_conds([r.positive for r in group], batch_sizes)
+                negative = fuse_conds([r.negative for r in group], batch_sizes)
+            except Exception as e:
+                logging.warning("Failed to batch {} sampler calls, sampling them one by one: {}".format(len(group), e))
+                return group[0].sample()
+
+            logging.debug("Sampling {} calls as one batch of {} latents.".format(len(group), sum(batch_sizes)))
+            output = group[0].run(noise, latent_image, positive, negative)
+            outputs = output if isinstance(output, tuple) else (output,)
+            offset = 0
+            for r in group:
+                split = tuple(o[offset:offset + r.batch_size] if o is not None else None for o in outputs)
+                r.result = split if isinstance(output, tuple) else split[0]
+                offset += r.batch_size
+            return group[0].result
+        finally:
+            for r in group[1:]:
+                r.done.set()
+
+
+_batcher: Optional[SamplerBatcher] = None
+
+
+def set_sampler_batching(window: float, expected_callers: Optional[Callable[[], int]] = None):
+    global _batcher
+    if window is not None and window > 0:
+        _batcher = SamplerBatcher(window, expected_callers)
+    else:
+        _batcher = None
+
+
+def get_link_tokens(class_def, cache, inputs: dict) -> Optional[dict]:
+    """
+    Signature tokens of the outputs linked to the inputs of a node that opted in to sampler
+    batching. None when batching is off or the cache doesn't compute input signatures.
+    """
+    if _batcher is None or not getattr(class_def, "SAMPLER_BATCHING", False):
+        return None
+    tokens = getattr(getattr(cache, "cache_key_set", None), "signature_tokens", None)
+    if tokens is None:
+        return None
+    # Tokens of nodes with unhashable inputs aren't tuples and never match another worker's.
+    return {k: (tokens[v[0]], v[1]) for k, v in inputs.items() if is_link(v) and isinstance(tokens.get(v[0]), tuple)}
+
+
+def get_sampler_key(model, sampler, noise_mask, linked_inputs: list[str], options: tuple) -> Optional[tuple]:
+    """
+    Key under which calls of the executing sampler node get batched together, or None if this
+    call has to run on its own.
+
+    Args:
+        model: The ModelPatcher sampled with.
+        sampler: The sampler name or SAMPLER object.
+        noise_mask: The noise mask of the latent. Masked sampling isn't batched.
+        linked_inputs: Inputs of the node that have to come from the same subgraph, e.g. the model.
+        options: Remaining sampler settings that have to be equal, e.g. steps and cfg.
+    """
+    if _batcher is None or noise_mask is not None or not is_deterministic_sampler(sampler):
+        return None
+    tokens = current_link_tokens.get()
+    if tokens is None or any(name not in tokens for name in linked_inputs):
+        return None
+    return (str(model.load_device),) + tuple(tokens[name] for name in linked_inputs) + tuple(options)
+
+
+def sample(key, run, noise, latent_image, positive, negative):
+    """
+    Returns run(noise, latent_image, positive, negative), possibly computed by a single call of
+    run for a batch made of this call and compatible calls made by other prompt workers. run
+    returns the samples or a tuple of per item tensors (or None), which get split back to every
+    caller. Progress and previews of a batch are reported by the node that ran it.
+    """
+    if _batcher is None or key is None or latent_image.is_nested or noise.is_nested:
+        return run(noise, latent_image, positive, negative)
+    return _batcher.sample(key + (tuple(latent_image.shape[1:]), latent_image.dtype), run, noise, latent_image, positive, negative)
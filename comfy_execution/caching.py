@@ -1,9 +1,18 @@
 import bisect
 import gc
+import hashlib
 import itertools
+import json
+import logging
+import os
 import psutil
+import tempfile
+import threading
 import time
 import torch
+import safetensors
+import safetensors.torch
+from collections import OrderedDict
 from typing import Sequence, Mapping, Dict
 from comfy_execution.graph import DynamicPrompt
 from abc import ABC, abstractmethod
@@ -50,18 +59,57 @@ class Unhashable:
     def __init__(self):
         self.value = float("NaN")
 
+# Tensors are hashed in full, a chunk at a time so tensors on other devices are never copied to
+# the cpu in one piece. Hashing a sample would give two tensors that only differ in the elements
+# that got skipped the same signature and so serve a stale cached output.
+TENSOR_HASH_CHUNK_BYTES = 16 * 1024 * 1024
+
+def tensor_fingerprint(tensor):
+    flat = tensor.detach().reshape(-1)
+    chunk = max(1, TENSOR_HASH_CHUNK_BYTES // flat.element_size())
+    sha = hashlib.sha256()
+    for start in range(0, flat.numel(), chunk):
+        data = flat[start:start + chunk].to("cpu").contiguous().view(torch.uint8)
+        sha.update(data.numpy())
+    return ("TENSOR", tuple(tensor.shape), str(tensor.dtype), sha.hexdigest())
+
+# Fingerprint functions for types that can't be converted by to_hashable directly. Each function
+# takes the object and returns something to_hashable can deal with.
+FINGERPRINT_FUNCTIONS = {
+    torch.Tensor: tensor_fingerprint,
+}
+
+def register_fingerprint_function(obj_type, function):
+    FINGERPRINT_FUNCTIONS[obj_type] = function
+
+def _get_fingerprint_function(obj):
+    for obj_type in type(obj).__mro__:
+        if obj_type in FINGERPRINT_FUNCTIONS:
+            return FINGERPRINT_FUNCTIONS[obj_type]
+    return None
+
 def to_hashable(obj):
     # So that we don't infinitely recurse since frozenset and tuples
     # are Sequences.
     if isinstance(obj, (int, float, str, bool, bytes, type(None))):
         return obj
-    elif isinstance(obj, Mapping):
+    # dict/list/tuple are checked first since isinstance on the typing ABCs is slow
+    elif isinstance(obj, (dict, Mapping)):
         return frozenset([(to_hashable(k), to_hashable(v)) for k, v in sorted(obj.items())])
-    elif isinstance(obj, Sequence):
+    elif isinstance(obj, (list, tuple, Sequence)):
         return frozenset(zip(itertools.count(), [to_hashable(i) for i in obj]))
+    elif hasattr(obj, "__comfy_hash__"):
+        # Objects can opt in to caching by returning a stable representation of their content.
+        return to_hashable(("CUSTOM", type(obj).__qualname__, obj.__comfy_hash__()))
     else:
-        # TODO - Support other objects like tensors?
-        return Unhashable()
+        fingerprint = _get_fingerprint_function(obj)
+        if fingerprint is None:
+            return Unhashable()
+        try:
+            return to_hashable(fingerprint(obj))
+        except Exception as e:
+            logging.debug("Failed to fingerprint {}: {}".format(type(obj).__name__, e))
+            return Unhashable()
 
 class CacheKeySetID(CacheKeySet):
     def __init__(self, dynprompt, node_ids, is_changed_cache):
@@ -78,11 +126,53 @@ class CacheKeySetID(CacheKeySet):
             self.keys[node_id] = (node_id, node["class_type"])
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
+# Signatures are interned across prompts so consecutive prompts sharing subgraphs reuse the same
+# signature objects and ancestor tokens instead of digesting them again.
+SIGNATURE_INTERN_MAX_SIZE = 100000
+SIGNATURE_INTERN = {}
+
+def intern_signature(signature):
+    """
+    Returns the interned version of a signature and the token its descendants use to refer to it.
+    Tokens are digests so signatures stay flat no matter how deep the graph is. Signatures that
+    contain unhashable inputs get a token that never compares equal to anything else.
+    """
+    entry = SIGNATURE_INTERN.get(signature)
+    if entry is None:
+        digest = key_digest(signature)
+        token = ("SIGNATURE", digest) if digest is not None else Unhashable()
+        entry = (signature, token)
+        if len(SIGNATURE_INTERN) >= SIGNATURE_INTERN_MAX_SIZE:
+            SIGNATURE_INTERN.clear()
+        SIGNATURE_INTERN[signature] = entry
+    return entry
+
+# The interned signature and token of a node by the literal values of its inputs and the tokens of
+# the nodes linked to them, so nodes that didn't change since an earlier prompt skip to_hashable.
+NODE_SIGNATURE_MEMO = {}
+
+def literal_memo_key(value):
+    """
+    A cheap hashable version of a literal input value, or a TypeError for values that can only be
+    compared by their fingerprint (tensors, dicts, custom objects). The type is part of the key so
+    1, 1.0 and True don't share an entry.
+    """
+    if isinstance(value, (int, float, str, bool, bytes, type(None))):
+        if value != value:
+            # NaN never equals an earlier NaN, so it can't be looked up either
+            raise TypeError("NaN")
+        return (type(value), value)
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(literal_memo_key(v) for v in value))
+    raise TypeError(type(value).__name__)
+
 class CacheKeySetInputSignature(CacheKeySet):
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         super().__init__(dynprompt, node_ids, is_changed_cache)
         self.dynprompt = dynprompt
         self.is_changed_cache = is_changed_cache
+        self.signatures = {}
+        self.signature_tokens = {}
 
     def include_node_id_in_input(self) -> bool:
         return False
@@ -97,63 +187,198 @@ class CacheKeySetInputSignature(CacheKeySet):
             self.keys[node_id] = await self.get_node_signature(self.dynprompt, node_id)
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
+    # The signature of a node contains the tokens of the nodes linked to its inputs (Merkle style)
+    # so each node is only hashed once, in topological order, no matter how many descendants it has.
     async def get_node_signature(self, dynprompt, node_id):
-        signature = []
-        ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
-        signature.append(await self.get_immediate_node_signature(dynprompt, node_id, order_mapping))
-        for ancestor_id in ancestors:
-            signature.append(await self.get_immediate_node_signature(dynprompt, ancestor_id, order_mapping))
-        return to_hashable(signature)
+        for ancestor_id in self.get_uncomputed_ancestry(dynprompt, node_id):
+            memo_key = await self.get_node_memo_key(dynprompt, ancestor_id)
+            entry = NODE_SIGNATURE_MEMO.get(memo_key) if memo_key is not None else None
+            if entry is None:
+                signature = await self.get_immediate_node_signature(dynprompt, ancestor_id)
+                entry = intern_signature(signature)
+                if memo_key is not None:
+                    if len(NODE_SIGNATURE_MEMO) >= SIGNATURE_INTERN_MAX_SIZE:
+                        NODE_SIGNATURE_MEMO.clear()
+                    NODE_SIGNATURE_MEMO[memo_key] = entry
+            self.signatures[ancestor_id], self.signature_tokens[ancestor_id] = entry
+        return self.signatures[node_id]
+
+    def include_node_id(self, class_type):
+        class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+        return self.include_node_id_in_input() or (hasattr(class_def, "NOT_IDEMPOTENT") and class_def.NOT_IDEMPOTENT) or include_unique_id_in_input(class_type)
+
+    # Returns None when the node has inputs that need to be fingerprinted to be compared.
+    async def get_node_memo_key(self, dynprompt, node_id):
+        if not dynprompt.has_node(node_id):
+            return None
+        node = dynprompt.get_node(node_id)
+        class_type = node["class_type"]
+        inputs = node["inputs"]
+        try:
+            memo_key = [class_type, literal_memo_key(await self.is_changed_cache.get(node_id))]
+            if self.include_node_id(class_type):
+                memo_key.append(node_id)
+            for key in sorted(inputs.keys()):
+                if is_link(inputs[key]):
+                    (ancestor_id, ancestor_socket) = inputs[key]
+                    ancestor_token = self.signature_tokens.get(ancestor_id, None)
+                    if ancestor_token is None or isinstance(ancestor_token, Unhashable):
+                        return None
+                    memo_key.append((key, "ANCESTOR", ancestor_token, ancestor_socket))
+                else:
+                    memo_key.append((key, literal_memo_key(inputs[key])))
+        except TypeError:
+            return None
+        return tuple(memo_key)
 
-    async def get_immediate_node_signature(self, dynprompt, node_id, ancestor_order_mapping):
+    async def get_immediate_node_signature(self, dynprompt, node_id):
         if not dynprompt.has_node(node_id):
             # This node doesn't exist -- we can't cache it.
-            return [float("NaN")]
+            return to_hashable([float("NaN")])
         node = dynprompt.get_node(node_id)
         class_type = node["class_type"]
-        class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
         signature = [class_type, await self.is_changed_cache.get(node_id)]
-        if self.include_node_id_in_input() or (hasattr(class_def, "NOT_IDEMPOTENT") and class_def.NOT_IDEMPOTENT) or include_unique_id_in_input(class_type):
+        if self.include_node_id(class_type):
             signature.append(node_id)
         inputs = node["inputs"]
         for key in sorted(inputs.keys()):
             if is_link(inputs[key]):
                 (ancestor_id, ancestor_socket) = inputs[key]
-                ancestor_index = ancestor_order_mapping[ancestor_id]
-                signature.append((key,("ANCESTOR", ancestor_index, ancestor_socket)))
+                # The token is only missing for dependency cycles, which get reported during execution.
+                ancestor_token = self.signature_tokens.get(ancestor_id, Unhashable())
+                signature.append((key,("ANCESTOR", ancestor_token, ancestor_socket)))
             else:
                 signature.append((key, inputs[key]))
-        return signature
-
-    # This function returns a list of all ancestors of the given node. The order of the list is
-    # deterministic based on which specific inputs the ancestor is connected by.
-    def get_ordered_ancestry(self, dynprompt, node_id):
-        ancestors = []
-        order_mapping = {}
-        self.get_ordered_ancestry_internal(dynprompt, node_id, ancestors, order_mapping)
-        return ancestors, order_mapping
+        return to_hashable(signature)
 
-    def get_ordered_ancestry_internal(self, dynprompt, node_id, ancestors, order_mapping):
-        if not dynprompt.has_node(node_id):
-            return
-        inputs = dynprompt.get_node(node_id)["inputs"]
-        input_keys = sorted(inputs.keys())
-        for key in input_keys:
-            if is_link(inputs[key]):
-                ancestor_id = inputs[key][0]
-                if ancestor_id not in order_mapping:
-                    ancestors.append(ancestor_id)
-                    order_mapping[ancestor_id] = len(ancestors) - 1
-                    self.get_ordered_ancestry_internal(dynprompt, ancestor_id, ancestors, order_mapping)
+    # This function returns the given node and all of its ancestors that don't have a signature yet,
+    # ordered so that every node comes after the nodes linked to its inputs.
+    def get_uncomputed_ancestry(self, dynprompt, node_id):
+        order = []
+        visited = set()
+        stack = [(node_id, False)]
+        while len(stack) > 0:
+            current_id, expanded = stack.pop()
+            if expanded:
+                order.append(current_id)
+                continue
+            if current_id in visited or current_id in self.signatures:
+                continue
+            visited.add(current_id)
+            stack.append((current_id, True))
+            if not dynprompt.has_node(current_id):
+                continue
+            inputs = dynprompt.get_node(current_id)["inputs"]
+            for key in sorted(inputs.keys(), reverse=True):
+                if is_link(inputs[key]):
+                    stack.append((inputs[key][0], False))
+        return order
+
+def _shared_weights(obj):
+    # Clones of a model patcher (and the CLIP/VAE objects wrapping one) share the same weights.
+    while getattr(obj, "patcher", None) is not None:
+        obj = obj.patcher
+    for attr in ("model", "first_stage_model"):
+        inner = getattr(obj, attr, None)
+        if isinstance(inner, torch.nn.Module):
+            return inner
+    return obj
+
+def _collect_storages(obj, storages, visited):
+    if isinstance(obj, torch.Tensor):
+        try:
+            storage = obj.untyped_storage()
+            if storage.data_ptr() != 0:
+                storages[("TENSOR", str(obj.device), storage.data_ptr())] = storage.nbytes()
+        except (RuntimeError, NotImplementedError):
+            storages[("OBJECT", id(obj))] = obj.numel() * obj.element_size()
+        return
+    if isinstance(obj, (str, bytes)):
+        storages[("OBJECT", id(obj))] = len(obj)
+        return
+    if obj is None or isinstance(obj, (bool, int, float)) or id(obj) in visited:
+        return
+    visited.add(id(obj))
+    if isinstance(obj, dict):
+        for value in obj.values():
+            _collect_storages(value, storages, visited)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _collect_storages(value, storages, visited)
+    elif hasattr(obj, "get_ram_usage"):
+        try:
+            storages[("OBJECT", id(_shared_weights(obj)))] = obj.get_ram_usage()
+        except Exception as e:
+            logging.debug("Failed to get the size of {}: {}".format(type(obj).__name__, e))
+    elif getattr(obj, "is_nested", False) and isinstance(getattr(obj, "tensors", None), list):
+        _collect_storages(obj.tensors, storages, visited)
+
+def get_value_storages(value) -> dict:
+    """
+    Memory referenced by a cached value, as a dict of storage identity to bytes. Covers tensors
+    (by their underlying storage, so views aren't counted twice), strings, nested lists, tuples
+    and dicts, and objects like model patchers, CLIP and VAE that report their size through
+    get_ram_usage(). Anything else is not counted.
+    """
+    storages = {}
+    _collect_storages(value, storages, set())
+    return storages
+
+class CacheUsage:
+    """
+    Bytes held by the entries of a cache and its subcaches, and its hit/miss/eviction counters.
+    Storage referenced by several entries, like the weights of model patcher clones or a tensor
+    passed through unchanged, is counted once and released with the last entry using it.
+    """
+    def __init__(self):
+        self.total_bytes = 0
+        self.entries = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refs = {}
+
+    def add(self, value) -> dict:
+        storages = get_value_storages(value)
+        for storage, size in storages.items():
+            ref = self.refs.get(storage)
+            if ref is None:
+                self.refs[storage] = [size, 1]
+                self.total_bytes += size
+            else:
+                ref[1] += 1
+        self.entries += 1
+        return storages
+
+    def remove(self, storages: dict):
+        for storage in storages:
+            ref = self.refs[storage]
+            ref[1] -= 1
+            if ref[1] == 0:
+                del self.refs[storage]
+                self.total_bytes -= ref[0]
+        self.entries -= 1
+
+    def get_stats(self) -> dict:
+        return {
+            "entries": self.entries,
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
 
 class BasicCache:
-    def __init__(self, key_class):
+    def __init__(self, key_class, usage=None):
         self.key_class = key_class
         self.initialized = False
         self.dynprompt: DynamicPrompt
         self.cache_key_set: CacheKeySet
         self.cache = {}
         self.subcaches = {}
+        self.usage = usage if usage is not None else CacheUsage()
+        self.storages = {}
+        self.execution_times = {}
 
     async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
         self.dynprompt = dynprompt
@@ -169,6 +394,29 @@ class BasicCache:
             node_ids = node_ids.union(subcache.all_node_ids())
         return node_ids
 
+    def _store(self, cache_key, value, execution_time=None):
+        if self.cache.get(cache_key) is not value:
+            if cache_key in self.cache:
+                self.usage.remove(self.storages[cache_key])
+            self.cache[cache_key] = value
+            self.storages[cache_key] = self.usage.add(value)
+        if execution_time is not None:
+            self.execution_times[cache_key] = execution_time
+
+    def _remove(self, cache_key):
+        value = self.cache.pop(cache_key)
+        self.usage.remove(self.storages.pop(cache_key))
+        self.execution_times.pop(cache_key, None)
+        self.usage.evictions += 1
+        return value
+
+    def _release(self):
+        for key in list(self.cache):
+            self._remove(key)
+        for subcache in self.subcaches.values():
+            subcache._release()
+        self.subcaches = {}
+
     def _clean_cache(self):
         preserve_keys = set(self.cache_key_set.get_used_keys())
         to_remove = []
@@ -176,7 +424,7 @@ class BasicCache:
             if key not in preserve_keys:
                 to_remove.append(key)
         for key in to_remove:
-            del self.cache[key]
+            self._remove(key)
 
     def _clean_subcaches(self):
         preserve_subcaches = set(self.cache_key_set.get_used_subcache_keys())
@@ -186,7 +434,7 @@ class BasicCache:
             if key not in preserve_subcaches:
                 to_remove.append(key)
         for key in to_remove:
-            del self.subcaches[key]
+            self.subcaches.pop(key)._release()
 
     def clean_unused(self):
         assert self.initialized
@@ -196,10 +444,13 @@ class BasicCache:
     def poll(self, **kwargs):
         pass
 
-    def _set_immediate(self, node_id, value):
+    def get_entry_size(self, cache_key) -> int:
+        return sum(self.storages[cache_key].values())
+
+    def _set_immediate(self, node_id, value, execution_time=None):
         assert self.initialized
         cache_key = self.cache_key_set.get_data_key(node_id)
-        self.cache[cache_key] = value
+        self._store(cache_key, value, execution_time)
 
     def _get_immediate(self, node_id):
         if not self.initialized:
@@ -214,7 +465,7 @@ class BasicCache:
         subcache_key = self.cache_key_set.get_subcache_key(node_id)
         subcache = self.subcaches.get(subcache_key, None)
         if subcache is None:
-            subcache = BasicCache(self.key_class)
+            subcache = BasicCache(self.key_class, usage=self.usage)
             self.subcaches[subcache_key] = subcache
         await subcache.set_prompt(self.dynprompt, children_ids, self.is_changed_cache)
         return subcache
@@ -263,10 +514,10 @@ class HierarchicalCache(BasicCache):
             return None
         return cache._get_immediate(node_id)
 
-    def set(self, node_id, value):
+    def set(self, node_id, value, execution_time=None):
         cache = self._get_cache_for(node_id)
         assert cache is not None
-        cache._set_immediate(node_id, value)
+        cache._set_immediate(node_id, value, execution_time)
 
     async def ensure_subcache_for(self, node_id, children_ids):
         cache = self._get_cache_for(node_id)
@@ -274,6 +525,8 @@ class HierarchicalCache(BasicCache):
         return await cache._ensure_subcache(node_id, children_ids)
 
 class NullCache:
+    def __init__(self):
+        self.usage = CacheUsage()
 
     async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
         pass
@@ -290,16 +543,222 @@ class NullCache:
     def get(self, node_id):
         return None
 
-    def set(self, node_id, value):
+    def set(self, node_id, value, execution_time=None):
         pass
 
     async def ensure_subcache_for(self, node_id, children_ids):
         return self
 
+class NotPersistable(Exception):
+    pass
+
+# Bump this when the on-disk layout changes so stale files are never read back.
+DISK_CACHE_FORMAT_VERSION = 1
+
+DISK_CACHE_MAX_MEMOIZED_DIGESTS = 100000
+
+def _canonical_key(obj):
+    # Cache keys are built from frozensets whose iteration order depends on the per-process
+    # hash seed, so sort everything into a deterministic structure before digesting.
+    if isinstance(obj, (int, float, str, bool, bytes, type(None))):
+        if obj != obj:
+            # NaN never compares equal, so it marks a value that can't be cached.
+            raise NotPersistable()
+        return (type(obj).__name__, obj)
+    if isinstance(obj, frozenset):
+        # Canonical keys always start with their type name, so they are totally ordered.
+        return ("frozenset", tuple(sorted(_canonical_key(i) for i in obj)))
+    if isinstance(obj, (tuple, list)):
+        return ("tuple", tuple(_canonical_key(i) for i in obj))
+    # Unhashable and anything else that didn't go through to_hashable
+    raise NotPersistable()
+
+def key_digest(cache_key):
+    """Returns a process independent digest for a cache key or None if the key can't be persisted."""
+    try:
+        canonical = _canonical_key(cache_key)
+    except NotPersistable:
+        return None
+    return hashlib.sha256(repr((DISK_CACHE_FORMAT_VERSION, canonical)).encode("utf-8")).hexdigest()
+
+def _encode_value(obj, tensors, tensor_names):
+    if isinstance(obj, torch.Tensor):
+        name = tensor_names.get(id(obj))
+        if name is None:
+            name = str(len(tensors))
+            tensor_names[id(obj)] = name
+            tensors[name] = obj
+        return {"t": name}
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, dict):
+        if not all(isinstance(k, str) for k in obj):
+            raise NotPersistable()
+        return {"d": {k: _encode_value(v, tensors, tensor_names) for k, v in obj.items()}}
+    if isinstance(obj, tuple):
+        return {"u": [_encode_value(v, tensors, tensor_names) for v in obj]}
+    if isinstance(obj, list):
+        return {"l": [_encode_value(v, tensors, tensor_names) for v in obj]}
+    raise NotPersistable()
+
+def _decode_value(obj, f):
+    if not isinstance(obj, dict):
+        return obj
+    if "t" in obj:
+        return f.get_tensor(obj["t"])
+    if "d" in obj:
+        return {k: _decode_value(v, f) for k, v in obj["d"].items()}
+    if "u" in obj:
+        return tuple(_decode_value(v, f) for v in obj["u"])
+    return [_decode_value(v, f) for v in obj["l"]]
+
+class DiskCache:
+    """
+    Second cache tier that stores node outputs as safetensors files keyed by a digest of the
+    cache key. Only outputs made of tensors, primitives, lists and string keyed dicts can be
+    persisted, everything else silently stays RAM only. Tensors are read back through mmap so
+    a hit only pages in the data that actually gets used. One DiskCache is shared by the output
+    caches of all the prompt workers, the index is guarded by a lock.
+    """
+    def __init__(self, directory, max_bytes, entry_type):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entry_type = entry_type
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        self.digests = {}
+        self.total_bytes = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            if not name.endswith(".safetensors"):
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_mtime, name[:-len(".safetensors")], stat.st_size))
+        for _, digest, size in sorted(found):
+            self.entries[digest] = size
+            self.total_bytes += size
+        self._evict()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, "{}.safetensors".format(digest))
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 0:
+            digest, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
+    def _touch(self, digest):
+        self.entries.move_to_end(digest)
+        try:
+            os.utime(self._path(digest))
+        except OSError:
+            pass
+
+    def _digest(self, cache_key):
+        # Entries get written back on every touch, so avoid re-canonicalizing large keys.
+        with self.lock:
+            if cache_key in self.digests:
+                return self.digests[cache_key]
+        digest = key_digest(cache_key)
+        with self.lock:
+            if len(self.digests) > DISK_CACHE_MAX_MEMOIZED_DIGESTS:
+                self.digests.clear()
+            self.digests[cache_key] = digest
+        return digest
+
+    def put(self, cache_key, value):
+        digest = self._digest(cache_key)
+        if digest is None:
+            return False
+        with self.lock:
+            if digest in self.entries:
+                self._touch(digest)
+                return True
+        tensors = {}
+        try:
+            structure = _encode_value(list(value.outputs), tensors, {})
+            metadata = {"outputs": json.dumps(structure), "ui": json.dumps(value.ui)}
+        except (NotPersistable, TypeError, ValueError):
+            return False
+
+        # Check the size before copying anything
+        size = sum(t.numel() * t.element_size() for t in tensors.values())
+        if size > self.max_bytes:
+            return False
+        # clone so tensors that are views of a shared storage can be saved individually
+        tensors = {k: t.detach().to("cpu").clone().contiguous() for k, t in tensors.items()}
+
+        # Every write gets its own temporary file, other workers can store the same entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=digest, suffix=".tmp")
+        os.close(fd)
+        try:
+            safetensors.torch.save_file(tensors, tmp_path, metadata=metadata)
+            size = os.path.getsize(tmp_path)
+        except Exception as e:
+            logging.warning("Failed to write disk cache entry {}: {}".format(digest, e))
+            os.remove(tmp_path)
+            return False
+
+        with self.lock:
+            if digest in self.entries:
+                os.remove(tmp_path)
+                self._touch(digest)
+                return True
+            os.replace(tmp_path, self._path(digest))
+            self.entries[digest] = size
+            self.total_bytes += size
+            self._evict()
+        return True
+
+    def get(self, cache_key):
+        digest = self._digest(cache_key)
+        if digest is None:
+            return None
+        with self.lock:
+            if digest not in self.entries:
+                return None
+            try:
+                with safetensors.safe_open(self._path(digest), framework="pt", device="cpu") as f:
+                    metadata = f.metadata()
+                    outputs = _decode_value(json.loads(metadata["outputs"]), f)
+                    ui = json.loads(metadata["ui"])
+            except Exception as e:
+                logging.warning("Dropping unreadable disk cache entry {}: {}".format(digest, e))
+                self.remove(cache_key)
+                return None
+            self._touch(digest)
+        return self.entry_type(ui=ui, outputs=outputs)
+
+    def remove(self, cache_key):
+        digest = self._digest(cache_key)
+        if digest is None:
+            return
+        with self.lock:
+            if digest not in self.entries:
+                return
+            self.total_bytes -= self.entries.pop(digest)
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
 class LRUCache(BasicCache):
-    def __init__(self, key_class, max_size=100):
+    def __init__(self, key_class, max_size=100, disk_cache=None):
         super().__init__(key_class)
         self.max_size = max_size
+        self.disk_cache = disk_cache
         self.min_generation = 0
         self.generation = 0
         self.used_generation = {}
@@ -316,7 +775,7 @@ class LRUCache(BasicCache):
             self.min_generation += 1
             to_remove = [key for key in self.cache if self.used_generation[key] < self.min_generation]
             for key in to_remove:
-                del self.cache[key]
+                self._evict_to_disk(key)
                 del self.used_generation[key]
                 if key in self.children:
                     del self.children[key]
@@ -324,16 +783,28 @@ class LRUCache(BasicCache):
 
     def get(self, node_id):
         self._mark_used(node_id)
-        return self._get_immediate(node_id)
+        value = self._get_immediate(node_id)
+        if value is None and self.disk_cache is not None and self.initialized:
+            cache_key = self.cache_key_set.get_data_key(node_id)
+            if cache_key is not None:
+                value = self.disk_cache.get(cache_key)
+                if value is not None:
+                    self._store(cache_key, value)
+        return value
 
     def _mark_used(self, node_id):
         cache_key = self.cache_key_set.get_data_key(node_id)
         if cache_key is not None:
             self.used_generation[cache_key] = self.generation
 
-    def set(self, node_id, value):
+    def _evict_to_disk(self, cache_key):
+        value = self._remove(cache_key)
+        if self.disk_cache is not None:
+            self.disk_cache.put(cache_key, value)
+
+    def set(self, node_id, value, execution_time=None):
         self._mark_used(node_id)
-        return self._set_immediate(node_id, value)
+        self._set_immediate(node_id, value, execution_time)
 
     async def ensure_subcache_for(self, node_id, children_ids):
         # Just uses subcaches for tracking 'live' nodes
@@ -366,16 +837,16 @@ RAM_CACHE_OLD_WORKFLOW_OOM_MULTIPLIER = 1.3
 
 class RAMPressureCache(LRUCache):
 
-    def __init__(self, key_class):
-        super().__init__(key_class, 0)
+    def __init__(self, key_class, disk_cache=None):
+        super().__init__(key_class, 0, disk_cache=disk_cache)
         self.timestamps = {}
 
     def clean_unused(self):
         self._clean_subcaches()
 
-    def set(self, node_id, value):
+    def set(self, node_id, value, execution_time=None):
         self.timestamps[self.cache_key_set.get_data_key(node_id)] = time.time()
-        super().set(node_id, value)
+        super().set(node_id, value, execution_time)
 
     def get(self, node_id):
         self.timestamps[self.cache_key_set.get_data_key(node_id)] = time.time()
@@ -393,24 +864,17 @@ class RAMPressureCache(LRUCache):
 
         clean_list = []
 
-        for key, (outputs, _), in self.cache.items():
+        for key in self.cache:
             oom_score =  RAM_CACHE_OLD_WORKFLOW_OOM_MULTIPLIER ** (self.generation - self.used_generation[key])
 
             ram_usage = RAM_CACHE_DEFAULT_RAM_USAGE
-            def scan_list_for_ram_usage(outputs):
-                nonlocal ram_usage
-                if outputs is None:
-                    return
-                for output in outputs:
-                    if isinstance(output, list):
-                        scan_list_for_ram_usage(output)
-                    elif isinstance(output, torch.Tensor) and output.device.type == 'cpu':
-                        #score Tensors at a 50% discount for RAM usage as they are likely to
-                        #be high value intermediates
-                        ram_usage += (output.numel() * output.element_size()) * 0.5
-                    elif hasattr(output, "get_ram_usage"):
-                        ram_usage += output.get_ram_usage()
-            scan_list_for_ram_usage(outputs)
+            for storage, size in self.storages[key].items():
+                if storage[0] != "TENSOR":
+                    ram_usage += size
+                elif storage[1] == "cpu":
+                    #score Tensors at a 50% discount for RAM usage as they are likely to
+                    #be high value intermediates
+                    ram_usage += size * 0.5
 
             oom_score *= ram_usage
             #In the case where we have no information on the node ram usage at all,
@@ -419,5 +883,57 @@ class RAMPressureCache(LRUCache):
 
         while _ram_gb() < ram_headroom * RAM_CACHE_HYSTERESIS and clean_list:
             _, _, key = clean_list.pop()
-            del self.cache[key]
+            self._evict_to_disk(key)
             gc.collect()
+
+#Assumed bookkeeping cost of an entry on top of the memory it references, so outputs without
+#any (strings, numbers) still pay something to stay cached.
+CACHE_ENTRY_OVERHEAD_BYTES = 1024
+
+class ByteBudgetCache(LRUCache):
+    """
+    Cache bounded by the bytes its outputs reference instead of by the number of entries.
+
+    Over budget, entries are evicted GreedyDual-Size style: an entry's priority is the time its
+    node took to execute divided by its size, plus an inflation value that rises to the priority
+    of every evicted entry. Big outputs that are quick to recompute go first and entries that
+    aren't used again age out. Entries of the prompt that is running are never evicted, so the
+    budget can be exceeded while a prompt needs more than that.
+    """
+    def __init__(self, key_class, max_bytes, disk_cache=None):
+        super().__init__(key_class, 0, disk_cache=disk_cache)
+        self.max_bytes = max_bytes
+        self.inflation = 0.0
+        self.priorities = {}
+
+    def _prioritize(self, cache_key):
+        if cache_key in self.cache:
+            size = self.get_entry_size(cache_key) + CACHE_ENTRY_OVERHEAD_BYTES
+            self.priorities[cache_key] = self.inflation + self.execution_times.get(cache_key, 0.0) / size
+
+    def _evict_over_budget(self):
+        if self.usage.total_bytes <= self.max_bytes:
+            return
+        candidates = [key for key in self.cache if self.used_generation[key] < self.generation]
+        candidates.sort(key=lambda key: self.priorities[key], reverse=True)
+        while self.usage.total_bytes > self.max_bytes and len(candidates) > 0:
+            key = candidates.pop()
+            self.inflation = self.priorities.pop(key)
+            self._evict_to_disk(key)
+            del self.used_generation[key]
+            self.children.pop(key, None)
+
+    def clean_unused(self):
+        self._evict_over_budget()
+        self._clean_subcaches()
+
+    def get(self, node_id):
+        value = super().get(node_id)
+        if value is not None:
+            self._prioritize(self.cache_key_set.get_data_key(node_id))
+        return value
+
+    def set(self, node_id, value, execution_time=None):
+        super().set(node_id, value, execution_time)
+        self._prioritize(self.cache_key_set.get_data_key(node_id))
+        self._evict_over_budget()
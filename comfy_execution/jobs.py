@@ -65,7 +65,7 @@ def is_previewable(media_type: str, item: dict) -> bool:
     return False
 
 
-def normalize_queue_item(item: tuple, status: str) -> dict:
+def normalize_queue_item(item: tuple, status: str, worker_id: Optional[int] = None) -> dict:
     """Convert queue item tuple to unified job dict.
 
     Expects item with sensitive data already removed (5 elements).
@@ -80,6 +80,7 @@ def normalize_queue_item(item: tuple, status: str) -> dict:
         'create_time': create_time,
         'outputs_count': 0,
         'workflow_id': workflow_id,
+        'worker_id': worker_id,
     })
 
 
@@ -200,7 +201,31 @@ def apply_sorting(jobs: list[dict], sort_by: str, sort_order: str) -> list[dict]
     return sorted(jobs, key=get_sort_key, reverse=reverse)
 
 
-def get_job(prompt_id: str, running: list, queued: list, history: dict) -> Optional[dict]:
+def get_cursor_key(job: dict) -> tuple[int, str]:
+    """Position of a job in created_at order, with the id breaking ties."""
+    return (job.get('create_time') or 0, job['id'])
+
+
+def encode_cursor(job: dict) -> str:
+    create_time, prompt_id = get_cursor_key(job)
+    return f"{create_time}:{prompt_id}"
+
+
+def decode_cursor(cursor: str) -> tuple[int, str]:
+    """Parse a cursor returned by encode_cursor. Raises ValueError if it is malformed."""
+    create_time, sep, prompt_id = cursor.partition(':')
+    if not sep:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return (int(create_time), prompt_id)
+
+
+def is_after_cursor(job: dict, cursor: tuple[int, str], sort_order: str) -> bool:
+    if sort_order == 'desc':
+        return get_cursor_key(job) < cursor
+    return get_cursor_key(job) > cursor
+
+
+def get_job(prompt_id: str, running: list, queued: list, history: dict, worker_ids: Optional[dict] = None) -> Optional[dict]:
     """
     Get a single job by prompt_id from history or queue.
 
@@ -209,6 +234,7 @@ def get_job(prompt_id: str, running: list, queued: list, history: dict) -> Optio
         running: List of currently running queue items
         queued: List of pending queue items
         history: Dict of history items keyed by prompt_id
+        worker_ids: Dict of prompt_id to the id of the worker running it
 
     Returns:
         Job dict with full details, or None if not found
@@ -216,9 +242,12 @@ def get_job(prompt_id: str, running: list, queued: list, history: dict) -> Optio
     if prompt_id in history:
         return normalize_history_item(prompt_id, history[prompt_id], include_outputs=True)
 
+    if worker_ids is None:
+        worker_ids = {}
+
     for item in running:
         if item[1] == prompt_id:
-            return normalize_queue_item(item, JobStatus.IN_PROGRESS)
+            return normalize_queue_item(item, JobStatus.IN_PROGRESS, worker_ids.get(prompt_id))
 
     for item in queued:
         if item[1] == prompt_id:
@@ -236,7 +265,9 @@ def get_all_jobs(
     sort_by: str = "created_at",
     sort_order: str = "desc",
     limit: Optional[int] = None,
-    offset: int = 0
+    offset: int = 0,
+    worker_ids: Optional[dict] = None,
+    cursor: Optional[tuple[int, str]] = None
 ) -> tuple[list[dict], int]:
     """
     Get all jobs (running, pending, completed) with filtering and sorting.
@@ -244,25 +275,32 @@ def get_all_jobs(
     Args:
         running: List of currently running queue items
         queued: List of pending queue items
-        history: Dict of history items keyed by prompt_id
+        history: Dict of history items keyed by prompt_id, or a history store that filters,
+            sorts and pages the finished jobs itself (see app.database.history)
         status_filter: List of statuses to include (from JobStatus.ALL)
         workflow_id: Filter by workflow ID
         sort_by: Field to sort by ('created_at', 'execution_duration')
         sort_order: 'asc' or 'desc'
         limit: Maximum number of items to return
         offset: Number of items to skip
+        worker_ids: Dict of prompt_id to the id of the worker running it
+        cursor: Only return jobs after this decoded cursor, in created_at order
 
     Returns:
         tuple: (jobs_list, total_count)
     """
     jobs = []
+    # Jobs a history store counted but did not return because they can't be on this page
+    skipped_history = 0
 
     if status_filter is None:
         status_filter = JobStatus.ALL
+    if worker_ids is None:
+        worker_ids = {}
 
     if JobStatus.IN_PROGRESS in status_filter:
         for item in running:
-            jobs.append(normalize_queue_item(item, JobStatus.IN_PROGRESS))
+            jobs.append(normalize_queue_item(item, JobStatus.IN_PROGRESS, worker_ids.get(item[1])))
 
     if JobStatus.PENDING in status_filter:
         for item in queued:
@@ -271,17 +309,37 @@ def get_all_jobs(
     include_completed = JobStatus.COMPLETED in status_filter
     include_failed = JobStatus.FAILED in status_filter
     if include_completed or include_failed:
-        for prompt_id, history_item in history.items():
-            is_failed = history_item.get('status', {}).get('status_str') == 'error'
-            if (is_failed and include_failed) or (not is_failed and include_completed):
-                jobs.append(normalize_history_item(prompt_id, history_item))
+        if isinstance(history, dict):
+            for prompt_id, history_item in history.items():
+                is_failed = history_item.get('status', {}).get('status_str') == 'error'
+                if (is_failed and include_failed) or (not is_failed and include_completed):
+                    jobs.append(normalize_history_item(prompt_id, history_item))
+        else:
+            statuses = [s for s in (JobStatus.COMPLETED, JobStatus.FAILED) if s in status_filter]
+            history_jobs, history_total = history.query_jobs(
+                statuses,
+                workflow_id=workflow_id,
+                sort_by=sort_by,
+                sort_order=sort_order,
+                limit=None if limit is None else offset + limit,
+                cursor=cursor
+            )
+            jobs.extend(history_jobs)
+            skipped_history = history_total - len(history_jobs)
 
     if workflow_id:
         jobs = [j for j in jobs if j.get('workflow_id') == workflow_id]
 
-    jobs = apply_sorting(jobs, sort_by, sort_order)
+    if cursor is not None:
+        jobs = [j for j in jobs if is_after_cursor(j, cursor, sort_order)]
+
+    if sort_by == 'created_at':
+        # Break ties by id so pages line up with the cursor
+        jobs = sorted(jobs, key=get_cursor_key, reverse=(sort_order == 'desc'))
+    else:
+        jobs = apply_sorting(jobs, sort_by, sort_order)
 
-    total_count = len(jobs)
+    total_count = len(jobs) + skipped_history
 
     if offset > 0:
         jobs = jobs[offset:]
@@ -0,0 +1,129 @@
+"""
+Prefetching of the model files of queued prompts.
+
+While a prompt runs, the model files of the prompts queued after it are read in the background so
+they are in the OS page cache by the time their loader nodes run and loading them doesn't wait on
+the disk. Loader nodes opt in by declaring the inputs that name model files and the models folder
+they are in:
+
+    PREFETCH_INPUTS = {"ckpt_name": "checkpoints"}
+"""
+
+import collections
+import logging
+import os
+import threading
+from typing import Optional
+
+import psutil
+
+import folder_paths
+import nodes
+
+READ_CHUNK_BYTES = 16 * 1024 * 1024
+# RAM left alone for everything else when deciding if a file fits in the page cache
+RAM_HEADROOM_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def get_model_files(prompt: dict) -> list[str]:
+    """Paths of the model files the loader nodes of prompt are going to load, in node order."""
+    paths = []
+    for node in prompt.values():
+        class_def = nodes.NODE_CLASS_MAPPINGS.get(node.get("class_type"))
+        prefetch_inputs = getattr(class_def, "PREFETCH_INPUTS", None)
+        if not prefetch_inputs:
+            continue
+        inputs = node.get("inputs", {})
+        for input_name, folder_name in prefetch_inputs.items():
+            name = inputs.get(input_name)
+            if not isinstance(name, str):
+                continue
+            path = folder_paths.get_full_path(folder_name, name)
+            if path is not None and path not in paths:
+                paths.append(path)
+    return paths
+
+
+class ModelPrefetcher:
+    """
+    Reads the model files of the next prompts into the page cache on a background thread. Up to
+    max_bytes of files are remembered as read and not read again, a file only gets read while the
+    available RAM has room for it.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.condition = threading.Condition()
+        self.prompts = []
+        self.prompt_ids = ()
+        # path -> (mtime, size) of files read recently, oldest first
+        self.warmed = collections.OrderedDict()
+        self.warmed_bytes = 0
+        self.thread = None
+
+    def prefetch(self, prompts: list[tuple[str, dict]]):
+        """Replaces the prompts to prefetch by prompts, a list of (prompt id, prompt) in queue order."""
+        prompt_ids = tuple(x[0] for x in prompts)
+        with self.condition:
+            if prompt_ids == self.prompt_ids:
+                return
+            self.prompt_ids = prompt_ids
+            self.prompts = list(prompts)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True, name="ModelPrefetcher")
+                self.thread.start()
+            self.condition.notify()
+
+    def _next_prompt(self) -> Optional[dict]:
+        with self.condition:
+            while len(self.prompts) == 0:
+                self.condition.wait()
+            return self.prompts.pop(0)[1]
+
+    def _is_warm(self, path, stat):
+        warm = self.warmed.get(path)
+        if warm is not None and warm == (stat.st_mtime, stat.st_size):
+            self.warmed.move_to_end(path)
+            return True
+        return False
+
+    def _remember(self, path, stat):
+        old = self.warmed.pop(path, None)
+        if old is not None:
+            self.warmed_bytes -= old[1]
+        self.warmed[path] = (stat.st_mtime, stat.st_size)
+        self.warmed_bytes += stat.st_size
+        while self.warmed_bytes > self.max_bytes:
+            _, (_, size) = self.warmed.popitem(last=False)
+            self.warmed_bytes -= size
+
+    def _warm(self, path: str, prompt_ids) -> bool:
+        buffer = bytearray(READ_CHUNK_BYTES)
+        with open(path, "rb", buffering=0) as f:
+            while f.readinto(buffer):
+                if self.prompt_ids != prompt_ids:
+                    # The queue changed, start over with the new next prompts
+                    return False
+        return True
+
+    def _run(self):
+        while True:
+            prompt = self._next_prompt()
+            prompt_ids = self.prompt_ids
+            try:
+                paths = get_model_files(prompt)
+            except Exception as e:
+                logging.debug("Model prefetch failed to get the model files of a prompt: {}".format(e))
+                continue
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                    if self._is_warm(path, stat):
+                        continue
+                    if stat.st_size > self.max_bytes or stat.st_size + RAM_HEADROOM_BYTES > psutil.virtual_memory().available:
+                        continue
+                    logging.debug("Prefetching model file {}".format(path))
+                    if not self._warm(path, prompt_ids):
+                        break
+                    self._remember(path, stat)
+                except OSError as e:
+                    logging.debug("Model prefetch failed to read {}: {}".format(path, e))
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import contextvars
 from typing import TypedDict, Dict, Optional, Tuple
 from typing_extensions import override
 from PIL import Image
@@ -321,16 +322,21 @@ class ProgressRegistry:
 
 # Global registry instance
 global_progress_registry: ProgressRegistry | None = None
+# Registry of the prompt running in the current context, set when several prompt workers
+# execute prompts at the same time. Falls back to the global registry.
+current_progress_registry: contextvars.ContextVar[ProgressRegistry | None] = contextvars.ContextVar("current_progress_registry", default=None)
 
 def reset_progress_state(prompt_id: str, dynprompt: "DynamicPrompt") -> None:
     global global_progress_registry
 
     # Reset existing handlers if registry exists
-    if global_progress_registry is not None:
-        global_progress_registry.reset_handlers()
+    registry = current_progress_registry.get(None) or global_progress_registry
+    if registry is not None:
+        registry.reset_handlers()
 
     # Create new registry
     global_progress_registry = ProgressRegistry(prompt_id, dynprompt)
+    current_progress_registry.set(global_progress_registry)
 
 
 def add_progress_handler(handler: ProgressHandler) -> None:
@@ -341,6 +347,9 @@ def add_progress_handler(handler: ProgressHandler) -> None:
 
 def get_progress_state() -> ProgressRegistry:
     global global_progress_registry
+    registry = current_progress_registry.get(None)
+    if registry is not None:
+        return registry
     if global_progress_registry is None:
         from comfy_execution.graph import DynamicPrompt
 
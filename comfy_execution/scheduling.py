@@ -0,0 +1,58 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+from enum import Enum
+from typing import Optional
+
+import torch
+
+
+class ExecutionResource(str, Enum):
+    """
+    Resource a node is bound by, declared with an ``EXECUTION_RESOURCE`` class attribute.
+
+    GPU is the default and keeps the node on the executor thread so accelerator work stays
+    serialized. CPU and IO nodes run on a thread pool concurrently with the rest of the graph
+    when parallel execution is enabled. Async nodes already overlap on the event loop and don't
+    need a hint.
+    """
+    GPU = "gpu"
+    CPU = "cpu"
+    IO = "io"
+
+
+_thread_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def set_parallel_execution(num_threads: int):
+    global _thread_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False)
+        _thread_pool = None
+    if num_threads is not None and num_threads > 0:
+        _thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="comfy_node")
+        logging.info("Running CPU/IO bound nodes on {} worker threads.".format(num_threads))
+
+
+def get_execution_resource(class_def) -> ExecutionResource:
+    try:
+        return ExecutionResource(getattr(class_def, "EXECUTION_RESOURCE", ExecutionResource.GPU))
+    except ValueError:
+        return ExecutionResource.GPU
+
+
+def runs_in_parallel(class_def) -> bool:
+    return _thread_pool is not None and get_execution_resource(class_def) != ExecutionResource.GPU
+
+
+async def run_in_thread_pool(f, **kwargs):
+    # Copy the context so the executing node context is visible to progress hooks in the worker.
+    context = contextvars.copy_context()
+
+    def run():
+        # inference_mode is thread local
+        with torch.inference_mode():
+            return f(**kwargs)
+
+    return await asyncio.get_running_loop().run_in_executor(_thread_pool, context.run, run)
@@ -0,0 +1,103 @@
+"""
+Prompt worker bookkeeping for running several executors against one PromptQueue.
+
+Each worker owns a PromptExecutor (and therefore its own output cache) and is pinned to a
+device. The queue uses the worker's affinity to hand it prompts that reuse the models it
+already has loaded, and reports each worker's status through /queue and /api/jobs.
+"""
+
+import contextvars
+import os
+from typing import Optional
+
+import torch
+
+import folder_paths
+
+
+def prompt_model_names(prompt: dict) -> frozenset:
+    """Model files referenced by the widget values of a prompt, e.g. ckpt_name or lora_name."""
+    names = set()
+    for node in prompt.values():
+        for value in node.get("inputs", {}).values():
+            if isinstance(value, str) and os.path.splitext(value)[1].lower() in folder_paths.supported_pt_extensions:
+                names.add(value)
+    return frozenset(names)
+
+
+def get_worker_devices(num_workers: int) -> list[Optional[torch.device]]:
+    """
+    Spread workers round robin over the visible CUDA devices. Workers get None (the default
+    device) when there is only one device or when running on anything other than CUDA.
+    """
+    import comfy.model_management
+    device = comfy.model_management.get_torch_device()
+    if device.type != "cuda" or torch.cuda.device_count() < 2:
+        return [None] * num_workers
+    return [torch.device("cuda", i % torch.cuda.device_count()) for i in range(num_workers)]
+
+
+class WorkerServer:
+    """
+    Per worker view of the PromptServer. The executor stores the client and node it is
+    currently running on the server object, which would be clobbered by other workers, so
+    those attributes live here and everything else is forwarded to the real server.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+
+    def __getattr__(self, name):
+        return getattr(self.server, name)
+
+
+class PromptWorker:
+    def __init__(self, worker_id: int, device: Optional[torch.device] = None):
+        self.worker_id = worker_id
+        self.device = device
+        self.prompt_id = None
+        self.model_names = frozenset()
+        self.flags = {}
+        self.executor = None
+
+    def pin_device(self):
+        # The current CUDA device is per thread and get_torch_device() follows it, so models
+        # loaded by this worker land on its device.
+        if self.device is not None:
+            torch.cuda.set_device(self.device)
+
+    def affinity(self, item) -> int:
+        """Number of models of a queued prompt that this worker ran with its last prompt."""
+        if len(self.model_names) == 0:
+            return 0
+        return len(prompt_model_names(item[2]) & self.model_names)
+
+    def finish(self, prompt):
+        self.model_names = prompt_model_names(prompt)
+
+    def get_cache_stats(self) -> Optional[dict]:
+        """Size and hit/miss/eviction counters of the output cache of this worker's executor."""
+        if self.executor is None:
+            return None
+        return {"worker_id": self.worker_id, **self.executor.caches.outputs.usage.get_stats()}
+
+    def get_status(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "device": str(self.device) if self.device is not None else "default",
+            "status": "idle" if self.prompt_id is None else "running",
+            "prompt_id": self.prompt_id,
+        }
+
+
+current_worker_server: contextvars.ContextVar[Optional[WorkerServer]] = contextvars.ContextVar("current_worker_server", default=None)
+
+
+def get_current_server(default):
+    """The server view of the worker running on this thread, or default outside of a worker."""
+    server = current_worker_server.get(None)
+    if server is None:
+        return default
+    return server
@@ -4,6 +4,7 @@ import torch
 from typing_extensions import override
 
 from comfy_api.latest import ComfyExtension, io
+import comfy.schedule_cache
 
 
 def loglinear_interp(t_steps, num_steps):
@@ -22,6 +23,8 @@ def loglinear_interp(t_steps, num_steps):
 NOISE_LEVELS = {"SD1": [14.6146412293, 6.4745760956,  3.8636745985,  2.6946151520, 1.8841921177,  1.3943805092,  0.9642583904,  0.6523686016, 0.3977456272,  0.1515232662,  0.0291671582],
                 "SDXL":[14.6146412293, 6.3184485287,  3.7681790315,  2.1811480769, 1.3405244945,  0.8620721141,  0.5550693289,  0.3798540708, 0.2332364134,  0.1114188177,  0.0291671582],
                 "SVD": [700.00, 54.5, 15.886, 7.977, 4.248, 1.789, 0.981, 0.403, 0.173, 0.034, 0.002]}
+for model_type, noise_levels in NOISE_LEVELS.items():
+    comfy.schedule_cache.register_table("AlignYourSteps", model_type, {len(noise_levels) - 1: noise_levels})
 
 class AlignYourStepsScheduler(io.ComfyNode):
     @classmethod
@@ -49,13 +52,11 @@ class AlignYourStepsScheduler(io.ComfyNode):
                 return io.NodeOutput(torch.FloatTensor([]))
             total_steps = round(steps * denoise)
 
-        sigmas = NOISE_LEVELS[model_type][:]
-        if (steps + 1) != len(sigmas):
-            sigmas = loglinear_interp(sigmas, steps + 1)
+        sigmas = comfy.schedule_cache.get("AlignYourSteps", model_type, steps, lambda: torch.FloatTensor(loglinear_interp(NOISE_LEVELS[model_type], steps + 1)))
 
         sigmas = sigmas[-(total_steps + 1):]
         sigmas[-1] = 0
-        return io.NodeOutput(torch.FloatTensor(sigmas))
+        return io.NodeOutput(sigmas)
 
 
 class AlignYourStepsExtension(ComfyExtension):
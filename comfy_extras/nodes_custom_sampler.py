@@ -6,6 +6,7 @@ from comfy.k_diffusion import sa_solver
 import latent_preview
 import torch
 import comfy.utils
+import comfy_execution.batching
 import node_helpers
 from typing_extensions import override
 from comfy_api.latest import ComfyExtension, io
@@ -735,6 +736,8 @@ class SamplerCustom(io.ComfyNode):
             ]
         )
 
+    SAMPLER_BATCHING = True
+
     @classmethod
     def execute(cls, model, add_noise, noise_seed, cfg, positive, negative, sampler, sigmas, latent_image) -> io.NodeOutput:
         latent = latent_image
@@ -756,12 +759,17 @@ class SamplerCustom(io.ComfyNode):
         callback = latent_preview.prepare_callback(model, sigmas.shape[-1] - 1, x0_output)
 
         disable_pbar = not comfy.utils.PROGRESS_BAR_ENABLED
-        samples = comfy.sample.sample_custom(model, noise, cfg, sampler, sigmas, positive, negative, latent_image, noise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=noise_seed)
+        def run(noise, latent_image, positive, negative):
+            samples = comfy.sample.sample_custom(model, noise, cfg, sampler, sigmas, positive, negative, latent_image, noise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=noise_seed, noise_inds=latent.get("batch_index", None))
+            return samples, x0_output.get("x0")
+
+        batch_key = comfy_execution.batching.get_sampler_key(model, sampler, noise_mask, ["model", "sampler", "sigmas"], (cfg,))
+        samples, x0 = comfy_execution.batching.sample(batch_key, run, noise, latent_image, positive, negative)
 
         out = latent.copy()
         out["samples"] = samples
-        if "x0" in x0_output:
-            x0_out = model.model.process_latent_out(x0_output["x0"].cpu())
+        if x0 is not None:
+            x0_out = model.model.process_latent_out(x0.cpu())
             if samples.is_nested:
                 latent_shapes = [x.shape for x in samples.unbind()]
                 x0_out = comfy.nested_tensor.NestedTensor(comfy.utils.unpack_latents(x0_out, latent_shapes))
@@ -947,7 +955,7 @@ class SamplerCustomAdvanced(io.ComfyNode):
         callback = latent_preview.prepare_callback(guider.model_patcher, sigmas.shape[-1] - 1, x0_output)
 
         disable_pbar = not comfy.utils.PROGRESS_BAR_ENABLED
-        samples = guider.sample(noise.generate_noise(latent), latent_image, sampler, sigmas, denoise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=noise.seed)
+        samples = guider.sample(noise.generate_noise(latent), latent_image, sampler, sigmas, denoise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=noise.seed, noise_inds=latent.get("batch_index", None))
         samples = samples.to(comfy.model_management.intermediate_device())
 
         out = latent.copy()
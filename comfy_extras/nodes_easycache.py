@@ -5,6 +5,7 @@ import comfy.patcher_extension
 import logging
 import torch
 import comfy.model_patcher
+import comfy.step_cache
 if TYPE_CHECKING:
     from uuid import UUID
 
@@ -490,11 +491,43 @@ class LazyCacheNode(io.ComfyNode):
         return io.NodeOutput(model)
 
 
+class StepCacheNode(io.ComfyNode):
+    @classmethod
+    def define_schema(cls) -> io.Schema:
+        return io.Schema(
+            node_id="StepCache",
+            display_name="Step Cache",
+            description="Reuses the model outputs of previous steps on the steps the chosen policy judges close enough to the last computed one. Works with every model.",
+            category="advanced/debug/model",
+            is_experimental=True,
+            inputs=[
+                io.Model.Input("model", tooltip="The model to add the step cache to."),
+                io.Combo.Input("policy", options=list(comfy.step_cache.POLICIES), default=comfy.step_cache.RelativeL1Policy.name, tooltip="relative_l1: accumulated change of the model input. first_block: change of the output of the first block of the model. teacache: accumulated change of the model input rescaled by a fitted polynomial."),
+                io.Float.Input("threshold", min=0.0, default=0.15, max=3.0, step=0.01, tooltip="Steps get skipped while the change measured by the policy stays below this."),
+                io.Float.Input("start_percent", min=0.0, default=0.15, max=1.0, step=0.01, tooltip="The relative sampling step to begin skipping steps."),
+                io.Float.Input("end_percent", min=0.0, default=0.95, max=1.0, step=0.01, tooltip="The relative sampling step to end skipping steps."),
+                io.String.Input("coefficients", default="", optional=True, tooltip="teacache only: the comma separated polynomial coefficients, highest degree first, that turn a change of the input into a change of the output."),
+            ],
+            outputs=[
+                io.Model.Output(tooltip="The model with the step cache."),
+            ],
+        )
+
+    @classmethod
+    def execute(cls, model: io.Model.Type, policy: str, threshold: float, start_percent: float, end_percent: float, coefficients: str = "") -> io.NodeOutput:
+        if policy == comfy.step_cache.TeaCachePolicy.name and len(coefficients.strip()) > 0:
+            step_policy = comfy.step_cache.TeaCachePolicy(threshold, [float(c) for c in coefficients.split(",")])
+        else:
+            step_policy = comfy.step_cache.POLICIES[policy](threshold)
+        return io.NodeOutput(comfy.step_cache.apply(model, comfy.step_cache.StepCache(step_policy, start_percent, end_percent)))
+
+
 class EasyCacheExtension(ComfyExtension):
     async def get_node_list(self) -> list[type[io.ComfyNode]]:
         return [
             EasyCacheNode,
             LazyCacheNode,
+            StepCacheNode,
         ]
 
 def comfy_entrypoint():
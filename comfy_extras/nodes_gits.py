@@ -3,6 +3,7 @@ import numpy as np
 import torch
 from typing_extensions import override
 from comfy_api.latest import ComfyExtension, io
+import comfy.schedule_cache
 
 def loglinear_interp(t_steps, num_steps):
     """
@@ -334,6 +335,8 @@ NOISE_LEVELS = {
         [14.61464119, 2.45070267, 1.41535246, 0.95350921, 0.72133851, 0.57119018, 0.4783645, 0.43325692, 0.38853383, 0.36617002, 0.34370604, 0.32104823, 0.29807833, 0.27464288, 0.25053367, 0.22545385, 0.19894916, 0.17026083, 0.13792117, 0.09824532, 0.02916753],
     ],
 }
+for coeff, noise_levels in NOISE_LEVELS.items():
+    comfy.schedule_cache.register_table("GITS", coeff, {len(sigmas) - 1: sigmas for sigmas in noise_levels})
 
 class GITSScheduler(io.ComfyNode):
     @classmethod
@@ -359,15 +362,13 @@ class GITSScheduler(io.ComfyNode):
                 return io.NodeOutput(torch.FloatTensor([]))
             total_steps = round(steps * denoise)
 
-        if steps <= 20:
-            sigmas = NOISE_LEVELS[round(coeff, 2)][steps-2][:]
-        else:
-            sigmas = NOISE_LEVELS[round(coeff, 2)][-1][:]
-            sigmas = loglinear_interp(sigmas, steps + 1)
+        # The schedules up to 20 steps are in the registered tables
+        coeff = round(coeff, 2)
+        sigmas = comfy.schedule_cache.get("GITS", coeff, steps, lambda: torch.FloatTensor(loglinear_interp(NOISE_LEVELS[coeff][-1], steps + 1)))
 
         sigmas = sigmas[-(total_steps + 1):]
         sigmas[-1] = 0
-        return io.NodeOutput(torch.FloatTensor(sigmas))
+        return io.NodeOutput(sigmas)
 
 
 class GITSSchedulerExtension(ComfyExtension):
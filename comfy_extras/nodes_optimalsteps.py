@@ -5,6 +5,7 @@ import torch
 
 from typing_extensions import override
 from comfy_api.latest import ComfyExtension, io
+import comfy.schedule_cache
 
 
 def loglinear_interp(t_steps, num_steps):
@@ -25,6 +26,8 @@ NOISE_LEVELS = {"FLUX": [0.9968, 0.9886, 0.9819, 0.975, 0.966, 0.9471, 0.9158, 0
 "Wan":[1.0, 0.997, 0.995, 0.993, 0.991, 0.989, 0.987, 0.985, 0.98, 0.975, 0.973, 0.968, 0.96, 0.946, 0.927, 0.902, 0.864, 0.776, 0.539, 0.208, 0.001],
 "Chroma": [0.992, 0.99, 0.988, 0.985, 0.982, 0.978, 0.973, 0.968, 0.961, 0.953, 0.943, 0.931, 0.917, 0.9, 0.881, 0.858, 0.832, 0.802, 0.769, 0.731, 0.69, 0.646, 0.599, 0.55, 0.501, 0.451, 0.402, 0.355, 0.311, 0.27, 0.232, 0.199, 0.169, 0.143, 0.12, 0.101, 0.084, 0.07, 0.058, 0.048, 0.001],
 }
+for model_type, noise_levels in NOISE_LEVELS.items():
+    comfy.schedule_cache.register_table("OptimalSteps", model_type, {len(noise_levels) - 1: noise_levels})
 
 class OptimalStepsScheduler(io.ComfyNode):
     @classmethod
@@ -50,13 +53,11 @@ class OptimalStepsScheduler(io.ComfyNode):
                 return io.NodeOutput(torch.FloatTensor([]))
             total_steps = round(steps * denoise)
 
-        sigmas = NOISE_LEVELS[model_type][:]
-        if (steps + 1) != len(sigmas):
-            sigmas = loglinear_interp(sigmas, steps + 1)
+        sigmas = comfy.schedule_cache.get("OptimalSteps", model_type, steps, lambda: torch.FloatTensor(loglinear_interp(NOISE_LEVELS[model_type], steps + 1)))
 
         sigmas = sigmas[-(total_steps + 1):]
         sigmas[-1] = 0
-        return io.NodeOutput(torch.FloatTensor(sigmas))
+        return io.NodeOutput(sigmas)
 
 
 class OptimalStepsExtension(ComfyExtension):
@@ -1,7 +1,12 @@
+import collections
 import copy
+import hashlib
 import heapq
 import inspect
+import itertools
+import json
 import logging
+import os
 import sys
 import threading
 import time
@@ -12,13 +17,17 @@ import asyncio
 
 import torch
 
+import comfy.model_eviction
 import comfy.model_management
+import folder_paths
 from latent_preview import set_preview_method
 import nodes
 from comfy_execution.caching import (
     BasicCache,
+    ByteBudgetCache,
     CacheKeySetID,
     CacheKeySetInputSignature,
+    DiskCache,
     NullCache,
     HierarchicalCache,
     LRUCache,
@@ -34,6 +43,8 @@ from comfy_execution.graph_utils import GraphBuilder, is_link
 from comfy_execution.validation import validate_node_input
 from comfy_execution.progress import get_progress_state, reset_progress_state, add_progress_handler, WebUIProgressHandler
 from comfy_execution.utils import CurrentNodeContext
+from comfy_execution import batching, scheduling
+from comfy_execution.workers import prompt_model_names
 from comfy_api.internal import _ComfyNodeInternal, _NodeOutputInternal, first_real_override, is_class, make_locked_method_func
 from comfy_api.latest import io, _io
 
@@ -100,10 +111,28 @@ class CacheType(Enum):
     LRU = 1
     NONE = 2
     RAM_PRESSURE = 3
+    BYTE_BUDGET = 4
+
+
+_disk_caches = {}
+_disk_caches_lock = threading.Lock()
+
+def get_disk_cache(directory, max_bytes):
+    """The DiskCache of directory, shared by the CacheSets of all the prompt workers."""
+    with _disk_caches_lock:
+        if directory not in _disk_caches:
+            _disk_caches[directory] = DiskCache(directory, max_bytes, CacheEntry)
+            logging.info("Using disk cache for node outputs in: {}".format(directory))
+        return _disk_caches[directory]
 
 
 class CacheSet:
     def __init__(self, cache_type=None, cache_args={}):
+        self.disk_cache = None
+        if cache_type in (CacheType.RAM_PRESSURE, CacheType.LRU, CacheType.BYTE_BUDGET) and cache_args.get("disk", 0) > 0:
+            disk_dir = os.path.join(folder_paths.get_cache_directory(), "outputs")
+            self.disk_cache = get_disk_cache(disk_dir, int(cache_args["disk"] * (1024 ** 3)))
+
         if cache_type == CacheType.NONE:
             self.init_null_cache()
             logging.info("Disabling intermediate node cache.")
@@ -115,6 +144,10 @@ class CacheSet:
             cache_size = cache_args.get("lru", 0)
             self.init_lru_cache(cache_size)
             logging.info("Using LRU cache")
+        elif cache_type == CacheType.BYTE_BUDGET:
+            cache_bytes = cache_args.get("bytes", 0)
+            self.init_byte_budget_cache(cache_bytes)
+            logging.info("Using byte budget cache with {:.2f} GB.".format(cache_bytes))
         else:
             self.init_classic_cache()
 
@@ -126,11 +159,15 @@ class CacheSet:
         self.objects = HierarchicalCache(CacheKeySetID)
 
     def init_lru_cache(self, cache_size):
-        self.outputs = LRUCache(CacheKeySetInputSignature, max_size=cache_size)
+        self.outputs = LRUCache(CacheKeySetInputSignature, max_size=cache_size, disk_cache=self.disk_cache)
+        self.objects = HierarchicalCache(CacheKeySetID)
+
+    def init_byte_budget_cache(self, max_gb):
+        self.outputs = ByteBudgetCache(CacheKeySetInputSignature, int(max_gb * (1024 ** 3)), disk_cache=self.disk_cache)
         self.objects = HierarchicalCache(CacheKeySetID)
 
     def init_ram_cache(self, min_headroom):
-        self.outputs = RAMPressureCache(CacheKeySetInputSignature)
+        self.outputs = RAMPressureCache(CacheKeySetInputSignature, disk_cache=self.disk_cache)
         self.objects = HierarchicalCache(CacheKeySetID)
 
     def init_null_cache(self):
@@ -144,6 +181,34 @@ class CacheSet:
         return result
 
 SENSITIVE_EXTRA_DATA_KEYS = ("auth_token_comfy_org", "api_key_comfy_org")
+# extra_data keys that differ between submissions without changing what a prompt outputs
+PROMPT_DIGEST_IGNORED_EXTRA_DATA_KEYS = ("client_id", "create_time")
+
+def get_prompt_digest(prompt, outputs_to_execute, extra_data, sensitive={}):
+    """
+    Digest of everything that decides the result of a prompt, used to find identical prompts.
+    The sensitive extra_data only goes in as a hash, prompts of different users never match.
+    """
+    extra_data = {k: v for k, v in extra_data.items() if k not in PROMPT_DIGEST_IGNORED_EXTRA_DATA_KEYS}
+    identity = hashlib.sha256(json.dumps(sensitive, sort_keys=True, default=repr).encode()).hexdigest()
+    data = json.dumps([prompt, sorted(outputs_to_execute), extra_data, identity], sort_keys=True, default=repr)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def can_share_results(prompt):
+    """
+    If identical prompts can share their results. Not for prompts with nodes that are
+    NOT_IDEMPOTENT or that decide with IS_CHANGED or fingerprint_inputs if they run again.
+    """
+    for node in prompt.values():
+        class_def = nodes.NODE_CLASS_MAPPINGS.get(node.get("class_type"))
+        if class_def is None or getattr(class_def, "NOT_IDEMPOTENT", False):
+            return False
+        if issubclass(class_def, _ComfyNodeInternal):
+            if first_real_override(class_def, "fingerprint_inputs") is not None:
+                return False
+        elif hasattr(class_def, "IS_CHANGED"):
+            return False
+    return True
 
 def get_input_data(inputs, class_def, unique_id, execution_list=None, dynprompt=None, extra_data={}):
     is_v3 = issubclass(class_def, _ComfyNodeInternal)
@@ -226,7 +291,7 @@ async def resolve_map_node_over_list_results(results):
                 raise exc
         return [x.result() if isinstance(x, asyncio.Task) else x for x in results]
 
-async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, v3_data=None):
+async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, v3_data=None, allow_parallel=False):
     # check if node wants the lists
     input_is_list = getattr(obj, "INPUT_IS_LIST", False)
 
@@ -287,6 +352,12 @@ async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, f
                     results.append(result)
                 else:
                     results.append(task)
+            elif allow_parallel and scheduling.runs_in_parallel(obj):
+                # CPU/IO bound node, run it on the thread pool and handle it like a pending async node
+                async def thread_wrapper(f, prompt_id, unique_id, list_index, args):
+                    with CurrentNodeContext(prompt_id, unique_id, list_index):
+                        return await scheduling.run_in_thread_pool(f, **args)
+                results.append(asyncio.create_task(thread_wrapper(f, prompt_id, unique_id, index, args=inputs)))
             else:
                 with CurrentNodeContext(prompt_id, unique_id, index):
                     result = f(**inputs)
@@ -327,7 +398,7 @@ def merge_result_data(results, obj):
     return output
 
 async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, v3_data=None):
-    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data)
+    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data, allow_parallel=True)
     has_pending_task = any(isinstance(r, asyncio.Task) and not r.done() for r in return_values)
     if has_pending_task:
         return return_values, {}, False, has_pending_task
@@ -408,6 +479,7 @@ def format_value(x):
         return str(x)
 
 async def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, ui_outputs):
+    start_time = time.perf_counter()
     unique_id = current_item
     real_node_id = dynprompt.get_real_node_id(unique_id)
     display_node_id = dynprompt.get_display_node_id(unique_id)
@@ -417,6 +489,7 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
     class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
     cached = caches.outputs.get(unique_id)
     if cached is not None:
+        caches.outputs.usage.hits += 1
         if server.client_id is not None:
             cached_ui = cached.ui or {}
             server.send_sync("executed", { "node": unique_id, "display_node": display_node_id, "output": cached_ui.get("output",None), "prompt_id": prompt_id }, server.client_id)
@@ -513,7 +586,11 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
             def pre_execute_cb(call_index):
                 # TODO - How to handle this with async functions without contextvars (which requires Python 3.12)?
                 GraphBuilder.set_default_prefix(unique_id, call_index, 0)
-            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data)
+            link_tokens = batching.current_link_tokens.set(batching.get_link_tokens(class_def, caches.outputs, inputs))
+            try:
+                output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data)
+            finally:
+                batching.current_link_tokens.reset(link_tokens)
             if has_pending_tasks:
                 pending_async_nodes[unique_id] = output_data
                 unblock = execution_list.add_external_block(unique_id)
@@ -573,7 +650,8 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
 
         cache_entry = CacheEntry(ui=ui_outputs.get(unique_id), outputs=output_data)
         execution_list.cache_update(unique_id, cache_entry)
-        caches.outputs.set(unique_id, cache_entry)
+        caches.outputs.usage.misses += 1
+        caches.outputs.set(unique_id, cache_entry, execution_time=time.perf_counter() - start_time)
 
     except comfy.model_management.InterruptProcessingException as iex:
         logging.info("Processing interrupted")
@@ -681,6 +759,7 @@ class PromptExecutor:
 
         self.status_messages = []
         self.add_message("execution_start", { "prompt_id": prompt_id}, broadcast=False)
+        comfy.model_eviction.prompt_started(prompt_model_names(prompt))
 
         with torch.inference_mode():
             dynamic_prompt = DynamicPrompt(prompt)
@@ -1097,34 +1176,207 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
 
 MAXIMUM_HISTORY_SIZE = 10000
 
+# How many of the next queued prompts a worker may pick from to reuse its loaded models
+WORKER_ROUTING_LOOKAHEAD = 8
+
 class PromptQueue:
+    """
+    Priority queue of prompts waiting to be executed plus the ones currently running.
+
+    Pending items live in a heap and are indexed by prompt id. Deleting an item only drops
+    it from the index, the heap entry is skipped when it reaches the top and the heap is
+    compacted once most of it is dead. Queue items are treated as immutable, readers get a
+    shared snapshot that is rebuilt only after the queue changed.
+
+    Items put with a digest (see get_prompt_digest) can be coalesced: a prompt identical to
+    one that is queued or running isn't queued itself, it is attached to the other one and
+    gets a copy of its history entry when it finishes.
+    """
     def __init__(self, server):
         self.server = server
         self.mutex = threading.RLock()
         self.not_empty = threading.Condition(self.mutex)
         self.task_counter = 0
         self.queue = []
+        self.queue_items = {}
+        self.queue_index = {}
+        self.queue_version = 0
+        self.queue_snapshot = None
         self.currently_running = {}
         self.history = {}
+        self.history_store = None
         self.flags = {}
+        self.workers = []
+        # digest -> prompt id of the queued or running prompt with that digest, and back
+        self.digests = {}
+        self.prompt_digests = {}
+        # prompt id -> items sharing the execution of that prompt
+        self.attached = {}
+        # digest -> (prompt id, finish time) of recent successful prompts, for replay()
+        self.finished_digests = collections.OrderedDict()
+        self.prefetcher = None
+
+    def set_history_store(self, history_store):
+        """Keep history in a database backed store (app.database.history) instead of in memory."""
+        with self.mutex:
+            self.history_store = history_store
+            self.history = {}
 
-    def put(self, item):
+    def set_prefetcher(self, prefetcher):
+        """Have prefetcher (comfy_execution.prefetch.ModelPrefetcher) read the models of the next prompts."""
         with self.mutex:
-            heapq.heappush(self.queue, item)
-            self.server.queue_updated()
-            self.not_empty.notify()
+            self.prefetcher = prefetcher
+            self._prefetch_next()
+
+    def _next_pending(self, count):
+        # The first count pending items in queue order, read from the top of the heap: the
+        # children of the items taken so far are the only candidates for the next one, so
+        # this doesn't look at the rest of the queue. Deleted entries are skipped.
+        items = []
+        candidates = [(self.queue[0], 0)] if len(self.queue) > 0 else []
+        while len(candidates) > 0 and len(items) < count:
+            item, i = heapq.heappop(candidates)
+            if self._is_pending(item):
+                items.append(item)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self.queue):
+                    heapq.heappush(candidates, (self.queue[child], child))
+        return items
+
+    def _prefetch_next(self):
+        # The next prompt of each worker
+        if self.prefetcher is not None:
+            items = self._next_pending(max(1, len(self.workers)))
+            self.prefetcher.prefetch([(x[1], x[2]) for x in items])
+
+    def get_pending_model_names(self, count):
+        """Model file names of the next count queued prompts, in queue order."""
+        with self.mutex:
+            items = self._next_pending(count)
+        return [prompt_model_names(x[2]) for x in items]
+
+    def register_worker(self, worker):
+        with self.mutex:
+            self.workers.append(worker)
+
+    def get_workers(self):
+        with self.mutex:
+            return [w.get_status() for w in self.workers]
+
+    def _queue_changed(self):
+        self.queue_version += 1
+        self.server.queue_updated()
 
-    def get(self, timeout=None):
+    def _is_pending(self, item):
+        return id(item) in self.queue_items
+
+    def _discard(self, item):
+        del self.queue_items[id(item)]
+        same_id = self.queue_index[item[1]]
+        if len(same_id) == 1:
+            del self.queue_index[item[1]]
+        else:
+            same_id.remove(next(x for x in same_id if x is item))
+
+    def _compact(self):
+        # Drop deleted entries once they make up most of the heap
+        if len(self.queue) > 2 * len(self.queue_items) + 64:
+            self.queue = [x for x in self.queue if self._is_pending(x)]
+            heapq.heapify(self.queue)
+
+    def _push(self, item):
+        heapq.heappush(self.queue, item)
+        self.queue_items[id(item)] = item
+        self.queue_index.setdefault(item[1], []).append(item)
+
+    def _register_digest(self, prompt_id, digest):
+        if digest is not None:
+            self.digests[digest] = prompt_id
+            self.prompt_digests[prompt_id] = digest
+
+    def _release_digest(self, prompt_id):
+        digest = self.prompt_digests.pop(prompt_id, None)
+        if digest is not None and self.digests.get(digest) == prompt_id:
+            del self.digests[digest]
+        return digest
+
+    def _delete(self, item):
+        self._discard(item)
+        digest = self._release_digest(item[1])
+        attached = self.attached.pop(item[1], None)
+        if attached:
+            # The first prompt sharing the deleted one's execution takes its place
+            self._push(attached[0])
+            self._register_digest(attached[0][1], digest)
+            if len(attached) > 1:
+                self.attached[attached[0][1]] = attached[1:]
+        self._compact()
+        self._queue_changed()
+
+    def _detach(self, function):
+        for prompt_id, attached in self.attached.items():
+            for x in attached:
+                if function(x):
+                    attached.remove(x)
+                    if len(attached) == 0:
+                        del self.attached[prompt_id]
+                    self._queue_changed()
+                    return True
+        return False
+
+    def _heappop_pending(self):
+        while True:
+            item = heapq.heappop(self.queue)
+            if self._is_pending(item):
+                self._discard(item)
+                return item
+
+    def put(self, item, digest=None, coalesce=False):
+        """
+        Queue an item. With coalesce, an item whose digest matches a queued or running prompt
+        is attached to that prompt instead, and its prompt id is returned.
+        """
+        with self.mutex:
+            if coalesce and digest in self.digests:
+                prompt_id = self.digests[digest]
+                self.attached.setdefault(prompt_id, []).append(item)
+                self._queue_changed()
+                return prompt_id
+            self._push(item)
+            self._register_digest(item[1], digest)
+            self._queue_changed()
+            self._prefetch_next()
+            self.not_empty.notify()
+            return None
+
+    def _pop_item(self, worker):
+        # Among the next few prompts prefer the one that uses the most models the worker
+        # already has loaded. max() keeps the earliest item on ties so order is kept otherwise.
+        if worker is None or len(self.workers) < 2 or len(self.queue_items) == 1:
+            return self._heappop_pending()
+        candidates = []
+        while len(candidates) < WORKER_ROUTING_LOOKAHEAD and len(self.queue_items) > 0:
+            candidates.append(self._heappop_pending())
+        item = max(candidates, key=worker.affinity)
+        for x in candidates:
+            if x is not item:
+                self._push(x)
+        return item
+
+    def get(self, timeout=None, worker=None):
         with self.not_empty:
-            while len(self.queue) == 0:
+            while len(self.queue_items) == 0:
                 self.not_empty.wait(timeout=timeout)
-                if timeout is not None and len(self.queue) == 0:
+                if timeout is not None and len(self.queue_items) == 0:
                     return None
-            item = heapq.heappop(self.queue)
+            item = self._pop_item(worker)
             i = self.task_counter
-            self.currently_running[i] = copy.deepcopy(item)
+            self.currently_running[i] = item
             self.task_counter += 1
-            self.server.queue_updated()
+            if worker is not None:
+                worker.prompt_id = item[1]
+            self._queue_changed()
+            self._prefetch_next()
             return (item, i)
 
     class ExecutionStatus(NamedTuple):
@@ -1133,80 +1385,177 @@ class PromptQueue:
         messages: List[str]
 
     def task_done(self, item_id, history_result,
-                  status: Optional['PromptQueue.ExecutionStatus'], process_item=None):
+                  status: Optional['PromptQueue.ExecutionStatus'], process_item=None, worker=None):
         with self.mutex:
-            prompt = self.currently_running.pop(item_id)
-            if len(self.history) > MAXIMUM_HISTORY_SIZE:
-                self.history.pop(next(iter(self.history)))
+            prompt = self.currently_running[item_id]
 
             status_dict: Optional[dict] = None
             if status is not None:
                 status_dict = copy.deepcopy(status._asdict())
 
+            digest = self._release_digest(prompt[1])
+            attached = self.attached.pop(prompt[1], [])
+
             if process_item is not None:
                 prompt = process_item(prompt)
 
-            self.history[prompt[1]] = {
+            history_item = {
                 "prompt": prompt,
                 "outputs": {},
                 'status': status_dict,
             }
-            self.history[prompt[1]].update(history_result)
-            self.server.queue_updated()
+            history_item.update(history_result)
+            shared = [self._shared_history_item(x, history_item, process_item) for x in attached]
 
-    # Note: slow
-    def get_current_queue(self):
+        # The prompt stays running until its history is written, without holding up the other
+        # workers and requests while the history store writes to the database
+        self._add_history([(prompt[1], history_item)] + [(x[1], h) for x, h in shared])
+
+        with self.mutex:
+            del self.currently_running[item_id]
+            if worker is not None:
+                worker.prompt_id = None
+            if digest is not None and status is not None and status.status_str == 'success':
+                self.finished_digests[digest] = (prompt[1], time.time())
+                self.finished_digests.move_to_end(digest)
+                if len(self.finished_digests) > MAXIMUM_HISTORY_SIZE:
+                    self.finished_digests.popitem(last=False)
+            self._queue_changed()
+
+        for x, h in shared:
+            self._send_shared_history(x, h)
+
+    def _add_history(self, items):
+        """Records (prompt id, history item) pairs, called without the mutex held."""
+        if self.history_store is not None:
+            for prompt_id, history_item in items:
+                self.history_store.put(prompt_id, history_item)
+            return
+        with self.mutex:
+            for prompt_id, history_item in items:
+                if len(self.history) > MAXIMUM_HISTORY_SIZE:
+                    self.history.pop(next(iter(self.history)))
+                self.history[prompt_id] = history_item
+
+    def _shared_history_item(self, item, history_item, process_item=None):
+        """(item, its history item) for item getting the result of another execution."""
+        if process_item is not None:
+            item = process_item(item)
+        return item, dict(history_item, prompt=item)
+
+    def _send_shared_history(self, item, history_item):
+        """Tell the client of item about the result it got from another execution."""
+        client_id = item[3].get("client_id")
+        if client_id is None:
+            return
+        prompt_id = item[1]
+        meta = history_item.get("meta", {})
+        for node_id, output in history_item.get("outputs", {}).items():
+            display_node_id = meta.get(node_id, {}).get("display_node", node_id)
+            self.server.send_sync("executed", { "node": node_id, "display_node": display_node_id, "output": output, "prompt_id": prompt_id }, client_id)
+        status = history_item.get("status") or {}
+        errors = [data for event, data in status.get("messages", []) if event == "execution_error"]
+        if status.get("status_str") == "error" and len(errors) > 0:
+            self.server.send_sync("execution_error", dict(errors[-1], prompt_id=prompt_id), client_id)
+        else:
+            self.server.send_sync("execution_success", { "prompt_id": prompt_id, "timestamp": int(time.time() * 1000) }, client_id)
+        self.server.send_sync("executing", { "node": None, "prompt_id": prompt_id }, client_id)
+
+    def replay(self, item, digest, max_age, process_item=None):
+        """
+        Finish item right away with the result of an identical prompt that succeeded in the
+        last max_age seconds. Returns the prompt id whose result was used, or None.
+        """
+        with self.mutex:
+            finished = self.finished_digests.get(digest)
+            if finished is None or time.time() - finished[1] > max_age:
+                return None
+        history_item = self.get_history(prompt_id=finished[0]).get(finished[0])
+        if history_item is None:
+            return None
+        item, history_item = self._shared_history_item(item, history_item, process_item)
+        self._add_history([(item[1], history_item)])
+        with self.mutex:
+            self._queue_changed()
+        self._send_shared_history(item, history_item)
+        return finished[0]
+
+    def _get_snapshot(self):
         with self.mutex:
-            out = []
-            for x in self.currently_running.values():
-                out += [x]
-            return (out, copy.deepcopy(self.queue))
+            if self.queue_snapshot is None or self.queue_snapshot[0] != self.queue_version:
+                running = []
+                for x in self.currently_running.values():
+                    running += [x] + self.attached.get(x[1], [])
+                queued = []
+                for x in self.queue:
+                    if self._is_pending(x):
+                        queued += [x] + self.attached.get(x[1], [])
+                running = tuple(running)
+                queued = tuple(queued)
+                self.queue_snapshot = (self.queue_version, running, queued)
+            return self.queue_snapshot[1:]
+
+    def get_current_queue(self):
+        return self._get_snapshot()
 
     # read-safe as long as queue items are immutable
     def get_current_queue_volatile(self):
-        with self.mutex:
-            running = [x for x in self.currently_running.values()]
-            queued = copy.copy(self.queue)
-            return (running, queued)
+        return self._get_snapshot()
 
     def get_tasks_remaining(self):
         with self.mutex:
-            return len(self.queue) + len(self.currently_running)
+            return len(self.queue_items) + len(self.currently_running) + sum(len(x) for x in self.attached.values())
 
     def wipe_queue(self):
         with self.mutex:
+            for x in self.queue_items.values():
+                self._release_digest(x[1])
+                self.attached.pop(x[1], None)
             self.queue = []
-            self.server.queue_updated()
+            self.queue_items = {}
+            self.queue_index = {}
+            self._queue_changed()
 
     def delete_queue_item(self, function):
         with self.mutex:
-            for x in range(len(self.queue)):
-                if function(self.queue[x]):
-                    if len(self.queue) == 1:
-                        self.wipe_queue()
-                    else:
-                        self.queue.pop(x)
-                        heapq.heapify(self.queue)
-                    self.server.queue_updated()
+            for x in self.queue:
+                if self._is_pending(x) and function(x):
+                    self._delete(x)
                     return True
-        return False
+            return self._detach(function)
+
+    def delete_queue_item_by_id(self, prompt_id):
+        with self.mutex:
+            same_id = self.queue_index.get(prompt_id)
+            if same_id is None:
+                return self._detach(lambda x: x[1] == prompt_id)
+            self._delete(same_id[0])
+            return True
 
     def get_history(self, prompt_id=None, max_items=None, offset=-1, map_function=None):
+        if self.history_store is not None:
+            # The store reads from the database, don't hold the mutex for that
+            if prompt_id is None:
+                out = self.history_store.get_history(max_items=max_items, offset=offset)
+            else:
+                p = self.history_store.get(prompt_id)
+                out = {} if p is None else {prompt_id: p}
+            if map_function is not None:
+                out = {k: map_function(p) for k, p in out.items()}
+            return out
+
         with self.mutex:
             if prompt_id is None:
                 out = {}
-                i = 0
                 if offset < 0 and max_items is not None:
                     offset = len(self.history) - max_items
-                for k in self.history:
-                    if i >= offset:
-                        p = self.history[k]
-                        if map_function is not None:
-                            p = map_function(p)
-                        out[k] = p
-                        if max_items is not None and len(out) >= max_items:
-                            break
-                    i += 1
+                for k in itertools.islice(self.history, max(offset, 0), None):
+                    p = self.history[k]
+                    if map_function is not None:
+                        p = map_function(p)
+                    out[k] = p
+                    if max_items is not None and len(out) >= max_items:
+                        break
                 return out
             elif prompt_id in self.history:
                 p = self.history[prompt_id]
@@ -1218,24 +1567,38 @@ class PromptQueue:
             else:
                 return {}
 
+    def get_jobs_history(self):
+        """History for get_all_jobs: the history store pages jobs itself, otherwise the dict."""
+        if self.history_store is not None:
+            return self.history_store
+        return self.get_history()
+
     def wipe_history(self):
+        if self.history_store is not None:
+            self.history_store.wipe()
         with self.mutex:
             self.history = {}
 
     def delete_history_item(self, id_to_delete):
+        if self.history_store is not None:
+            self.history_store.delete(id_to_delete)
         with self.mutex:
             self.history.pop(id_to_delete, None)
 
     def set_flag(self, name, data):
         with self.mutex:
             self.flags[name] = data
-            self.not_empty.notify()
+            for worker in self.workers:
+                worker.flags[name] = data
+            self.not_empty.notify_all()
 
-    def get_flags(self, reset=True):
+    def get_flags(self, reset=True, worker=None):
+        # Every worker gets its own copy of the flags so each one resets its executor.
+        holder = self if worker is None else worker
         with self.mutex:
             if reset:
-                ret = self.flags
-                self.flags = {}
+                ret = holder.flags
+                holder.flags = {}
                 return ret
             else:
-                return self.flags.copy()
+                return holder.flags.copy()
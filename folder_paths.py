@@ -56,6 +56,7 @@ output_directory = os.path.join(base_path, "output")
 temp_directory = os.path.join(base_path, "temp")
 input_directory = os.path.join(base_path, "input")
 user_directory = os.path.join(base_path, "user")
+cache_directory = os.path.join(base_path, "cache")
 
 filename_list_cache: dict[str, tuple[list[str], dict[str, float], float]] = {}
 
@@ -136,6 +137,14 @@ def set_user_directory(user_dir: str) -> None:
     global user_directory
     user_directory = user_dir
 
+def get_cache_directory() -> str:
+    global cache_directory
+    return cache_directory
+
+def set_cache_directory(cache_dir: str) -> None:
+    global cache_directory
+    cache_directory = cache_dir
+
 
 # System User Protection - Protects system directories from HTTP endpoint access
 # System Users are internal-only users that cannot be accessed via HTTP endpoints.
@@ -106,6 +106,11 @@ def apply_custom_paths():
         logging.info(f"Setting user directory to: {user_dir}")
         folder_paths.set_user_directory(user_dir)
 
+    if args.cache_directory:
+        cache_dir = os.path.abspath(args.cache_directory)
+        logging.info(f"Setting cache directory to: {cache_dir}")
+        folder_paths.set_cache_directory(cache_dir)
+
 
 def execute_prestartup_script():
     if args.disable_all_custom_nodes and len(args.whitelist_custom_nodes) == 0:
@@ -173,8 +178,14 @@ if 'torch' in sys.modules:
     logging.warning("WARNING: Potential Error in code: Torch already imported, torch should never be imported before this point.")
 
 import comfy.utils
+import comfy.compiled_models
+import comfy.model_eviction
 
 import execution
+import comfy_execution.batching
+import comfy_execution.prefetch
+import comfy_execution.scheduling
+import comfy_execution.workers
 import server
 from protocol import BinaryEventTypes
 import nodes
@@ -195,17 +206,28 @@ def cuda_malloc_warning():
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
 
-def prompt_worker(q, server_instance):
+def prompt_worker(q, server_instance, worker=None):
+    if worker is not None:
+        worker.pin_device()
+        if len(q.workers) > 1:
+            server_instance = comfy_execution.workers.WorkerServer(server_instance)
+            comfy_execution.workers.current_worker_server.set(server_instance)
+            comfy.model_management.current_model_user.set(worker.worker_id)
+
     current_time: float = 0.0
     cache_type = execution.CacheType.CLASSIC
     if args.cache_lru > 0:
         cache_type = execution.CacheType.LRU
     elif args.cache_ram > 0:
         cache_type = execution.CacheType.RAM_PRESSURE
+    elif args.cache_bytes > 0:
+        cache_type = execution.CacheType.BYTE_BUDGET
     elif args.cache_none:
         cache_type = execution.CacheType.NONE
 
-    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_args={ "lru" : args.cache_lru, "ram" : args.cache_ram } )
+    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_args={ "lru" : args.cache_lru, "ram" : args.cache_ram, "bytes" : args.cache_bytes, "disk" : args.cache_disk } )
+    if worker is not None:
+        worker.executor = e
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -215,7 +237,7 @@ def prompt_worker(q, server_instance):
         if need_gc:
             timeout = max(gc_collect_interval - (current_time - last_gc_collect), 0.0)
 
-        queue_item = q.get(timeout=timeout)
+        queue_item = q.get(timeout=timeout, worker=worker)
         if queue_item is not None:
             item, item_id = queue_item
             execution_start_time = time.perf_counter()
@@ -228,6 +250,7 @@ def prompt_worker(q, server_instance):
                 extra_data[k] = sensitive[k]
 
             e.execute(item[2], prompt_id, extra_data, item[4])
+            comfy.model_management.release_models()
             need_gc = True
 
             remove_sensitive = lambda prompt: prompt[:5] + prompt[6:]
@@ -236,7 +259,9 @@ def prompt_worker(q, server_instance):
                         status=execution.PromptQueue.ExecutionStatus(
                             status_str='success' if e.success else 'error',
                             completed=e.success,
-                            messages=e.status_messages), process_item=remove_sensitive)
+                            messages=e.status_messages), process_item=remove_sensitive, worker=worker)
+            if worker is not None:
+                worker.finish(item[2])
             if server_instance.client_id is not None:
                 server_instance.send_sync("executing", {"node": None, "prompt_id": prompt_id}, server_instance.client_id)
 
@@ -250,7 +275,7 @@ def prompt_worker(q, server_instance):
             else:
                 logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
 
-        flags = q.get_flags()
+        flags = q.get_flags(worker=worker)
         free_memory = flags.get("free_memory", False)
 
         if flags.get("unload_models", free_memory):
@@ -281,8 +306,9 @@ async def run(server_instance, address='', port=8188, verbose=True, call_on_star
         server_instance.start_multi_address(addresses, call_on_start, verbose), server_instance.publish_loop()
     )
 
-def hijack_progress(server_instance):
+def hijack_progress(prompt_server):
     def hook(value, total, preview_image, prompt_id=None, node_id=None):
+        server_instance = comfy_execution.workers.get_current_server(prompt_server)
         executing_context = get_executing_context()
         if prompt_id is None and executing_context is not None:
             prompt_id = executing_context.prompt_id
@@ -328,6 +354,18 @@ def setup_database():
         logging.error(f"Failed to initialize database. Please ensure you have installed the latest requirements. If the error persists, please report this as in future the database will be required: {e}")
 
 
+def setup_history_store(prompt_queue):
+    try:
+        from app.database import db
+        if not db.can_create_session():
+            logging.warning("The database is not available, prompt history will be kept in memory.")
+            return
+        from app.database.history import HistoryStore
+        prompt_queue.set_history_store(HistoryStore(db.Session, max_items=args.persistent_history))
+    except Exception as e:
+        logging.error(f"Failed to set up the persistent prompt history, it will be kept in memory: {e}")
+
+
 def start_comfyui(asyncio_loop=None):
     """
     Starts the ComfyUI server using the provided asyncio event loop or creates a new one.
@@ -363,11 +401,32 @@ def start_comfyui(asyncio_loop=None):
 
     cuda_malloc_warning()
     setup_database()
+    if args.persistent_history > 0:
+        setup_history_store(prompt_server.prompt_queue)
 
     prompt_server.add_routes()
     hijack_progress(prompt_server)
 
-    threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
+    if args.parallel_execution > 0:
+        comfy_execution.scheduling.set_parallel_execution(args.parallel_execution)
+
+    devices = comfy_execution.workers.get_worker_devices(max(1, args.prompt_workers))
+    workers = [comfy_execution.workers.PromptWorker(i, device) for i, device in enumerate(devices)]
+    for worker in workers:
+        prompt_server.prompt_queue.register_worker(worker)
+    for worker in workers:
+        threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server, worker)).start()
+    if len(workers) > 1:
+        logging.info("Started {} prompt workers on devices: {}".format(len(workers), ", ".join(w.get_status()["device"] for w in workers)))
+    comfy.model_eviction.set_pending_prompt_models(lambda: prompt_server.prompt_queue.get_pending_model_names(comfy.model_eviction.REUSE_LOOKAHEAD_PROMPTS))
+    if args.compiled_model_cache > 0:
+        comfy.compiled_models.set_cache_directory(os.path.join(folder_paths.get_cache_directory(), "compiled_models"))
+    if args.prefetch_models > 0:
+        prompt_server.prompt_queue.set_prefetcher(comfy_execution.prefetch.ModelPrefetcher(int(args.prefetch_models * (1024 ** 3))))
+    if args.sampler_batching > 0:
+        if len(workers) < 2:
+            logging.warning("--sampler-batching only batches samplers of prompts running at the same time, it needs --prompt-workers 2 or more.")
+        comfy_execution.batching.set_sampler_batching(args.sampler_batching, lambda: sum(1 for w in workers if w.prompt_id is not None))
 
     if args.quick_test_for_ci:
         exit(0)
@@ -27,6 +27,7 @@ import comfy.sample
 import comfy.sd
 import comfy.utils
 import comfy.controlnet
+import comfy_execution.batching
 from comfy.comfy_types import IO, ComfyNodeABC, InputTypeDict, FileLocator
 from comfy_api.internal import register_versions, ComfyAPIWithVersion
 from comfy_api.version_list import supported_versions
@@ -574,6 +575,7 @@ class CheckpointLoaderSimple:
     FUNCTION = "load_checkpoint"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"ckpt_name": "checkpoints"}
     DESCRIPTION = "Loads a diffusion model checkpoint, diffusion models are used to denoise latents."
 
     def load_checkpoint(self, ckpt_name):
@@ -660,6 +662,7 @@ class LoraLoader:
     FUNCTION = "load_lora"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"lora_name": "loras"}
     DESCRIPTION = "LoRAs are used to modify diffusion and CLIP models, altering the way in which latents are denoised such as applying styles. Multiple LoRA nodes can be linked together."
 
     def load_lora(self, model, clip, lora_name, strength_model, strength_clip):
@@ -780,6 +783,7 @@ class VAELoader:
     FUNCTION = "load_vae"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"vae_name": "vae"}
 
     #TODO: scale factor?
     def load_vae(self, vae_name):
@@ -807,6 +811,7 @@ class ControlNetLoader:
     FUNCTION = "load_controlnet"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"control_net_name": "controlnet"}
 
     def load_controlnet(self, control_net_name):
         controlnet_path = folder_paths.get_full_path_or_raise("controlnet", control_net_name)
@@ -923,6 +928,7 @@ class UNETLoader:
     FUNCTION = "load_unet"
 
     CATEGORY = "advanced/loaders"
+    PREFETCH_INPUTS = {"unet_name": "diffusion_models"}
 
     def load_unet(self, unet_name, weight_dtype):
         model_options = {}
@@ -951,6 +957,7 @@ class CLIPLoader:
     FUNCTION = "load_clip"
 
     CATEGORY = "advanced/loaders"
+    PREFETCH_INPUTS = {"clip_name": "text_encoders"}
 
     DESCRIPTION = "[Recipes]\n\nstable_diffusion: clip-l\nstable_cascade: clip-g\nsd3: t5 xxl/ clip-g / clip-l\nstable_audio: t5 base\nmochi: t5 xxl\ncosmos: old t5 xxl\nlumina2: gemma 2 2B\nwan: umt5 xxl\n hidream: llama-3.1 (Recommend) or t5\nomnigen2: qwen vl 2.5 3B"
 
@@ -979,6 +986,7 @@ class DualCLIPLoader:
     FUNCTION = "load_clip"
 
     CATEGORY = "advanced/loaders"
+    PREFETCH_INPUTS = {"clip_name1": "text_encoders", "clip_name2": "text_encoders"}
 
     DESCRIPTION = "[Recipes]\n\nsdxl: clip-l, clip-g\nsd3: clip-l, clip-g / clip-l, t5 / clip-g, t5\nflux: clip-l, t5\nhidream: at least one of t5 or llama, recommended t5 and llama\nhunyuan_image: qwen2.5vl 7b and byt5 small\nnewbie: gemma-3-4b-it, jina clip v2"
 
@@ -1004,6 +1012,7 @@ class CLIPVisionLoader:
     FUNCTION = "load_clip"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"clip_name": "clip_vision"}
 
     def load_clip(self, clip_name):
         clip_path = folder_paths.get_full_path_or_raise("clip_vision", clip_name)
@@ -1490,10 +1499,10 @@ def common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive,
     latent_image = latent["samples"]
     latent_image = comfy.sample.fix_empty_latent_channels(model, latent_image)
 
+    batch_inds = latent["batch_index"] if "batch_index" in latent else None
     if disable_noise:
         noise = torch.zeros(latent_image.size(), dtype=latent_image.dtype, layout=latent_image.layout, device="cpu")
     else:
-        batch_inds = latent["batch_index"] if "batch_index" in latent else None
         noise = comfy.sample.prepare_noise(latent_image, seed, batch_inds)
 
     noise_mask = None
@@ -1502,9 +1511,14 @@ def common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive,
 
     callback = latent_preview.prepare_callback(model, steps)
     disable_pbar = not comfy.utils.PROGRESS_BAR_ENABLED
-    samples = comfy.sample.sample(model, noise, steps, cfg, sampler_name, scheduler, positive, negative, latent_image,
-                                  denoise=denoise, disable_noise=disable_noise, start_step=start_step, last_step=last_step,
-                                  force_full_denoise=force_full_denoise, noise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=seed)
+    def run(noise, latent_image, positive, negative):
+        return comfy.sample.sample(model, noise, steps, cfg, sampler_name, scheduler, positive, negative, latent_image,
+                                   denoise=denoise, disable_noise=disable_noise, start_step=start_step, last_step=last_step,
+                                   force_full_denoise=force_full_denoise, noise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=seed, noise_inds=batch_inds)
+
+    batch_key = comfy_execution.batching.get_sampler_key(model, sampler_name, noise_mask, ["model"],
+                                                         (steps, cfg, sampler_name, scheduler, denoise, disable_noise, start_step, last_step, force_full_denoise))
+    samples = comfy_execution.batching.sample(batch_key, run, noise, latent_image, positive, negative)
     out = latent.copy()
     out["samples"] = samples
     return (out, )
@@ -1533,6 +1547,7 @@ class KSampler:
 
     CATEGORY = "sampling"
     DESCRIPTION = "Uses the provided model, positive and negative conditioning to denoise the latent image."
+    SAMPLER_BATCHING = True
 
     def sample(self, model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=1.0):
         return common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=denoise)
@@ -1561,6 +1576,7 @@ class KSamplerAdvanced:
     FUNCTION = "sample"
 
     CATEGORY = "sampling"
+    SAMPLER_BATCHING = True
 
     def sample(self, model, add_noise, noise_seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, start_at_step, end_at_step, return_with_leftover_noise, denoise=1.0):
         force_full_denoise = True
@@ -1654,6 +1670,7 @@ class LoadImage:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
+    EXECUTION_RESOURCE = "cpu"
     def load_image(self, image):
         image_path = folder_paths.get_annotated_filepath(image)
 
@@ -1731,6 +1748,7 @@ class LoadImageMask:
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
+    EXECUTION_RESOURCE = "cpu"
     def load_image(self, image, channel):
         image_path = folder_paths.get_annotated_filepath(image)
         i = node_helpers.pillow(Image.open, image_path)
@@ -3,11 +3,12 @@ import sys
 import asyncio
 import traceback
 import time
+import threading
 
 import nodes
 import folder_paths
 import execution
-from comfy_execution.jobs import JobStatus, get_job, get_all_jobs
+from comfy_execution.jobs import JobStatus, get_job, get_all_jobs, encode_cursor, decode_cursor
 import uuid
 import urllib
 import json
@@ -28,6 +29,10 @@ import mimetypes
 from comfy.cli_args import args
 import comfy.utils
 import comfy.model_management
+import comfy.model_eviction
+import comfy.weight_streaming
+import comfy.step_cache
+import comfy.schedule_cache
 from comfy_api import feature_flags
 import node_helpers
 from comfyui_version import __version__
@@ -242,6 +247,8 @@ class PromptServer():
         self.routes = routes
         self.last_node_id = None
         self.client_id = None
+        self.queue_updated_lock = threading.Lock()
+        self.queue_update_pending = False
 
         self.on_prompt_handlers = []
 
@@ -637,7 +644,13 @@ class PromptServer():
                         "torch_vram_total": torch_vram_total,
                         "torch_vram_free": torch_vram_free,
                     }
-                ]
+                ],
+                "cache": [stats for stats in (w.get_cache_stats() for w in self.prompt_queue.workers) if stats is not None],
+                "model_eviction": comfy.model_eviction.get_stats(),
+                "pinned_memory": comfy.model_management.pinned_memory_stats(),
+                "weight_streaming": comfy.weight_streaming.get_stats(),
+                "step_cache": comfy.step_cache.get_stats(),
+                "schedule_cache": comfy.schedule_cache.get_stats(),
             }
             return web.json_response(system_stats)
 
@@ -715,6 +728,7 @@ class PromptServer():
                 sort_order: Sort direction: asc, desc (default)
                 limit: Max items to return (positive integer)
                 offset: Items to skip (non-negative integer, default 0)
+                cursor: Return the jobs after this cursor, taken from next_cursor of the previous page (created_at sort only)
             """
             query = request.rel_url.query
 
@@ -774,8 +788,23 @@ class PromptServer():
                         status=400
                     )
 
+            cursor = None
+            if 'cursor' in query:
+                if sort_by != 'created_at':
+                    return web.json_response(
+                        {"error": "cursor can only be used with sort_by 'created_at'"},
+                        status=400
+                    )
+                try:
+                    cursor = decode_cursor(query.get('cursor'))
+                except ValueError:
+                    return web.json_response(
+                        {"error": "Invalid cursor"},
+                        status=400
+                    )
+
             running, queued = self.prompt_queue.get_current_queue_volatile()
-            history = self.prompt_queue.get_history()
+            history = self.prompt_queue.get_jobs_history()
 
             running = _remove_sensitive_from_queue(running)
             queued = _remove_sensitive_from_queue(queued)
@@ -787,19 +816,25 @@ class PromptServer():
                 sort_by=sort_by,
                 sort_order=sort_order,
                 limit=limit,
-                offset=offset
+                offset=offset,
+                worker_ids=self.get_running_worker_ids(),
+                cursor=cursor
             )
 
             has_more = (offset + len(jobs)) < total
 
+            pagination = {
+                'offset': offset,
+                'limit': limit,
+                'total': total,
+                'has_more': has_more
+            }
+            if has_more and len(jobs) > 0 and sort_by == 'created_at':
+                pagination['next_cursor'] = encode_cursor(jobs[-1])
+
             return web.json_response({
                 'jobs': jobs,
-                'pagination': {
-                    'offset': offset,
-                    'limit': limit,
-                    'total': total,
-                    'has_more': has_more
-                }
+                'pagination': pagination
             })
 
         @routes.get("/api/jobs/{job_id}")
@@ -818,7 +853,7 @@ class PromptServer():
             running = _remove_sensitive_from_queue(running)
             queued = _remove_sensitive_from_queue(queued)
 
-            job = get_job(job_id, running, queued, history)
+            job = get_job(job_id, running, queued, history, worker_ids=self.get_running_worker_ids())
             if job is None:
                 return web.json_response(
                     {"error": "Job not found"},
@@ -852,6 +887,7 @@ class PromptServer():
             current_queue = self.prompt_queue.get_current_queue_volatile()
             queue_info['queue_running'] = _remove_sensitive_from_queue(current_queue[0])
             queue_info['queue_pending'] = _remove_sensitive_from_queue(current_queue[1])
+            queue_info['workers'] = self.prompt_queue.get_workers()
             return web.json_response(queue_info)
 
         @routes.post("/prompt")
@@ -892,8 +928,24 @@ class PromptServer():
                         if sensitive_val in extra_data:
                             sensitive[sensitive_val] = extra_data.pop(sensitive_val)
                     extra_data["create_time"] = int(time.time() * 1000)  # timestamp in milliseconds
-                    self.prompt_queue.put((number, prompt_id, prompt, extra_data, outputs_to_execute, sensitive))
+                    item = (number, prompt_id, prompt, extra_data, outputs_to_execute, sensitive)
                     response = {"prompt_id": prompt_id, "number": number, "node_errors": valid[3]}
+
+                    # Clients can ask for coalescing with "coalesce": true, or opt out of it and replay with false
+                    share_results = execution.can_share_results(prompt)
+                    coalesce = share_results and json_data.get("coalesce", args.enable_prompt_coalescing)
+                    replay = share_results and json_data.get("coalesce", True) and args.replay_prompt_results > 0
+                    digest = None
+                    if coalesce or replay:
+                        digest = execution.get_prompt_digest(prompt, outputs_to_execute, extra_data, sensitive)
+                    if replay:
+                        replayed_from = self.prompt_queue.replay(item, digest, args.replay_prompt_results, process_item=lambda x: x[:5] + x[6:])
+                        if replayed_from is not None:
+                            response["replayed_from"] = replayed_from
+                            return web.json_response(response)
+                    coalesced_with = self.prompt_queue.put(item, digest=digest, coalesce=coalesce)
+                    if coalesced_with is not None:
+                        response["coalesced_with"] = coalesced_with
                     return web.json_response(response)
                 else:
                     logging.warning("invalid prompt: {}".format(valid[1]))
@@ -916,8 +968,7 @@ class PromptServer():
             if "delete" in json_data:
                 to_delete = json_data['delete']
                 for id_to_delete in to_delete:
-                    delete_func = lambda a: a[1] == id_to_delete
-                    self.prompt_queue.delete_queue_item(delete_func)
+                    self.prompt_queue.delete_queue_item_by_id(id_to_delete)
 
             return web.Response(status=200)
 
@@ -1043,6 +1094,9 @@ class PromptServer():
             web.static('/', self.web_root),
         ])
 
+    def get_running_worker_ids(self):
+        return {w["prompt_id"]: w["worker_id"] for w in self.prompt_queue.get_workers() if w["prompt_id"] is not None}
+
     def get_queue_info(self):
         prompt_info = {}
         exec_info = {}
@@ -1157,7 +1211,18 @@ class PromptServer():
             self.messages.put_nowait, (event, data, sid))
 
     def queue_updated(self):
-        self.send_sync("status", { "status": self.get_queue_info() })
+        # Queue changes come in bursts (batch submits, deletes, every get and task_done), so
+        # only one status broadcast is scheduled until the event loop gets to send it.
+        with self.queue_updated_lock:
+            if self.queue_update_pending:
+                return
+            self.queue_update_pending = True
+        self.loop.call_soon_threadsafe(self.send_queue_status)
+
+    def send_queue_status(self):
+        with self.queue_updated_lock:
+            self.queue_update_pending = False
+        self.messages.put_nowait(("status", { "status": self.get_queue_info() }, None))
 
     async def publish_loop(self):
         while True:
@@ -0,0 +1,97 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database.models import Base
+from app.database.history import HistoryStore
+from comfy_execution.jobs import JobStatus, decode_cursor, encode_cursor, get_all_jobs
+
+
+def make_history_item(prompt_id, create_time, status_str='success', workflow_id=None):
+    extra_data = {'create_time': create_time}
+    if workflow_id is not None:
+        extra_data['extra_pnginfo'] = {'workflow': {'id': workflow_id}}
+    return {
+        'prompt': (create_time, prompt_id, {}, extra_data, []),
+        'outputs': {'9': {'images': [{'filename': f'{prompt_id}.png', 'type': 'output'}]}},
+        'status': {'status_str': status_str, 'completed': status_str == 'success', 'messages': []},
+    }
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def store(session_factory):
+    store = HistoryStore(session_factory)
+    for i in range(10):
+        store.put(f'p{i}', make_history_item(f'p{i}', 1000 + i, 'error' if i % 3 == 0 else 'success', workflow_id=f'w{i % 2}'))
+    return store
+
+
+def test_roundtrip_and_restart(store, session_factory):
+    item = store.get('p1')
+    assert item['outputs']['9']['images'][0]['filename'] == 'p1.png'
+    assert store.get('missing') is None
+
+    reopened = HistoryStore(session_factory)
+    assert len(reopened) == 10
+    assert reopened.get('p1') == item
+
+
+def test_get_history_paging(store):
+    assert list(store.get_history()) == [f'p{i}' for i in range(10)]
+    assert list(store.get_history(max_items=3)) == ['p7', 'p8', 'p9']
+    assert list(store.get_history(max_items=2, offset=4)) == ['p4', 'p5']
+
+
+def test_delete_wipe_and_replace(store):
+    store.delete('p0')
+    assert len(store) == 9 and store.get('p0') is None
+    store.put('p1', make_history_item('p1', 5000))
+    assert len(store) == 9
+    assert list(store.get_history())[-1] == 'p1'
+    store.wipe()
+    assert len(store) == 0 and store.get_history() == {}
+
+
+def test_max_items_drops_oldest(session_factory):
+    store = HistoryStore(session_factory, max_items=3)
+    for i in range(5):
+        store.put(f'p{i}', make_history_item(f'p{i}', i))
+    assert len(store) == 3
+    assert list(store.get_history()) == ['p2', 'p3', 'p4']
+
+
+def test_query_jobs_filters_in_database(store):
+    jobs, total = store.query_jobs([JobStatus.FAILED], limit=2)
+    assert total == 4
+    assert [j['id'] for j in jobs] == ['p9', 'p6']
+
+    jobs, total = store.query_jobs([JobStatus.COMPLETED, JobStatus.FAILED], workflow_id='w1', sort_order='asc')
+    assert total == 5
+    assert [j['id'] for j in jobs] == ['p1', 'p3', 'p5', 'p7', 'p9']
+
+
+def test_get_all_jobs_with_store_matches_dict(store):
+    history = store.get_history()
+    queued = [(0, 'q0', {}, {'create_time': 1005}, [])]
+    for offset in (0, 3, 9):
+        expected = get_all_jobs([], queued, history, limit=4, offset=offset)
+        assert get_all_jobs([], queued, store, limit=4, offset=offset) == expected
+
+
+def test_cursor_paging(store):
+    seen = []
+    cursor = None
+    while True:
+        jobs, total = get_all_jobs([], [], store, limit=4, cursor=cursor)
+        seen += [j['id'] for j in jobs]
+        if len(jobs) == total:
+            break
+        cursor = decode_cursor(encode_cursor(jobs[-1]))
+    assert seen == [f'p{i}' for i in reversed(range(10))]
@@ -60,3 +60,27 @@ async def test_get_model_preview_safetensors(aiohttp_client, app, tmp_path):
 
         # Clean up
         img.close()
+
+async def test_detect_models(aiohttp_client, app, tmp_path):
+    from comfy.cli_args import args
+    import torch
+    if not torch.cuda.is_available():
+        args.cpu = True
+
+    header_bytes = json.dumps({"lora_unet_a.lora_up.weight": {"dtype": "F16", "shape": [2], "data_offsets": [0, 4]}}).encode('utf-8')
+    with open(tmp_path / "lora.safetensors", 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * 4)
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'test_folder': ([str(tmp_path)], {".safetensors"})
+    }):
+        client = await aiohttp_client(app)
+        response = await client.get('/experiment/models/detect/test_folder')
+        assert response.status == 200
+        files = await response.json()
+        assert [(f["name"], f["model"]) for f in files] == [("lora.safetensors", None)]
+
+        response = await client.get('/experiment/models/detect/missing_folder')
+        assert response.status == 404
@@ -0,0 +1,142 @@
+import os
+import threading
+
+import pytest
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.compiled_models as compiled_models
+import comfy.safetensors_stream
+import comfy.supported_models
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    directory = str(tmp_path / "compiled_models")
+    monkeypatch.setattr(compiled_models, "cache_directory", directory)
+    monkeypatch.setattr(compiled_models, "MAX_BYTES", 1024 ** 3)
+    return directory
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    safetensors.torch.save_file({"weight": torch.randn(4, 8)}, path)
+    return path
+
+
+def sd15_config():
+    unet_config = {
+        "context_dim": 768,
+        "model_channels": 320,
+        "use_linear_in_transformer": False,
+        "adm_in_channels": None,
+        "use_temporal_attention": False,
+        "transformer_depth": [1, 1, 1, 1, 1, 1, 0, 0],
+        "channel_mult": (1, 2, 4, 4),
+    }
+    return comfy.supported_models.SD15(unet_config)
+
+
+def test_save_file_matches_safetensors(tmp_path):
+    sd = {
+        "half": torch.randn(3, dtype=torch.float16),
+        "bf16": torch.randn(2, 5, dtype=torch.bfloat16),
+        "float": torch.randn(7),
+        "scalar": torch.tensor(3, dtype=torch.int64),
+        "empty": torch.zeros(0, 4),
+        "strided": torch.randn(4, 6).t(),
+    }
+    path = str(tmp_path / "out.safetensors")
+    comfy.safetensors_stream.save_file(sd, path, metadata={"a": "b"})
+    loaded = safetensors.torch.load_file(path)
+    assert loaded.keys() == sd.keys()
+    for k in sd:
+        assert loaded[k].dtype == sd[k].dtype and torch.equal(loaded[k], sd[k])
+
+    f = comfy.safetensors_stream.SafetensorsFile(path)
+    assert f.metadata == {"a": "b"}
+    for info in f.tensors.values():
+        assert (f.data_start + info.start) % torch.empty((), dtype=info.dtype).element_size() == 0
+    assert [k for k in os.listdir(tmp_path)] == ["out.safetensors"]
+
+
+def test_save_file_casts_and_concurrent_saves(tmp_path):
+    sd = {"half": torch.randn(3, dtype=torch.float16), "float": torch.randn(5), "int": torch.arange(4)}
+    path = str(tmp_path / "out.safetensors")
+    threads = [threading.Thread(target=comfy.safetensors_stream.save_file, args=(sd, path), kwargs={"dtypes": {"half": torch.float32, "float": torch.float16}}) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    loaded = safetensors.torch.load_file(path)
+    assert loaded["half"].dtype == torch.float32 and torch.equal(loaded["half"], sd["half"].float())
+    assert loaded["float"].dtype == torch.float16 and torch.equal(loaded["float"], sd["float"].half())
+    assert torch.equal(loaded["int"], sd["int"])
+    assert [k for k in os.listdir(tmp_path)] == ["out.safetensors"]
+
+
+def test_get_path(cache, model_file):
+    path = compiled_models.get_path(model_file, {})
+    assert os.path.dirname(path) == cache
+    assert compiled_models.get_path(model_file, {}) == path
+    assert compiled_models.get_path(model_file, {"dtype": torch.float16}) != path
+    assert compiled_models.get_path(model_file, {"custom_operations": object()}) is None
+    assert compiled_models.get_path(str(model_file).replace(".safetensors", ".ckpt"), {}) is None
+
+    safetensors.torch.save_file({"weight": torch.randn(4, 9)}, model_file)
+    assert compiled_models.get_path(model_file, {}) != path
+
+
+def test_disabled(model_file, monkeypatch):
+    monkeypatch.setattr(compiled_models, "cache_directory", None)
+    assert compiled_models.get_path(model_file, {}) is None
+
+
+def test_save_and_load_config(cache, model_file):
+    path = compiled_models.get_path(model_file, {})
+    model_config = sd15_config()
+    info = compiled_models.describe(model_config, 1234, torch.float32)
+    model_config.set_inference_dtype(torch.float16, None)
+
+    module = torch.nn.Linear(8, 4, dtype=torch.float16)
+    sd = {"weight": torch.randn(4, 8), "bias": torch.randn(4), "extra": torch.randn(2)}
+    compiled_models.save(path, sd, info, model_config, module)
+
+    saved = safetensors.torch.load_file(path)
+    # Weights of the module get cast to its dtype, the rest is saved as is
+    assert saved["weight"].dtype == torch.float16 and torch.equal(saved["weight"], sd["weight"].half())
+    assert saved["extra"].dtype == torch.float32
+
+    loaded_config, loaded_info = compiled_models.load_config(path)
+    assert type(loaded_config) is comfy.supported_models.SD15
+    assert loaded_config.unet_config == {k: v for k, v in model_config.unet_config.items() if k != "dtype"}
+    assert loaded_config.unet_config["channel_mult"] == (1, 2, 4, 4)
+    assert loaded_info["parameters"] == 1234 and loaded_info["weight_dtype"] == torch.float32
+
+    loaded_config.set_inference_dtype(torch.float16, None)
+    assert compiled_models.dtypes_match(loaded_info, loaded_config)
+    loaded_config.set_inference_dtype(torch.bfloat16, None)
+    assert not compiled_models.dtypes_match(loaded_info, loaded_config)
+
+
+def test_load_config_missing_or_invalid(cache, tmp_path):
+    assert compiled_models.load_config(os.path.join(cache, "missing.safetensors")) is None
+    path = str(tmp_path / "plain.safetensors")
+    safetensors.torch.save_file({"weight": torch.randn(2)}, path)
+    assert compiled_models.load_config(path) is None
+
+
+def test_trim(cache):
+    os.makedirs(cache)
+    for i, name in enumerate(["a", "b", "c"]):
+        path = os.path.join(cache, "{}.safetensors".format(name))
+        with open(path, "wb") as f:
+            f.write(b"0" * 100)
+        os.utime(path, (i, i))
+    compiled_models.trim(250)
+    assert sorted(os.listdir(cache)) == ["b.safetensors", "c.safetensors"]
@@ -0,0 +1,96 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.conds
+import comfy.samplers as samplers
+
+
+class FakePatcher:
+    def prepare_hook_patches_current_keyframe(self, t, hook_group, model_options):
+        pass
+
+    def prepare_state(self, timestep):
+        pass
+
+    def apply_hooks(self, hooks):
+        return {}
+
+
+class FakeModel:
+    def __init__(self):
+        self.current_patcher = FakePatcher()
+        self.calls = []
+
+    def memory_required(self, input_shape, cond_shapes={}):
+        return 100 * input_shape[0]
+
+    def apply_model(self, x, t, c_crossattn=None, transformer_options={}, **kwargs):
+        self.calls.append(x.shape[0])
+        return x * c_crossattn.mean(dim=(1, 2)).reshape(-1, 1, 1, 1) + t.reshape(-1, 1, 1, 1)
+
+
+def cond(value, **kwargs):
+    return {"model_conds": {"c_crossattn": comfy.conds.CONDCrossAttn(torch.full((1, 4, 8), value))}, "uuid": object(), **kwargs}
+
+
+@pytest.fixture
+def conds():
+    positive = [cond(1.0), cond(2.0, area=[4, 4, 0, 2], strength=0.5), cond(3.0, timestep_start=0.5)]
+    negative = [cond(-1.0)]
+    return [positive, negative]
+
+
+@pytest.fixture
+def planned(monkeypatch):
+    built = []
+    plan_cond_batches = samplers.plan_cond_batches
+    monkeypatch.setattr(samplers, "plan_cond_batches", lambda *a: built.append(a[3]) or plan_cond_batches(*a))
+    return built
+
+
+def test_plan_matches_unplanned(conds, planned):
+    torch.manual_seed(0)
+    model = FakeModel()
+    model_options = {"cond_batch_plan": samplers.CondBatchPlan()}
+    for sigma in (0.9, 0.7, 0.4, 0.2):
+        x = torch.randn(1, 4, 8, 8)
+        timestep = torch.tensor([sigma])
+        expected = samplers._calc_cond_batch(model, conds, x, timestep, {})
+        out = samplers._calc_cond_batch(model, conds, x, timestep, model_options)
+        for a, b in zip(out, expected):
+            assert torch.equal(a, b)
+    # The third cond only starts at 0.5, every other step reused the plan
+    assert len(planned) == 4 + 2
+    assert model.calls[:2] == [2, 1]
+
+
+def test_plan_invalidation(conds, planned, monkeypatch):
+    model = FakeModel()
+    plan = samplers.CondBatchPlan()
+    timestep = torch.tensor([0.4])
+    batches = plan.get_batches(model, conds, torch.zeros(1, 4, 8, 8), timestep, {})
+    assert plan.get_batches(model, conds, torch.zeros(1, 4, 8, 8), timestep, {}) is batches
+    assert sorted(len(b.cond_objs) for b in batches) == [1, 3]
+    assert all(p.input_x is None for b in batches for p in b.cond_objs)
+
+    plan.get_batches(model, conds, torch.zeros(2, 4, 8, 8), timestep, {})
+    plan.get_batches(model, [conds[0]], torch.zeros(1, 4, 8, 8), timestep, {})
+    assert len(planned) == 3
+
+    # Batches that don't fit anymore get planned again
+    monkeypatch.setattr(samplers.model_management, "get_free_memory", lambda *a, **kw: 200)
+    batches = plan.get_batches(model, conds, torch.zeros(1, 4, 8, 8), timestep, {})
+    assert all(len(b.cond_objs) == 1 for b in batches)
+    assert len(planned) == 4
+
+
+def test_plan_limit(planned):
+    model = FakeModel()
+    plan = samplers.CondBatchPlan()
+    for _ in range(samplers.CondBatchPlan.MAX_PLANS + 2):
+        plan.get_batches(model, [[cond(1.0)]], torch.zeros(1, 4, 8, 8), torch.tensor([0.5]), {})
+    assert len(plan.plans) == samplers.CondBatchPlan.MAX_PLANS
@@ -0,0 +1,91 @@
+import json
+import os
+import struct
+
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.header_detection as header_detection
+import comfy.ldm.flux.model
+import comfy.ops
+
+
+def flux_state_dict(prefix="model.diffusion_model.", depth=2):
+    model = comfy.ldm.flux.model.Flux(in_channels=16, out_channels=16, vec_in_dim=768, context_in_dim=4096, hidden_size=3072, mlp_ratio=4.0, num_heads=24,
+                                      depth=depth, depth_single_blocks=3, axes_dim=[16, 56, 56], theta=10000, qkv_bias=True, guidance_embed=True, patch_size=2,
+                                      image_model="flux", txt_ids_dims=[], operations=comfy.ops.disable_weight_init, dtype=torch.bfloat16, device="meta")
+    return {prefix + k: v for k, v in model.state_dict().items()}
+
+
+def write_header_only(path, sd):
+    """A safetensors file with the header of sd and a sparse hole for the data, so nothing gets read."""
+    header = {}
+    offset = 0
+    for k, v in sd.items():
+        size = v.nelement() * v.element_size()
+        header[k] = {"dtype": "BF16", "shape": list(v.shape), "data_offsets": [offset, offset + size]}
+        offset += size
+    header = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.truncate(8 + len(header) + offset)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    header_detection.clear_cache()
+    yield
+    header_detection.clear_cache()
+
+
+def test_detect_checkpoint_and_diffusion_model(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.safetensors")
+    write_header_only(checkpoint, flux_state_dict())
+    diffusion_model = str(tmp_path / "diffusion_model.safetensors")
+    write_header_only(diffusion_model, flux_state_dict(prefix=""))
+
+    for path, prefix in ((checkpoint, "model.diffusion_model."), (diffusion_model, "")):
+        detected = header_detection.detect_file(path)
+        assert detected.to_json() == {
+            "model_type": "Flux",
+            "image_model": "flux",
+            "unet_prefix": prefix,
+            "diffusers": False,
+            "parameters": sum(v.nelement() for v in flux_state_dict().values()),
+            "weight_dtype": "bfloat16",
+            "quantized": False,
+        }
+        assert detected.model_config.unet_config["depth"] == 2
+
+
+def test_cache(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    write_header_only(path, flux_state_dict())
+    detected = header_detection.detect_file(path)
+    assert header_detection.detect_file(path) is detected
+
+    write_header_only(path, flux_state_dict(depth=1))
+    os.utime(path, ns=(0, 0))
+    assert header_detection.detect_file(path).model_config.unet_config["depth"] == 1
+
+
+def test_detect_files(tmp_path):
+    model = str(tmp_path / "model.safetensors")
+    write_header_only(model, flux_state_dict())
+    unknown = str(tmp_path / "unknown.safetensors")
+    write_header_only(unknown, {"lora_unet_a.lora_up.weight": torch.empty(4, 4, device="meta")})
+    invalid = str(tmp_path / "invalid.safetensors")
+    with open(invalid, "wb") as f:
+        f.write(b"not safetensors")
+    ckpt = str(tmp_path / "model.ckpt")
+
+    detected = header_detection.detect_files([model, unknown, invalid, ckpt], threads=2)
+    assert detected[model].model_config.__class__.__name__ == "Flux"
+    assert detected[unknown] is None
+    assert detected[invalid] is None
+    assert detected[ckpt] is None
@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import patch
+
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.lora
+import comfy.model_patcher
+from comfy.weight_adapter.lora import LoRAAdapter
+from comfy.weight_adapter.loha import LoHaAdapter
+from comfy.weight_adapter.lokr import LoKrAdapter
+
+
+class ConvModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.blocks = torch.nn.ModuleList([torch.nn.Linear(64, 64) for _ in range(4)])
+        self.conv = torch.nn.Conv2d(8, 16, 3)
+        self.out = torch.nn.Linear(64, 32)
+
+
+def lora(out_dim, in_dim, rank=8, conv=False):
+    if conv:
+        return LoRAAdapter(set(), (torch.randn(out_dim, rank, 1, 1), torch.randn(rank, in_dim, 3, 3), 4.0, None, None, None))
+    return LoRAAdapter(set(), (torch.randn(out_dim, rank), torch.randn(rank, in_dim), 4.0, None, None, None))
+
+
+def loha(out_dim, in_dim, rank=4):
+    return LoHaAdapter(set(), (torch.randn(out_dim, rank), torch.randn(rank, in_dim), 2.0,
+                               torch.randn(out_dim, rank), torch.randn(rank, in_dim), None, None, None))
+
+
+def lokr(out_dim, in_dim, rank=4):
+    # w1 given, w2 from its factors
+    return LoKrAdapter(set(), (torch.randn(4, 4), None, 2.0, None, None,
+                               torch.randn(out_dim // 4, rank), torch.randn(rank, in_dim // 4), None, None))
+
+
+def make_patches(model):
+    patches = {}
+    for i, block in enumerate(model.blocks):
+        patches["blocks.{}.weight".format(i)] = lora(64, 64, rank=16) if i % 2 == 0 else loha(64, 64, rank=16)
+    patches["out.weight"] = lokr(32, 64)
+    patches["conv.weight"] = lora(16, 8, conv=True)
+    return patches
+
+
+class TestBatchedLoraMerge(unittest.TestCase):
+    def test_products_match_per_key_merge(self):
+        model = ConvModel()
+        patcher = comfy.model_patcher.ModelPatcher(model, torch.device("cpu"), torch.device("cpu"))
+        patcher.add_patches(make_patches(model), 0.8)
+        patcher.add_patches({"blocks.0.weight": lora(64, 64, rank=16)}, 0.5)
+        with patch("torch.bmm", wraps=torch.bmm) as bmm:
+            products = comfy.lora.calculate_matmul_products(patcher.patches, torch.device("cpu"))
+        # The LoRA and LoHa factors all have the same shapes, the LoKr and conv ones are too small
+        self.assertEqual(bmm.call_count, 1)
+        self.assertEqual(len(products["blocks.0.weight"]), 2)
+
+        for key, key_patches in patcher.patches.items():
+            weight = comfy.model_patcher.get_key_weight(model, key)[0]
+            expected = comfy.lora.calculate_weight(key_patches, weight.clone(), key)
+            batched = comfy.lora.calculate_weight(key_patches, weight.clone(), key, matmul_products=products[key])
+            self.assertTrue(torch.equal(expected, batched), key)
+
+    def test_load_matches_per_key_patching(self):
+        model = ConvModel()
+        patches = make_patches(model)
+        patcher = comfy.model_patcher.ModelPatcher(model, torch.device("cpu"), torch.device("cpu"))
+        patcher.add_patches(patches, 1.0)
+        expected = {}
+        for key in patches:
+            patcher.patch_weight_to_device(key, torch.device("cpu"))
+            expected[key] = comfy.model_patcher.get_key_weight(model, key)[0].clone()
+        patcher.unpatch_model(torch.device("cpu"))
+
+        # A small budget so the keys get split over several windows
+        batched_products = comfy.lora.BatchedMatmulProducts(patcher.patches, list(patches), torch.device("cpu"), max_bytes=64 * 64 * 4 * 3)
+        for key in patches:
+            patcher.patch_weight_to_device(key, torch.device("cpu"), batched_products=batched_products)
+            self.assertTrue(torch.equal(comfy.model_patcher.get_key_weight(model, key)[0], expected[key]), key)
+        self.assertEqual(len(batched_products.products), 0)
+        patcher.unpatch_model(torch.device("cpu"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import pytest
+
+import comfy.model_eviction as model_eviction
+
+
+class FakeModule:
+    pass
+
+
+class FakePatcher:
+    def __init__(self):
+        self.model = FakeModule()
+
+
+class FakeLoadedModel:
+    def __init__(self, size, offloaded=0):
+        self.model = FakePatcher()
+        self.size = size
+        self.offloaded = offloaded
+
+    def model_memory(self):
+        return self.size
+
+    def model_offloaded_memory(self):
+        return self.offloaded
+
+
+@pytest.fixture(autouse=True)
+def eviction_state(monkeypatch):
+    monkeypatch.setattr(model_eviction, "telemetry", model_eviction.EvictionTelemetry())
+    monkeypatch.setattr(model_eviction, "_policy", model_eviction.POLICIES["default"])
+    monkeypatch.setattr(model_eviction, "_pending_prompt_models", None)
+    token = model_eviction._current_prompt_models.set(None)
+    yield
+    model_eviction._current_prompt_models.reset(token)
+
+
+def use(loaded_model, names, seconds=1.0):
+    model_eviction.prompt_started(frozenset(names))
+    model_eviction.record_load(loaded_model.model, seconds, loaded_model.size)
+
+
+def order(*loaded_models):
+    return [x[0] for x in model_eviction.order_for_eviction([(m, 2, i) for i, m in enumerate(loaded_models)])]
+
+
+def test_default_policy_prefers_offloaded_models():
+    a = FakeLoadedModel(100)
+    b = FakeLoadedModel(100, offloaded=50)
+    c = FakeLoadedModel(10)
+    assert order(a, b, c) == [b, c, a]
+
+
+def test_cost_policy_keeps_models_of_queued_prompts():
+    model_eviction.set_policy("cost")
+    sd15 = FakeLoadedModel(100)
+    sdxl = FakeLoadedModel(100)
+    flux = FakeLoadedModel(100)
+    use(sd15, ["sd15.safetensors", "vae.safetensors"])
+    use(sdxl, ["sdxl.safetensors", "vae.safetensors"])
+    use(flux, ["flux.safetensors"])
+
+    model_eviction.set_pending_prompt_models(lambda: [frozenset(["sdxl.safetensors", "vae.safetensors"]), frozenset(["sd15.safetensors", "vae.safetensors"])])
+    # flux isn't queued, sd15 is needed after sdxl
+    assert order(sdxl, sd15, flux) == [flux, sd15, sdxl]
+
+    # Without a queue the slowest model to load is kept
+    model_eviction.set_pending_prompt_models(None)
+    slow = FakeLoadedModel(100)
+    use(slow, ["slow.safetensors"], seconds=10.0)
+    assert order(slow, flux)[0] is flux
+
+
+def test_model_names_are_the_ones_common_to_its_prompts():
+    model_eviction.set_policy("cost")
+    model = FakeLoadedModel(100)
+    use(model, ["sd15.safetensors", "lora_a.safetensors"])
+    use(model, ["sd15.safetensors", "lora_b.safetensors"])
+    assert model_eviction.reuse_distance(model.model, [frozenset(["sd15.safetensors"])]) == 0
+    assert model_eviction.reuse_distance(model.model, [frozenset(["lora_a.safetensors"])]) == 1
+
+
+def test_regretted_evictions():
+    model = FakeLoadedModel(100)
+    use(model, ["sd15.safetensors"])
+    model_eviction.record_eviction(model.model)
+    for _ in range(2):
+        model_eviction.prompt_started(frozenset())
+    use(model, ["sd15.safetensors"])
+
+    model_eviction.record_eviction(model.model)
+    for _ in range(model_eviction.EVICTION_REGRET_PROMPTS + 1):
+        model_eviction.prompt_started(frozenset())
+    model_eviction.record_load(model.model, 1.0, model.size)
+
+    stats = model_eviction.get_stats()
+    assert stats["evictions"] == 2
+    assert stats["regretted"] == 1
+    # The first load of the model isn't a reload
+    assert stats["reloads"] == 2
+    assert stats["policy"] == "default"
@@ -0,0 +1,58 @@
+import contextvars
+import threading
+
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.model_management as model_management
+import comfy.model_patcher
+
+CPU = torch.device("cpu")
+
+
+def as_worker(worker_id, f, *args):
+    def run():
+        model_management.current_model_user.set(worker_id)
+        return f(*args)
+    return contextvars.copy_context().run(run)
+
+
+@pytest.fixture
+def patcher():
+    patcher = comfy.model_patcher.ModelPatcher(torch.nn.Linear(4, 4), load_device=CPU, offload_device=CPU)
+    yield patcher
+    for worker_id in (1, 2):
+        as_worker(worker_id, model_management.release_models)
+    model_management.free_memory(1e30, CPU)
+
+
+def is_loaded(patcher):
+    return any(m.model is patcher for m in model_management.current_loaded_models)
+
+
+def test_models_in_use_are_not_unloaded(patcher):
+    as_worker(1, model_management.load_models_gpu, [patcher])
+    assert is_loaded(patcher)
+    as_worker(2, model_management.free_memory, 1e30, CPU)
+    assert is_loaded(patcher)
+    as_worker(1, model_management.free_memory, 1e30, CPU)
+    assert not is_loaded(patcher)
+
+
+def test_clones_wait_for_release(patcher):
+    as_worker(1, model_management.load_models_gpu, [patcher])
+    clone = patcher.clone()
+    loaded = threading.Event()
+    thread = threading.Thread(target=lambda: as_worker(2, model_management.load_models_gpu, [clone]) or loaded.set())
+    thread.start()
+    assert not loaded.wait(0.5)
+    assert is_loaded(patcher)
+
+    as_worker(1, model_management.release_models)
+    assert loaded.wait(10)
+    thread.join()
+    assert is_loaded(clone) and not is_loaded(patcher)
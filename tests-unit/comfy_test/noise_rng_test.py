@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.k_diffusion.sampling
+import comfy.model_sampling
+import comfy.noise_rng as noise_rng
+import comfy.sample
+import comfy.samplers
+
+
+@pytest.mark.parametrize("counter, key, expected", [
+    ((0, 0, 0, 0), (0, 0), (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+    ((0xffffffff,) * 4, (0xffffffff,) * 2, (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+    ((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344), (0xa4093822, 0x299f31d0), (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1)),
+])
+def test_philox_known_answers(counter, key, expected):
+    # Random123 known answer tests of Philox4x32-10
+    out = noise_rng.philox4x32(*[torch.tensor([c], dtype=torch.int64) for c in counter], *key)
+    assert tuple(int(o) for o in out) == expected
+
+
+def test_randn_distribution():
+    noise = noise_rng.randn((4, 4, 32, 32), seed=1234)
+    assert noise.dtype == torch.float32
+    assert abs(noise.mean().item()) < 0.02
+    assert abs(noise.std().item() - 1.0) < 0.02
+
+
+def test_randn_keyed_per_item():
+    batch = noise_rng.randn((4, 3, 5, 7), seed=42)
+    assert torch.equal(noise_rng.randn((1, 3, 5, 7), seed=42, indices=[2])[0], batch[2])
+    assert torch.equal(noise_rng.randn((2, 3, 5, 7), seed=42, indices=[3, 0]), batch[[3, 0]])
+    assert not torch.equal(batch[0], batch[1])
+    assert not torch.equal(noise_rng.randn((4, 3, 5, 7), seed=43), batch)
+    assert not torch.equal(noise_rng.randn((4, 3, 5, 7), seed=42, offset=1), batch)
+    assert not torch.equal(noise_rng.randn((4, 3, 5, 7), seed=42, stream=noise_rng.STREAM_NOISE_SAMPLER), batch)
+    # Seeds over 32 bits use the high half of the key
+    assert not torch.equal(noise_rng.randn((4, 3, 5, 7), seed=42 + (1 << 32)), batch)
+
+
+def loop_prepare_noise(latent_image, seed, noise_inds):
+    generator = torch.manual_seed(seed)
+    unique_inds, inverse = np.unique(noise_inds, return_inverse=True)
+    noises = []
+    for i in range(unique_inds[-1] + 1):
+        noise = torch.randn([1] + list(latent_image.size())[1:], dtype=latent_image.dtype, layout=latent_image.layout, generator=generator, device="cpu")
+        if i in unique_inds:
+            noises.append(noise)
+    noises = [noises[i] for i in inverse]
+    return torch.cat(noises, axis=0)
+
+
+@pytest.mark.parametrize("shape", [(4, 4, 8, 8), (4, 3, 5, 7), (3, 16, 1, 6, 6)])
+@pytest.mark.parametrize("noise_inds", [[0, 1, 2, 3], [3, 1, 1, 7], [5, 5, 5, 0]])
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float16])
+def test_torch_mode_batch_index_unchanged(shape, noise_inds, dtype):
+    noise_inds = noise_inds[:shape[0]]
+    latent = torch.zeros((len(noise_inds),) + shape[1:], dtype=dtype)
+    assert torch.equal(comfy.sample.prepare_noise(latent, 77, noise_inds), loop_prepare_noise(latent, 77, noise_inds))
+
+
+def test_philox_mode(monkeypatch):
+    monkeypatch.setattr(noise_rng, "MODE", "philox")
+    latent = torch.zeros(3, 4, 8, 8)
+    noise = comfy.sample.prepare_noise(latent, 5)
+    assert torch.equal(noise, noise_rng.randn(latent.shape, 5))
+    assert torch.equal(comfy.sample.prepare_noise(latent[:1], 5, [1])[0], noise[1])
+
+    sampler = comfy.k_diffusion.sampling.default_noise_sampler(latent, seed=5)
+    first, second = sampler(None, None), sampler(None, None)
+    assert not torch.equal(first, second)
+    assert not torch.equal(first, noise)
+    assert torch.equal(comfy.k_diffusion.sampling.default_noise_sampler(latent, seed=5)(None, None), first)
+
+
+class FakeModelWrap:
+    """Stands in for the CFGGuider a KSAMPLER samples with, denoises every item on its own."""
+    def __init__(self):
+        class ModelSampling(comfy.model_sampling.ModelSamplingDiscrete, comfy.model_sampling.EPS):
+            pass
+        self.inner_model = type("Model", (), {"model_sampling": ModelSampling()})()
+
+    def __call__(self, x, sigma, model_options={}, seed=None):
+        return x * 0.5
+
+
+@pytest.mark.parametrize("sampler_name", ["euler_ancestral", "dpmpp_2s_ancestral"])
+def test_philox_ancestral_noise_keyed_by_batch_index(monkeypatch, sampler_name):
+    monkeypatch.setattr(noise_rng, "MODE", "philox")
+    model_wrap = FakeModelWrap()
+    sigmas = torch.tensor([14.6, 5.0, 1.0, 0.0])
+    latent = torch.zeros(4, 4, 8, 8)
+
+    def sample(batch_index):
+        noise = comfy.sample.prepare_noise(latent[batch_index], 5, batch_index)
+        extra_args = {"model_options": {}, "seed": 5, "noise_inds": batch_index}
+        return comfy.samplers.ksampler(sampler_name).sample(model_wrap, sigmas, extra_args, None, noise, latent[batch_index])
+
+    batch = sample([0, 1, 2, 3])
+    assert torch.allclose(sample([2])[0], batch[2])
+    assert torch.allclose(sample([3, 1])[0], batch[3])
@@ -0,0 +1,104 @@
+import unittest
+from unittest.mock import patch
+
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.lora
+import comfy.model_patcher
+import comfy.weight_cache
+from comfy.weight_adapter.lora import LoRAAdapter
+
+
+class SimpleModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.layer1 = torch.nn.Linear(16, 32)
+        self.layer2 = torch.nn.Linear(32, 8)
+
+
+def make_lora(model, rank=4):
+    patches = {}
+    for name in ("layer1.weight", "layer2.weight"):
+        out_dim, in_dim = model.get_parameter(name).shape
+        up = torch.randn(out_dim, rank)
+        down = torch.randn(rank, in_dim)
+        patches[name] = LoRAAdapter(set(), (up, down, 1.0, None, None, None))
+    return patches
+
+
+def make_patcher(model, lora, strength=1.0):
+    patcher = comfy.model_patcher.ModelPatcher(model, torch.device("cpu"), torch.device("cpu"))
+    patcher.add_patches(lora, strength)
+    return patcher
+
+
+def patched_weights(patcher):
+    for key in patcher.patches:
+        patcher.patch_weight_to_device(key, torch.device("cpu"))
+    weights = {key: comfy.model_patcher.get_key_weight(patcher.model, key)[0].clone() for key in patcher.patches}
+    patcher.unpatch_model(torch.device("cpu"))
+    return weights
+
+
+class TestPatchedWeightCache(unittest.TestCase):
+    def setUp(self):
+        comfy.weight_cache.set_cache_size(1.0)
+
+    def tearDown(self):
+        comfy.weight_cache.set_cache_size(0)
+
+    def test_switching_back_reuses_merged_weights(self):
+        model = SimpleModel()
+        original = model.layer1.weight.detach().clone()
+        lora_a = make_lora(model)
+        lora_b = make_lora(model)
+
+        with patch("comfy.lora.calculate_weight", wraps=comfy.lora.calculate_weight) as calculate_weight:
+            # A new patcher with the same adapters, like a LoRA loader that ran again
+            first_a = patched_weights(make_patcher(model, lora_a))
+            first_b = patched_weights(make_patcher(model, lora_b))
+            self.assertEqual(calculate_weight.call_count, 4)
+            second_a = patched_weights(make_patcher(model, lora_a))
+            self.assertEqual(calculate_weight.call_count, 4)
+            # A different strength is a different patch set
+            patched_weights(make_patcher(model, lora_a, strength=0.5))
+            self.assertEqual(calculate_weight.call_count, 6)
+
+        for key in first_a:
+            self.assertTrue(torch.equal(first_a[key], second_a[key]))
+            self.assertFalse(torch.equal(first_a[key], first_b[key]))
+        self.assertTrue(torch.equal(model.layer1.weight, original), "Unpatching should restore the original weights")
+
+    def test_byte_cap_evicts_least_recently_used(self):
+        model = SimpleModel()
+        size = sum(model.get_parameter(k).numel() * 4 for k in ("layer1.weight", "layer2.weight"))
+        comfy.weight_cache.set_cache_size(size * 1.5 / (1024 ** 3))
+        lora_a = make_lora(model)
+        lora_b = make_lora(model)
+
+        with patch("comfy.lora.calculate_weight", wraps=comfy.lora.calculate_weight) as calculate_weight:
+            patched_weights(make_patcher(model, lora_a))
+            patched_weights(make_patcher(model, lora_b))
+            self.assertLessEqual(comfy.weight_cache._cache.total_bytes, size * 1.5)
+            patched_weights(make_patcher(model, lora_b))
+            self.assertEqual(calculate_weight.call_count, 4)
+            patched_weights(make_patcher(model, lora_a))
+            self.assertEqual(calculate_weight.call_count, 6)
+
+    def test_entries_are_dropped_with_the_model(self):
+        model = SimpleModel()
+        patched_weights(make_patcher(model, make_lora(model)))
+        self.assertGreater(len(comfy.weight_cache._cache.entries), 0)
+        del model
+        import gc
+        gc.collect()
+        self.assertEqual(len(comfy.weight_cache._cache.entries), 0)
+        self.assertEqual(comfy.weight_cache._cache.total_bytes, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.model_management
+import comfy.model_patcher
+
+
+class FakePatcher:
+    def __init__(self, size):
+        self.model = torch.nn.Identity()
+        self.size = size
+        self.pinned = 0
+
+    def model_size(self):
+        return self.size
+
+    def pin_offloaded_weights(self):
+        self.pinned = self.size
+        return self.size
+
+    def unpin_all_weights(self):
+        self.pinned = 0
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(comfy.model_management, "MAX_PINNED_MEMORY", 10_000)
+    monkeypatch.setattr(comfy.model_management, "TOTAL_PINNED_MEMORY", 0)
+    return comfy.model_management.PinnedModelPool(max_bytes=1000)
+
+
+def test_evicts_least_recently_unloaded(pool):
+    a, b, c = FakePatcher(400), FakePatcher(400), FakePatcher(400)
+    pool.add(a)
+    pool.add(b)
+    pool.add(c)
+    assert a.pinned == 0 and b.pinned == 400 and c.pinned == 400
+    assert pool.total_bytes() == 800
+
+    # b got loaded back to the GPU and unloaded again, it's the most recent now
+    pool.remove(b)
+    pool.add(b)
+    pool.add(a)
+    assert c.pinned == 0 and b.pinned == 400 and a.pinned == 400
+
+    stats = pool.get_stats()
+    assert stats["evictions"] == 2
+    assert [m["bytes"] for m in stats["models"]] == [400, 400]
+
+
+def test_model_larger_than_pool(pool):
+    big = FakePatcher(2000)
+    pool.add(big)
+    assert big.pinned == 0
+    assert pool.total_bytes() == 0
+
+
+def test_dead_models_are_forgotten(pool):
+    a = FakePatcher(400)
+    pool.add(a)
+    del a
+    assert pool.total_bytes() == 0
+
+
+def test_pin_offloaded_weights(monkeypatch):
+    pinned = []
+    monkeypatch.setattr(comfy.model_management, "pin_memory", lambda tensor: pinned.append(tensor) or True)
+    model = torch.nn.Linear(8, 4)
+    patcher = comfy.model_patcher.ModelPatcher(model, torch.device("cpu"), torch.device("cpu"))
+    assert patcher.pin_offloaded_weights() == (8 * 4 + 4) * 4
+    assert patcher.pinned == {"weight", "bias"}
+    # Already pinned weights aren't pinned twice
+    assert patcher.pin_offloaded_weights() == 0
+    patcher.pinned.clear()
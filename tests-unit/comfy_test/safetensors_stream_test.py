@@ -0,0 +1,138 @@
+import json
+import os
+import struct
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.ops
+import comfy.safetensors_stream
+import comfy.sd
+import comfy.utils
+from comfy.ldm.modules.diffusionmodules.openaimodel import UNetModel
+
+
+class Model(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.proj = torch.nn.Linear(32, 16)
+        self.norm = torch.nn.LayerNorm(16)
+        self.register_buffer("steps", torch.zeros(3, dtype=torch.int64))
+
+
+def state_dict():
+    return {
+        "proj.weight": torch.randn(16, 32, dtype=torch.bfloat16),
+        "proj.bias": torch.randn(16, dtype=torch.float16),
+        "norm.weight": torch.randn(16),
+        "norm.bias": torch.randn(16),
+        "steps": torch.arange(3, dtype=torch.int64),
+        "scalar": torch.tensor(2.5),
+        "empty": torch.zeros(0, 4),
+    }
+
+
+class TestSafetensorsStream(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "model.safetensors")
+        self.sd = state_dict()
+        safetensors.torch.save_file(self.sd, self.path, metadata={"format": "pt"})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_load_matches_safetensors(self):
+        # Tiny chunks so the tensors get spread over many reads
+        with patch.object(comfy.safetensors_stream, "READ_CHUNK_BYTES", 256):
+            f = comfy.safetensors_stream.SafetensorsFile(self.path)
+            self.assertGreater(len(f._read_ranges(f.keys())), 2)
+            sd = f.load()
+        self.assertEqual(f.metadata, {"format": "pt"})
+        self.assertEqual(list(sd.keys()), list(safetensors.torch.load_file(self.path).keys()))
+        for k, v in self.sd.items():
+            self.assertEqual(sd[k].dtype, v.dtype, k)
+            self.assertTrue(torch.equal(sd[k], v), k)
+
+    def test_dtype_conversion(self):
+        f = comfy.safetensors_stream.SafetensorsFile(self.path)
+        sd = dict(f.stream(dtype=torch.float16))
+        self.assertEqual(sd["norm.weight"].dtype, torch.float16)
+        self.assertEqual(sd["steps"].dtype, torch.int64)
+        self.assertTrue(torch.equal(sd["norm.weight"], self.sd["norm.weight"].half()))
+
+    def test_load_torch_file_without_mmap(self):
+        with patch.object(comfy.utils, "DISABLE_MMAP", True):
+            sd, metadata = comfy.utils.load_torch_file(self.path, return_metadata=True)
+        self.assertEqual(metadata, {"format": "pt"})
+        self.assertTrue(torch.equal(sd["proj.weight"], self.sd["proj.weight"]))
+
+    def test_corrupt_file(self):
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 8)
+        with patch.object(comfy.utils, "DISABLE_MMAP", True):
+            with self.assertRaisesRegex(ValueError, "corrupt/incomplete"):
+                comfy.utils.load_torch_file(self.path)
+
+    def test_unaligned_tensors(self):
+        # The format allows tensors that aren't aligned to their element size
+        path = os.path.join(self.tmp.name, "unaligned.safetensors")
+        header = json.dumps({"a": {"dtype": "F16", "shape": [3], "data_offsets": [0, 6]}, "b": {"dtype": "F32", "shape": [2], "data_offsets": [6, 14]}}).encode()
+        with open(path, "wb") as f:
+            f.write(struct.pack("<Q", len(header)) + header)
+            f.write(torch.tensor([1, 2, 3], dtype=torch.float16).numpy().tobytes())
+            f.write(torch.tensor([4, 5], dtype=torch.float32).numpy().tobytes())
+        sd = comfy.safetensors_stream.SafetensorsFile(path).load()
+        expected = safetensors.torch.load_file(path)
+        for k in ("a", "b"):
+            self.assertTrue(torch.equal(sd[k], expected[k]), k)
+
+    def test_streamed_diffusion_model(self):
+        # A small unet that gets detected as SD15
+        unet = UNetModel(image_size=32, in_channels=4, out_channels=4, model_channels=320, num_res_blocks=[1], channel_mult=[1], transformer_depth=[1], transformer_depth_output=[1, 1],
+                         transformer_depth_middle=-1, context_dim=768, num_head_channels=64, use_linear_in_transformer=False, adm_in_channels=None, use_spatial_transformer=True,
+                         legacy=False, dtype=torch.float16, operations=comfy.ops.disable_weight_init)
+        sd = {k: torch.randn(v.shape).to(v.dtype) for k, v in unet.state_dict().items()}
+        path = os.path.join(self.tmp.name, "unet.safetensors")
+        safetensors.torch.save_file({"model.diffusion_model." + k: v for k, v in sd.items()}, path)
+
+        expected = comfy.sd.load_diffusion_model(path).model.diffusion_model.state_dict()
+        with patch.object(comfy.utils, "DISABLE_MMAP", True), patch.object(comfy.utils, "load_torch_file", side_effect=AssertionError("the state dict path was used")):
+            model = comfy.sd.load_diffusion_model(path)
+        self.assertEqual(model.model.model_config.__class__.__name__, "SD15")
+        loaded = model.model.diffusion_model.state_dict()
+        self.assertEqual(loaded.keys(), expected.keys())
+        for k, v in expected.items():
+            self.assertTrue(torch.equal(loaded[k], v), k)
+
+    def test_load_into_module(self):
+        model = Model()
+        missing, unexpected = comfy.safetensors_stream.load_into_module(model, self.path)
+        self.assertEqual(missing, [])
+        self.assertEqual(sorted(unexpected), ["empty", "scalar"])
+        self.assertEqual(model.proj.weight.dtype, torch.float32)
+        self.assertTrue(torch.equal(model.proj.weight, self.sd["proj.weight"].float()))
+        self.assertTrue(torch.equal(model.steps, self.sd["steps"]))
+
+        with self.assertRaises(RuntimeError):
+            comfy.utils.load_torch_file_into_module(Model(), self.path)
+
+    def test_load_into_module_with_prefix(self):
+        path = os.path.join(self.tmp.name, "prefixed.safetensors")
+        safetensors.torch.save_file({"first_stage_model." + k: v for k, v in self.sd.items() if k.startswith("proj")}, path)
+        model = Model()
+        missing, unexpected = comfy.safetensors_stream.load_into_module(model, path, prefix="first_stage_model.")
+        self.assertEqual(sorted(missing), ["norm.bias", "norm.weight", "steps"])
+        self.assertEqual(unexpected, [])
+        self.assertTrue(torch.equal(model.proj.bias, self.sd["proj.bias"].float()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.model_sampling
+import comfy.samplers as samplers
+import comfy.schedule_cache as schedule_cache
+from comfy_extras import nodes_align_your_steps, nodes_gits
+
+
+def make_model_sampling(s, c, **parameters):
+    class ModelSampling(s, c):
+        pass
+    model_sampling = ModelSampling()
+    if parameters:
+        model_sampling.set_parameters(**parameters)
+    return model_sampling
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    cache = schedule_cache.ScheduleCache(4)
+    monkeypatch.setattr(schedule_cache, "cache", cache)
+    return cache
+
+
+def uncached_sigmas(model_sampling, scheduler_name, steps):
+    handler = samplers.SCHEDULER_HANDLERS[scheduler_name]
+    if handler.use_ms:
+        return handler.handler(model_sampling, steps)
+    return handler.handler(n=steps, sigma_min=float(model_sampling.sigma_min), sigma_max=float(model_sampling.sigma_max))
+
+
+@pytest.mark.parametrize("scheduler_name", samplers.SCHEDULER_NAMES)
+def test_cached_sigmas_match(scheduler_name, fresh_cache):
+    model_sampling = make_model_sampling(comfy.model_sampling.ModelSamplingDiscrete, comfy.model_sampling.EPS)
+    expected = uncached_sigmas(model_sampling, scheduler_name, 9)
+    first = samplers.calculate_sigmas(model_sampling, scheduler_name, 9)
+    assert torch.equal(first, expected)
+    # Callers can modify the schedules they get
+    first[0] = -1
+    assert torch.equal(samplers.calculate_sigmas(model_sampling, scheduler_name, 9), expected)
+    assert fresh_cache.get_stats()["hits"] == 1
+    assert fresh_cache.get_stats()["misses"] == 1
+
+
+def test_model_sampling_key(fresh_cache):
+    flow = lambda shift: make_model_sampling(comfy.model_sampling.ModelSamplingDiscreteFlow, comfy.model_sampling.CONST, shift=shift)
+    assert schedule_cache.model_sampling_key(flow(3.0)) == schedule_cache.model_sampling_key(flow(3.0))
+    assert schedule_cache.model_sampling_key(flow(3.0)) != schedule_cache.model_sampling_key(flow(1.0))
+    eps = make_model_sampling(comfy.model_sampling.ModelSamplingDiscrete, comfy.model_sampling.EPS)
+    v = make_model_sampling(comfy.model_sampling.ModelSamplingDiscrete, comfy.model_sampling.V_PREDICTION)
+    assert schedule_cache.model_sampling_key(eps) != schedule_cache.model_sampling_key(v)
+
+    sigmas = samplers.calculate_sigmas(flow(3.0), "simple", 4)
+    assert not torch.equal(samplers.calculate_sigmas(flow(1.0), "simple", 4), sigmas)
+    assert torch.equal(samplers.calculate_sigmas(flow(3.0), "simple", 4), sigmas)
+
+
+def test_lru_and_tables(fresh_cache):
+    computed = []
+    compute = lambda steps: lambda: computed.append(steps) or torch.linspace(1, 0, steps + 1)
+    for steps in range(1, 7):
+        schedule_cache.get("linear", "model", steps, compute(steps))
+    assert fresh_cache.get_stats()["entries"] == 4
+    schedule_cache.get("linear", "model", 3, compute(3))
+    schedule_cache.get("linear", "model", 1, compute(1))
+    assert computed == [1, 2, 3, 4, 5, 6, 1]
+
+    # Another function computing the schedule doesn't get the cached ones
+    schedule_cache.get("linear", "model", 3, compute(3), source="other")
+    assert computed[-1] == 3
+
+    schedule_cache.register_table("linear", "model", {3: [3.0, 2.0, 1.0, 0.0]})
+    assert schedule_cache.get("linear", "model", 3, compute(3)).tolist() == [3.0, 2.0, 1.0, 0.0]
+    assert len(computed) == 8
+
+
+def test_disabled_cache_uses_tables(monkeypatch):
+    monkeypatch.setattr(schedule_cache, "cache", schedule_cache.ScheduleCache(0))
+    computed = []
+    compute = lambda: computed.append(1) or torch.ones(3)
+    schedule_cache.get("ones", None, 2, compute)
+    schedule_cache.get("ones", None, 2, compute)
+    assert len(computed) == 2
+    schedule_cache.register_table("ones", None, {2: [2.0, 2.0, 2.0]})
+    assert schedule_cache.get("ones", None, 2, compute).tolist() == [2.0, 2.0, 2.0]
+    assert len(computed) == 2
+
+
+@pytest.mark.parametrize("steps", [4, 10, 25])
+@pytest.mark.parametrize("denoise", [1.0, 0.5])
+def test_schedule_nodes_unchanged(steps, denoise):
+    # The nodes registered their tables in the module cache at import
+    total_steps = round(steps * denoise)
+    for _ in range(2):
+        sigmas = nodes_align_your_steps.NOISE_LEVELS["SDXL"][:]
+        if (steps + 1) != len(sigmas):
+            sigmas = nodes_align_your_steps.loglinear_interp(sigmas, steps + 1)
+        sigmas = sigmas[-(total_steps + 1):]
+        sigmas[-1] = 0
+        out = nodes_align_your_steps.AlignYourStepsScheduler.execute("SDXL", steps, denoise).result[0]
+        assert torch.equal(out, torch.FloatTensor(sigmas))
+
+        if steps <= 20:
+            sigmas = nodes_gits.NOISE_LEVELS[1.2][steps - 2][:]
+        else:
+            sigmas = nodes_gits.loglinear_interp(nodes_gits.NOISE_LEVELS[1.2][-1][:], steps + 1)
+        sigmas = sigmas[-(total_steps + 1):]
+        sigmas[-1] = 0
+        out = nodes_gits.GITSScheduler.execute(1.2, steps, denoise).result[0]
+        assert torch.equal(out, torch.FloatTensor(sigmas))
@@ -0,0 +1,94 @@
+import pytest
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.ops
+import comfy.sd
+import comfy.shared_weights as shared_weights
+from comfy.ldm.modules.diffusionmodules.openaimodel import UNetModel
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    torch.manual_seed(0)
+    sd = {
+        "weight": torch.randn(4, 8),
+        "bias": torch.randn(4),
+        "odd": torch.randn(3, dtype=torch.float16),
+    }
+    safetensors.torch.save_file(sd, path, metadata={"format": "pt"})
+    return path, sd
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(shared_weights, "ENABLED", True)
+
+
+def test_load_safetensors(model_file):
+    path, expected = model_file
+    sd, metadata = shared_weights.load_safetensors(path)
+    assert metadata == {"format": "pt"}
+    assert sd.keys() == expected.keys()
+    for k in sd:
+        assert torch.equal(sd[k], expected[k])
+    assert shared_weights.is_shared(sd["weight"])
+    assert not shared_weights.is_shared(expected["weight"])
+
+
+def test_writes_stay_private(model_file):
+    path, expected = model_file
+    sd, _ = shared_weights.load_safetensors(path)
+    sd["weight"].zero_()
+    sd_again, _ = shared_weights.load_safetensors(path)
+    assert torch.equal(sd_again["weight"], expected["weight"])
+
+
+def test_load_state_dict_assigns_shared_weights(model_file, enabled):
+    path, expected = model_file
+    sd, _ = shared_weights.load_safetensors(path)
+    module = torch.nn.Linear(8, 4)
+    m, u = shared_weights.load_state_dict(module, sd)
+    assert m == [] and u == ["odd"]
+    assert shared_weights.is_shared(module.weight)
+    assert isinstance(module.weight, torch.nn.Parameter)
+    assert torch.equal(module.weight, expected["weight"])
+
+    # Other dtypes get cast, into private memory
+    half = torch.nn.Linear(8, 4, dtype=torch.float16)
+    shared_weights.load_state_dict(half, sd)
+    assert half.weight.dtype == torch.float16
+    assert not shared_weights.is_shared(half.weight)
+    assert torch.equal(half.weight, expected["weight"].half())
+
+
+def test_load_state_dict_disabled(model_file):
+    path, _ = model_file
+    sd, _ = shared_weights.load_safetensors(path)
+    module = torch.nn.Linear(8, 4)
+    shared_weights.load_state_dict(module, sd)
+    assert not shared_weights.is_shared(module.weight)
+
+
+def test_diffusion_model_weights_stay_shared(tmp_path, enabled):
+    # A small unet that gets detected as SD15
+    unet = UNetModel(image_size=32, in_channels=4, out_channels=4, model_channels=320, num_res_blocks=[1], channel_mult=[1], transformer_depth=[1], transformer_depth_output=[1, 1],
+                     transformer_depth_middle=-1, context_dim=768, num_head_channels=64, use_linear_in_transformer=False, adm_in_channels=None, use_spatial_transformer=True,
+                     legacy=False, operations=comfy.ops.disable_weight_init)
+    path = str(tmp_path / "unet.safetensors")
+    safetensors.torch.save_file({"model.diffusion_model." + k: torch.randn(v.shape) for k, v in unet.state_dict().items()}, path)
+
+    patcher = comfy.sd.load_diffusion_model(path, model_options={"dtype": torch.float32})
+    diffusion_model = patcher.model.diffusion_model
+    assert all(shared_weights.is_shared(v) for v in diffusion_model.state_dict().values())
+    patcher.patch_model(device_to=torch.device("cpu"))
+    # The copies a round trip through the GPU leaves behind
+    diffusion_model.to(torch.float64).to(torch.float32)
+    assert not any(shared_weights.is_shared(v) for v in diffusion_model.state_dict().values())
+    patcher.unpatch_model(device_to=torch.device("cpu"))
+    assert all(shared_weights.is_shared(v) for v in diffusion_model.state_dict().values())
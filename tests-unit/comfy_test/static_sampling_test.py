@@ -0,0 +1,106 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.k_diffusion.sampling as k_diffusion_sampling
+import comfy.ops
+import comfy.samplers
+import comfy.sd
+import comfy.static_sampling as static_sampling
+import safetensors.torch
+from comfy.ldm.modules.diffusionmodules.openaimodel import UNetModel
+
+
+def model(x, sigma, scale=1.0):
+    return torch.tanh(x * scale) / (sigma.reshape(-1, 1, 1, 1) ** 2 + 1) ** 0.5
+
+
+def sigmas():
+    return k_diffusion_sampling.get_sigmas_karras(12, 0.03, 14.6)
+
+
+@pytest.mark.parametrize("sampler_name", list(static_sampling.SAMPLERS))
+def test_static_matches_dynamic(sampler_name):
+    torch.manual_seed(0)
+    x = torch.randn(2, 4, 8, 8) * 14.6
+    dynamic_steps = []
+    static_steps = []
+    dynamic = getattr(k_diffusion_sampling, "sample_{}".format(sampler_name))(model, x, sigmas(), extra_args={"scale": 0.5}, callback=dynamic_steps.append, disable=True)
+    static = static_sampling.sample_static(model, x, sigmas(), extra_args={"scale": 0.5}, callback=static_steps.append, disable=True, sampler_name=sampler_name)
+    assert torch.equal(static, dynamic)
+    assert len(static_steps) == len(dynamic_steps) == 12
+    for a, b in zip(static_steps, dynamic_steps):
+        assert a["i"] == b["i"] and torch.equal(a["x"], b["x"]) and torch.equal(a["denoised"], b["denoised"])
+
+
+def test_no_steps():
+    x = torch.randn(1, 4, 8, 8)
+    assert static_sampling.sample_static(model, x, torch.tensor([1.0]), disable=True) is x
+
+
+def test_ksampler(monkeypatch):
+    assert comfy.samplers.ksampler("euler").sampler_function is k_diffusion_sampling.sample_euler
+    monkeypatch.setattr(static_sampling, "MODE", "eager")
+    assert comfy.samplers.ksampler("euler").sampler_function is not k_diffusion_sampling.sample_euler
+    # Samplers with options and the ones without a static loop stay dynamic
+    assert comfy.samplers.ksampler("euler", {"s_churn": 1.0}).sampler_function is k_diffusion_sampling.sample_euler
+    assert comfy.samplers.ksampler("heun").sampler_function is k_diffusion_sampling.sample_heun
+    assert comfy.samplers.sampler_object("uni_pc").sampler_function is not comfy.samplers.uni_pc.sample_unipc
+    monkeypatch.setattr(static_sampling, "MODE", None)
+    assert comfy.samplers.sampler_object("uni_pc").sampler_function is comfy.samplers.uni_pc.sample_unipc
+
+
+@pytest.fixture(scope="module")
+def unet(tmp_path_factory):
+    # A small unet that gets detected as SD15
+    torch.manual_seed(0)
+    unet = UNetModel(image_size=32, in_channels=4, out_channels=4, model_channels=320, num_res_blocks=[1], channel_mult=[1], transformer_depth=[1], transformer_depth_output=[1, 1],
+                     transformer_depth_middle=-1, context_dim=768, num_head_channels=64, use_linear_in_transformer=False, adm_in_channels=None, use_spatial_transformer=True,
+                     legacy=False, operations=comfy.ops.disable_weight_init)
+    path = str(tmp_path_factory.mktemp("static_sampling") / "unet.safetensors")
+    safetensors.torch.save_file({"model.diffusion_model." + k: torch.randn(v.shape) * 0.02 for k, v in unet.state_dict().items()}, path)
+    return comfy.sd.load_diffusion_model(path, model_options={"dtype": torch.float32})
+
+
+def sample_unet(patcher, sampler_name, cfg=7.0):
+    torch.manual_seed(1)
+    positive = [[torch.randn(1, 77, 768), {}]]
+    negative = [[torch.randn(1, 77, 768), {}]]
+    noise = torch.randn(1, 4, 8, 8)
+    sigmas = comfy.samplers.calculate_sigmas(patcher.get_model_object("model_sampling"), "karras", 4)
+    steps = []
+    samples = comfy.samplers.sample(patcher, noise, positive, negative, cfg, "cpu", comfy.samplers.sampler_object(sampler_name), sigmas, model_options=patcher.model_options,
+                                    latent_image=torch.zeros(1, 4, 8, 8), callback=lambda *args: steps.append(args[1]), disable_pbar=True, seed=0)
+    return samples, steps
+
+
+@pytest.mark.parametrize("sampler_name", ["euler", "dpmpp_2m", "uni_pc", "uni_pc_bh2"])
+@pytest.mark.parametrize("cfg", [7.0, 1.0])
+def test_frozen_model_call_matches_dynamic(unet, monkeypatch, sampler_name, cfg):
+    dynamic, dynamic_steps = sample_unet(unet, sampler_name, cfg)
+    monkeypatch.setattr(static_sampling, "MODE", "eager")
+    frozen = []
+    frozen_model = static_sampling.frozen_model
+    monkeypatch.setattr(static_sampling, "frozen_model", lambda *args: frozen.append(frozen_model(*args)) or frozen[-1])
+    static, static_steps = sample_unet(unet, sampler_name, cfg)
+    assert len(frozen) == 1 and frozen[0] is not None
+    assert torch.equal(static, dynamic)
+    assert len(static_steps) == len(dynamic_steps)
+    for a, b in zip(static_steps, dynamic_steps):
+        assert torch.equal(a, b)
+
+
+def test_patched_models_keep_the_dynamic_model_call(unet, monkeypatch):
+    patcher = unet.clone()
+    patcher.set_model_sampler_cfg_function(lambda args: args["cond"])
+    dynamic, _ = sample_unet(patcher, "euler")
+    monkeypatch.setattr(static_sampling, "MODE", "eager")
+    frozen = []
+    frozen_model = static_sampling.frozen_model
+    monkeypatch.setattr(static_sampling, "frozen_model", lambda *args: frozen.append(frozen_model(*args)) or frozen[-1])
+    static, _ = sample_unet(patcher, "euler")
+    assert frozen == [None]
+    assert torch.equal(static, dynamic)
@@ -0,0 +1,115 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.model_base
+import comfy.model_management
+import comfy.model_patcher
+import comfy.sample
+import comfy.step_cache as step_cache
+import comfy.supported_models
+
+
+class TinyUnet(torch.nn.Module):
+    def __init__(self, device=None, operations=None, **kwargs):
+        super().__init__()
+        self.dtype = torch.float32
+        self.proj_in = torch.nn.Conv2d(4, 8, 1)
+        self.blocks = torch.nn.ModuleList([torch.nn.Conv2d(8, 8, 3, padding=1) for _ in range(3)])
+        self.proj_out = torch.nn.Conv2d(8, 4, 1)
+        self.first_block_runs = 0
+        self.runs = 0
+        self.blocks[0].register_forward_hook(self.count_first_block)
+        self.proj_out.register_forward_hook(self.count_run)
+
+    def count_first_block(self, module, args, output):
+        self.first_block_runs += 1
+
+    def count_run(self, module, args, output):
+        self.runs += 1
+
+    def forward(self, x, timesteps=None, context=None, control=None, transformer_options={}, **kwargs):
+        # Mostly predicts the input as the noise, so sampling converges
+        h = self.proj_in(x) * (1 + context.mean(dim=(1, 2)).reshape(-1, 1, 1, 1))
+        h = h + (timesteps / 1000).reshape(-1, 1, 1, 1)
+        for block in self.blocks:
+            h = h + torch.tanh(block(h))
+        return 0.9 * x + 0.1 * torch.tanh(self.proj_out(h))
+
+
+def make_model():
+    unet_config = {
+        "context_dim": 8,
+        "model_channels": 320,
+        "use_linear_in_transformer": False,
+        "adm_in_channels": None,
+        "use_temporal_attention": False,
+        "transformer_depth": [1, 1, 1, 1, 1, 1, 0, 0],
+        "channel_mult": (1, 2, 4, 4),
+    }
+    torch.manual_seed(0)
+    base = comfy.model_base.BaseModel(comfy.supported_models.SD15(unet_config), unet_model=TinyUnet)
+    return comfy.model_patcher.ModelPatcher(base, comfy.model_management.get_torch_device(), torch.device("cpu"))
+
+
+@pytest.fixture(scope="module")
+def model():
+    return make_model()
+
+
+def sample(model, steps=20):
+    generator = torch.manual_seed(1)
+    latent = torch.zeros(1, 4, 8, 8)
+    noise = torch.randn(latent.shape, generator=generator)
+    positive = [[torch.ones(1, 3, 8) * 0.5, {}]]
+    negative = [[torch.zeros(1, 3, 8), {}]]
+    return comfy.sample.sample(model, noise, steps, 4.0, "euler", "normal", positive, negative, latent, disable_pbar=True, seed=1)
+
+
+@pytest.mark.parametrize("policy,threshold", [("relative_l1", 0.2), ("first_block", 0.1), ("teacache", 0.2)])
+def test_policies_skip_steps(model, policy, threshold):
+    reference = sample(model)
+    diffusion_model = model.model.diffusion_model
+    runs = diffusion_model.runs
+    first_block_runs = diffusion_model.first_block_runs
+
+    cache = step_cache.StepCache(step_cache.POLICIES[policy](threshold), start_percent=0.0, end_percent=1.0)
+    output = sample(step_cache.apply(model, cache))
+    run = cache.runs[-1]
+    assert run["steps"] == 20 and 0 < run["skipped"] < 20
+    # cond and uncond are one batch, one model call per computed step
+    assert diffusion_model.runs - runs == 20 - run["skipped"]
+    if policy == "first_block":
+        assert diffusion_model.first_block_runs - first_block_runs == 20
+    assert step_cache.relative_l1(output, reference) < 0.05
+    assert "step_cache" not in model.model_options["transformer_options"]
+
+
+def test_zero_threshold_matches_reference(model):
+    reference = sample(model)
+    cache = step_cache.StepCache(step_cache.RelativeL1Policy(0.0))
+    assert torch.equal(sample(step_cache.apply(model, cache)), reference)
+    assert cache.runs[-1]["skipped"] == 0
+
+
+def test_fit_and_benchmark(model):
+    cache = step_cache.StepCache(step_cache.RelativeL1Policy(0.0), record_history=True)
+    sample(step_cache.apply(model, cache))
+    history = cache.runs[-1]["history"]
+    assert len(history) == 20 and history[0] == (None, None)
+    coefficients = step_cache.fit_polynomial(history, degree=2)
+    assert len(coefficients) == 3
+
+    results = step_cache.benchmark(model, sample, {
+        "relative_l1": step_cache.StepCache(step_cache.RelativeL1Policy(0.2)),
+        "teacache": step_cache.StepCache(step_cache.TeaCachePolicy(0.2, coefficients)),
+    })
+    assert set(results) == {"reference", "relative_l1", "teacache"}
+    assert results["reference"]["relative_l1"] == 0.0
+    for name in ("relative_l1", "teacache"):
+        assert 0 <= results[name]["skip_ratio"] < 1
+        assert results[name]["psnr"] > 20
+    assert step_cache.get_stats()["runs"] >= 3
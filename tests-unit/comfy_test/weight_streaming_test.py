@@ -0,0 +1,112 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.ops
+import comfy.weight_streaming as weight_streaming
+
+# Weights on "cpu" count as offloaded for a streamer to "cpu:0", this runs the streaming without a GPU
+STREAM_DEVICE = torch.device("cpu", 0)
+
+
+class Net(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.proj_in = comfy.ops.manual_cast.Linear(8, 16)
+        self.blocks = torch.nn.ModuleList([torch.nn.Sequential(comfy.ops.manual_cast.Linear(16, 16), torch.nn.GELU(), comfy.ops.manual_cast.Linear(16, 16)) for _ in range(3)])
+        self.single_blocks = torch.nn.ModuleList([comfy.ops.manual_cast.Linear(16, 16, bias=False) for _ in range(2)])
+
+    def forward(self, x, reverse=False):
+        x = self.proj_in(x)
+        blocks = list(self.blocks) + list(self.single_blocks)
+        for block in (reversed(blocks) if reverse else blocks):
+            x = block(x)
+        return x
+
+
+@pytest.fixture(autouse=True)
+def fresh_telemetry(monkeypatch):
+    monkeypatch.setattr(weight_streaming, "telemetry", weight_streaming.StreamingTelemetry())
+
+
+@pytest.fixture
+def net():
+    torch.manual_seed(0)
+    net = Net()
+    with torch.no_grad():
+        for p in net.parameters():
+            p.copy_(torch.randn_like(p) * 0.3)
+    for m in net.modules():
+        if hasattr(m, "comfy_cast_weights"):
+            m.comfy_cast_weights = True
+            # The class level lists are shared by all the layers, other tests append to them
+            m.weight_function = []
+            m.bias_function = []
+    return net
+
+
+def test_find_blocks(net):
+    assert weight_streaming.find_blocks(net) == list(net.blocks) + list(net.single_blocks)
+
+
+def test_streamed_results_match(net, monkeypatch):
+    x = torch.randn(2, 8)
+    expected = net(x)
+    expected_reverse = net(x, reverse=True)
+
+    taken = []
+    take_prefetched = weight_streaming.take_prefetched
+    monkeypatch.setattr(weight_streaming, "take_prefetched", lambda m, d: taken.append(m) or take_prefetched(m, d))
+    streamer = weight_streaming.BlockStreamer(net, STREAM_DEVICE)
+    # The first call records the block order
+    assert torch.equal(net(x), expected)
+    assert streamer.recording == list(net.blocks) + list(net.single_blocks)
+    assert len(taken) == 0
+    for _ in range(2):
+        assert torch.equal(net(x), expected)
+    assert streamer.order == list(net.blocks) + list(net.single_blocks)
+    assert len(taken) == 2 * (3 * 2 + 2)
+    assert weight_streaming.telemetry.get_stats()["blocks"] == 2 * 5
+    assert all(buffer is not None for buffer in streamer.ring)
+    assert len(streamer.ring) == weight_streaming.RING_BLOCKS
+
+    # Another order stops the streaming until it got recorded again
+    assert torch.equal(net(x, reverse=True), expected_reverse)
+    assert streamer.order is None
+    assert torch.equal(net(x, reverse=True), expected_reverse)
+    assert torch.equal(net(x, reverse=True), expected_reverse)
+    assert streamer.order == list(reversed(list(net.blocks) + list(net.single_blocks)))
+
+    streamer.remove()
+    assert not any(hasattr(m, "comfy_prefetched") for m in net.modules())
+    assert all(buffer is None for buffer in streamer.ring)
+
+
+def test_weight_functions_and_replaced_weights(net):
+    x = torch.randn(2, 8)
+    net.blocks[1][0].weight_function = [lambda w: w * 2]
+    expected = net(x)
+
+    streamer = weight_streaming.BlockStreamer(net, STREAM_DEVICE)
+    net(x)
+    assert torch.equal(net(x), expected)
+    # The function modifies the streamed copy, never the weight
+    assert torch.equal(net(x), expected)
+
+    # Weights replaced after they got copied ahead are cast the regular way
+    net.blocks[0][0].weight = torch.nn.Parameter(net.blocks[0][0].weight * 0)
+    expected = Net.forward(net, x)
+    assert torch.equal(net(x), expected)
+    streamer.remove()
+
+
+def test_ring_bytes(net):
+    streamer = weight_streaming.BlockStreamer(net, STREAM_DEVICE, ring_blocks=3)
+    block_bytes = 2 * (16 * 16 + 16) * 4
+    aligned = sum((n + weight_streaming.ALIGNMENT - 1) // weight_streaming.ALIGNMENT * weight_streaming.ALIGNMENT for n in (16 * 16 * 4, 16 * 4, 16 * 16 * 4, 16 * 4))
+    assert aligned >= block_bytes
+    assert streamer.ring_bytes() == 3 * aligned
+    streamer.remove()
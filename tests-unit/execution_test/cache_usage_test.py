@@ -0,0 +1,122 @@
+from typing import NamedTuple
+from unittest.mock import patch, MagicMock
+
+import pytest
+import torch
+
+# Native extension modules can't be initialized twice, so import them before patch.dict
+# drops everything imported inside the block from sys.modules again.
+import psutil  # noqa: F401
+import safetensors.torch  # noqa: F401
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    from comfy_execution.caching import ByteBudgetCache, CacheKeySetID, CacheUsage, HierarchicalCache, get_value_storages
+    from comfy_execution.graph import DynamicPrompt
+
+
+class Entry(NamedTuple):
+    ui: dict
+    outputs: list
+
+
+class FakePatcher:
+    def __init__(self, model, size):
+        self.model = model
+        self.size = size
+
+    def get_ram_usage(self):
+        return self.size
+
+
+def make_prompt(*node_ids):
+    return DynamicPrompt({node_id: {"class_type": "Node", "inputs": {}} for node_id in node_ids})
+
+
+def tensor_of_bytes(size):
+    return torch.zeros(size, dtype=torch.uint8)
+
+
+class TestValueStorages:
+    def test_counts_tensors_once_per_storage(self):
+        tensor = tensor_of_bytes(1000)
+        latent = {"samples": tensor, "batch_index": [0]}
+        storages = get_value_storages(Entry(ui=None, outputs=[[latent], [tensor[:10], tensor.view(10, 100)]]))
+        assert sum(storages.values()) == 1000
+
+    def test_strings_and_nested_lists(self):
+        storages = get_value_storages([["a" * 100, ["b" * 50, 3, None]]])
+        assert sum(storages.values()) == 150
+
+    def test_model_patcher_clones_share_weights(self):
+        model = torch.nn.Linear(1, 1)
+        storages = get_value_storages([[FakePatcher(model, 10000), FakePatcher(model, 10000)]])
+        assert sum(storages.values()) == 10000
+
+
+class TestCacheUsage:
+    def test_shared_storage_released_with_last_entry(self):
+        usage = CacheUsage()
+        tensor = tensor_of_bytes(1000)
+        a = usage.add([[tensor]])
+        b = usage.add([[tensor, tensor_of_bytes(10)]])
+        assert usage.total_bytes == 1010
+        usage.remove(a)
+        assert usage.total_bytes == 1010
+        usage.remove(b)
+        assert usage.total_bytes == 0 and usage.entries == 0
+
+    @pytest.mark.asyncio
+    async def test_hierarchical_cache_accounting(self):
+        cache = HierarchicalCache(CacheKeySetID)
+        await cache.set_prompt(make_prompt("1", "2"), ["1", "2"], None)
+        cache.set("1", Entry(ui=None, outputs=[[tensor_of_bytes(100)]]))
+        cache.set("2", Entry(ui=None, outputs=[[tensor_of_bytes(200)]]))
+        assert cache.usage.total_bytes == 300
+        # Setting the same value again (write back on touch) doesn't count it twice
+        cache.set("2", cache.get("2"))
+        assert cache.usage.total_bytes == 300
+
+        await cache.set_prompt(make_prompt("2"), ["2"], None)
+        cache.clean_unused()
+        assert cache.usage.total_bytes == 200
+        assert cache.usage.evictions == 1
+
+
+class TestByteBudgetCache:
+    @pytest.mark.asyncio
+    async def test_evicts_cheapest_bytes_first(self):
+        cache = ByteBudgetCache(CacheKeySetID, max_bytes=150_000)
+        await cache.set_prompt(make_prompt("1", "2", "3"), ["1", "2", "3"], None)
+        # big and quick to recompute
+        cache.set("1", Entry(ui=None, outputs=[[tensor_of_bytes(100_000)]]), execution_time=0.01)
+        # big and slow to recompute
+        cache.set("2", Entry(ui=None, outputs=[[tensor_of_bytes(100_000)]]), execution_time=10.0)
+        # small and quick
+        cache.set("3", Entry(ui=None, outputs=[["a cat"]]), execution_time=0.01)
+        # Entries of the running prompt are never evicted
+        assert cache.usage.total_bytes > cache.max_bytes
+        assert cache.usage.entries == 3
+
+        await cache.set_prompt(make_prompt("4"), ["4"], None)
+        cache.clean_unused()
+        assert cache.usage.total_bytes <= cache.max_bytes
+        assert cache.usage.evictions == 1
+
+        await cache.set_prompt(make_prompt("1", "2", "3"), ["1", "2", "3"], None)
+        assert cache.get("1") is None
+        assert cache.get("2") is not None
+        assert cache.get("3") is not None
+
+    @pytest.mark.asyncio
+    async def test_evicts_during_execution(self):
+        cache = ByteBudgetCache(CacheKeySetID, max_bytes=150_000)
+        await cache.set_prompt(make_prompt("1"), ["1"], None)
+        cache.set("1", Entry(ui=None, outputs=[[tensor_of_bytes(100_000)]]), execution_time=1.0)
+
+        await cache.set_prompt(make_prompt("2"), ["2"], None)
+        cache.clean_unused()
+        assert cache.usage.entries == 1
+        cache.set("2", Entry(ui=None, outputs=[[tensor_of_bytes(100_000)]]), execution_time=1.0)
+        assert cache.usage.entries == 1
+        assert cache.get("2") is not None
@@ -0,0 +1,110 @@
+import os
+import threading
+from typing import NamedTuple
+from unittest.mock import patch, MagicMock
+
+import pytest
+import torch
+
+# Native extension modules can't be initialized twice, so import them before patch.dict
+# drops everything imported inside the block from sys.modules again.
+import psutil  # noqa: F401
+import safetensors.torch  # noqa: F401
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    from comfy_execution.caching import DiskCache, Unhashable, key_digest
+
+
+class Entry(NamedTuple):
+    ui: dict
+    outputs: list
+
+
+def make_key(*items):
+    return frozenset(zip(range(len(items)), items))
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "outputs")
+
+
+class TestKeyDigest:
+    def test_digest_is_stable_for_equal_keys(self):
+        a = frozenset([("seed", 1), ("text", "a cat"), ("steps", 20)])
+        b = frozenset([("steps", 20), ("text", "a cat"), ("seed", 1)])
+        assert key_digest(a) == key_digest(b)
+
+    def test_digest_differs_for_different_keys(self):
+        assert key_digest(make_key("a", 1)) != key_digest(make_key("a", 2))
+
+    def test_unhashable_keys_are_not_persisted(self):
+        assert key_digest(make_key("a", Unhashable())) is None
+        assert key_digest(make_key("a", float("NaN"))) is None
+
+
+class TestDiskCache:
+    def test_roundtrip(self, cache_dir):
+        cache = DiskCache(cache_dir, 1024 ** 2, Entry)
+        latent = {"samples": torch.randn(1, 4, 8, 8)}
+        image = torch.rand(1, 8, 8, 3)
+        entry = Entry(ui={"images": [{"filename": "a.png"}]}, outputs=[[latent], [image, image], ["text", 3]])
+        key = make_key("VAEEncode", 1)
+        assert cache.put(key, entry)
+
+        loaded = cache.get(key)
+        assert loaded.ui == entry.ui
+        assert torch.equal(loaded.outputs[0][0]["samples"], latent["samples"])
+        assert torch.equal(loaded.outputs[1][0], image)
+        assert torch.equal(loaded.outputs[1][1], image)
+        assert loaded.outputs[2] == ["text", 3]
+
+    def test_survives_restart(self, cache_dir):
+        key = make_key("CLIPTextEncode", "a cat")
+        DiskCache(cache_dir, 1024 ** 2, Entry).put(key, Entry(ui=None, outputs=[[torch.ones(4)]]))
+
+        cache = DiskCache(cache_dir, 1024 ** 2, Entry)
+        assert torch.equal(cache.get(key).outputs[0][0], torch.ones(4))
+
+    def test_non_persistable_outputs_are_skipped(self, cache_dir):
+        cache = DiskCache(cache_dir, 1024 ** 2, Entry)
+        key = make_key("CheckpointLoaderSimple", "model.safetensors")
+        assert not cache.put(key, Entry(ui=None, outputs=[[object()]]))
+        assert cache.get(key) is None
+
+    def test_too_large_entries_are_not_copied(self, cache_dir):
+        cache = DiskCache(cache_dir, 1024 ** 2, Entry)
+        # 8GB if it got cloned
+        huge = torch.zeros(1).expand(2 ** 31)
+        assert not cache.put(make_key("node", 1), Entry(ui=None, outputs=[[huge]]))
+        assert os.listdir(cache_dir) == []
+
+    def test_lru_eviction_respects_size_cap(self, cache_dir):
+        cache = DiskCache(cache_dir, 3000, Entry)
+        keys = [make_key("node", i) for i in range(3)]
+        for key in keys[:2]:
+            assert cache.put(key, Entry(ui=None, outputs=[[torch.zeros(256)]]))
+        # touch the first entry so the second one is the least recently used
+        assert cache.get(keys[0]) is not None
+        assert cache.put(keys[2], Entry(ui=None, outputs=[[torch.zeros(256)]]))
+
+        assert cache.total_bytes <= 3000
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) is not None
+        assert cache.get(keys[2]) is not None
+        assert len(os.listdir(cache_dir)) == 2
+
+    def test_concurrent_puts_of_the_same_entry(self, cache_dir):
+        cache = DiskCache(cache_dir, 1024 ** 2, Entry)
+        key = make_key("node", 1)
+        value = torch.arange(4096, dtype=torch.float32)
+        threads = [threading.Thread(target=cache.put, args=(key, Entry(ui=None, outputs=[[value]]))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert os.listdir(cache_dir) == ["{}.safetensors".format(key_digest(key))]
+        assert cache.total_bytes == os.path.getsize(os.path.join(cache_dir, os.listdir(cache_dir)[0]))
+        assert torch.equal(cache.get(key).outputs[0][0], value)
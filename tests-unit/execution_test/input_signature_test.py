@@ -0,0 +1,132 @@
+import asyncio
+import time
+from unittest.mock import patch, MagicMock
+
+# Native extension modules can't be initialized twice, so import them before patch.dict
+# drops everything imported inside the block from sys.modules again.
+import psutil  # noqa: F401
+import safetensors.torch  # noqa: F401
+import torch
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    import comfy_execution.caching as caching
+    from comfy_execution.graph import DynamicPrompt
+
+
+class StubNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {}}
+
+
+class NotIdempotentNode(StubNode):
+    NOT_IDEMPOTENT = True
+
+
+class NoIsChanged:
+    async def get(self, node_id):
+        return False
+
+
+def chain_prompt(length, seed=0):
+    prompt = {"0": {"class_type": "Stub", "inputs": {"seed": seed}}}
+    for i in range(1, length):
+        prompt[str(i)] = {"class_type": "Stub", "inputs": {"value": [str(i - 1), 0], "index": i}}
+    return prompt
+
+
+def signatures(prompt):
+    key_set = caching.CacheKeySetInputSignature(DynamicPrompt(prompt), prompt.keys(), NoIsChanged())
+    asyncio.run(key_set.add_keys(prompt.keys()))
+    return key_set
+
+
+def setup_module():
+    caching.nodes.NODE_CLASS_MAPPINGS = {"Stub": StubNode, "NotIdempotent": NotIdempotentNode}
+    caching.NODE_CLASS_CONTAINS_UNIQUE_ID.clear()
+
+
+def test_signatures_depend_on_ancestors():
+    a = signatures(chain_prompt(5, seed=1))
+    b = signatures(chain_prompt(5, seed=2))
+    for node_id in a.keys:
+        assert a.get_data_key(node_id) != b.get_data_key(node_id)
+
+
+def test_signatures_are_reused_between_prompts():
+    prompt_a = chain_prompt(5)
+    prompt_b = chain_prompt(5)
+    prompt_b["4"]["inputs"]["index"] = 100
+    a = signatures(prompt_a)
+    b = signatures(prompt_b)
+    for node_id in ["0", "1", "2", "3"]:
+        assert a.get_data_key(node_id) is b.get_data_key(node_id)
+    assert a.get_data_key("4") != b.get_data_key("4")
+
+
+def test_shared_ancestor():
+    prompt = {
+        "1": {"class_type": "Stub", "inputs": {"seed": 1}},
+        "2": {"class_type": "Stub", "inputs": {"a": ["1", 0]}},
+        "3": {"class_type": "Stub", "inputs": {"a": ["1", 0]}},
+        "4": {"class_type": "Stub", "inputs": {"a": ["2", 0], "b": ["3", 0]}},
+    }
+    key_set = signatures(prompt)
+    assert key_set.get_data_key("2") == key_set.get_data_key("3")
+    assert len(key_set.signatures) == 4
+
+
+def test_not_idempotent_nodes_include_node_id():
+    prompt = {
+        "1": {"class_type": "NotIdempotent", "inputs": {"seed": 1}},
+        "2": {"class_type": "NotIdempotent", "inputs": {"seed": 1}},
+    }
+    key_set = signatures(prompt)
+    assert key_set.get_data_key("1") != key_set.get_data_key("2")
+
+
+def test_deep_graphs_do_not_recurse():
+    key_set = signatures(chain_prompt(5000))
+    assert len(key_set.signatures) == 5000
+
+
+def test_unchanged_nodes_are_not_rebuilt(monkeypatch):
+    signatures(chain_prompt(1500))
+    prompt = chain_prompt(1500)
+    prompt["1499"]["inputs"]["index"] = -1
+    rebuilt = []
+    get_immediate_node_signature = caching.CacheKeySetInputSignature.get_immediate_node_signature
+    async def counting(self, dynprompt, node_id):
+        rebuilt.append(node_id)
+        return await get_immediate_node_signature(self, dynprompt, node_id)
+    monkeypatch.setattr(caching.CacheKeySetInputSignature, "get_immediate_node_signature", counting)
+    signatures(prompt)
+    assert rebuilt == ["1499"]
+
+
+def test_tensor_inputs_are_not_memoized():
+    tensor = torch.zeros(4)
+    prompt = {"1": {"class_type": "Stub", "inputs": {"value": tensor}}}
+    a = signatures(prompt)
+    tensor[0] = 1
+    b = signatures(prompt)
+    assert a.get_data_key("1") != b.get_data_key("1")
+
+
+def test_signatures_of_a_large_unchanged_prompt_are_fast():
+    prompt = chain_prompt(1500)
+    for node in prompt.values():
+        node["inputs"]["text"] = "a photo of a cat, highly detailed, " * 8
+    signatures(prompt)
+
+    def seconds(memoized):
+        start = time.perf_counter()
+        for i in range(5):
+            if not memoized:
+                caching.NODE_SIGNATURE_MEMO.clear()
+            signatures(prompt)
+        return time.perf_counter() - start
+
+    # Memoized it's about 5 times as fast as rebuilding the signatures of all the nodes
+    assert seconds(True) * 2 < seconds(False)
@@ -0,0 +1,77 @@
+import os
+import time
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+# Native extension modules can't be initialized twice, so import them before patch.dict
+# drops everything imported inside the block from sys.modules again.
+import psutil  # noqa: F401
+import safetensors.torch  # noqa: F401
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    from comfy_execution import prefetch
+
+
+class CheckpointLoader:
+    PREFETCH_INPUTS = {"ckpt_name": "checkpoints"}
+
+
+class DualLoader:
+    PREFETCH_INPUTS = {"clip_name1": "text_encoders", "clip_name2": "text_encoders"}
+
+
+@pytest.fixture
+def model_files(tmp_path):
+    files = {}
+    for name, size in (("a.safetensors", 3000), ("b.safetensors", 2000), ("c.safetensors", 1000)):
+        path = tmp_path / name
+        path.write_bytes(os.urandom(size))
+        files[name] = str(path)
+
+    def get_full_path(folder_name, filename):
+        return files.get(filename)
+
+    mappings = {"CheckpointLoaderSimple": CheckpointLoader, "DualCLIPLoader": DualLoader}
+    with patch.object(prefetch.nodes, "NODE_CLASS_MAPPINGS", mappings), patch.object(prefetch.folder_paths, "get_full_path", get_full_path):
+        yield files
+
+
+def loader_prompt(*names):
+    prompt = {str(i): {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": name}} for i, name in enumerate(names)}
+    prompt["x"] = {"class_type": "KSampler", "inputs": {"model": ["0", 0]}}
+    return prompt
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+
+def test_get_model_files(model_files):
+    prompt = loader_prompt("a.safetensors", "missing.safetensors", "a.safetensors")
+    prompt["d"] = {"class_type": "DualCLIPLoader", "inputs": {"clip_name1": "b.safetensors", "clip_name2": ["x", 0]}}
+    assert prefetch.get_model_files(prompt) == [model_files["a.safetensors"], model_files["b.safetensors"]]
+
+
+def test_prefetch_reads_each_file_once(model_files):
+    prefetcher = prefetch.ModelPrefetcher(max_bytes=10_000)
+    with patch.object(prefetcher, "_warm", wraps=prefetcher._warm) as warm:
+        prefetcher.prefetch([("1", loader_prompt("a.safetensors", "b.safetensors"))])
+        wait_for(lambda: len(prefetcher.warmed) == 2)
+        prefetcher.prefetch([("2", loader_prompt("b.safetensors", "c.safetensors"))])
+        wait_for(lambda: len(prefetcher.warmed) == 3)
+        assert [x.args[0] for x in warm.call_args_list] == [model_files[n] for n in ("a.safetensors", "b.safetensors", "c.safetensors")]
+    assert prefetcher.warmed_bytes == 6000
+
+
+def test_prefetch_budget(model_files):
+    prefetcher = prefetch.ModelPrefetcher(max_bytes=4000)
+    prefetcher.prefetch([("1", loader_prompt("a.safetensors", "b.safetensors", "c.safetensors"))])
+    wait_for(lambda: model_files["c.safetensors"] in prefetcher.warmed)
+    # The oldest file is forgotten once the budget is exceeded
+    assert list(prefetcher.warmed) == [model_files["b.safetensors"], model_files["c.safetensors"]]
+    assert prefetcher.warmed_bytes == 3000
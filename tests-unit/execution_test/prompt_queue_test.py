@@ -0,0 +1,296 @@
+import threading
+from unittest.mock import patch, MagicMock
+
+# Native extension modules can't be initialized twice, so import them before patch.dict
+# drops everything imported inside the block from sys.modules again.
+import psutil  # noqa: F401
+import safetensors.torch  # noqa: F401
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    import execution
+    from execution import PromptQueue, get_prompt_digest
+    from comfy_execution.workers import PromptWorker, prompt_model_names
+
+
+def make_prompt(ckpt_name):
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt_name}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "a cat", "clip": ["1", 1]}},
+    }
+
+
+def make_item(number, prompt_id, prompt):
+    return (number, prompt_id, prompt, {}, [], {})
+
+
+def make_queue(num_workers):
+    q = PromptQueue(MagicMock())
+    workers = [PromptWorker(i) for i in range(num_workers)]
+    for worker in workers:
+        q.register_worker(worker)
+    return q, workers
+
+
+def test_prompt_model_names():
+    assert prompt_model_names(make_prompt("sd15.safetensors")) == frozenset(["sd15.safetensors"])
+
+
+def test_worker_prefers_prompts_using_its_models():
+    q, workers = make_queue(2)
+    workers[0].finish(make_prompt("sdxl.safetensors"))
+    q.put(make_item(0, "a", make_prompt("sd15.safetensors")))
+    q.put(make_item(1, "b", make_prompt("sdxl.safetensors")))
+
+    item, _ = q.get(timeout=0, worker=workers[0])
+    assert item[1] == "b"
+    assert workers[0].prompt_id == "b"
+    assert q.get_workers()[0]["status"] == "running"
+
+    item, _ = q.get(timeout=0, worker=workers[1])
+    assert item[1] == "a"
+
+
+def test_single_worker_keeps_queue_order():
+    q, workers = make_queue(1)
+    workers[0].finish(make_prompt("sdxl.safetensors"))
+    q.put(make_item(0, "a", make_prompt("sd15.safetensors")))
+    q.put(make_item(1, "b", make_prompt("sdxl.safetensors")))
+
+    item, _ = q.get(timeout=0, worker=workers[0])
+    assert item[1] == "a"
+
+
+def test_task_done_frees_worker():
+    q, workers = make_queue(2)
+    q.put(make_item(0, "a", make_prompt("sd15.safetensors")))
+    item, item_id = q.get(timeout=0, worker=workers[1])
+    q.task_done(item_id, {}, status=None, worker=workers[1])
+    assert [w["status"] for w in q.get_workers()] == ["idle", "idle"]
+    assert "a" in q.get_history()
+
+
+def test_every_worker_receives_flags():
+    q, workers = make_queue(2)
+    q.set_flag("free_memory", True)
+    assert q.get_flags(worker=workers[0]) == {"free_memory": True}
+    assert q.get_flags(worker=workers[0]) == {}
+    assert q.get_flags(worker=workers[1]) == {"free_memory": True}
+
+
+def test_delete_by_id_skips_item():
+    q, _ = make_queue(0)
+    for i in range(5):
+        q.put(make_item(i, str(i), {}))
+    assert q.delete_queue_item_by_id("0")
+    assert q.delete_queue_item(lambda item: item[1] == "3")
+    assert not q.delete_queue_item_by_id("0")
+    assert q.get_tasks_remaining() == 3
+
+    order = [q.get(timeout=0)[0][1] for _ in range(3)]
+    assert order == ["1", "2", "4"]
+    assert q.get(timeout=0) is None
+
+
+def test_deleted_items_are_compacted():
+    q, _ = make_queue(0)
+    for i in range(1000):
+        q.put(make_item(i, str(i), {}))
+    for i in range(990):
+        q.delete_queue_item_by_id(str(i))
+    assert len(q.queue) < 200
+    assert [x[1] for x in q.get_current_queue_volatile()[1]] == sorted(str(i) for i in range(990, 1000))
+
+
+def test_duplicate_prompt_ids():
+    q, _ = make_queue(0)
+    q.put(make_item(0, "a", {}))
+    q.put(make_item(1, "a", {}))
+    assert q.delete_queue_item_by_id("a")
+    assert q.get_tasks_remaining() == 1
+    assert q.get(timeout=0)[0][0] == 1
+
+
+def test_snapshot_is_reused_until_queue_changes():
+    q, _ = make_queue(0)
+    q.put(make_item(0, "a", {}))
+    snapshot = q.get_current_queue_volatile()
+    assert q.get_current_queue_volatile()[1] is snapshot[1]
+    q.put(make_item(1, "b", {}))
+    running, queued = q.get_current_queue()
+    assert len(running) == 0 and len(queued) == 2
+    assert queued is not snapshot[1]
+
+
+def make_client_item(number, prompt_id, client_id="client"):
+    return (number, prompt_id, make_prompt("sd15.safetensors"), {"client_id": client_id}, ["2"], {"api_key_comfy_org": "secret"})
+
+
+def remove_sensitive(item):
+    return item[:5] + item[6:]
+
+
+def finish(q, item_id, status_str='success'):
+    status = PromptQueue.ExecutionStatus(status_str=status_str, completed=status_str == 'success', messages=[])
+    q.task_done(item_id, {"outputs": {"9": {"images": [{"filename": "a.png"}]}}, "meta": {}}, status=status, process_item=remove_sensitive)
+
+
+def test_prompt_digest_ignores_client_and_time():
+    a = get_prompt_digest(make_prompt("a.safetensors"), ["2"], {"client_id": "x", "create_time": 1})
+    b = get_prompt_digest(make_prompt("a.safetensors"), ["2"], {"client_id": "y", "create_time": 2})
+    assert a == b
+    assert a != get_prompt_digest(make_prompt("b.safetensors"), ["2"], {})
+    assert a != get_prompt_digest(make_prompt("a.safetensors"), ["2"], {"extra_pnginfo": {"workflow": 1}})
+
+
+def test_prompt_digest_keeps_users_apart():
+    a = get_prompt_digest(make_prompt("a.safetensors"), ["2"], {}, {"auth_token_comfy_org": "token a"})
+    assert a == get_prompt_digest(make_prompt("a.safetensors"), ["2"], {}, {"auth_token_comfy_org": "token a"})
+    assert a != get_prompt_digest(make_prompt("a.safetensors"), ["2"], {}, {"auth_token_comfy_org": "token b"})
+    assert a != get_prompt_digest(make_prompt("a.safetensors"), ["2"], {})
+
+
+
+def test_only_idempotent_prompts_share_results():
+    class Loader:
+        pass
+
+    class Encode:
+        pass
+
+    class Random:
+        NOT_IDEMPOTENT = True
+
+    class LoadImage:
+        @classmethod
+        def IS_CHANGED(cls, image):
+            return image
+
+    mappings = {"CheckpointLoaderSimple": Loader, "CLIPTextEncode": Encode}
+    with patch.object(execution.nodes, "NODE_CLASS_MAPPINGS", mappings):
+        assert execution.can_share_results(make_prompt("a.safetensors"))
+        for class_def in (Random, LoadImage):
+            mappings["CLIPTextEncode"] = class_def
+            assert not execution.can_share_results(make_prompt("a.safetensors"))
+        del mappings["CLIPTextEncode"]
+        assert not execution.can_share_results(make_prompt("a.safetensors"))
+
+def test_identical_prompts_share_one_execution():
+    q, _ = make_queue(0)
+    assert q.put(make_client_item(0, "a"), digest="d", coalesce=True) is None
+    assert q.put(make_client_item(1, "b", client_id="other"), digest="d", coalesce=True) == "a"
+    assert q.get_tasks_remaining() == 2
+    assert [x[1] for x in q.get_current_queue()[1]] == ["a", "b"]
+
+    item, item_id = q.get(timeout=0)
+    assert item[1] == "a"
+    assert q.get(timeout=0) is None
+    assert [x[1] for x in q.get_current_queue()[0]] == ["a", "b"]
+
+    q.server.send_sync.reset_mock()
+    finish(q, item_id)
+    history = q.get_history()
+    assert history["b"]["outputs"] == history["a"]["outputs"]
+    assert history["b"]["prompt"][1] == "b" and len(history["b"]["prompt"]) == 5
+    sent = [(c.args[0], c.args[2]) for c in q.server.send_sync.call_args_list]
+    assert sent == [("executed", "other"), ("execution_success", "other"), ("executing", "other")]
+    assert q.get_tasks_remaining() == 0
+
+    # Finished prompts aren't coalesced with
+    assert q.put(make_client_item(2, "c"), digest="d", coalesce=True) is None
+
+
+def test_deleting_coalesced_prompt_promotes_attached_one():
+    q, _ = make_queue(0)
+    q.put(make_client_item(0, "a"), digest="d", coalesce=True)
+    q.put(make_client_item(1, "b"), digest="d", coalesce=True)
+    q.put(make_client_item(2, "c"), digest="d", coalesce=True)
+    assert q.delete_queue_item_by_id("a")
+    assert q.delete_queue_item_by_id("c")
+    item, _ = q.get(timeout=0)
+    assert item[1] == "b"
+    assert q.get_tasks_remaining() == 1
+
+
+def test_replay_recent_results():
+    q, _ = make_queue(0)
+    q.put(make_client_item(0, "a"), digest="d")
+    _, item_id = q.get(timeout=0)
+    finish(q, item_id)
+
+    assert q.replay(make_client_item(1, "b"), "d", max_age=60, process_item=remove_sensitive) == "a"
+    assert q.get_history(prompt_id="b")["b"]["outputs"] == q.get_history(prompt_id="a")["a"]["outputs"]
+    assert q.replay(make_client_item(2, "c"), "d", max_age=-1) is None
+    assert q.replay(make_client_item(2, "c"), "other", max_age=60) is None
+
+
+def test_failed_prompts_are_not_replayed():
+    q, _ = make_queue(0)
+    q.put(make_client_item(0, "a"), digest="d")
+    _, item_id = q.get(timeout=0)
+    finish(q, item_id, status_str='error')
+    assert q.replay(make_client_item(1, "b"), "d", max_age=60) is None
+
+
+def test_prefetches_next_prompt_of_each_worker():
+    q, workers = make_queue(2)
+    prefetcher = MagicMock()
+    q.set_prefetcher(prefetcher)
+    q.put(make_item(0, "a", make_prompt("sd15.safetensors")))
+    q.put(make_item(1, "b", make_prompt("sdxl.safetensors")))
+    q.put(make_item(2, "c", make_prompt("flux.safetensors")))
+    assert [x[0] for x in prefetcher.prefetch.call_args[0][0]] == ["a", "b"]
+
+    q.get(timeout=0, worker=workers[0])
+    assert [x[0] for x in prefetcher.prefetch.call_args[0][0]] == ["b", "c"]
+
+
+def test_next_pending_items_skip_deleted_ones():
+    q, _ = make_queue(0)
+    for i in reversed(range(50)):
+        q.put(make_item(i, str(i), make_prompt("sd15.safetensors")))
+    for i in range(0, 50, 3):
+        q.delete_queue_item_by_id(str(i))
+    pending = [x[1] for x in sorted(q.queue_items.values())]
+    for count in (1, 5, 50):
+        assert [x[1] for x in q._next_pending(count)] == pending[:count]
+
+
+class DictHistoryStore:
+    """A history store that checks the queue isn't locked while it is used."""
+    def __init__(self, q):
+        self.q = q
+        self.items = {}
+
+    def check_unlocked(self):
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(self.q.mutex.acquire(timeout=5)) or self.q.mutex.release())
+        thread.start()
+        thread.join()
+        assert acquired == [True]
+
+    def put(self, prompt_id, history_item):
+        self.check_unlocked()
+        self.items[prompt_id] = history_item
+
+    def get(self, prompt_id):
+        self.check_unlocked()
+        return self.items.get(prompt_id)
+
+    def delete(self, prompt_id):
+        self.check_unlocked()
+        self.items.pop(prompt_id, None)
+
+
+def test_history_store_is_used_without_the_queue_locked():
+    q, _ = make_queue(0)
+    q.set_history_store(DictHistoryStore(q))
+    q.put(make_client_item(0, "a"), digest="d")
+    q.put(make_client_item(1, "b"), digest="d", coalesce=True)
+    _, item_id = q.get(timeout=0)
+    finish(q, item_id)
+    assert q.get_tasks_remaining() == 0
+    assert q.get_history(prompt_id="b")["b"]["outputs"] == q.get_history(prompt_id="a")["a"]["outputs"]
+    assert q.replay(make_client_item(2, "c"), "d", max_age=60) == "a"
+    q.delete_history_item("a")
+    assert q.get_history(prompt_id="a") == {}
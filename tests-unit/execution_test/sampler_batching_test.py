@@ -0,0 +1,154 @@
+import threading
+
+import pytest
+import torch
+
+from comfy_execution import batching
+from comfy_execution.batching import SamplerBatcher, conds_compatible, fuse_conds
+
+
+def make_cond(value, tokens=77):
+    return [[torch.full((1, tokens, 8), float(value)), {"pooled_output": torch.full((1, 4), float(value))}]]
+
+
+class Caller:
+    """Records the batches its run function is called with."""
+    def __init__(self, value, batch_size=1, tokens=77):
+        self.latent = torch.zeros((batch_size, 4, 8, 8))
+        self.noise = torch.full((batch_size, 4, 8, 8), float(value))
+        self.positive = make_cond(value, tokens)
+        self.negative = make_cond(0, tokens)
+        self.calls = []
+        self.result = None
+
+    def run(self, noise, latent_image, positive, negative):
+        self.calls.append(noise.shape[0])
+        # Every item of the output depends on its own noise and its own cond only.
+        return noise + positive[0][0][:, :1, :4].reshape(-1, 4, 1, 1)
+
+    def sample(self, batcher, key):
+        self.result = batcher.sample(key, self.run, self.noise, self.latent, self.positive, self.negative)
+
+
+def sample_concurrently(batcher, callers, keys):
+    threads = [threading.Thread(target=c.sample, args=(batcher, k)) for c, k in zip(callers, keys)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+
+
+def test_conds_compatible():
+    assert conds_compatible(make_cond(1), make_cond(2))
+    assert not conds_compatible(make_cond(1), make_cond(2, tokens=154))
+    assert not conds_compatible(make_cond(1), make_cond(1) + make_cond(1))
+
+    a = make_cond(1)
+    b = make_cond(2)
+    a[0][1]["guidance"] = 3.5
+    b[0][1]["guidance"] = 4.0
+    assert not conds_compatible(a, b)
+    b[0][1]["guidance"] = 3.5
+    assert conds_compatible(a, b)
+    # Objects like control nets only match when shared
+    a[0][1]["control"] = object()
+    b[0][1]["control"] = object()
+    assert not conds_compatible(a, b)
+
+
+def test_fuse_conds_repeats_to_batch_size():
+    fused = fuse_conds([make_cond(1), make_cond(2)], [2, 1])
+    cond, options = fused[0]
+    assert cond.shape == (3, 77, 8)
+    assert cond[:, 0, 0].tolist() == [1.0, 1.0, 2.0]
+    assert options["pooled_output"][:, 0].tolist() == [1.0, 1.0, 2.0]
+
+
+def test_compatible_calls_are_batched():
+    batcher = SamplerBatcher(5.0, expected_callers=lambda: 3)
+    callers = [Caller(1), Caller(2, batch_size=2), Caller(3)]
+    sample_concurrently(batcher, callers, ["key"] * 3)
+
+    assert sorted(sum((c.calls for c in callers), [])) == [4]
+    for i, c in enumerate(callers):
+        assert c.result.shape[0] == c.noise.shape[0]
+        assert torch.equal(c.result, c.run(c.noise, c.latent, c.positive, c.negative)), f"caller {i} got another item's result"
+
+
+def test_incompatible_calls_run_on_their_own():
+    batcher = SamplerBatcher(0.2, expected_callers=lambda: 2)
+    callers = [Caller(1), Caller(2)]
+    sample_concurrently(batcher, callers, ["key1", "key2"])
+    assert callers[0].calls == [1] and callers[1].calls == [1]
+
+    callers = [Caller(1), Caller(2, tokens=154)]
+    sample_concurrently(batcher, callers, ["key"] * 2)
+    assert callers[0].calls == [1] and callers[1].calls == [1]
+
+
+def test_single_caller_does_not_wait():
+    batcher = SamplerBatcher(60.0, expected_callers=lambda: 1)
+    caller = Caller(1)
+    caller.sample(batcher, "key")
+    assert caller.calls == [1]
+
+
+def test_max_batch_size():
+    batcher = SamplerBatcher(0.5, expected_callers=lambda: 3, max_batch_size=2)
+    callers = [Caller(1), Caller(2), Caller(3)]
+    sample_concurrently(batcher, callers, ["key"] * 3)
+    assert sorted(sum((c.calls for c in callers), [])) == [1, 2]
+    for c in callers:
+        assert torch.equal(c.result, c.run(c.noise, c.latent, c.positive, c.negative))
+
+
+def test_failed_batch_falls_back():
+    batcher = SamplerBatcher(5.0, expected_callers=lambda: 2)
+    failing = threading.Event()
+
+    class FailingCaller(Caller):
+        def run(self, noise, latent_image, positive, negative):
+            if noise.shape[0] > 1:
+                failing.set()
+                raise RuntimeError("out of memory")
+            return super().run(noise, latent_image, positive, negative)
+
+        def sample(self, batcher, key):
+            try:
+                super().sample(batcher, key)
+            except RuntimeError as e:
+                self.result = e
+
+    callers = [FailingCaller(1), FailingCaller(2)]
+    sample_concurrently(batcher, callers, ["key"] * 2)
+    assert failing.is_set()
+    errors = [c for c in callers if isinstance(c.result, RuntimeError)]
+    assert len(errors) == 1, "Only the caller that ran the batch should get its error"
+    follower = [c for c in callers if not isinstance(c.result, RuntimeError)][0]
+    assert follower.calls == [1]
+
+
+@pytest.fixture
+def sampler_batching():
+    batching.set_sampler_batching(0.05)
+    yield
+    batching.set_sampler_batching(0)
+
+
+def test_sampler_key(sampler_batching):
+    class Model:
+        load_device = torch.device("cpu")
+
+    model_token = (("SIGNATURE", "abc"), 0)
+    token = batching.current_link_tokens.set({"model": model_token})
+    try:
+        assert batching.get_sampler_key(Model(), "euler", None, ["model"], (20, 8.0)) == ("cpu", model_token, 20, 8.0)
+        assert batching.get_sampler_key(Model(), "euler_ancestral", None, ["model"], (20, 8.0)) is None
+        assert batching.get_sampler_key(Model(), "euler", torch.ones((1, 8, 8)), ["model"], (20, 8.0)) is None
+        assert batching.get_sampler_key(Model(), "euler", None, ["model", "sigmas"], (20, 8.0)) is None
+    finally:
+        batching.current_link_tokens.reset(token)
+    assert batching.get_sampler_key(Model(), "euler", None, ["model"], (20, 8.0)) is None
+
+    batching.set_sampler_batching(0)
+    assert batching.get_link_tokens(type("KSampler", (), {"SAMPLER_BATCHING": True}), None, {}) is None
@@ -0,0 +1,78 @@
+from unittest.mock import patch, MagicMock
+
+import torch
+
+# Native extension modules can't be initialized twice, so import them before patch.dict
+# drops everything imported inside the block from sys.modules again.
+import psutil  # noqa: F401
+import safetensors.torch  # noqa: F401
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    import comfy_execution.caching as caching
+
+to_hashable = caching.to_hashable
+
+
+class CustomInput:
+    def __init__(self, value):
+        self.value = value
+
+    def __comfy_hash__(self):
+        return {"value": self.value}
+
+
+class TestTensorHashing:
+    def test_equal_content_gives_equal_signature(self):
+        a = torch.randn(2, 3, 8, 8)
+        assert to_hashable(a) == to_hashable(a.clone())
+        assert to_hashable([a, "x"]) == to_hashable([a.clone(), "x"])
+
+    def test_content_shape_and_dtype_change_signature(self):
+        a = torch.randn(4, 4)
+        b = a.clone()
+        b[3, 3] += 1.0
+        assert to_hashable(a) != to_hashable(b)
+        assert to_hashable(a) != to_hashable(a.reshape(2, 8))
+        assert to_hashable(a) != to_hashable(a.to(torch.float16))
+
+    def test_non_contiguous_and_bfloat16(self):
+        a = torch.randn(8, 8).bfloat16().t()
+        assert to_hashable(a) == to_hashable(a.contiguous())
+
+    def test_large_tensors_are_hashed_in_full(self, monkeypatch):
+        monkeypatch.setattr(caching, "TENSOR_HASH_CHUNK_BYTES", 64)
+        a = torch.zeros(1000)
+        for i in [0, 15, 16, 17, 500, 999]:
+            b = a.clone()
+            b[i] = 1.0
+            assert to_hashable(a) != to_hashable(b)
+        assert to_hashable(a) == to_hashable(a.clone())
+        assert to_hashable(a.bfloat16()) != to_hashable(a.bfloat16().index_fill(0, torch.tensor([777]), 1.0))
+
+    def test_tensors_differing_in_a_few_elements(self):
+        a = torch.zeros(5 * 1024 * 1024)
+        b = a.clone()
+        b[1] = 1.0
+        assert to_hashable(a) != to_hashable(b)
+
+
+class TestCustomFingerprints:
+    def test_comfy_hash_protocol(self):
+        assert to_hashable(CustomInput(1)) == to_hashable(CustomInput(1))
+        assert to_hashable(CustomInput(1)) != to_hashable(CustomInput(2))
+
+    def test_unknown_objects_stay_unhashable(self):
+        assert isinstance(to_hashable(object()), caching.Unhashable)
+
+    def test_registered_fingerprint_function(self):
+        class Opaque:
+            def __init__(self, name):
+                self.name = name
+
+        caching.register_fingerprint_function(Opaque, lambda x: x.name)
+        try:
+            assert to_hashable(Opaque("a")) == to_hashable(Opaque("a"))
+            assert to_hashable(Opaque("a")) != to_hashable(Opaque("b"))
+        finally:
+            caching.FINGERPRINT_FUNCTIONS.pop(Opaque)
@@ -66,10 +66,12 @@ class ComfyClient:
         ws.connect("ws://{}/ws?clientId={}".format(self.server_address, self.client_id))
         self.ws = ws
 
-    def queue_prompt(self, prompt, partial_execution_targets=None):
+    def queue_prompt(self, prompt, partial_execution_targets=None, coalesce=None):
         p = {"prompt": prompt, "client_id": self.client_id}
         if partial_execution_targets is not None:
             p["partial_execution_targets"] = partial_execution_targets
+        if coalesce is not None:
+            p["coalesce"] = coalesce
         data = json.dumps(p).encode('utf-8')
         req =  urllib.request.Request("http://{}/prompt".format(self.server_address), data=data)
         return json.loads(urllib.request.urlopen(req).read())
@@ -186,6 +188,7 @@ class TestExecution:
         { "extra_args" : [], "should_cache_results" : True },
         { "extra_args" : ["--cache-lru", 0], "should_cache_results" : True },
         { "extra_args" : ["--cache-lru", 100], "should_cache_results" : True },
+        { "extra_args" : ["--cache-bytes", 4], "should_cache_results" : True },
         { "extra_args" : ["--cache-none"], "should_cache_results" : False },
     ])
     def server(self, args_pytest, request):
@@ -290,6 +293,27 @@ class TestExecution:
             assert result2.did_run(input1), "Input1 should have been rerun"
             assert result2.did_run(input2), "Input2 should have been rerun"
 
+    def test_cache_stats(self, client: ComfyClient, builder: GraphBuilder, server):
+        g = builder
+        input1 = g.node("StubImage", content="BLACK", height=512, width=512, batch_size=1)
+        g.node("SaveImage", images=input1.out(0))
+
+        def get_cache_stats():
+            with urllib.request.urlopen("http://{}/system_stats".format(client.server_address)) as response:
+                return json.loads(response.read())["cache"][0]
+
+        client.run(g)
+        before = get_cache_stats()
+        client.run(g)
+        after = get_cache_stats()
+        if server["should_cache_results"]:
+            # The inputs of a cached output node aren't looked up at all
+            assert after["hits"] - before["hits"] == 1
+            assert after["bytes"] >= 512 * 512 * 3 * 4, "The cached image should be accounted for"
+        else:
+            assert after["hits"] == 0 and after["bytes"] == 0
+            assert after["misses"] - before["misses"] == 2
+
     def test_error(self, client: ComfyClient, builder: GraphBuilder):
         g = builder
         input1 = g.node("StubImage", content="BLACK", height=512, width=512, batch_size=1)
@@ -1011,3 +1035,32 @@ class TestExecution:
         """Test getting a non-existent job returns 404"""
         job = client.get_job("nonexistent-job-id")
         assert job is None, "Non-existent job should return None"
+
+    def test_identical_prompts_are_coalesced(
+        self, client: ComfyClient, builder: GraphBuilder
+    ):
+        """Test that an identical prompt submitted while the first runs shares its outputs"""
+        g = builder
+        input_node = g.node("StubImage", content="BLACK", height=32, width=32, batch_size=1)
+        sleep_node = g.node("TestSleep", value=input_node.out(0), seconds=0.5)
+        g.node("SaveImage", images=sleep_node.out(0), filename_prefix="coalesced")
+        prompt = g.finalize()
+
+        first = client.queue_prompt(prompt, coalesce=True)
+        second = client.queue_prompt(prompt, coalesce=True)
+        assert second["coalesced_with"] == first["prompt_id"], "Second prompt should share the first execution"
+        # Coalescing is opt-in
+        third = client.queue_prompt(prompt)
+        assert "coalesced_with" not in third, "Prompts should only be coalesced when asked for"
+
+        finished = set()
+        while len(finished) < 3:
+            out = client.ws.recv()
+            if isinstance(out, str):
+                message = json.loads(out)
+                if message["type"] == "executing" and message["data"]["node"] is None:
+                    finished.add(message["data"]["prompt_id"])
+
+        first_history = client.get_history(first["prompt_id"])[first["prompt_id"]]
+        second_history = client.get_history(second["prompt_id"])[second["prompt_id"]]
+        assert second_history["outputs"] == first_history["outputs"], "Coalesced prompt should have the same outputs"
@@ -262,6 +262,15 @@ class TestNormalizeQueueItem:
         assert 'preview_output' not in job
         assert job['outputs_count'] == 0
         assert job['workflow_id'] == 'workflow-abc'
+        assert 'worker_id' not in job
+
+    def test_running_item_reports_worker(self):
+        """Running items should report the worker executing them."""
+        item = (1, 'prompt-123', {}, {'create_time': 1234567890}, ['node1'])
+        job = normalize_queue_item(item, JobStatus.IN_PROGRESS, worker_id=2)
+
+        assert job['status'] == 'in_progress'
+        assert job['worker_id'] == 2
 
 
 class TestNormalizeHistoryItem:
@@ -0,0 +1,109 @@
+import pytest
+import time
+import torch
+import numpy as np
+import subprocess
+
+from pytest import fixture
+from comfy_execution.graph_utils import GraphBuilder
+from tests.execution.test_execution import ComfyClient, run_warmup
+
+
+@pytest.mark.execution
+class TestParallelExecution:
+    @fixture(scope="class", autouse=True)
+    def _server(self, args_pytest):
+        pargs = [
+            'python','main.py',
+            '--output-directory', args_pytest["output_dir"],
+            '--listen', args_pytest["listen"],
+            '--port', str(args_pytest["port"]),
+            '--extra-model-paths-config', 'tests/execution/extra_model_paths.yaml',
+            '--cpu',
+            '--parallel-execution', '4',
+        ]
+        p = subprocess.Popen(pargs)
+        yield
+        p.kill()
+        torch.cuda.empty_cache()
+
+    @fixture(scope="class", autouse=True)
+    def shared_client(self, args_pytest, _server):
+        client = ComfyClient()
+        n_tries = 5
+        for i in range(n_tries):
+            time.sleep(4)
+            try:
+                client.connect(listen=args_pytest["listen"], port=args_pytest["port"])
+            except ConnectionRefusedError:
+                # Retrying...
+                pass
+            else:
+                break
+        yield client
+        del client
+        torch.cuda.empty_cache()
+
+    @fixture
+    def client(self, shared_client, request):
+        shared_client.set_test_name(f"parallel_execution[{request.node.name}]")
+        yield shared_client
+
+    @fixture
+    def builder(self, request):
+        yield GraphBuilder(prefix=request.node.name)
+
+    def test_cpu_nodes_run_in_parallel(self, client: ComfyClient, builder: GraphBuilder, skip_timing_checks):
+        """Test that sync nodes declared as CPU bound overlap on the thread pool."""
+        run_warmup(client)
+
+        g = builder
+        image = g.node("StubImage", content="BLACK", height=512, width=512, batch_size=1)
+        sleep1 = g.node("TestCPUSleep", value=image.out(0), seconds=0.5)
+        sleep2 = g.node("TestCPUSleep", value=image.out(0), seconds=0.5)
+        sleep3 = g.node("TestCPUSleep", value=image.out(0), seconds=0.5)
+        g.node("PreviewImage", images=sleep1.out(0))
+        g.node("PreviewImage", images=sleep2.out(0))
+        g.node("PreviewImage", images=sleep3.out(0))
+
+        start_time = time.time()
+        result = client.run(g)
+        elapsed_time = time.time() - start_time
+
+        # Should take ~0.5s (max duration) not 1.5s (sum of durations)
+        if not skip_timing_checks:
+            assert elapsed_time < 1.2, f"Parallel execution took {elapsed_time}s, expected < 1.2s"
+        assert result.did_run(sleep1) and result.did_run(sleep2) and result.did_run(sleep3)
+
+    def test_cpu_nodes_with_dependencies(self, client: ComfyClient, builder: GraphBuilder):
+        """Test that threaded nodes still respect graph dependencies."""
+        g = builder
+        image1 = g.node("StubImage", content="BLACK", height=512, width=512, batch_size=1)
+        image2 = g.node("StubImage", content="WHITE", height=512, width=512, batch_size=1)
+        sleep1 = g.node("TestCPUSleep", value=image1.out(0), seconds=0.1)
+        sleep2 = g.node("TestCPUSleep", value=image2.out(0), seconds=0.1)
+        average = g.node("TestVariadicAverage", input1=sleep1.out(0), input2=sleep2.out(0))
+        chained = g.node("TestCPUSleep", value=average.out(0), seconds=0.1)
+        output = g.node("SaveImage", images=chained.out(0))
+
+        result = client.run(g)
+
+        assert result.did_run(sleep1) and result.did_run(sleep2)
+        assert result.did_run(average) and result.did_run(chained) and result.did_run(output)
+        result_images = result.get_images(output)
+        avg_value = np.array(result_images[0]).mean()
+        assert abs(avg_value - 127.5) < 1, f"Average should be ~127.5, got {avg_value}"
+
+    def test_cpu_node_error(self, client: ComfyClient, builder: GraphBuilder):
+        """Test that errors raised on the thread pool are reported against the node."""
+        g = builder
+        image = g.node("StubImage", content="BLACK", height=512, width=512, batch_size=1)
+        error_node = g.node("TestCPUError", value=image.out(0))
+        g.node("SaveImage", images=error_node.out(0))
+
+        try:
+            client.run(g)
+            assert False, "Should have raised an error"
+        except Exception as e:
+            assert 'prompt_id' in e.args[0], f"Did not get proper error message: {e}"
+            assert e.args[0]['node_id'] == error_node.id, "Error should be from the threaded node"
@@ -0,0 +1,90 @@
+import pytest
+import time
+import json
+import torch
+import subprocess
+import urllib.request
+
+from pytest import fixture
+from comfy_execution.graph_utils import GraphBuilder
+from tests.execution.test_execution import ComfyClient, run_warmup
+
+
+@pytest.mark.execution
+class TestPromptWorkers:
+    @fixture(scope="class", autouse=True)
+    def _server(self, args_pytest):
+        pargs = [
+            'python','main.py',
+            '--output-directory', args_pytest["output_dir"],
+            '--listen', args_pytest["listen"],
+            '--port', str(args_pytest["port"]),
+            '--extra-model-paths-config', 'tests/execution/extra_model_paths.yaml',
+            '--cpu',
+            '--prompt-workers', '2',
+        ]
+        p = subprocess.Popen(pargs)
+        yield
+        p.kill()
+        torch.cuda.empty_cache()
+
+    @fixture(scope="class", autouse=True)
+    def shared_client(self, args_pytest, _server):
+        client = ComfyClient()
+        n_tries = 5
+        for i in range(n_tries):
+            time.sleep(4)
+            try:
+                client.connect(listen=args_pytest["listen"], port=args_pytest["port"])
+            except ConnectionRefusedError:
+                # Retrying...
+                pass
+            else:
+                break
+        yield client
+        del client
+        torch.cuda.empty_cache()
+
+    @fixture
+    def client(self, shared_client, request):
+        shared_client.set_test_name(f"prompt_workers[{request.node.name}]")
+        yield shared_client
+
+    def get_queue(self, client: ComfyClient):
+        with urllib.request.urlopen("http://{}/queue".format(client.server_address)) as response:
+            return json.loads(response.read())
+
+    def test_queue_reports_workers(self, client: ComfyClient):
+        workers = self.get_queue(client)["workers"]
+        assert [w["worker_id"] for w in workers] == [0, 1]
+        assert all(w["status"] == "idle" for w in workers)
+
+    def test_prompts_run_concurrently(self, client: ComfyClient, skip_timing_checks):
+        """Two prompts should execute at the same time on different workers."""
+        run_warmup(client)
+
+        prompt_ids = set()
+        start_time = time.time()
+        for i in range(2):
+            g = GraphBuilder(prefix=f"concurrent_{i}")
+            image = g.node("StubImage", content="BLACK", height=512, width=512, batch_size=1)
+            sleep = g.node("TestCPUSleep", value=image.out(0), seconds=1.0)
+            g.node("PreviewImage", images=sleep.out(0))
+            prompt_ids.add(client.queue_prompt(g.finalize())["prompt_id"])
+
+        finished = set()
+        while finished != prompt_ids:
+            out = client.ws.recv()
+            if not isinstance(out, str):
+                continue
+            message = json.loads(out)
+            if message["type"] == "executing" and message["data"]["node"] is None:
+                finished.add(message["data"]["prompt_id"])
+            elif message["type"] == "execution_error":
+                raise Exception(message["data"])
+        elapsed_time = time.time() - start_time
+
+        if not skip_timing_checks:
+            assert elapsed_time < 1.8, f"Two workers took {elapsed_time}s, expected < 1.8s"
+        for prompt_id in prompt_ids:
+            assert client.get_job(prompt_id)["status"] == "completed"
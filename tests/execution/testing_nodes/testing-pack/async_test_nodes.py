@@ -1,5 +1,6 @@
 import torch
 import asyncio
+import time
 from typing import Dict
 from comfy.utils import ProgressBar
 from comfy_execution.graph_utils import GraphBuilder
@@ -315,6 +316,48 @@ class TestAsyncConcurrentLimit(ComfyNodeABC):
             return (value,)
 
 
+class TestCPUSleep(ComfyNodeABC):
+    """Sync node declared as CPU bound so it can run on the thread pool."""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "value": (IO.ANY, {}),
+                "seconds": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 10.0}),
+            },
+        }
+
+    RETURN_TYPES = (IO.ANY,)
+    FUNCTION = "sleep"
+    CATEGORY = "_for_testing/async"
+    EXECUTION_RESOURCE = "cpu"
+
+    def sleep(self, value, seconds):
+        time.sleep(seconds)
+        return (value,)
+
+
+class TestCPUError(ComfyNodeABC):
+    """CPU bound node that errors, to test error propagation out of the thread pool."""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "value": (IO.ANY, {}),
+            },
+        }
+
+    RETURN_TYPES = (IO.ANY,)
+    FUNCTION = "cpu_error"
+    CATEGORY = "_for_testing/async"
+    EXECUTION_RESOURCE = "cpu"
+
+    def cpu_error(self, value):
+        raise RuntimeError("Intentional thread pool execution error for testing")
+
+
 # Add node mappings
 ASYNC_TEST_NODE_CLASS_MAPPINGS = {
     "TestAsyncValidation": TestAsyncValidation,
@@ -327,6 +370,8 @@ ASYNC_TEST_NODE_CLASS_MAPPINGS = {
     "TestAsyncResourceUser": TestAsyncResourceUser,
     "TestAsyncBatchProcessing": TestAsyncBatchProcessing,
     "TestAsyncConcurrentLimit": TestAsyncConcurrentLimit,
+    "TestCPUSleep": TestCPUSleep,
+    "TestCPUError": TestCPUError,
 }
 
 ASYNC_TEST_NODE_DISPLAY_NAME_MAPPINGS = {
@@ -340,4 +385,6 @@ ASYNC_TEST_NODE_DISPLAY_NAME_MAPPINGS = {
     "TestAsyncResourceUser": "Test Async Resource User",
     "TestAsyncBatchProcessing": "Test Async Batch Processing",
     "TestAsyncConcurrentLimit": "Test Async Concurrent Limit",
+    "TestCPUSleep": "Test CPU Sleep",
+    "TestCPUError": "Test CPU Error",
 }